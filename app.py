@@ -1,5 +1,6 @@
 import streamlit as st
 import os
+from src.known_rules import known_rules
 from src.rule import RuleGenerator, RuleConverter
 
 
@@ -71,10 +72,13 @@ def page_rule_generation():
     #         st.subheader("Generated Rule:")
     #         st.markdown(generated_rule)
     use_agent = st.checkbox("Use Agent", help="Use AI Agent to generate and optimze the rule step by step",)
+    reuse_known = st.checkbox("Reuse known detections", value=known_rules.enabled,
+                              help="Answer with the search of an existing detection when the description matches one")
     
     if st.button("Generate Rule"):
         st.write("Generating rule...")
         st.session_state.use_agent = use_agent
+        known_rules.enabled = reuse_known
 
         output_area = st.empty()
         progress_bar = st.progress(0)
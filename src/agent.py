@@ -1,13 +1,17 @@
 from dotenv import load_dotenv
 from pathlib import Path
-from src.rule import RuleGenerator, model, client
-from src.tool import query_splunk, grammar_check
+from src.known_rules import find_known_rule
+from src.rule import RuleGenerator, AsyncRuleGenerator, chat_completion, async_chat_completion
+from src.scoring import (DIMENSIONS, PASS_SCORE, combine_scores, failure_notes, parse_llm_scores, prescore_rule,
+                         score_messages)
+from src.tool import FEASIBILITY_SOURCES, feasibility_backend, query_splunk, query_splunk_async, grammar_check
 from typing import List, Dict
 import pandas as pd
 import openai
 import os
 import json
 import re
+import asyncio
 import logging
 import time
 
@@ -21,38 +25,48 @@ load_dotenv()
 
 
 def _call_openai_api(messages: list, response_format: str = "text", function_call: bool = False,
-                     max_retries=5, delay=2) -> str:
+                     max_retries=5, delay=2, stage: str = None) -> str:
     retries = 0
     while retries < max_retries:
         try:
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                response_format={"type": response_format},
-
-            )
+            response = chat_completion(messages, stage=stage, retries=retries,
+                                       response_format={"type": response_format})
             return response.choices[0].message.content
         except Exception as e:
             retries += 1
-            print(f"Attempt {retries} failed with error: {e}")
+            logging.warning(f"Attempt {retries} of {stage or 'LLM call'} failed with error: {e}")
             time.sleep(delay)
     raise Exception(f"All {max_retries} attempts failed.")
 
 
+async def _call_openai_api_async(messages: list, response_format: str = "text", max_retries=5, delay=2,
+                                 stage: str = None) -> str:
+    retries = 0
+    while retries < max_retries:
+        try:
+            response = await async_chat_completion(messages, stage=stage, retries=retries,
+                                                   response_format={"type": response_format})
+            return response.choices[0].message.content
+        except Exception as e:
+            retries += 1
+            logging.warning(f"Attempt {retries} of {stage or 'LLM call'} failed with error: {e}")
+            await asyncio.sleep(delay)
+    raise Exception(f"All {max_retries} attempts failed.")
+
+
 class SecurityRuleAgent:
     def __init__(self, model_name="gpt-3.5-turbo"):
         self.model_name = model_name
         self.dsl_fragments = None
         self.rule_raw = None
         self.final_rule = None
+        # set when the rule was taken from an existing detection instead of being generated
+        self.provenance = None
 
     def optimize_rule(self, rule: str, reflection_scores: Dict[str, float], description) -> str:
         """
         """
-        low_score_dimensions = []
-        for dim in ["logical_coherence", "syntax_validation", "execution_feasibility"]:
-            if reflection_scores.get(dim, 1.0) < 0.6:
-                low_score_dimensions.append(dim)
+        low_score_dimensions = self._low_score_dimensions(reflection_scores)
 
         if not low_score_dimensions:
             return rule
@@ -61,51 +75,86 @@ class SecurityRuleAgent:
         for dim in low_score_dimensions:
             if dim == "syntax_validation":
                 syntax_feedback = grammar_check(improved_rule)
-                from src.prompt import RULE_OPTIMIZE_PROMPT
-                user_prompt = f'''
-                The following is the rule to be optimized:
-                {rule}
-                The following is the description of the rule:
-                {description}
-                The following is the feedback from the syntax validation tool:
-                {syntax_feedback}
-                '''
-                messages = [{"role": "system", "content": RULE_OPTIMIZE_PROMPT}, {"role": "user", "content": user_prompt}]
-                improved_rule = _call_openai_api(messages)
+                messages = self._optimize_messages(rule, description, "the syntax validation tool", syntax_feedback)
+                improved_rule = RuleGenerator._extract_rule(
+                    _call_openai_api(messages, stage="optimize_rule:syntax_validation"))
             elif dim == "execution_feasibility":
-                exec_feedback = query_splunk(improved_rule)
-                from src.prompt import RULE_OPTIMIZE_PROMPT
-                user_prompt = f'''
+                exec_feedback = self._feasibility_feedback(query_splunk(improved_rule), reflection_scores)
+                messages = self._optimize_messages(rule, description, self._feasibility_source(), exec_feedback)
+                improved_rule = RuleGenerator._extract_rule(
+                    _call_openai_api(messages, stage="optimize_rule:execution_feasibility"))
+            elif dim == "logical_coherence":
+                dsl = RuleGenerator.generate_dsl_rule(description, rule_type='splunk', stream=False)
+                dsl = next(dsl)
+                messages = self._optimize_messages(rule, description, "the execution feasibility tool (Splunk API)",
+                                                   dsl)
+                refined_text = _call_openai_api(messages, stage="optimize_rule:logical_coherence")
+                improved_rule = RuleGenerator._extract_rule(refined_text)
+
+        return improved_rule
+
+    async def optimize_rule_async(self, rule: str, reflection_scores: Dict[str, float], description) -> str:
+        improved_rule = rule
+        for dim in self._low_score_dimensions(reflection_scores):
+            if dim == "syntax_validation":
+                # the Splunk tools are blocking, keep them off the event loop
+                syntax_feedback = await asyncio.to_thread(grammar_check, improved_rule)
+                messages = self._optimize_messages(rule, description, "the syntax validation tool", syntax_feedback)
+                improved_rule = RuleGenerator._extract_rule(
+                    await _call_openai_api_async(messages, stage="optimize_rule:syntax_validation"))
+            elif dim == "execution_feasibility":
+                exec_feedback = self._feasibility_feedback(await query_splunk_async(improved_rule), reflection_scores)
+                messages = self._optimize_messages(rule, description, self._feasibility_source(), exec_feedback)
+                improved_rule = RuleGenerator._extract_rule(
+                    await _call_openai_api_async(messages, stage="optimize_rule:execution_feasibility"))
+            elif dim == "logical_coherence":
+                dsl = await AsyncRuleGenerator.generate_dsl_rule(description, rule_type='splunk')
+                messages = self._optimize_messages(rule, description, "the execution feasibility tool (Splunk API)",
+                                                   dsl)
+                refined_text = await _call_openai_api_async(messages, stage="optimize_rule:logical_coherence")
+                improved_rule = RuleGenerator._extract_rule(refined_text)
+
+        return improved_rule
+
+    @staticmethod
+    def _feasibility_feedback(exec_feedback, reflection_scores: Dict) -> str:
+        # the pre-score's reasons (missing required fields, dry-run errors) alongside the tool output
+        notes = failure_notes(reflection_scores, "execution_feasibility")
+        return f"{exec_feedback}\n{notes}" if notes else exec_feedback
+
+    @staticmethod
+    def _feasibility_source() -> str:
+        return f"the execution feasibility tool ({FEASIBILITY_SOURCES.get(feasibility_backend(), 'Splunk API')})"
+
+    @staticmethod
+    def _low_score_dimensions(reflection_scores: Dict[str, float]) -> List[str]:
+        return [dim for dim in DIMENSIONS if reflection_scores.get(dim, 1.0) < PASS_SCORE]
+
+    @staticmethod
+    def _optimize_messages(rule: str, description: str, feedback_source: str, feedback) -> list:
+        from src.prompt import RULE_OPTIMIZE_PROMPT
+        user_prompt = f'''
                 The following is the rule to be optimized:
                 {rule}
                 The following is the description of the rule:
                 {description}
-                The following is the feedback from the execution feasibility tool (Splunk API):
-                {exec_feedback}
+                The following is the feedback from {feedback_source}:
+                {feedback}
                 '''
-                messages = [{"role": "system", "content": RULE_OPTIMIZE_PROMPT}, {"role": "user", "content": user_prompt}]
-                improved_rule = _call_openai_api(messages)
-            elif dim == "logical_coherence":
-                from src.prompt import RULE_OPTIMIZE_PROMPT
-                dsl = RuleGenerator.generate_dsl_rule(description, rule_type='splunk', stream=False)
-                dsl = next(dsl)
-                user_prompt = f'''
-                                The following is the rule to be optimized:
-                                {rule}
-                                The following is the description of the rule:
-                                {description}
-                                The following is the feedback from the execution feasibility tool (Splunk API):
-                                {dsl}
-                                '''
-                messages = [{"role": "system", "content": RULE_OPTIMIZE_PROMPT},
-                            {"role": "user", "content": user_prompt}]
-                refined_text = _call_openai_api(messages)
-                improved_rule = refined_text.strip()
+        return [{"role": "system", "content": RULE_OPTIMIZE_PROMPT}, {"role": "user", "content": user_prompt}]
 
-        return improved_rule
+    def _reuse_known_rule(self, description: str, rule_type: str, required_fields: str = None) -> bool:
+        self.provenance = find_known_rule(description, rule_type, required_fields)
+        if self.provenance is None:
+            return False
+        logging.info("=== [0] Known Detection ===")
+        self.final_rule = self.provenance.rule
+        return True
 
     def run_agent(self, description: str, max_iterations: int = 3, rule_type: str = 'splunk',
                   required_fields: str = None, log_demo: str = None) -> str:
+        if self._reuse_known_rule(description, rule_type, required_fields):
+            return self.final_rule
 
         logging.info("=== [1] Analyse Phase ===")
         dsl_rule = RuleGenerator.generate_dsl_rule(description, rule_type, required_fields, log_demo, stream=False)
@@ -113,24 +162,69 @@ class SecurityRuleAgent:
         self.dsl_fragments = dsl_rule
 
         logging.info("\n=== [2] Generation Phase ===")
-        self.rule_raw = RuleGenerator.generate_rule_from_dsl(description, self.dsl_fragments, rule_type,
-                                                             required_fields)
+        self.rule_raw = RuleGenerator._extract_rule(
+            RuleGenerator.generate_rule_from_dsl(description, self.dsl_fragments, rule_type, required_fields))
+        logging.info(f"Initial rule (R_raw):\n{self.rule_raw}")
+
+        current_rule = self.rule_raw
+        for iteration in range(max_iterations):
+            logging.info(f"\n=== [3] Reflection Iteration {iteration + 1} ===")
+            scores = self.reflect_and_score_rule(current_rule, description, required_fields)
+            logging.info(f"Scores => {scores}")
+
+            if all(scores.get(dim, 0.0) >= PASS_SCORE for dim in DIMENSIONS):
+                logging.info("All scores are acceptable. Rule is considered final.")
+                self.final_rule = current_rule
+                break
+            else:
+                logging.info("Scores below threshold, optimizing rule...")
+                improved_rule = self.optimize_rule(current_rule, scores, description)
+                if improved_rule == current_rule:
+                    # nothing was optimized (e.g. the LLM rating was unusable); scoring it again changes nothing
+                    logging.warning("Rule unchanged by optimization, output it as final.")
+                    self.final_rule = current_rule
+                    break
+                current_rule = improved_rule
+        else:
+            logging.warning("Max iterations reached, output the last version as final.")
+            self.final_rule = current_rule
+
+        logging.info("\n=== Final Rule Output ===")
+        logging.info(self.final_rule)
+        return self.final_rule
+
+    async def run_agent_async(self, description: str, max_iterations: int = 3, rule_type: str = 'splunk',
+                              required_fields: str = None, log_demo: str = None) -> str:
+        """asyncio version of run_agent; cancelling the task aborts between (or during) LLM calls."""
+        if self._reuse_known_rule(description, rule_type, required_fields):
+            return self.final_rule
+        logging.info("=== [1] Analyse Phase ===")
+        self.dsl_fragments = await AsyncRuleGenerator.generate_dsl_rule(description, rule_type, required_fields,
+                                                                        log_demo)
+
+        logging.info("\n=== [2] Generation Phase ===")
+        self.rule_raw = RuleGenerator._extract_rule(await AsyncRuleGenerator.generate_rule_from_dsl(
+            description, self.dsl_fragments, rule_type, required_fields))
         logging.info(f"Initial rule (R_raw):\n{self.rule_raw}")
 
         current_rule = self.rule_raw
         for iteration in range(max_iterations):
             logging.info(f"\n=== [3] Reflection Iteration {iteration + 1} ===")
-            scores = self.reflect_and_score_rule(current_rule, description)
+            scores = await self.reflect_and_score_rule_async(current_rule, description, required_fields)
             logging.info(f"Scores => {scores}")
 
-            if all(scores.get(dim, 0.0) >= 0.6 for dim in
-                   ["logical_coherence", "syntax_validation", "execution_feasibility"]):
+            if all(scores.get(dim, 0.0) >= PASS_SCORE for dim in DIMENSIONS):
                 logging.info("All scores are acceptable. Rule is considered final.")
                 self.final_rule = current_rule
                 break
             else:
                 logging.info("Scores below threshold, optimizing rule...")
-                current_rule = self.optimize_rule(current_rule, scores, description)
+                improved_rule = await self.optimize_rule_async(current_rule, scores, description)
+                if improved_rule == current_rule:
+                    logging.warning("Rule unchanged by optimization, output it as final.")
+                    self.final_rule = current_rule
+                    break
+                current_rule = improved_rule
         else:
             logging.warning("Max iterations reached, output the last version as final.")
             self.final_rule = current_rule
@@ -139,21 +233,34 @@ class SecurityRuleAgent:
         logging.info(self.final_rule)
         return self.final_rule
 
-    def reflect_and_score_rule(self, rule: str, description: str) -> Dict[str, float]:
+    def reflect_and_score_rule(self, rule: str, description: str, required_fields: str = None) -> Dict:
+        """
+        Syntax and execution feasibility are scored locally (src.scoring); only a rule that passes both costs an
+        LLM call, which rates its logical coherence. Lowered scores come with their reasons under "failures".
+        A rule still wrapped in a Markdown code fence is scored on the search inside it.
+        """
+        rule = RuleGenerator._extract_rule(rule)
+        prescore = prescore_rule(rule, required_fields)
+        if not prescore.passed:
+            return combine_scores(prescore)
+        reflection_result = _call_openai_api(score_messages(rule, description), response_format="json_object",
+                                             stage="reflect_and_score_rule")
+        return self._scores_from_reflection(prescore, reflection_result)
 
-        from src.prompt import SCORE_PROMPT
-        prompt = SCORE_PROMPT.format(rule=rule, description=description)
-        message = [{"role": "system", "content": prompt}]
-        reflection_result = _call_openai_api(message, response_format="json")
+    async def reflect_and_score_rule_async(self, rule: str, description: str, required_fields: str = None) -> Dict:
+        rule = RuleGenerator._extract_rule(rule)
+        prescore = await asyncio.to_thread(prescore_rule, rule, required_fields)
+        if not prescore.passed:
+            return combine_scores(prescore)
+        reflection_result = await _call_openai_api_async(score_messages(rule, description),
+                                                         response_format="json_object",
+                                                         stage="reflect_and_score_rule")
+        return self._scores_from_reflection(prescore, reflection_result)
 
-        import json
+    @staticmethod
+    def _scores_from_reflection(prescore, reflection_result: str) -> Dict:
         try:
-            scores = json.loads(reflection_result)
-        except Exception as e:
-            scores = {
-                "logical_coherence": 1.0,
-                "syntax_validation": 1.0,
-                "execution_feasibility": 1.0,
-                "comment": "Failed to parse reflection result, assume pass."
-            }
-        return scores
+            return combine_scores(prescore, parse_llm_scores(reflection_result))
+        except ValueError as e:
+            logging.error(f"Unusable reflection result: {e}")
+            return combine_scores(prescore, error=str(e))
@@ -0,0 +1,319 @@
+from pathlib import Path
+from openai.types.chat import ChatCompletion
+from src.cache import response_cache
+from src.router import Provider, router as default_router
+from src.rule import RuleGenerator
+from src.scoring import score_messages
+from src.utils import description_and_rule_generator
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+# hard limit of the Batch API on requests per input file
+MAX_REQUESTS_PER_BATCH = 50000
+
+
+class BatchRoundRunner:
+    """
+    Runs one "round" of independent chat completions through the OpenAI Batch API.
+
+    Requests are sent to the provider their stage is routed to (src.router), one batch per provider and chunk.
+    Every batch is persisted under workdir as <round>.<provider>.<digest>.<chunk>.jsonl (input), .batch (batch id)
+    and .output.jsonl (results), where digest hashes the chunk's requests, so re-running a crashed job re-attaches
+    to submitted batches and replays finished ones without resubmitting them, while a changed request set gets
+    batches of its own. Responses are also written to the response cache under the same keys the synchronous
+    path uses, and requests that are already cached are never submitted.
+    """
+
+    def __init__(self, workdir: str, poll_interval: float = 60, completion_window: str = "24h", router=None,
+                 cache=None):
+        self.workdir = workdir
+        self.poll_interval = poll_interval
+        self.completion_window = completion_window
+        self.router = router or default_router
+        self.cache = cache or response_cache
+        os.makedirs(workdir, exist_ok=True)
+
+    @staticmethod
+    def _digest(provider: Provider, requests: dict) -> str:
+        payload = [[custom_id, provider.model, str(provider.client.base_url), messages, params]
+                   for custom_id, (_, messages, params) in sorted(requests.items())]
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+    def run_round(self, name: str, requests: dict) -> dict:
+        """
+        requests maps custom_id -> (stage, messages, params); returns custom_id -> message content,
+        or None for requests that failed.
+        """
+        results = {}
+        pending = {}
+        for custom_id, (stage, messages, params) in requests.items():
+            provider = self.router.primary(stage)
+            cached = self.cache.get(self.router.cache_key(provider, messages, params))
+            if cached is not None:
+                results[custom_id] = ChatCompletion.model_validate_json(cached).choices[0].message.content
+            else:
+                pending.setdefault(provider.name, {})[custom_id] = (stage, messages, params)
+        logging.info(f"Round {name}: {len(requests)} requests, {len(results)} served from cache")
+
+        for provider_name, provider_requests in pending.items():
+            provider = self.router.providers[provider_name]
+            ids = sorted(provider_requests)
+            batches = []
+            for n in range(0, len(ids), MAX_REQUESTS_PER_BATCH):
+                chunk = {custom_id: provider_requests[custom_id] for custom_id in ids[n:n + MAX_REQUESTS_PER_BATCH]}
+                batch_name = f"{name}.{provider_name}.{self._digest(provider, chunk)}.{n // MAX_REQUESTS_PER_BATCH}"
+                batches.append((batch_name, chunk, self._submit(provider, batch_name, chunk)))
+            for batch_name, chunk, batch_id in batches:
+                responses = self._collect(provider, batch_name, batch_id)
+                for custom_id, (_, messages, params) in chunk.items():
+                    response = responses.get(custom_id)
+                    if response is None:
+                        results[custom_id] = None
+                        continue
+                    self.cache.set(self.router.cache_key(provider, messages, params), response.model_dump_json())
+                    results[custom_id] = response.choices[0].message.content
+        return results
+
+    def _submit(self, provider: Provider, name: str, requests: dict) -> str:
+        batch_path = os.path.join(self.workdir, f"{name}.batch")
+        if os.path.exists(os.path.join(self.workdir, f"{name}.output.jsonl")):
+            return ''
+        if os.path.exists(batch_path):
+            with open(batch_path, 'r') as f:
+                return f.read().strip()
+
+        input_path = os.path.join(self.workdir, f"{name}.jsonl")
+        with open(input_path, 'w', encoding='utf-8') as f:
+            for custom_id, (_, messages, params) in requests.items():
+                body = {"model": provider.model, "messages": messages, **params}
+                f.write(json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions",
+                                    "body": body}, ensure_ascii=False) + "\n")
+        with open(input_path, 'rb') as f:
+            input_file = provider.client.files.create(file=f, purpose="batch")
+        batch = provider.client.batches.create(input_file_id=input_file.id, endpoint="/v1/chat/completions",
+                                               completion_window=self.completion_window, metadata={"round": name})
+        with open(batch_path, 'w') as f:
+            f.write(batch.id)
+        logging.info(f"Submitted batch {batch.id} for {name} ({len(requests)} requests)")
+        return batch.id
+
+    def _collect(self, provider: Provider, name: str, batch_id: str) -> dict:
+        output_path = os.path.join(self.workdir, f"{name}.output.jsonl")
+        if not os.path.exists(output_path):
+            batch = self._wait(provider, batch_id)
+            lines = []
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    lines.append(provider.client.files.content(file_id).text.strip())
+            with open(output_path, 'w', encoding='utf-8') as f:
+                f.write("\n".join(line for line in lines if line) + "\n")
+
+        responses = {}
+        with open(output_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                response = item.get("response") or {}
+                if item.get("error") or response.get("status_code") != 200:
+                    logging.error(f"Request {item['custom_id']} failed: {item.get('error') or response.get('body')}")
+                    responses[item["custom_id"]] = None
+                else:
+                    responses[item["custom_id"]] = ChatCompletion.model_validate(response["body"])
+        return responses
+
+    def _wait(self, provider: Provider, batch_id: str):
+        while True:
+            batch = provider.client.batches.retrieve(batch_id)
+            if batch.status in ("completed", "failed", "expired", "cancelled"):
+                break
+            counts = batch.request_counts
+            progress = f"{counts.completed}/{counts.total}" if counts else "?"
+            logging.info(f"Batch {batch_id} is {batch.status} ({progress}), polling again in {self.poll_interval}s")
+            time.sleep(self.poll_interval)
+        if batch.status != "completed":
+            logging.error(f"Batch {batch_id} ended with status {batch.status}: {batch.errors}")
+        return batch
+
+
+def item_key(item: dict) -> str:
+    """A custom_id prefix derived from the item's id, so results stay attached to it when the item list changes."""
+    return hashlib.sha1(str(item['id']).encode("utf-8")).hexdigest()[:16]
+
+
+def _check_unique_keys(states: list):
+    seen = {}
+    for state in states:
+        if state["key"] in seen:
+            raise ValueError(f"Items {seen[state['key']]!r} and {state['item']['id']!r} share a batch key")
+        seen[state["key"]] = state["item"]['id']
+
+
+def generate_rules(items: list, runner: BatchRoundRunner, rule_type: str = 'splunk') -> list:
+    """
+    Batch equivalent of RuleGenerator.generate_rule for many descriptions.
+
+    items are dicts with 'id', 'description' and optional 'required_fields'. The DSL analysis stage is
+    pipelined like generate_dsl_rule: round k carries breakdown step k and the DSL translation of step k-1,
+    so n planned steps take n + 1 rounds (steps are planned per description, up to eight). DSL optimization,
+    generation from DSL and rule optimization follow with one round each.
+    """
+    from src.context import context_compactor
+    from src.prompt import TASK_BREAKDOWN_PROMPTS
+    from src.step_planner import nothing_to_add, plan_dsl_steps
+    states = []
+    for item in items:
+        breakdown_msgs, dsl_msgs = RuleGenerator._dsl_conversations(item['description'], rule_type,
+                                                                    item.get('required_fields'))
+        states.append({"item": item, "key": item_key(item), "breakdown_msgs": breakdown_msgs, "dsl_msgs": dsl_msgs,
+                       "analyses": [], "dsl_rules": [], "steps": plan_dsl_steps(item['description']), "error": None})
+    _check_unique_keys(states)
+
+    def active():
+        return [(state["key"], state) for state in states if state["error"] is None]
+
+    for k in range(max((len(state["steps"]) for state in states), default=0) + 1):
+        requests = {}
+        for key, state in active():
+            steps = state["steps"]
+            if k > len(steps):
+                continue
+            if k < len(steps):
+                state["breakdown_msgs"].append({"role": "user", "content": TASK_BREAKDOWN_PROMPTS[steps[k]]})
+                stage = f"_analyse_subtask:{steps[k]}:breakdown"
+                requests[f"{key}-breakdown-{k}"] = (stage, context_compactor.compact(
+                    list(state["breakdown_msgs"]), 'breakdown', stage), {})
+            if k > 0 and state["analyses"][k - 1] is not None and not nothing_to_add(state["analyses"][k - 1]):
+                step_name = steps[k - 1].replace('_', ' ')
+                state["dsl_msgs"].append({"role": "user", "content": step_name + ':\n' + state["analyses"][k - 1]})
+                stage = f"_analyse_subtask:{steps[k - 1]}:dsl"
+                requests[f"{key}-dsl-{k - 1}"] = (stage, context_compactor.compact(
+                    list(state["dsl_msgs"]), 'dsl', stage), {})
+        if not requests:
+            continue
+        results = runner.run_round(f"dsl_round_{k}", requests)
+        for key, state in active():
+            steps = state["steps"]
+            if k < len(steps):
+                analyse_message = results.get(f"{key}-breakdown-{k}")
+                if analyse_message is not None:
+                    state["breakdown_msgs"].append({"role": "assistant", "content": analyse_message})
+                else:
+                    state["breakdown_msgs"].pop()
+                state["analyses"].append(analyse_message)
+            custom_id = f"{key}-dsl-{k - 1}"
+            if custom_id in results:
+                if results[custom_id] is None:
+                    state["dsl_msgs"].pop()
+                    continue
+                dsl_rules = RuleGenerator._dsl_lines(results[custom_id])
+                RuleGenerator._keep_dsl_turn(state["dsl_msgs"], results[custom_id], dsl_rules)
+                state["dsl_rules"].extend(dsl_rules)
+
+    # (round, router stage of the synchronous call, field, fenced block to extract, messages)
+    stages = [
+        ("dsl_optimize", "_optimize_dsl_rule", "dsl_rule", 'plaintext',
+         lambda state: RuleGenerator._optimize_dsl_messages(state["dsl_rules"], state["item"]['description'])),
+        ("generate", "generate_rule_from_dsl", "raw_rule", None,
+         lambda state: RuleGenerator._rule_from_dsl_messages(state["item"]['description'], state["dsl_rule"],
+                                                             rule_type)),
+        ("optimize", "optimize_rule", "rule", 'spl',
+         lambda state: RuleGenerator._optimize_rule_messages(state["raw_rule"], state["item"]['description'])),
+    ]
+    for stage, route, field, block, build_messages in stages:
+        results = runner.run_round(stage, {f"{key}-{stage}": (route, build_messages(state), {})
+                                           for key, state in active()})
+        for key, state in active():
+            content = results.get(f"{key}-{stage}")
+            if content is None:
+                state["error"] = f"{stage} request failed"
+                continue
+            try:
+                state[field] = RuleGenerator._extract_block(content, block) if block else content
+            except AttributeError:
+                state["error"] = f"no {block} block in {stage} response"
+
+    records = []
+    for state in states:
+        record = {"id": state["item"]['id'], "status": "error" if state["error"] else "ok"}
+        if state["error"]:
+            record["error"] = state["error"]
+        else:
+            record.update(dsl_rule=state["dsl_rule"], rule=state["rule"])
+        records.append(record)
+    return records
+
+
+def score_rules(items: list, runner: BatchRoundRunner) -> list:
+    """Re-score existing rules with SCORE_PROMPT; items are dicts with 'id', 'rule' and 'description'."""
+    keyed = [(item_key(item), item) for item in items]
+    _check_unique_keys([{"key": key, "item": item} for key, item in keyed])
+    requests = {}
+    for key, item in keyed:
+        requests[f"{key}-score"] = ("reflect_and_score_rule", score_messages(item['rule'], item['description']),
+                                    {"response_format": {"type": "json_object"}})
+    results = runner.run_round("score", requests)
+    records = []
+    for key, item in keyed:
+        content = results.get(f"{key}-score")
+        try:
+            records.append({"id": item['id'], "status": "ok", "scores": json.loads(content)})
+        except (TypeError, json.JSONDecodeError):
+            records.append({"id": item['id'], "status": "error", "error": "scoring request failed"})
+    return records
+
+
+def _load_category_items(category: str) -> list:
+    from src.runner import list_categories
+    categories = list_categories() if category == 'all' else [category]
+    items = []
+    for category in categories:
+        for path, data in description_and_rule_generator(category):
+            items.append({"id": os.path.relpath(path, PROJECT_ROOT), "description": data['description'],
+                          "required_fields": "\n".join(f"- {f}" for f in data.get('required_fields') or []),
+                          "rule": data.get('rule')})
+    return items
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run offline rule generation or scoring through the Batch API.")
+    parser.add_argument('command', choices=['generate', 'score'])
+    parser.add_argument('--category', default='all')
+    parser.add_argument('--input', default=None,
+                        help="score: JSONL with path/rule records (e.g. src.runner output); "
+                             "defaults to the reference rules of --category")
+    parser.add_argument('--rule-type', default='splunk')
+    parser.add_argument('--workdir', default=None)
+    parser.add_argument('--poll-interval', type=float, default=60)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    workdir = args.workdir or os.path.join(PROJECT_ROOT, 'output', 'batch_api', f'{args.command}_{args.category}')
+    runner = BatchRoundRunner(workdir, poll_interval=args.poll_interval)
+    items = _load_category_items(args.category)
+    if args.command == 'generate':
+        records = generate_rules(items, runner, args.rule_type)
+    else:
+        if args.input:
+            descriptions = {item['id']: item['description'] for item in items}
+            with open(args.input, 'r', encoding='utf-8') as f:
+                rows = [json.loads(line) for line in f if line.strip()]
+            items = [{"id": row['path'], "rule": row['rule'], "description": descriptions[row['path']]}
+                     for row in rows if row.get('status') == 'ok' and row['path'] in descriptions]
+        records = score_rules(items, runner)
+
+    output = args.output or os.path.join(workdir, 'results.jsonl')
+    with open(output, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    logging.info(f"{sum(r['status'] == 'ok' for r in records)}/{len(records)} succeeded, results in {output}")
+
+
+if __name__ == '__main__':
+    main()
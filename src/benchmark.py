@@ -0,0 +1,238 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from src.event_logs import event_view, technique_of
+from src.known_rules import known_rules
+from src.rule import RuleGenerator, model
+from src.runner import generate_one
+from src.spl_engine import local_engine
+import argparse
+import json
+import logging
+import os
+import re
+import time
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+REDTEAM_PATH = os.path.join(PROJECT_ROOT, "dataset/redteam")
+# bump when the report layout or the scoring changes, so old baselines are not compared blindly
+SCHEMA_VERSION = 1
+
+_TEST_NUMBER = re.compile(r'^Atomic Test #(\d+)\s*-\s*(.*?)(?:\.txt)?\s*$')
+
+
+@dataclass
+class BenchmarkCase:
+    """One atomic test description under dataset/redteam/<technique>/ to generate a rule from."""
+    id: str
+    technique: str
+    test: str
+    path: str
+    description: str
+
+
+def load_cases(techniques=None) -> list:
+    wanted = {t.upper() for t in techniques} if techniques else None
+    cases = []
+    for folder in sorted(os.listdir(REDTEAM_PATH)):
+        technique = technique_of(folder)
+        folder_path = os.path.join(REDTEAM_PATH, folder)
+        if technique is None or not os.path.isdir(folder_path):
+            continue
+        if wanted and technique not in wanted and technique.split('.')[0] not in wanted:
+            continue
+        for name in os.listdir(folder_path):
+            match = _TEST_NUMBER.match(name)
+            if not match:
+                continue
+            path = os.path.join(folder_path, name)
+            with open(path, "r", encoding="utf-8-sig", errors="replace") as f:
+                description = f.read().strip()
+            test = f"Atomic Test #{match.group(1)} - {match.group(2).strip()}"
+            cases.append(BenchmarkCase(id=f"{technique}#{match.group(1)}", technique=technique, test=test,
+                                       path=path, description=description or test))
+    return sorted(cases, key=lambda case: (case.technique, int(case.id.split('#')[1])))
+
+
+def test_alerts() -> dict:
+    """Ground truth: atomic test id ('T1490#1') -> a view of its events in the Rule Ground Truth exports."""
+    groups = {}
+    for (technique, test), view in event_view().groups(['technique', 'atomic_test']).items():
+        match = _TEST_NUMBER.match(test)
+        if match:
+            groups[f"{technique}#{match.group(1)}"] = view
+    return groups
+
+
+def fired_tests(rule: str, groups: dict) -> tuple:
+    """
+    (atomic tests the rule returns results for, why it could not run or None).
+
+    The rule runs over each test's events on its own, so aggregations and thresholds see exactly what an alert
+    on that test would have seen. Rules still wrapped in a Markdown code fence (agent answers) are unwrapped first.
+    """
+    rule = RuleGenerator._extract_rule(rule)
+    fired = set()
+    for test_id, frame in groups.items():
+        result = local_engine.run(rule, events=frame)
+        if result.unsupported:
+            return set(), f"unsupported {result.unsupported}"
+        if result.error:
+            return set(), result.error
+        if result.count:
+            fired.add(test_id)
+    return fired, None
+
+
+def _ratios(tp: int, fp: int, fn: int) -> dict:
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"tp": tp, "fp": fp, "fn": fn, "precision": round(precision, 4), "recall": round(recall, 4),
+            "f1": round(f1, 4)}
+
+
+def score_case(record: dict, groups: dict) -> dict:
+    """Adds the alert-level confusion counts of a generated rule to its case record."""
+    technique = record["technique"]
+    positives = {test_id for test_id in groups if test_id.split('#')[0] == technique}
+    fired, problem = fired_tests(record["rule"], groups) if record.get("rule") else (set(), record.get("error"))
+    record.update(_ratios(len(fired & positives), len(fired - positives), len(positives - fired)))
+    record.update(fired=sorted(fired), executable=problem is None and bool(record.get("rule")),
+                  detected_own_test=record["id"] in fired, problem=problem)
+    return record
+
+
+def _totals(records: list) -> dict:
+    latencies = [r["latency"] for r in records]
+    usage = [r["usage"] for r in records]
+    rules = max(len(records), 1)
+    return {
+        "cases": len(records),
+        "generated": sum(r["status"] == "ok" for r in records),
+        "executable": sum(r["executable"] for r in records),
+        "detected_own_test": sum(r["detected_own_test"] for r in records),
+        "reused_known": sum(bool(r.get("provenance")) for r in records),
+        "latency_mean": round(sum(latencies) / rules, 3),
+        "llm_calls": sum(u["calls"] for u in usage),
+        "prompt_tokens": sum(u["prompt_tokens"] for u in usage),
+        "completion_tokens": sum(u["completion_tokens"] for u in usage),
+        "total_tokens": sum(u["total_tokens"] for u in usage),
+        "calls_per_rule": round(sum(u["calls"] for u in usage) / rules, 2),
+        "tokens_per_rule": round(sum(u["total_tokens"] for u in usage) / rules, 1),
+    }
+
+
+def build_report(records: list, config: dict, wall_time: float) -> dict:
+    """
+    The benchmark report: per case, per technique and overall precision/recall/F1 with cost. Keys are sorted and
+    cases ordered by id, so two reports diff cleanly.
+    """
+    records = sorted(records, key=lambda r: (r["technique"], int(r["id"].split('#')[1])))
+    techniques = {}
+    for technique in sorted({r["technique"] for r in records}):
+        subset = [r for r in records if r["technique"] == technique]
+        techniques[technique] = {**_totals(subset), **_ratios(sum(r["tp"] for r in subset),
+                                                              sum(r["fp"] for r in subset),
+                                                              sum(r["fn"] for r in subset))}
+    summary = {**_totals(records), **_ratios(sum(r["tp"] for r in records), sum(r["fp"] for r in records),
+                                             sum(r["fn"] for r in records))}
+    summary["macro_f1"] = round(sum(t["f1"] for t in techniques.values()) / max(len(techniques), 1), 4)
+    summary["wall_time"] = round(wall_time, 3)
+    return {"schema_version": SCHEMA_VERSION, "config": config, "summary": summary, "techniques": techniques,
+            "cases": records}
+
+
+def run_benchmark(cases: list, mode: str = 'generator', rule_type: str = 'splunk', workers: int = 4,
+                  reuse_known: bool = False) -> dict:
+    """
+    Generates and scores a rule per case. Known-rule reuse is off unless asked for, since a reused corpus search
+    measures the corpus rather than generation; reused rules are counted in the summary either way.
+    """
+    groups = test_alerts()
+    start = time.perf_counter()
+    reuse_default, known_rules.enabled = known_rules.enabled, reuse_known
+    try:
+        records = _generate_cases(cases, groups, mode, rule_type, workers)
+    finally:
+        known_rules.enabled = reuse_default
+    config = {"mode": mode, "rule_type": rule_type, "model": model, "workers": workers, "reuse_known": reuse_known}
+    return build_report(records, config, time.perf_counter() - start)
+
+
+def _generate_cases(cases: list, groups: dict, mode: str, rule_type: str, workers: int) -> list:
+    records = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(generate_one, case.path, {"description": case.description}, case.technique,
+                                   mode, rule_type): case for case in cases}
+        for future in as_completed(futures):
+            case = futures[future]
+            generated = future.result()
+            record = {"id": case.id, "technique": case.technique, "test": case.test, "status": generated["status"],
+                      "rule": generated.get("rule"), "error": generated.get("error"),
+                      "provenance": generated.get("provenance"), "latency": generated["latency"],
+                      "usage": generated["usage"]}
+            records.append(score_case(record, groups))
+            logging.info(f"[{len(records)}/{len(cases)}] {case.id}: f1 {record['f1']} "
+                         f"({record['latency']}s, {record['usage']['total_tokens']} tokens)")
+    return records
+
+
+def rescore(report: dict) -> dict:
+    """Scores the rules of an earlier report again (after an engine or ground-truth change) without LLM calls."""
+    groups = test_alerts()
+    records = [score_case(dict(record), groups) for record in report["cases"]]
+    return build_report(records, report["config"], report["summary"]["wall_time"])
+
+
+def compare(baseline: dict, report: dict) -> list:
+    """One line per changed metric, with F1 or recall drops marked as regressions."""
+    if baseline.get("schema_version") != report.get("schema_version"):
+        return [f"baseline schema {baseline.get('schema_version')} != {report.get('schema_version')}, not compared"]
+    lines = []
+    rows = [("overall", baseline["summary"], report["summary"])]
+    rows += [(technique, baseline["techniques"].get(technique, {}), stats)
+             for technique, stats in report["techniques"].items()]
+    for name, before, after in rows:
+        for metric in ("f1", "precision", "recall", "tokens_per_rule", "calls_per_rule", "latency_mean"):
+            if metric not in before or before[metric] == after[metric]:
+                continue
+            regression = metric in ("f1", "recall") and after[metric] < before[metric]
+            lines.append(f"{'REGRESSION ' if regression else ''}{name} {metric}: {before[metric]} -> {after[metric]}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate rules for the redteam atomic tests and score them "
+                                                 "against the Rule Ground Truth events.")
+    parser.add_argument('--technique', action='append', default=None, help="only this technique (repeatable)")
+    parser.add_argument('--mode', choices=['generator', 'agent'], default='generator',
+                        help="RuleGenerator.generate_rule or SecurityRuleAgent.run_agent")
+    parser.add_argument('--rule-type', default='splunk')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--reuse-known', action='store_true',
+                        help="let descriptions that match an existing detection reuse its search (off by default)")
+    parser.add_argument('--output', default=None, help="report path (default output/benchmark_<mode>.json)")
+    parser.add_argument('--baseline', default=None, help="earlier report to compare against")
+    parser.add_argument('--rescore', default=None, help="score the rules of this report again instead of generating")
+    args = parser.parse_args()
+
+    if args.rescore:
+        with open(args.rescore, 'r', encoding='utf-8') as f:
+            report = rescore(json.load(f))
+    else:
+        report = run_benchmark(load_cases(args.technique), args.mode, args.rule_type, args.workers, args.reuse_known)
+    output = args.output or os.path.join(PROJECT_ROOT, 'output', f"benchmark_{report['config']['mode']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+    print(json.dumps({"summary": report["summary"], "techniques": {t: stats["f1"] for t, stats in
+                                                                   report["techniques"].items()}}, indent=2))
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            for line in compare(json.load(f), report):
+                print(line)
+
+
+if __name__ == '__main__':
+    main()
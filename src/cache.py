@@ -0,0 +1,149 @@
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from pathlib import Path
+from src.config import env_flag
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+load_dotenv()
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_CACHE_PATH = os.path.join(PROJECT_ROOT, ".cache", "llm_cache.sqlite")
+# eviction trims the cache to this fraction of max_entries, so it does not run again on the next insert
+LOW_WATER_MARK = 0.9
+
+
+class ResponseCache:
+    """
+    Persistent, content-addressed store for LLM completions.
+
+    Entries are keyed on a SHA-256 of the endpoint, model, messages and request
+    params, so only byte-identical requests share a response. Every evict_every
+    inserts, expired entries (ttl seconds after creation) are dropped and, once
+    the cache holds more than max_entries, the least recently used entries are
+    evicted down to LOW_WATER_MARK * max_entries.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, ttl: float = 0, max_entries: int = 100000,
+                 enabled: bool = True, evict_every: int = None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        # the cache may overshoot max_entries by this many rows between two checks
+        self.evict_every = evict_every or max(1, min(1000, max_entries // 100))
+        self._inserts = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._conn = None
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache":
+        return cls(
+            path=os.getenv("LLM_CACHE_PATH") or DEFAULT_CACHE_PATH,
+            ttl=float(os.getenv("LLM_CACHE_TTL", 0)),
+            max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", 100000)),
+            enabled=not env_flag("LLM_CACHE_DISABLED", False),
+        )
+
+    @staticmethod
+    def make_key(model: str, messages: list, **params) -> str:
+        payload = {"model": model, "messages": messages, "params": params}
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @property
+    def active(self) -> bool:
+        return self.enabled and not getattr(self._local, "bypass", False)
+
+    @contextmanager
+    def bypass(self):
+        # skip the cache for calls made by the current thread
+        previous = getattr(self._local, "bypass", False)
+        self._local.bypass = True
+        try:
+            yield
+        finally:
+            self._local.bypass = previous
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str):
+        if not self.active:
+            return None
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.ttl and now - row[1] > self.ttl):
+                self.misses += 1
+                return None
+            conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+            self.hits += 1
+        return row[0]
+
+    def set(self, key: str, value: str):
+        if not self.active:
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("INSERT OR REPLACE INTO responses (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                         (key, value, now, now))
+            self._inserts += 1
+            if self._inserts % self.evict_every == 0:
+                self._evict(conn, now)
+            conn.commit()
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        if self.ttl:
+            conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+        if not self.max_entries:
+            return
+        entries = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if entries > self.max_entries:
+            # the accessed_at index makes this a scan of the oldest rows only
+            conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY accessed_at LIMIT ?)",
+                (entries - int(self.max_entries * LOW_WATER_MARK),)
+            )
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._connect().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+        }
+
+
+response_cache = ResponseCache.from_env()
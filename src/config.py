@@ -0,0 +1,7 @@
+import os
+
+
+def env_flag(name: str, default: bool) -> bool:
+    """Boolean environment setting: 1/true/yes (any case) is on, anything else off, unset or empty is default."""
+    value = os.getenv(name)
+    return default if value in (None, '') else value.strip().lower() in ('1', 'true', 'yes')
@@ -0,0 +1,95 @@
+from dotenv import load_dotenv
+from src.config import env_flag
+from src.instrumentation import instrumentation
+import os
+import re
+
+load_dotenv()
+
+# rough prompt-token estimate; good enough to report savings without a tokenizer dependency
+CHARS_PER_TOKEN = 4
+_BLOCK = re.compile(r'```plaintext\n(.*?)\n```', re.DOTALL)
+_KEY_LINE = re.compile(r'^\s*([-*•]|\d+[.)]|#+)\s*')
+
+
+def estimate_tokens(messages: list) -> int:
+    return sum(len(message.get("content") or '') for message in messages) // CHARS_PER_TOKEN
+
+
+def _turns(messages: list) -> tuple:
+    """(fixed prefix, completed (user, assistant) turns, trailing pending messages)."""
+    prefix = []
+    rest = list(messages)
+    # the system prompt and the rule context message that directly follows it (see build_messages)
+    while rest and (rest[0]["role"] == "system" or (len(rest) > 1 and rest[0]["role"] == rest[1]["role"] == "user")):
+        prefix.append(rest.pop(0))
+    turns = []
+    while len(rest) >= 2 and rest[0]["role"] == "user" and rest[1]["role"] == "assistant":
+        turns.append((rest.pop(0), rest.pop(0)))
+    return prefix, turns, rest
+
+
+class ContextCompactor:
+    """
+    Shrinks the two _analyse_subtask conversations before each request.
+
+    Both conversations grow by one question and one answer per step, so by OPTIMIZE_OUTPUT every request
+    resends the whole history. The compactor sends the system prompt and the rule context unchanged (a stable
+    prefix for provider-side prompt caching), then one running summary of the older turns, then the last
+    keep_turns turns verbatim and the new question. For the DSL conversation the summary is the DSL lines
+    generated so far; for the breakdown conversation it is the key lines (bullets, headings, first sentences)
+    of every earlier answer. The stored conversations are left intact; the estimated tokens saved are reported
+    per stage.
+    """
+
+    def __init__(self, keep_turns: int = 1, max_answer_chars: int = 600, enabled: bool = True):
+        self.keep_turns = keep_turns
+        self.max_answer_chars = max_answer_chars
+        self.enabled = enabled
+
+    def _key_points(self, answer: str) -> str:
+        lines = [line.strip() for line in answer.splitlines() if line.strip() and not line.startswith('```')]
+        points = [line for line in lines if _KEY_LINE.match(line)] or lines[:2]
+        summary = "\n".join(points)
+        return summary if len(summary) <= self.max_answer_chars else summary[:self.max_answer_chars] + ' ...'
+
+    def _breakdown_summary(self, turns: list) -> str:
+        sections = []
+        for question, answer in turns:
+            sections.append(f"Q: {question['content'].strip()}\n{self._key_points(answer['content'])}")
+        return "## Key points of the previous answers:\n" + "\n\n".join(sections)
+
+    @staticmethod
+    def _dsl_summary(turns: list) -> str:
+        steps, lines = [], []
+        for question, answer in turns:
+            steps.append(question['content'].split(':', 1)[0].strip())
+            for block in _BLOCK.findall(answer['content']):
+                lines.extend(line for line in block.split('\n') if line.strip())
+        dsl = "\n".join(lines)
+        return (f"## Steps already translated: {', '.join(steps)}\n"
+                f"## DSL rules generated so far (do not repeat them):\n```plaintext\n{dsl}\n```")
+
+    def compact(self, messages: list, kind: str, stage: str = None) -> list:
+        """The messages to send for a 'breakdown' or 'dsl' conversation."""
+        if not self.enabled:
+            return messages
+        prefix, turns, pending = _turns(messages)
+        if len(turns) <= self.keep_turns:
+            return messages
+        older = turns[:len(turns) - self.keep_turns]
+        recent = turns[len(turns) - self.keep_turns:]
+        summary = self._dsl_summary(older) if kind == 'dsl' else self._breakdown_summary(older)
+        compacted = prefix + [{"role": "user", "content": summary}]
+        for question, answer in recent:
+            compacted += [question, answer]
+        compacted += pending
+        saved = estimate_tokens(messages) - estimate_tokens(compacted)
+        if saved <= 0:
+            return messages
+        instrumentation.add_compaction(stage, saved)
+        return compacted
+
+
+context_compactor = ContextCompactor(keep_turns=int(os.getenv("CONTEXT_KEEP_TURNS") or 1),
+                                     enabled=env_flag("CONTEXT_COMPACTION", True))
@@ -0,0 +1,267 @@
+from collections import defaultdict
+from dataclasses import dataclass
+from dotenv import load_dotenv
+from pathlib import Path
+import argparse
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import threading
+import time
+import yaml
+
+load_dotenv()
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+DATASET_PATH = os.path.join(PROJECT_ROOT, "dataset")
+DEFAULT_SNAPSHOT_PATH = os.path.join(PROJECT_ROOT, ".cache", "corpus.snapshot")
+CORPUS_DIRS = ("detections", "descriptions")
+SNAPSHOT_MAGIC = b"RPCORPUS1"
+# libyaml is ~10x faster than the pure-Python loader
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+@dataclass
+class DetectionRecord:
+    id: str
+    name: str
+    category: str
+    file: str
+    type: str = None
+    status: str = None
+    description: str = ''
+    search: str = ''
+    # the descriptions/ copy of the rule, with the common macros expanded
+    rule: str = ''
+    data_source: tuple = ()
+    mitre_attack_id: tuple = ()
+    required_fields: tuple = ()
+    analytic_story: tuple = ()
+    detection_path: str = None
+    description_path: str = None
+
+
+def _strings(values) -> tuple:
+    if values is None:
+        return ()
+    if not isinstance(values, list):
+        values = [values]
+    return tuple(sys.intern(str(v)) for v in values if v is not None)
+
+
+_KEPT_KEYS = ("id", "name", "type", "status", "description", "search", "rule", "data_source", "required_fields")
+_KEPT_TAGS = ("mitre_attack_id", "required_fields", "analytic_story")
+
+
+def _parse_file(path: str) -> dict:
+    # a few files are not valid UTF-8; decode them leniently rather than dropping the rule
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        data = yaml.load(f, Loader=YAML_LOADER) or {}
+    if not isinstance(data, dict):
+        return {}
+    # only what the records need goes into the snapshot
+    compact = {key: data[key] for key in _KEPT_KEYS if key in data}
+    tags = data.get("tags")
+    if isinstance(tags, dict):
+        compact["tags"] = {key: tags[key] for key in _KEPT_TAGS if key in tags}
+    return compact
+
+
+class Corpus:
+    """
+    In-memory record store over dataset/detections and dataset/descriptions.
+
+    YAML is parsed once with the libyaml loader and the parsed files are persisted to a pickle snapshot
+    (.cache/corpus.snapshot) guarded by a SHA-256 of its payload. On load only files whose mtime or size
+    changed since the snapshot are re-parsed. Records are indexed by id, name, category, MITRE technique,
+    data source and required field.
+    """
+
+    def __init__(self, dataset_path: str = DATASET_PATH, snapshot_path: str = DEFAULT_SNAPSHOT_PATH):
+        self.dataset_path = dataset_path
+        self.snapshot_path = snapshot_path
+        self.records = []
+        self.indexes = {}
+        self._files = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _scan(self) -> dict:
+        stats = {}
+        for directory in CORPUS_DIRS:
+            base = os.path.join(self.dataset_path, directory)
+            if not os.path.isdir(base):
+                continue
+            for root, _, files in os.walk(base):
+                for file in files:
+                    if not file.endswith((".yml", ".yaml")):
+                        continue
+                    path = os.path.join(root, file)
+                    stat = os.stat(path)
+                    stats[os.path.relpath(path, self.dataset_path)] = (stat.st_mtime_ns, stat.st_size)
+        return stats
+
+    def _read_snapshot(self) -> dict:
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                blob = f.read()
+        except OSError:
+            return {}
+        header = len(SNAPSHOT_MAGIC)
+        if blob[:header] != SNAPSHOT_MAGIC or hashlib.sha256(blob[header + 32:]).digest() != blob[header:header + 32]:
+            logging.warning(f"Ignoring corrupt corpus snapshot {self.snapshot_path}")
+            return {}
+        try:
+            return pickle.loads(blob[header + 32:])
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable corpus snapshot {self.snapshot_path}: {e}")
+            return {}
+
+    def _write_snapshot(self):
+        payload = pickle.dumps(self._files, protocol=pickle.HIGHEST_PROTOCOL)
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+            tmp_path = f"{self.snapshot_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(SNAPSHOT_MAGIC + hashlib.sha256(payload).digest() + payload)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            logging.warning(f"Could not write corpus snapshot {self.snapshot_path}: {e}")
+
+    def load(self, refresh: bool = False):
+        """Load the snapshot and re-parse changed files; refresh forces a new mtime check after the first load."""
+        with self._lock:
+            if self._loaded and not refresh:
+                return
+            start = time.perf_counter()
+            files = self._files or self._read_snapshot()
+            stats = self._scan()
+            changed = [path for path, stat in stats.items() if files.get(path, {}).get("stat") != stat]
+            removed = [path for path in files if path not in stats]
+            for path in removed:
+                del files[path]
+            for path in changed:
+                try:
+                    data = _parse_file(os.path.join(self.dataset_path, path))
+                except yaml.YAMLError as e:
+                    logging.error(f"Failed to parse {path}: {e}")
+                    data = {}
+                files[path] = {"stat": stats[path], "data": data}
+            self._files = files
+            if changed or removed or not self._loaded:
+                self._build()
+            if changed or removed:
+                self._write_snapshot()
+            self._loaded = True
+            logging.info(f"Loaded {len(self.records)} corpus records in {time.perf_counter() - start:.3f}s "
+                         f"({len(changed)} files parsed, {len(removed)} removed)")
+
+    def _build(self):
+        descriptions = {}
+        for path, entry in self._files.items():
+            parts = Path(path).parts
+            if parts[0] == "descriptions":
+                descriptions[(parts[1], parts[-1])] = (path, entry["data"])
+        records = []
+        for path in sorted(self._files):
+            parts = Path(path).parts
+            if parts[0] != "detections":
+                continue
+            data = self._files[path]["data"]
+            tags = data.get("tags") or {}
+            category, file = parts[1], parts[-1]
+            description_path, description = descriptions.pop((category, file), (None, {}))
+            records.append(self._record(data, tags, category, file, path, description_path, description))
+        # descriptions without a detection still belong to the corpus
+        for (category, file), (description_path, description) in sorted(descriptions.items()):
+            records.append(self._record({}, {}, category, file, None, description_path, description))
+
+        indexes = {key: defaultdict(list) for key in ("id", "name", "category", "mitre_attack_id", "data_source",
+                                                        "required_fields")}
+        for n, record in enumerate(records):
+            indexes["id"][record.id].append(n)
+            indexes["name"][record.name.lower()].append(n)
+            indexes["category"][record.category].append(n)
+            for technique in record.mitre_attack_id:
+                indexes["mitre_attack_id"][technique.upper()].append(n)
+            for data_source in record.data_source:
+                indexes["data_source"][data_source.lower()].append(n)
+            for required_field in record.required_fields:
+                indexes["required_fields"][required_field].append(n)
+        self.records = records
+        self.indexes = {key: dict(index) for key, index in indexes.items()}
+
+    @staticmethod
+    def _record(data: dict, tags: dict, category: str, file: str, detection_path: str, description_path: str,
+                description: dict) -> DetectionRecord:
+        return DetectionRecord(
+            id=str(data.get("id") or os.path.splitext(file)[0]),
+            name=str(data.get("name") or os.path.splitext(file)[0]),
+            category=sys.intern(category),
+            file=file,
+            type=data.get("type"),
+            status=data.get("status"),
+            description=description.get("description") or data.get("description") or '',
+            search=data.get("search") or '',
+            rule=description.get("rule") or '',
+            data_source=_strings(data.get("data_source")),
+            mitre_attack_id=_strings(tags.get("mitre_attack_id")),
+            required_fields=_strings(description.get("required_fields") or tags.get("required_fields")),
+            analytic_story=_strings(tags.get("analytic_story")),
+            detection_path=detection_path,
+            description_path=description_path,
+        )
+
+    def _lookup(self, index: str, key: str) -> list:
+        self.load()
+        return [self.records[n] for n in self.indexes[index].get(key, [])]
+
+    def by_id(self, rule_id: str):
+        records = self._lookup("id", rule_id)
+        return records[0] if records else None
+
+    def by_name(self, name: str) -> list:
+        return self._lookup("name", name.lower())
+
+    def by_category(self, category: str) -> list:
+        return self._lookup("category", category)
+
+    def by_mitre(self, technique: str) -> list:
+        """Records tagged with a technique; a parent ID such as T1059 also matches its sub-techniques."""
+        self.load()
+        technique = technique.upper()
+        keys = [key for key in self.indexes["mitre_attack_id"] if key == technique or key.startswith(technique + ".")]
+        return [self.records[n] for n in sorted({n for key in keys for n in self.indexes["mitre_attack_id"][key]})]
+
+    def by_data_source(self, data_source: str) -> list:
+        return self._lookup("data_source", data_source.lower())
+
+    def by_required_field(self, required_field: str) -> list:
+        return self._lookup("required_fields", required_field)
+
+    def categories(self) -> list:
+        self.load()
+        return sorted(self.indexes["category"])
+
+    def __len__(self):
+        self.load()
+        return len(self.records)
+
+    def __iter__(self):
+        self.load()
+        return iter(self.records)
+
+
+corpus = Corpus(snapshot_path=os.getenv("CORPUS_SNAPSHOT_PATH") or DEFAULT_SNAPSHOT_PATH)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Build or refresh the corpus snapshot.")
+    parser.add_argument("--rebuild", action="store_true", help="ignore the existing snapshot")
+    args = parser.parse_args()
+    if args.rebuild and os.path.exists(corpus.snapshot_path):
+        os.remove(corpus.snapshot_path)
+    corpus.load()
+    print(f"{len(corpus)} records in {len(corpus.categories())} categories, snapshot at {corpus.snapshot_path}")
@@ -0,0 +1,208 @@
+from collections import deque
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+import glob
+import logging
+import os
+import pandas as pd
+import re
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+GROUND_TRUTH_PATH = os.path.join(PROJECT_ROOT, "dataset/redteam/Rule Ground Truth")
+
+_TEST_HEADER = re.compile(r'^Atomic Test #(\d+)\s*-\s*(.*)$')
+_LOG_MARKER = re.compile(r'^Log\d+$')
+_TIMESTAMP = re.compile(r'^\d{2}/\d{2}/\d{4} \d{1,2}:\d{2}:\d{2} [AP]M$')
+_HEADER_FIELD = re.compile(r'^([A-Za-z][A-Za-z0-9_]*)=(.*)$')
+_MESSAGE_FIELD = re.compile(r'^([A-Za-z][A-Za-z0-9]+):\s?(.*)$')
+_TRAILER = re.compile(r'^host = (.*?)source = (.*?)sourcetype = (.*)$')
+# the viewer's "collapse" link, copied along with the event
+_COLLAPSE = {'折叠', 'Collapse'}
+_SCRIPT_BLOCK_ID = re.compile(r'^ScriptBlock ID:\s*(.*)$')
+_SCRIPT_PATH = re.compile(r'^(路径|Path):\s*(.*)$')
+
+# CIM names used by the detections -> the Windows field they are extracted from, as the Splunk add-ons do
+FIELD_ALIASES = {
+    'EventID': 'EventCode', 'signature_id': 'EventCode', 'dest': 'ComputerName', 'user': 'User',
+    'process': 'CommandLine', 'process_path': 'Image', 'process_id': 'ProcessId', 'process_guid': 'ProcessGuid',
+    'parent_process': 'ParentCommandLine', 'parent_process_path': 'ParentImage',
+    'parent_process_id': 'ParentProcessId', 'parent_process_guid': 'ParentProcessGuid',
+    'original_file_name': 'OriginalFileName', 'registry_path': 'TargetObject', 'registry_value_data': 'Details',
+    'file_path': 'TargetFilename', 'Computer': 'ComputerName',
+}
+BASENAME_ALIASES = {
+    'process_name': 'Image', 'parent_process_name': 'ParentImage', 'file_name': 'TargetFilename',
+    'registry_value_name': 'TargetObject',
+}
+
+
+def technique_of(path: str) -> str:
+    """'T1021_002_malicious_logs(GT).txt' -> 'T1021.002'"""
+    match = re.match(r'(T\d{4})(?:[_.](\d{3}))?', os.path.basename(path))
+    if not match:
+        return None
+    return f"{match.group(1)}.{match.group(2)}" if match.group(2) else match.group(1)
+
+
+@lru_cache(maxsize=4096)
+def _epoch(timestamp: str) -> float:
+    return datetime.strptime(timestamp, "%m/%d/%Y %I:%M:%S %p").replace(tzinfo=timezone.utc).timestamp()
+
+
+def _basename(path: str) -> str:
+    return re.split(r'[\\/]', path.rstrip('\\/'))[-1] if path else path
+
+
+def _windows(lines, ahead: int = 2):
+    """(previous line, line, the next `ahead` lines) for every line, reading the input only once."""
+    buffer, previous = deque(), None
+    for line in lines:
+        buffer.append(line.rstrip('\r\n'))
+        if len(buffer) > ahead:
+            current = buffer.popleft()
+            yield previous, current, tuple(buffer)
+            previous = current
+    while buffer:
+        current = buffer.popleft()
+        yield previous, current, tuple(buffer)
+        previous = current
+
+
+def _event_starts(previous: str, line: str, following: tuple) -> bool:
+    """True when the line opens an event: 'LogN' or a timestamp followed by the LogName= header."""
+    # nearly every line is a header or message line; skip the regexes for them
+    if not line or not (line[0] == 'L' or line[0].isdigit()):
+        return False
+    if _LOG_MARKER.match(line):
+        nxt = next((l for l in following if l.strip()), '')
+        return bool(_TIMESTAMP.match(nxt) or nxt.startswith('LogName='))
+    if _TIMESTAMP.match(line):
+        return bool(following) and following[0].startswith('LogName=')
+    return line.startswith('LogName=') and (previous is None or not _TIMESTAMP.match(previous))
+
+
+def _message_fields(event: dict, message: list):
+    if event.get('EventCode') == '4104':
+        # Script block logging: the first line is a (localized) title, the script runs up to "ScriptBlock ID:"
+        script = []
+        for line in message[1:]:
+            block_id, path = _SCRIPT_BLOCK_ID.match(line), _SCRIPT_PATH.match(line)
+            if block_id:
+                event['ScriptBlockId'] = block_id.group(1).strip()
+            elif path:
+                event['Path'] = path.group(2).strip()
+            elif 'ScriptBlockId' not in event:
+                script.append(line)
+        event['ScriptBlockText'] = "\n".join(script).strip()
+        return
+    for line in message[1:]:
+        match = _MESSAGE_FIELD.match(line)
+        if match:
+            # the message carries the event's own values (e.g. the process user rather than SYSTEM)
+            event[match.group(1)] = match.group(2).strip()
+
+
+def _finish(event: dict, raw: list, message: list) -> dict:
+    event['_raw'] = "\n".join(raw).strip()
+    if message:
+        event['Message'] = "\n".join(message).strip()
+        _message_fields(event, message)
+    log_name = event.get('LogName')
+    if log_name:
+        event.setdefault('sourcetype', f"WinEventLog:{log_name}")
+        event.setdefault('source', f"WinEventLog:{log_name}")
+    event.setdefault('host', event.get('ComputerName'))
+    for alias, name in FIELD_ALIASES.items():
+        if alias not in event and event.get(name) is not None:
+            event[alias] = event[name]
+    for alias, name in BASENAME_ALIASES.items():
+        if alias not in event and event.get(name):
+            event[alias] = _basename(event[name])
+    return event
+
+
+def iter_events(path: str):
+    """
+    The events of one ground-truth file as dicts: Key=Value headers, the Message with its "Key: value" lines
+    flattened into fields, host/source/sourcetype from the trailer, plus technique and atomic_test labels.
+    The file is streamed, so only the event being read is held in memory.
+    """
+    technique, test = technique_of(path), None
+    event, raw, message = None, [], None
+    with open(path, encoding="utf-8-sig", errors="replace") as f:
+        for previous, line, following in _windows(f):
+            if line.startswith('Atomic Test #') and _TEST_HEADER.match(line):
+                if event is not None:
+                    yield _finish(event, raw, message)
+                event, raw, message = None, [], None
+                test = line.strip()
+                continue
+            # "Log2" and the timestamp below it open the same event
+            if _event_starts(previous, line, following) and (event is None or raw):
+                if event is not None:
+                    yield _finish(event, raw, message)
+                event, raw, message = {'technique': technique, 'atomic_test': test}, [], None
+            if event is None:
+                continue
+            trailer = _TRAILER.match(line) if line.startswith('host = ') else None
+            if trailer:
+                event['host'], event['source'], event['sourcetype'] = (part.strip() for part in trailer.groups())
+                raw.append(line)
+                yield _finish(event, raw, message)
+                event, raw, message = None, [], None
+                continue
+            if _LOG_MARKER.match(line):
+                continue
+            raw.append(line)
+            if _TIMESTAMP.match(line) and '_time' not in event:
+                event['_time'] = _epoch(line)
+            elif message is not None:
+                if line.strip() in _COLLAPSE:
+                    raw.pop()
+                else:
+                    message.append(line)
+            elif line.startswith('Message='):
+                message = [line[len('Message='):]]
+            else:
+                match = _HEADER_FIELD.match(line)
+                if match:
+                    event[match.group(1)] = match.group(2).strip()
+        if event is not None:
+            yield _finish(event, raw, message)
+
+
+def parse_events(path: str) -> list:
+    return list(iter_events(path))
+
+
+def ground_truth_files(techniques=None) -> list:
+    files = sorted(glob.glob(os.path.join(GROUND_TRUTH_PATH, "*.txt")))
+    if techniques:
+        wanted = {t.upper() for t in techniques}
+        files = [f for f in files if technique_of(f) in wanted or (technique_of(f) or '').split('.')[0] in wanted]
+    return files
+
+
+def event_view(paths=None):
+    """
+    The events of the given files (all ground-truth files by default) as an EventView over the columnar event store,
+    in file order; nothing is decoded until the view is read.
+    """
+    from src.event_store import event_store, fallback_store
+    paths = list(paths or ground_truth_files())
+    try:
+        return event_store.view(paths)
+    except OSError as e:
+        # e.g. a read-only checkout: keep the tables under the temp directory instead
+        store = fallback_store()
+        logging.warning(f"Event store unavailable, storing the logs under {store.path}: {e}")
+        return store.view(paths)
+
+
+def load_events(paths=None) -> pd.DataFrame:
+    """
+    One row per event of the given files (all ground-truth files by default), newest first as Splunk returns them.
+    Every column is decoded; filter an event_view first where only some events or fields are needed.
+    """
+    return event_view(paths).newest_first().frame()
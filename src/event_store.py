@@ -0,0 +1,403 @@
+from dotenv import load_dotenv
+from pathlib import Path
+from src.event_logs import ground_truth_files, iter_events
+import argparse
+import array
+import hashlib
+import json
+import logging
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import tempfile
+import threading
+import time
+
+load_dotenv()
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_EVENT_STORE_PATH = os.path.join(PROJECT_ROOT, ".cache", "events")
+# bump when the parser's output changes so stale tables are rebuilt
+STORE_VERSION = 1
+# free text that is (nearly) unique per event; interning it would only grow the dictionaries
+TEXT_COLUMNS = {'_raw', 'Message', 'ScriptBlockText'}
+FLOAT_COLUMNS = {'_time'}
+NULL_CODE = -1
+# rows of a text or time column decoded at a time when a search tests it
+CHUNK_ROWS = 65536
+
+
+def _write_strings(prefix: str, values: list):
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    with open(f"{prefix}.bin", "wb") as f:
+        for n, value in enumerate(values):
+            data = value.encode("utf-8")
+            f.write(data)
+            offsets[n + 1] = offsets[n] + len(data)
+    np.save(f"{prefix}.offsets.npy", offsets)
+
+
+def _blob(path: str):
+    # numpy cannot map an empty file
+    return np.memmap(path, dtype=np.uint8, mode="r") if os.path.getsize(path) else np.zeros(0, dtype=np.uint8)
+
+
+class _DictionaryColumn:
+    """Interned strings: one int32 code per row into the column's distinct values, NULL_CODE for missing."""
+
+    kind = "dict"
+
+    def __init__(self, prefix: str, rows: int):
+        self.prefix = prefix
+        self.codes = array.array('i', [NULL_CODE]) * rows
+        self.index = {}
+
+    def add(self, value):
+        if value is None:
+            self.codes.append(NULL_CODE)
+            return
+        value = str(value)
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.index)
+        self.codes.append(code)
+
+    def close(self):
+        np.save(f"{self.prefix}.codes.npy", np.frombuffer(self.codes, dtype=np.int32))
+        _write_strings(f"{self.prefix}.values", list(self.index))
+
+
+class _TextColumn:
+    """Free text streamed straight to a UTF-8 blob; row i is blob[offsets[i]:offsets[i + 1]], empty for missing."""
+
+    kind = "text"
+
+    def __init__(self, prefix: str, rows: int):
+        self.prefix = prefix
+        self.file = open(f"{prefix}.bin", "wb")
+        self.offsets = array.array('q', [0]) * (rows + 1)
+        self.size = 0
+
+    def add(self, value):
+        if value:
+            data = str(value).encode("utf-8")
+            self.file.write(data)
+            self.size += len(data)
+        self.offsets.append(self.size)
+
+    def close(self):
+        self.file.close()
+        np.save(f"{self.prefix}.offsets.npy", np.frombuffer(self.offsets, dtype=np.int64))
+
+
+class _FloatColumn:
+    kind = "float"
+
+    def __init__(self, prefix: str, rows: int):
+        self.prefix = prefix
+        self.values = array.array('d', [np.nan]) * rows
+
+    def add(self, value):
+        self.values.append(np.nan if value is None else float(value))
+
+    def close(self):
+        np.save(f"{self.prefix}.npy", np.frombuffer(self.values, dtype=np.float64))
+
+
+class EventTable:
+    """The events of one source file as memory-mapped columns; values are only decoded for the rows and columns read."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "table.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.source = meta["source"]
+        self.rows = meta["rows"]
+        self.columns = meta["columns"]
+        self._codes = {}
+        self._dictionaries = {}
+
+    def __len__(self):
+        return self.rows
+
+    @staticmethod
+    def write(path: str, source: str, events) -> int:
+        """Stream the events into columns under path; returns the number of rows."""
+        os.makedirs(path, exist_ok=True)
+        columns, rows = {}, 0
+        try:
+            for event in events:
+                for name in event:
+                    if name not in columns:
+                        kind = (_FloatColumn if name in FLOAT_COLUMNS else
+                                _TextColumn if name in TEXT_COLUMNS else _DictionaryColumn)
+                        columns[name] = kind(os.path.join(path, f"c{len(columns)}"), rows)
+                for name, column in columns.items():
+                    column.add(event.get(name))
+                rows += 1
+        finally:
+            for column in columns.values():
+                column.close()
+        meta = {"version": STORE_VERSION, "source": source, "rows": rows,
+                "columns": {name: {"kind": column.kind, "file": os.path.basename(column.prefix)}
+                            for name, column in columns.items()}}
+        with open(os.path.join(path, "table.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        return rows
+
+    def _file(self, name: str, suffix: str) -> str:
+        return os.path.join(self.path, self.columns[name]["file"] + suffix)
+
+    def codes(self, name: str) -> np.ndarray:
+        """The int32 codes of a dictionary column, memory-mapped."""
+        codes = self._codes.get(name)
+        if codes is None:
+            codes = self._codes[name] = np.load(self._file(name, ".codes.npy"), mmap_mode="r")
+        return codes
+
+    def dictionary(self, name: str) -> np.ndarray:
+        """The distinct values of a dictionary column followed by None, so NULL_CODE (-1) indexes to None."""
+        values = self._dictionaries.get(name)
+        if values is None:
+            offsets = np.load(self._file(name, ".values.offsets.npy"))
+            blob = _blob(self._file(name, ".values.bin"))
+            values = [blob[offsets[n]:offsets[n + 1]].tobytes().decode("utf-8") for n in range(len(offsets) - 1)]
+            values = self._dictionaries[name] = np.array(values + [None], dtype=object)
+        return values
+
+    def column(self, name: str, rows: np.ndarray = None) -> np.ndarray:
+        """The values of a column, decoded for the given row numbers only (every row by default)."""
+        kind = self.columns[name]["kind"]
+        if kind == "float":
+            values = np.load(self._file(name, ".npy"), mmap_mode="r")
+            return values if rows is None else values[rows]
+        if kind == "dict":
+            # rows share the interned value objects, so repeated strings cost one pointer each
+            codes = self.codes(name)
+            return self.dictionary(name)[codes if rows is None else codes[rows]]
+        offsets = np.load(self._file(name, ".offsets.npy"), mmap_mode="r")
+        blob = _blob(self._file(name, ".bin"))
+        rows = range(self.rows) if rows is None else rows
+        values = np.empty(len(rows), dtype=object)
+        for n, row in enumerate(rows):
+            start, end = offsets[row], offsets[row + 1]
+            values[n] = blob[start:end].tobytes().decode("utf-8") if end > start else None
+        return values
+
+    def chunks(self, name: str, rows: np.ndarray = None):
+        """
+        (start, codes, values) covering the given rows (every row by default), where row start + i of them holds
+        values[codes[i]]. A dictionary column is one chunk of its distinct values, so a test on it runs once per
+        value; text and time columns are decoded CHUNK_ROWS rows at a time.
+        """
+        if self.columns[name]["kind"] == "dict":
+            codes, values = self.codes(name), self.dictionary(name)
+            if rows is not None:
+                used, codes = np.unique(codes[rows], return_inverse=True)
+                values, codes = values[used], codes.reshape(-1)
+            yield 0, codes, values
+            return
+        total = self.rows if rows is None else len(rows)
+        for start in range(0, total, CHUNK_ROWS):
+            chunk = np.arange(start, min(start + CHUNK_ROWS, total)) if rows is None else rows[start:start + CHUNK_ROWS]
+            yield start, np.arange(len(chunk)), self.column(name, chunk)
+
+    def frame(self, columns=None, rows: np.ndarray = None) -> pd.DataFrame:
+        names = [name for name in (self.columns if columns is None else columns) if name in self.columns]
+        return pd.DataFrame({name: self.column(name, rows) for name in names},
+                            index=pd.RangeIndex(self.rows if rows is None else len(rows)))
+
+
+class EventView:
+    """
+    Rows of one or more event tables, in order, read through the tables' memory maps. Searches narrow a view with
+    mask() and select(), which work on the int32 codes and text offsets; frame() decodes only the rows and columns
+    asked for, and nothing decoded is kept.
+    """
+
+    def __init__(self, tables: list, positions: np.ndarray = None, columns: list = None):
+        self.tables = tables
+        self._starts = np.cumsum([0] + [len(table) for table in tables])
+        # indexes into the tables' rows laid end to end; None is every row in table order
+        self.positions = positions
+        self.columns = columns or list(dict.fromkeys(name for table in tables for name in table.columns))
+
+    def __len__(self):
+        return int(self._starts[-1]) if self.positions is None else len(self.positions)
+
+    def _view(self, positions: np.ndarray) -> "EventView":
+        return EventView(self.tables, positions, self.columns)
+
+    def _parts(self):
+        """(table, its rows or None for all of them, where those rows are in the view) per table in the view."""
+        if self.positions is None:
+            for n, table in enumerate(self.tables):
+                if len(table):
+                    yield table, None, slice(self._starts[n], self._starts[n + 1])
+            return
+        owners = np.searchsorted(self._starts, self.positions, side="right") - 1
+        order = np.argsort(owners, kind="stable")
+        bounds = np.searchsorted(owners[order], np.arange(len(self.tables) + 1))
+        for n, table in enumerate(self.tables):
+            where = order[bounds[n]:bounds[n + 1]]
+            if len(where):
+                yield table, self.positions[where] - self._starts[n], where
+
+    def mask(self, name: str, predicate) -> np.ndarray:
+        """
+        predicate(frame) -> bool per row of a frame holding just the named column, for every row of the view. The
+        tables' chunks are tested together, up to CHUNK_ROWS values per call; rows of tables without the column are
+        tested as a missing value.
+        """
+        matched = np.zeros(len(self), dtype=bool)
+        batch, size = [], 0
+        for table, rows, where in self._parts():
+            where = np.arange(len(self))[where]
+            chunks = table.chunks(name, rows) if name in table.columns else \
+                [(0, np.zeros(len(where), dtype=np.intp), np.array([None], dtype=object))]
+            for start, codes, values in chunks:
+                batch.append((where[start:start + len(codes)], codes, values))
+                size += len(values)
+                if size >= CHUNK_ROWS:
+                    self._test(name, predicate, batch, matched)
+                    batch, size = [], 0
+        if batch:
+            self._test(name, predicate, batch, matched)
+        return matched
+
+    @staticmethod
+    def _test(name: str, predicate, batch: list, matched: np.ndarray):
+        values = np.concatenate([values for _, _, values in batch]) if len(batch) > 1 else batch[0][2]
+        result = np.asarray(predicate(pd.DataFrame({name: values})), dtype=bool)
+        start = 0
+        for where, codes, values in batch:
+            matched[where] = result[start:start + len(values)][codes]
+            start += len(values)
+
+    def select(self, mask: np.ndarray) -> "EventView":
+        return self._view(np.flatnonzero(mask) if self.positions is None else self.positions[mask])
+
+    def take(self, indices: np.ndarray) -> "EventView":
+        return self._view((np.arange(len(self)) if self.positions is None else self.positions)[indices])
+
+    def newest_first(self) -> "EventView":
+        """Sorted by _time descending as Splunk returns events; stable, with events without a time last."""
+        if "_time" not in self.columns:
+            return self
+        times = self.frame(["_time"])["_time"].astype(float)
+        return self.take(times.sort_values(ascending=False, kind="stable").index.to_numpy())
+
+    def groups(self, names: list) -> dict:
+        """Values of the names -> the view of the rows holding them, by sorted values; rows missing one are left out."""
+        frame = self.frame(names)
+        positions = np.arange(len(self)) if self.positions is None else self.positions
+        groups = frame.groupby(names, sort=False).indices
+        return {key if isinstance(key, tuple) else (key,): self._view(positions[rows])
+                for key, rows in sorted(groups.items())}
+
+    def frame(self, columns=None) -> pd.DataFrame:
+        """The given columns (every column by default) of the view's rows, decoded in view order."""
+        names = [name for name in self.columns if columns is None or name in columns]
+        parts = []
+        for table, rows, where in self._parts():
+            part = table.frame(names, rows)
+            part.index = pd.RangeIndex(len(self))[where]
+            parts.append(part)
+        if not parts:
+            return pd.DataFrame({name: pd.Series(dtype=float if name in FLOAT_COLUMNS else object) for name in names})
+        frame = pd.concat(parts).sort_index() if len(parts) > 1 else parts[0]
+        # a column only some tables have is missing (NaN) on the other tables' rows
+        return frame.reindex(columns=names)
+
+
+class EventStore:
+    """
+    Columnar cache of the parsed ground-truth exports under .cache/events.
+
+    Every source file is streamed through src.event_logs once into its own table: _time as float64, repeated
+    values (hosts, images, event codes, GUIDs...) as int32 codes into an interned dictionary, and free text
+    (_raw, Message, ScriptBlockText) as UTF-8 blobs with offsets. Tables are memory-mapped on open and rebuilt
+    when the source file's size or mtime changes, so large lab exports are parsed once and read without copies.
+    """
+
+    def __init__(self, path: str = DEFAULT_EVENT_STORE_PATH):
+        self.path = path
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _names(source: str) -> tuple:
+        """(prefix shared by every version of the source's table, directory name of the current version)."""
+        source = os.path.abspath(source)
+        stat = os.stat(source)
+        prefix = hashlib.sha1(source.encode("utf-8")).hexdigest()[:12]
+        version = hashlib.sha1(f"{STORE_VERSION}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()[:12]
+        return prefix, f"{prefix}-{version}"
+
+    def build(self, source: str) -> EventTable:
+        prefix, name = self._names(source)
+        path = os.path.join(self.path, name)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        start = time.time()
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        rows = EventTable.write(tmp_path, os.path.abspath(source), iter_events(source))
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        for entry in os.listdir(self.path):
+            if entry.startswith(f"{prefix}-") and entry != name:
+                shutil.rmtree(os.path.join(self.path, entry), ignore_errors=True)
+        logging.info(f"Stored {rows} events of {source} in {time.time() - start:.2f}s")
+        return EventTable(path)
+
+    def table(self, source: str, rebuild: bool = False) -> EventTable:
+        with self._lock:
+            _, name = self._names(source)
+            if not rebuild and name in self._tables:
+                return self._tables[name]
+            path = os.path.join(self.path, name)
+            if rebuild or not os.path.exists(os.path.join(path, "table.json")):
+                os.makedirs(self.path, exist_ok=True)
+                table = self.build(source)
+            else:
+                table = EventTable(path)
+            self._tables[name] = table
+            return table
+
+    def view(self, sources) -> EventView:
+        return EventView([self.table(source) for source in sources])
+
+    def frame(self, sources, columns=None) -> pd.DataFrame:
+        return self.view(sources).frame(columns)
+
+
+event_store = EventStore(os.getenv("EVENT_STORE_PATH") or DEFAULT_EVENT_STORE_PATH)
+_fallback_store = None
+
+
+def fallback_store() -> EventStore:
+    """A store under the temp directory, for checkouts where the event store path is not writable."""
+    global _fallback_store
+    if _fallback_store is None:
+        _fallback_store = EventStore(os.path.join(tempfile.gettempdir(), "rulepilot-events"))
+    return _fallback_store
+
+
+def _store(source: str, rebuild: bool) -> str:
+    start = time.time()
+    table = event_store.table(source, rebuild=rebuild)
+    size = sum(os.path.getsize(os.path.join(table.path, f)) for f in os.listdir(table.path))
+    return (f"{os.path.basename(source)}: {len(table)} events, {len(table.columns)} columns, "
+            f"{size / 1024:.0f} KiB in {time.time() - start:.2f}s")
+
+
+if __name__ == '__main__':
+    from concurrent.futures import ProcessPoolExecutor
+    parser = argparse.ArgumentParser(description="Build the columnar event store for ground-truth exports.")
+    parser.add_argument("files", nargs="*", help="exports to store (default: dataset/redteam/Rule Ground Truth)")
+    parser.add_argument("--rebuild", action="store_true", help="re-parse even when the table is up to date")
+    parser.add_argument("--workers", type=int, default=1, help="files parsed in parallel")
+    args = parser.parse_args()
+    sources = args.files or ground_truth_files()
+    with ProcessPoolExecutor(max_workers=max(args.workers, 1)) as pool:
+        for line in pool.map(_store, sources, [args.rebuild] * len(sources)):
+            print(line)
@@ -0,0 +1,260 @@
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict, field
+from dotenv import load_dotenv
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from src.prompt_builder import cached_prompt_tokens
+import asyncio
+import concurrent.futures
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+
+load_dotenv()
+
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+_CANCELLED = (asyncio.CancelledError, concurrent.futures.CancelledError)
+
+
+@dataclass
+class CallRecord:
+    stage: str
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # prompt tokens the provider served from its prefix cache
+    cached_tokens: int = 0
+    latency: float = 0.0
+    # attempt index: 0 for the first attempt, n for the n-th retry
+    retries: int = 0
+    cache_hit: bool = False
+    error: str = None
+    # abandoned by the caller, e.g. a hedged request that lost the race; neither a success nor an error
+    cancelled: bool = False
+    rule_id: str = None
+    provider: str = None
+    timestamp: float = field(default_factory=time.time)
+
+
+class UsageTracker:
+    """Per-rule rollup of every completion issued inside a track_usage() block."""
+
+    def __init__(self, rule_id: str = None):
+        self.rule_id = rule_id
+        self.calls = 0
+        self.cached_calls = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.latency = 0.0
+        self.compacted_tokens = 0
+        self.stages = defaultdict(lambda: {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0,
+                                           "latency": 0.0})
+        self._lock = threading.Lock()
+
+    def add(self, record: CallRecord):
+        with self._lock:
+            self.calls += 1
+            self.cached_calls += record.cache_hit
+            self.errors += record.error is not None
+            self.prompt_tokens += record.prompt_tokens
+            self.cached_tokens += record.cached_tokens
+            self.completion_tokens += record.completion_tokens
+            self.latency += record.latency
+            stage = self.stages[record.stage]
+            stage["calls"] += 1
+            stage["prompt_tokens"] += record.prompt_tokens
+            stage["cached_tokens"] += record.cached_tokens
+            stage["completion_tokens"] += record.completion_tokens
+            stage["latency"] = round(stage["latency"] + record.latency, 3)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "cached_calls": self.cached_calls,
+                "errors": self.errors,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_prompt_tokens": self.cached_tokens,
+                "prompt_cache_ratio": round(self.cached_tokens / self.prompt_tokens, 4) if self.prompt_tokens else 0.0,
+                "completion_tokens": self.completion_tokens,
+                "total_tokens": self.prompt_tokens + self.completion_tokens,
+                "llm_latency": round(self.latency, 3),
+                "compacted_tokens": self.compacted_tokens,
+                "stages": {name: dict(stage) for name, stage in self.stages.items()},
+            }
+
+
+class _CallScope:
+    def __init__(self, stage: str, model: str, retries: int, provider: str = None):
+        self.record = CallRecord(stage=stage or "unknown", model=model, retries=retries, provider=provider)
+        self.response = None
+        self.cache_hit = False
+
+
+class Instrumentation:
+    """
+    Records one CallRecord per LLM call and keeps running totals per (stage, model).
+
+    Records are kept in a bounded in-memory buffer, appended to LLM_METRICS_PATH as JSONL when it is set,
+    rolled up into the innermost track_usage() block, and exposed in Prometheus text format.
+    """
+
+    def __init__(self, jsonl_path: str = None, buffer_size: int = 10000):
+        self.jsonl_path = jsonl_path
+        self.records = deque(maxlen=buffer_size)
+        self.totals = defaultdict(lambda: {"calls": 0, "cache_hits": 0, "errors": 0, "cancelled": 0, "retries": 0,
+                                           "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0,
+                                           "latency_sum": 0.0,
+                                           "latency_buckets": [0] * len(LATENCY_BUCKETS)})
+        # estimated prompt tokens removed by context compaction, per stage
+        self.compaction = defaultdict(int)
+        self._tracker = contextvars.ContextVar("usage_tracker", default=None)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def call(self, stage: str, model: str, retries: int = 0, provider: str = None, abandoned=None):
+        """
+        Wrap one completion; set scope.response (and scope.cache_hit) before leaving the block. A call still
+        running when the abandoned threading.Event is set, such as a hedged request that lost the race, is
+        recorded as cancelled.
+        """
+        scope = _CallScope(stage, model, retries, provider)
+        start = time.perf_counter()
+        try:
+            yield scope
+        except _CANCELLED:
+            scope.record.cancelled = True
+            raise
+        except BaseException as e:
+            scope.record.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            if abandoned is not None and abandoned.is_set():
+                scope.record.cancelled = True
+            scope.record.latency = round(time.perf_counter() - start, 4)
+            scope.record.cache_hit = scope.cache_hit
+            usage = getattr(scope.response, "usage", None)
+            if usage is not None and not scope.cache_hit:
+                scope.record.prompt_tokens = usage.prompt_tokens
+                scope.record.cached_tokens = cached_prompt_tokens(usage)
+                scope.record.completion_tokens = usage.completion_tokens
+            self.add(scope.record)
+
+    def add(self, record: CallRecord):
+        tracker = self._tracker.get()
+        if tracker is not None:
+            record.rule_id = tracker.rule_id
+            # abandoned attempts did not contribute to the rule
+            if not record.cancelled:
+                tracker.add(record)
+        with self._lock:
+            self.records.append(record)
+            totals = self.totals[(record.stage, record.model)]
+            totals["calls"] += 1
+            totals["cache_hits"] += record.cache_hit
+            totals["errors"] += record.error is not None and not record.cancelled
+            totals["cancelled"] += record.cancelled
+            totals["retries"] += record.retries > 0
+            totals["prompt_tokens"] += record.prompt_tokens
+            totals["cached_tokens"] += record.cached_tokens
+            totals["completion_tokens"] += record.completion_tokens
+            totals["latency_sum"] += record.latency
+            for n, bound in enumerate(LATENCY_BUCKETS):
+                if record.latency <= bound:
+                    totals["latency_buckets"][n] += 1
+            if self.jsonl_path:
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(asdict(record), ensure_ascii=False) + "\n")
+
+    def add_compaction(self, stage: str, saved_tokens: int):
+        tracker = self._tracker.get()
+        if tracker is not None:
+            with tracker._lock:
+                tracker.compacted_tokens += saved_tokens
+        with self._lock:
+            self.compaction[stage or "unknown"] += saved_tokens
+
+    @contextmanager
+    def track_usage(self, rule_id: str = None):
+        tracker = UsageTracker(rule_id)
+        token = self._tracker.set(tracker)
+        try:
+            yield tracker
+        finally:
+            self._tracker.reset(token)
+
+    def export_jsonl(self, path: str):
+        with self._lock:
+            records = list(self.records)
+        with open(path, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(asdict(record), ensure_ascii=False) + "\n")
+
+    def prometheus_text(self) -> str:
+        with self._lock:
+            totals = {key: dict(value, latency_buckets=list(value["latency_buckets"]))
+                      for key, value in self.totals.items()}
+            compaction = dict(self.compaction)
+        counters = [
+            ("rulepilot_llm_calls_total", "calls", "LLM calls, including cache hits and failed attempts."),
+            ("rulepilot_llm_cache_hits_total", "cache_hits", "LLM calls served from the response cache."),
+            ("rulepilot_llm_errors_total", "errors", "LLM calls that raised."),
+            ("rulepilot_llm_cancelled_total", "cancelled", "LLM calls abandoned by the caller, such as hedged "
+                                                           "requests that lost the race."),
+            ("rulepilot_llm_retries_total", "retries", "LLM calls that retried a failed attempt."),
+            ("rulepilot_llm_prompt_tokens_total", "prompt_tokens", "Prompt tokens billed."),
+            ("rulepilot_llm_cached_prompt_tokens_total", "cached_tokens", "Prompt tokens served from the provider's "
+                                                                          "prompt cache."),
+            ("rulepilot_llm_completion_tokens_total", "completion_tokens", "Completion tokens billed."),
+        ]
+        lines = []
+        for name, key, help_text in counters:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for (stage, model), values in sorted(totals.items()):
+                lines.append(f'{name}{{stage="{stage}",model="{model}"}} {values[key]}')
+        name = "rulepilot_llm_latency_seconds"
+        lines += [f"# HELP {name} Wall-clock latency of LLM calls.", f"# TYPE {name} histogram"]
+        for (stage, model), values in sorted(totals.items()):
+            labels = f'stage="{stage}",model="{model}"'
+            for bound, count in zip(LATENCY_BUCKETS, values["latency_buckets"]):
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {values["calls"]}')
+            lines.append(f'{name}_sum{{{labels}}} {round(values["latency_sum"], 4)}')
+            lines.append(f'{name}_count{{{labels}}} {values["calls"]}')
+        name = "rulepilot_llm_compacted_tokens_total"
+        lines += [f"# HELP {name} Estimated prompt tokens removed by context compaction.", f"# TYPE {name} counter"]
+        for stage, saved in sorted(compaction.items()):
+            lines.append(f'{name}{{stage="{stage}"}} {saved}')
+        return "\n".join(lines) + "\n"
+
+    def serve_metrics(self, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+        instrumentation = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                body = instrumentation.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logging.info(f"Serving LLM metrics on http://{host}:{port}/metrics")
+        return server
+
+
+instrumentation = Instrumentation(jsonl_path=os.getenv("LLM_METRICS_PATH") or None)
+track_usage = instrumentation.track_usage
@@ -0,0 +1,196 @@
+from dataclasses import dataclass, asdict
+from dotenv import load_dotenv
+from src.config import env_flag
+from src.corpus import corpus
+import argparse
+import contextvars
+import hashlib
+import logging
+import numpy as np
+import os
+import re
+import threading
+import zlib
+
+load_dotenv()
+
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16
+SHINGLE_SIZE = 3
+# smallest prime above 2**32, so (a * x + b) of 32-bit values stays inside uint64
+_PRIME = 4294967311
+_TERM = re.compile(r'[a-z0-9]+')
+_FIELD_SEPARATOR = re.compile(r'[\n,]')
+
+
+@dataclass
+class KnownRuleMatch:
+    record_id: str
+    name: str
+    rule: str
+    similarity: float
+    method: str
+    detection_path: str = None
+    # the local pre-score the stored search passed before it was reused
+    prescore: dict = None
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+    def __str__(self):
+        return (f"Reused existing detection '{self.name}' ({self.detection_path}), "
+                f"{self.method} match with similarity {self.similarity:.2f}")
+
+
+# the match (if any) behind the last rule generated in the current context, for callers that need provenance
+known_rule_match = contextvars.ContextVar("known_rule_match", default=None)
+
+
+def normalize_fields(required_fields) -> tuple:
+    """Field names from a list or from the '- field' / comma separated text the prompts use."""
+    if not required_fields:
+        return ()
+    if isinstance(required_fields, str):
+        required_fields = _FIELD_SEPARATOR.split(required_fields)
+    fields = (str(f).strip().lstrip('-*').strip().lower() for f in required_fields)
+    return tuple(sorted({f for f in fields if f}))
+
+
+def _terms(description: str) -> list:
+    return _TERM.findall((description or '').lower())
+
+
+def _shingles(terms: list, fields: tuple) -> np.ndarray:
+    grams = {" ".join(terms[i:i + SHINGLE_SIZE]) for i in range(max(len(terms) - SHINGLE_SIZE + 1, 1))}
+    grams.update(f"field:{f}" for f in fields)
+    grams.discard('')
+    return np.array(sorted(zlib.crc32(gram.encode("utf-8")) for gram in grams), dtype=np.uint64)
+
+
+class KnownRuleIndex:
+    """
+    Fingerprints of every corpus detection's description and required fields, so that a description we already
+    have a rule for is answered from the corpus instead of the LLM pipeline.
+
+    Exact matches are found by a SHA-1 of the normalized text. Near-duplicates (reworded sentences, a missing
+    field) go through MinHash signatures over word 3-grams and field names, bucketed with LSH; candidates from
+    the buckets are confirmed with their exact Jaccard similarity against the threshold (KNOWN_RULE_THRESHOLD).
+    """
+
+    def __init__(self, threshold: float = 0.85, num_permutations: int = NUM_PERMUTATIONS, bands: int = LSH_BANDS,
+                 enabled: bool = False):
+        self.threshold = threshold
+        self.enabled = enabled
+        self.bands = bands
+        self.rows = num_permutations // bands
+        generator = np.random.default_rng(1)
+        self._a = generator.integers(1, 1 << 32, num_permutations, dtype=np.uint64)
+        self._b = generator.integers(0, 1 << 32, num_permutations, dtype=np.uint64)
+        self.exact = {}
+        self.shingles = {}
+        self.buckets = []
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(description: str, required_fields=None) -> str:
+        text = " ".join(_terms(description)) + "\n" + ",".join(normalize_fields(required_fields))
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def signature(self, shingles: np.ndarray) -> np.ndarray:
+        if not len(shingles):
+            return np.zeros(len(self._a), dtype=np.uint64)
+        # one universal hash (a * x + b) mod p per permutation, all permutations at once
+        hashed = (self._a[:, None] * shingles[None, :] + self._b[:, None]) % np.uint64(_PRIME)
+        return hashed.min(axis=1)
+
+    def _band_keys(self, signature: np.ndarray) -> list:
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            exact, shingles, buckets = {}, {}, [{} for _ in range(self.bands)]
+            for record in corpus:
+                if not record.search or not record.description:
+                    continue
+                exact.setdefault(self.fingerprint(record.description, record.required_fields), record.id)
+                shingles[record.id] = _shingles(_terms(record.description), normalize_fields(record.required_fields))
+                for band, key in enumerate(self._band_keys(self.signature(shingles[record.id]))):
+                    buckets[band].setdefault(key, []).append(record.id)
+            self.exact, self.shingles, self.buckets = exact, shingles, buckets
+            self._loaded = True
+            logging.info(f"Fingerprinted {len(shingles)} known detections")
+
+    def _match(self, record_id: str, similarity: float, method: str) -> KnownRuleMatch:
+        record = corpus.by_id(record_id)
+        return KnownRuleMatch(record.id, record.name, record.search, round(similarity, 4), method,
+                              record.detection_path)
+
+    def lookup(self, description: str, required_fields=None, threshold: float = None):
+        """The best known detection for a description, or None when nothing reaches the threshold."""
+        self.load()
+        threshold = self.threshold if threshold is None else threshold
+        record_id = self.exact.get(self.fingerprint(description, required_fields))
+        if record_id is not None:
+            return self._match(record_id, 1.0, "exact")
+        query = _shingles(_terms(description), normalize_fields(required_fields))
+        if not len(query):
+            return None
+        candidates = set()
+        for band, key in enumerate(self._band_keys(self.signature(query))):
+            candidates.update(self.buckets[band].get(key, ()))
+        best, best_similarity = None, 0.0
+        for candidate in candidates:
+            shingles = self.shingles[candidate]
+            common = len(np.intersect1d(query, shingles, assume_unique=True))
+            similarity = common / (len(query) + len(shingles) - common)
+            if similarity > best_similarity:
+                best, best_similarity = candidate, similarity
+        if best is None or best_similarity < threshold:
+            return None
+        return self._match(best, best_similarity, "near_duplicate")
+
+
+known_rules = KnownRuleIndex(threshold=float(os.getenv("KNOWN_RULE_THRESHOLD") or 0.85),
+                             enabled=env_flag("KNOWN_RULE_REUSE", False))
+
+
+def find_known_rule(description: str, rule_type: str, required_fields=None):
+    """
+    Lookup stage in front of rule generation; records the match in known_rule_match for provenance. A stored
+    search is only reused when it passes the same local syntax and feasibility checks as a generated rule.
+    """
+    from src.scoring import prescore_rule
+    known_rule_match.set(None)
+    # the corpus only holds Splunk detections
+    if not known_rules.enabled or (rule_type or '').lower() != 'splunk':
+        return None
+    try:
+        match = known_rules.lookup(description, required_fields)
+        prescore = prescore_rule(match.rule, required_fields) if match is not None else None
+    except Exception as e:
+        logging.error(f"Known rule lookup failed: {e}")
+        return None
+    if match is None:
+        return None
+    if not prescore.passed:
+        logging.warning(f"Not reusing '{match.name}': {'; '.join(str(failure) for failure in prescore.failures)}")
+        return None
+    match.prescore = prescore.scores()
+    logging.info(str(match))
+    known_rule_match.set(match)
+    return match
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Look up the known detection for a description.")
+    parser.add_argument("description")
+    parser.add_argument("--fields", default=None, help="comma separated required fields")
+    parser.add_argument("--threshold", type=float, default=None)
+    args = parser.parse_args()
+    found = known_rules.lookup(args.description, args.fields, args.threshold)
+    print(found or "No known detection above the threshold")
+    if found:
+        print(found.rule)
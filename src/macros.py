@@ -0,0 +1,208 @@
+from dotenv import load_dotenv
+from pathlib import Path
+from src.spl_parser import tokenize, SPLSyntaxError, MACRO
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import yaml
+
+load_dotenv()
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+MACROS_PATH = os.path.join(PROJECT_ROOT, "dataset/macros")
+DEFAULT_MACRO_INDEX_PATH = os.path.join(PROJECT_ROOT, ".cache", "macro_index.json")
+MAX_EXPANSION_DEPTH = 32
+
+_MACRO_CALL = re.compile(r'^([\w-]+)(?:\((.*)\))?$', re.DOTALL)
+_MACRO_REFERENCE = re.compile(r'`([\w-]+(?:\([^`]*\))?)`')
+_ARGUMENT = re.compile(r'\$(\w+)\$')
+
+
+class MacroCycleError(ValueError):
+    def __init__(self, chain: list):
+        super().__init__(f"macro cycle: {' -> '.join(chain)}")
+        self.chain = chain
+
+
+def split_macro_args(text: str) -> list:
+    args, current, depth, quote = [], '', 0, None
+    for c in text:
+        if quote:
+            quote = None if c == quote else quote
+        elif c in '"\'':
+            quote = c
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            args.append(current.strip())
+            current = ''
+            continue
+        current += c
+    if current.strip():
+        args.append(current.strip())
+    return args
+
+
+def parse_macro_call(reference: str):
+    """`name(a, b)` (without backticks) -> (name, [args]), or None when it is not a macro call."""
+    match = _MACRO_CALL.match(reference.strip())
+    if not match:
+        return None
+    return match.group(1), split_macro_args(match.group(2)) if match.group(2) is not None else []
+
+
+def macro_key(name: str, arity: int) -> str:
+    # Splunk names macros with arguments `name(n)`
+    return f"{name}({arity})" if arity else name
+
+
+def _compile(definition: str, arguments: list) -> list:
+    # literal text and argument positions, so expanding is a single join
+    parts, last = [], 0
+    for match in _ARGUMENT.finditer(definition):
+        if match.group(1) not in arguments:
+            continue
+        parts.append(definition[last:match.start()])
+        parts.append(arguments.index(match.group(1)))
+        last = match.end()
+    parts.append(definition[last:])
+    return parts
+
+
+class MacroIndex:
+    """
+    Compiled index of dataset/macros keyed by `name` / `name(n)`, used to expand backtick macros in SPL.
+
+    The YAML files are parsed once and the compiled index is serialized to .cache/macro_index.json together
+    with a fingerprint of the macro files (name, size, mtime); later runs load the JSON unless a file changed.
+    Expansion substitutes $arg$ placeholders, recurses into nested macros and raises MacroCycleError on cycles.
+    Macros that are not in the index (per-detection *_filter macros, Splunk ES macros) are left untouched.
+    """
+
+    def __init__(self, macros_path: str = MACROS_PATH, path: str = DEFAULT_MACRO_INDEX_PATH):
+        self.macros_path = macros_path
+        self.path = path
+        self.entries = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _fingerprint(self) -> list:
+        files = []
+        for file in sorted(os.listdir(self.macros_path)):
+            if file.endswith(".yml"):
+                stat = os.stat(os.path.join(self.macros_path, file))
+                files.append([file, stat.st_size, stat.st_mtime_ns])
+        return files
+
+    def load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            fingerprint = self._fingerprint()
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        cached = json.load(f)
+                    if cached.get("fingerprint") == fingerprint:
+                        self.entries = cached["entries"]
+                        self._loaded = True
+                        return
+                except (OSError, ValueError, KeyError):
+                    pass
+            self.entries = self._build()
+            self._loaded = True
+            self._save(fingerprint)
+
+    def _build(self) -> dict:
+        entries = {}
+        for file in os.listdir(self.macros_path):
+            if not file.endswith(".yml"):
+                continue
+            with open(os.path.join(self.macros_path, file), "r", encoding="utf-8", errors="replace") as f:
+                macro = yaml.safe_load(f) or {}
+            if not macro.get("name"):
+                continue
+            arguments = [str(a) for a in macro.get("arguments") or []]
+            definition = str(macro.get("definition") or "")
+            entries[macro_key(macro["name"], len(arguments))] = {
+                "name": macro["name"], "arguments": arguments, "definition": definition,
+                "parts": _compile(definition, arguments),
+            }
+        logging.info(f"Compiled {len(entries)} macros from {self.macros_path}")
+        return entries
+
+    def _save(self, fingerprint: list):
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"fingerprint": fingerprint, "entries": self.entries}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.warning(f"Could not write macro index {self.path}: {e}")
+
+    def get(self, name: str, arity: int = 0):
+        self.load()
+        return self.entries.get(macro_key(name, arity))
+
+    def arities(self) -> dict:
+        """name -> argument count for every indexed macro."""
+        self.load()
+        return {entry["name"]: len(entry["arguments"]) for entry in self.entries.values()}
+
+    def expand(self, search: str) -> str:
+        """Expand every known macro in search, recursively."""
+        self.load()
+        return self._expand(search, [])
+
+    def _references(self, text: str) -> list:
+        # (start, end, reference) of every macro; the tokenizer skips quoted strings and ```comments```
+        try:
+            return [(token.pos, token.pos + len(token.value) + 2, token.value)
+                    for token in tokenize(text) if token.kind == MACRO]
+        except SPLSyntaxError:
+            return [(match.start(), match.end(), match.group(1)) for match in _MACRO_REFERENCE.finditer(text)]
+
+    def _expand(self, text: str, chain: list) -> str:
+        if '`' not in text:
+            return text
+        pieces, last = [], 0
+        for start, end, reference in self._references(text):
+            call = parse_macro_call(reference)
+            if call is None:
+                continue
+            name, args = call
+            key = macro_key(name, len(args))
+            entry = self.entries.get(key)
+            if entry is None:
+                continue
+            if key in chain:
+                raise MacroCycleError(chain + [key])
+            if len(chain) >= MAX_EXPANSION_DEPTH:
+                raise MacroCycleError(chain + [key])
+            body = "".join(part if isinstance(part, str) else args[part] for part in entry["parts"])
+            pieces.append(text[last:start])
+            pieces.append(self._expand(body, chain + [key]))
+            last = end
+        pieces.append(text[last:])
+        return "".join(pieces)
+
+
+macro_index = MacroIndex(path=os.getenv("MACRO_INDEX_PATH") or DEFAULT_MACRO_INDEX_PATH)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rebuild the macro index or expand the macros of a search.")
+    parser.add_argument("search", nargs="?", help="SPL search to expand; omit to only rebuild the index")
+    args = parser.parse_args()
+    if args.search:
+        print(macro_index.expand(args.search))
+    else:
+        macro_index.entries = macro_index._build()
+        macro_index._loaded = True
+        macro_index._save(macro_index._fingerprint())
+        print(f"Indexed {len(macro_index.entries)} macros into {macro_index.path}")
@@ -0,0 +1,132 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from dotenv import load_dotenv
+from pathlib import Path
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+
+load_dotenv()
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_PIPE_INDEX_PATH = os.path.join(PROJECT_ROOT, ".cache", "pipe_index.json")
+
+# every detection ends with its own `<detection_name>_filter` macro; they all mean the same thing
+_FILTER_MACRO = re.compile(r"`[\w-]+_filter`")
+_WHITESPACE = re.compile(r"\s+")
+
+
+class PipeIndex:
+    """
+    Fingerprint index from normalized pipe text to its extracted operation_type/input_fields/output_fields.
+
+    Pipes are normalized by collapsing whitespace and canonicalizing per-detection `*_filter` macros,
+    so the same pipe written in thousands of detections is only ever sent to the LLM once.
+    """
+
+    def __init__(self, path: str = DEFAULT_PIPE_INDEX_PATH):
+        self.path = path
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+        self.load()
+
+    @staticmethod
+    def normalize(pipe: str) -> str:
+        pipe = _WHITESPACE.sub(" ", pipe).strip()
+        return _FILTER_MACRO.sub("`detection_filter`", pipe)
+
+    @classmethod
+    def fingerprint(cls, pipe: str, rule_type: str = "splunk") -> str:
+        return hashlib.sha1(f"{rule_type}\0{cls.normalize(pipe)}".encode("utf-8")).hexdigest()
+
+    def get(self, pipe: str, rule_type: str = "splunk"):
+        key = self.fingerprint(pipe, rule_type)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return dict(entry["info"])
+
+    def put(self, pipe: str, info: dict, rule_type: str = "splunk"):
+        info = {k: v for k, v in info.items() if k != "pipe"}
+        with self._lock:
+            self.entries[self.fingerprint(pipe, rule_type)] = {"pipe": self.normalize(pipe), "rule_type": rule_type,
+                                                               "info": info}
+            self._dirty = True
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            # a truncated or unreadable index is only a cold cache; it must not break importing src.rule
+            logging.warning(f"Ignoring unreadable pipe index {self.path}: {e}")
+            return
+        if isinstance(entries, dict):
+            self.entries = entries
+        else:
+            logging.warning(f"Ignoring pipe index {self.path}: not a JSON object")
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+
+    def prewarm(self, min_count: int = 2, workers: int = 8) -> int:
+        """Extract every pipe that occurs at least min_count times across the detections; returns how many were added."""
+        from src.corpus import corpus
+        from src.rule import extract_info_from_pipe, parse_pipe_locally
+        from src.spl_parser import split_pipes
+        counts = Counter()
+        examples = {}
+        for record in corpus:
+            if not record.search:
+                continue
+            for pipe in split_pipes(record.search):
+                if parse_pipe_locally(pipe) is not None:
+                    # handled by the local parser, never reaches the index
+                    continue
+                key = self.fingerprint(pipe)
+                counts[key] += 1
+                examples.setdefault(key, pipe)
+        todo = [examples[key] for key, count in counts.items() if count >= min_count and key not in self.entries]
+        logging.info(f"{len(counts)} distinct pipes, {len(todo)} to extract (seen at least {min_count} times)")
+
+        def extract(pipe):
+            try:
+                self.put(pipe, extract_info_from_pipe(pipe))
+            except Exception as e:
+                logging.error(f"Failed to extract pipe {pipe!r}: {e}")
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(extract, todo))
+        self.save()
+        return len(todo)
+
+
+pipe_index = PipeIndex(os.getenv("PIPE_INDEX_PATH") or DEFAULT_PIPE_INDEX_PATH)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Prewarm the pipe index from dataset/detections.")
+    parser.add_argument("--min-count", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+    added = pipe_index.prewarm(min_count=args.min_count, workers=args.workers)
+    print(f"Added {added} pipes, index now holds {len(pipe_index.entries)} entries ({pipe_index.path})")
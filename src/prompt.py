@@ -36,6 +36,19 @@ The output should be:
 {{result: 'index="main" source="WinEventLog:Security" | stats values(host) as UniqueComputers by EventCode'}}
 '''
 
+RULE_STITCH_PROMPT = '''
+You are a security analyst working for a cybersecurity company.
+Your task is to assemble a complete {target_rule_type} rule from parts that were converted one by one.
+Below is the instruction for the task:
+- You will be provided with the original rule and its converted parts, in order.
+- Join the parts into one valid {target_rule_type} rule and fix field names or syntax that do not line up between parts.
+- Do not add or remove detection logic.
+- The output should be in JSON format.
+
+The output format is as follows:
+{{result: "CONVERTED_RULE"}}
+'''
+
 DESCRIPTION_ANALYSE_PROMPT = '''
 You are a security analyst working for a cybersecurity company.
 Your task is to analyze the following {rule_type} rule description and generate the requirements for the rule.
@@ -109,7 +122,7 @@ DSL_GENERATION_PROMPT = '''
 You are an expert in Splunk rules and DSL writing.
 Your task is to generate a DSL rule based on the {rule_type} rule description and the analysis of the description.
 Below is the instruction for the task:
-- You will be provided with the rule description and one part of the analysis, which describes the requirements for the rule.
+- You will be provided with the rule description (in the first message after these instructions) and one part of the analysis, which describes the requirements for the rule.
 - You may need to generate SEVERAL DSL rules to achieve the desired functionality.
 - You only need to generate the DSL rule for the given information.
 - Note that the DSL rules you generate will be combined to form the final rule, so do not be duplicative.
@@ -125,9 +138,6 @@ Below is the instruction for the task:
 ## Below is the description of the KEYWORD:
 {keyword}
 
-## Below is the description of the rule:
-{rule_description}
-
 ## Below is the structure of your output:
 ```plaintext
 <YOUR_GENERATED_DSL_RULE_1>
@@ -145,9 +155,7 @@ Your task is to analyze the given {rule_type} rule description and generate key
 - You will be asked several questions to break down the rule description and generate key logic.
 - You need to select the most appropriate question to answer based on the rule description.
 - If not necessary, you do not need to generate the analysis output.
-
-## Below is the description of the rule:
-{description}
+- The rule description is given in the first message after these instructions.
 
 ## Below are the functions of the questions:
 - Understanding the problem: Understand the monitoring objectives and outputs mentioned in the description.
@@ -458,25 +466,20 @@ LLM_EVALUATION_PROMPTS = {
 
 SCORE_PROMPT = """
 You are a rule reflection and optimization assistant.
-You need to evaluate the following Splunk rule based on the given criteria and its ideal description.
-Here is the rule to evaluate:
-{rule}
-
-Below is the description of the ideal rule:
-{ideal_rule}
+You need to evaluate a Splunk rule based on the given criteria and the description of the ideal rule, both given by the user.
 
 Rate it on:
-1) Logical Coherence (0-1)
+1) Logical Coherence (0-1): does the rule implement the detection logic of the description
 2) Syntax Validation (0-1)
 3) Execution Feasibility (0-1)
 
 Provide a JSON with your ratings and a short comment:
-{{ 
-  "logical_coherence": 0.0, 
-  "syntax_validation": 0.0, 
+{
+  "logical_coherence": 0.0,
+  "syntax_validation": 0.0,
   "execution_feasibility": 0.0,
-  "comment": "Your analysis" 
-}}
+  "comment": "Your analysis"
+}
 """
 
 RULE_OPTIMIZE_PROMPT = '''
@@ -0,0 +1,46 @@
+def render_sections(sections) -> str:
+    """'## heading:\\ncontent' blocks for (heading, content) pairs; empty contents are skipped, None headings
+    are emitted as-is (for sections that carry their own heading)."""
+    blocks = []
+    for heading, content in sections:
+        if not content or (isinstance(content, str) and not content.strip()):
+            continue
+        if isinstance(content, (list, tuple)):
+            content = "\n".join(f"- {item}" for item in content)
+        blocks.append(str(content).strip() if heading is None else f"## {heading}:\n{str(content).strip()}")
+    return "\n\n".join(blocks)
+
+
+def build_messages(static_prompt: str, sections=(), user: str = None) -> list:
+    """
+    [system: static_prompt, user: per-rule sections followed by user].
+
+    Providers cache prompts by exact prefix, so whatever differs between rules (description, required fields,
+    log samples, retrieved examples) goes after the static instructions instead of being formatted into them.
+    """
+    tail = render_sections(sections)
+    if user:
+        tail = f"{tail}\n\n{user.strip()}" if tail else user.strip()
+    messages = [{"role": "system", "content": static_prompt}]
+    if tail:
+        messages.append({"role": "user", "content": tail})
+    return messages
+
+
+def cached_prompt_tokens(usage) -> int:
+    """Prompt tokens served from the provider's prompt cache, for OpenAI and DeepSeek style usage payloads."""
+    if usage is None:
+        return 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    if details is None and getattr(usage, "model_extra", None):
+        details = usage.model_extra.get("prompt_tokens_details")
+    if isinstance(details, dict):
+        cached = details.get("cached_tokens")
+    else:
+        cached = getattr(details, "cached_tokens", None)
+    if cached is None:
+        # DeepSeek reports the cache hits at the top level
+        cached = getattr(usage, "prompt_cache_hit_tokens", None)
+        if cached is None and getattr(usage, "model_extra", None):
+            cached = usage.model_extra.get("prompt_cache_hit_tokens")
+    return int(cached or 0)
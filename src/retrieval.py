@@ -0,0 +1,258 @@
+from collections import Counter
+from dotenv import load_dotenv
+from pathlib import Path
+from src.corpus import corpus
+import argparse
+import hashlib
+import json
+import logging
+import numpy as np
+import os
+import re
+import shutil
+import threading
+import time
+
+load_dotenv()
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_RETRIEVAL_PATH = os.path.join(PROJECT_ROOT, ".cache", "retrieval")
+# segments written by incremental updates are merged back into one once there are more than this
+MAX_SEGMENTS = 8
+MAX_EXAMPLE_CHARS = 1500
+
+_TERM = re.compile(r'[a-z0-9]+')
+_STOPWORDS = {'the', 'a', 'an', 'and', 'or', 'of', 'to', 'in', 'on', 'for', 'by', 'is', 'are', 'be', 'as', 'at',
+              'this', 'that', 'it', 'its', 'with', 'from', 'if', 'can', 'could', 'such', 'which', 'these', 'into',
+              'may', 'was', 'were', 'has', 'have', 'than', 'not', 'but', 'also', 'other', 'any'}
+
+
+def tokenize_text(text: str) -> list:
+    return [term for term in _TERM.findall(text.lower()) if len(term) > 1 and term not in _STOPWORDS]
+
+
+def _normalize(text: str) -> str:
+    return " ".join(_TERM.findall((text or '').lower()))
+
+
+def _document(record) -> str:
+    return "\n".join([record.name, record.description, " ".join(record.required_fields),
+                      " ".join(record.data_source)])
+
+
+class _Segment:
+    """One immutable, memory-mapped block of postings: per term a [start, end) range into docs/tfs."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "segment.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.keys = meta["keys"]
+        self.hashes = meta["hashes"]
+        self.terms = meta["terms"]
+        self.docs = np.load(os.path.join(path, "docs.npy"), mmap_mode="r")
+        self.tfs = np.load(os.path.join(path, "tfs.npy"), mmap_mode="r")
+        self.lengths = np.load(os.path.join(path, "lengths.npy"), mmap_mode="r")
+
+    @staticmethod
+    def write(path: str, documents: list):
+        """documents: list of (key, hash, terms)."""
+        postings = {}
+        lengths = np.zeros(len(documents), dtype=np.float32)
+        for n, (_, _, terms) in enumerate(documents):
+            lengths[n] = len(terms)
+            for term, tf in Counter(terms).items():
+                postings.setdefault(term, []).append((n, tf))
+        ranges, docs, tfs = {}, [], []
+        for term in sorted(postings):
+            ranges[term] = [len(docs), len(docs) + len(postings[term])]
+            for n, tf in postings[term]:
+                docs.append(n)
+                tfs.append(tf)
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "docs.npy"), np.asarray(docs, dtype=np.int32))
+        np.save(os.path.join(path, "tfs.npy"), np.asarray(tfs, dtype=np.float32))
+        np.save(os.path.join(path, "lengths.npy"), lengths)
+        with open(os.path.join(path, "segment.json"), "w", encoding="utf-8") as f:
+            json.dump({"keys": [d[0] for d in documents], "hashes": [d[1] for d in documents], "terms": ranges}, f)
+
+
+class RetrievalIndex:
+    """
+    BM25 index over the name, description, required fields and data sources of every corpus detection.
+
+    The index is a list of memory-mapped segments under .cache/retrieval. update() only indexes detections
+    that are new or whose text changed since the last update, writing them as a new segment and masking
+    their old versions; once there are more than MAX_SEGMENTS segments they are merged into one.
+    Lookups take a few milliseconds and need nothing beyond numpy.
+    """
+
+    def __init__(self, path: str = DEFAULT_RETRIEVAL_PATH, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.segments = []
+        self._live = []
+        self._by_description = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.path, "manifest.json")
+
+    def _open(self):
+        self.segments = []
+        if os.path.exists(self._manifest_path()):
+            with open(self._manifest_path(), "r", encoding="utf-8") as f:
+                names = json.load(f)["segments"]
+            self.segments = [_Segment(os.path.join(self.path, name)) for name in names]
+        # a document lives in the newest segment that contains its key
+        seen, live = set(), []
+        for segment in reversed(self.segments):
+            mask = np.array([key not in seen for key in segment.keys], dtype=bool)
+            seen.update(segment.keys)
+            live.append(mask)
+        self._live = list(reversed(live))
+
+    def _write_manifest(self, names: list):
+        tmp_path = f"{self._manifest_path()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"segments": names}, f)
+        os.replace(tmp_path, self._manifest_path())
+
+    def update(self, records=None) -> int:
+        """Index new or changed corpus records; returns how many documents were (re)indexed."""
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            self._open()
+            records = list(records if records is not None else corpus)
+            indexed = {}
+            for segment, live in zip(self.segments, self._live):
+                for key, content_hash, alive in zip(segment.keys, segment.hashes, live):
+                    if alive:
+                        indexed[key] = content_hash
+            documents = []
+            for record in records:
+                text = _document(record)
+                content_hash = hashlib.sha1(text.encode("utf-8")).hexdigest()
+                if indexed.get(record.id) != content_hash:
+                    documents.append((record.id, content_hash, tokenize_text(text)))
+            names = [os.path.basename(segment.path) for segment in self.segments]
+            removed = set(indexed) - {record.id for record in records}
+            if documents:
+                name = self._new_segment_name()
+                _Segment.write(os.path.join(self.path, name), documents)
+                names.append(name)
+            if len(names) > MAX_SEGMENTS or removed:
+                # deleted detections can only be dropped by rewriting the segments
+                names = self._merge(records)
+            if documents or removed or len(names) != len(self.segments):
+                self._write_manifest(names)
+                self._remove_orphans(names)
+            self._open()
+            self._loaded = True
+            return len(documents)
+
+    def _new_segment_name(self, suffix: str = "") -> str:
+        # two updates within the same millisecond must not overwrite each other's segment
+        stamp = int(time.time() * 1000)
+        while os.path.exists(os.path.join(self.path, f"segment_{stamp}{suffix}")):
+            stamp += 1
+        return f"segment_{stamp}{suffix}"
+
+    def _merge(self, records: list) -> list:
+        name = self._new_segment_name("_merged")
+        documents = []
+        for record in records:
+            text = _document(record)
+            documents.append((record.id, hashlib.sha1(text.encode("utf-8")).hexdigest(), tokenize_text(text)))
+        _Segment.write(os.path.join(self.path, name), documents)
+        return [name]
+
+    def _remove_orphans(self, names: list):
+        for entry in os.listdir(self.path):
+            if entry.startswith("segment_") and entry not in names:
+                shutil.rmtree(os.path.join(self.path, entry), ignore_errors=True)
+
+    def load(self):
+        # the first use in a process brings the index up to date with the corpus
+        if not self._loaded:
+            self.update()
+
+    def search(self, text: str, k: int = 3, exclude: set = None) -> list:
+        """Top-k (record id, score) pairs for a free-text query."""
+        self.load()
+        terms = Counter(tokenize_text(text))
+        if not terms or not self.segments:
+            return []
+        total_docs = sum(int(live.sum()) for live in self._live)
+        total_length = sum(float(segment.lengths[live].sum()) for segment, live in zip(self.segments, self._live))
+        average_length = total_length / max(total_docs, 1)
+        document_frequency = {term: sum(segment.terms[term][1] - segment.terms[term][0]
+                                        for segment in self.segments if term in segment.terms) for term in terms}
+        candidates = []
+        for segment, live in zip(self.segments, self._live):
+            scores = np.zeros(len(segment.keys), dtype=np.float32)
+            norm = self.k1 * (1 - self.b + self.b * np.asarray(segment.lengths) / average_length)
+            for term, query_tf in terms.items():
+                if term not in segment.terms:
+                    continue
+                start, end = segment.terms[term]
+                docs, tfs = segment.docs[start:end], segment.tfs[start:end]
+                df = document_frequency[term]
+                idf = np.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+                scores[docs] += query_tf * idf * tfs * (self.k1 + 1) / (tfs + norm[docs])
+            scores[~live] = 0
+            top = np.argsort(-scores)[:k + len(exclude or ())]
+            candidates.extend((segment.keys[n], float(scores[n])) for n in top if scores[n] > 0)
+        candidates.sort(key=lambda item: -item[1])
+        return [(key, score) for key, score in candidates if not exclude or key not in exclude][:k]
+
+    def examples(self, description: str, required_fields=None, k: int = 3) -> list:
+        """The k most similar corpus detections, leaving out entries with the very same description."""
+        if isinstance(required_fields, (list, tuple)):
+            required_fields = " ".join(required_fields)
+        if self._by_description is None:
+            by_description = {}
+            for record in corpus:
+                by_description.setdefault(_normalize(record.description), set()).add(record.id)
+            self._by_description = by_description
+        # the same detection would hand over the answer (and skew evaluation on the dataset itself)
+        same = self._by_description.get(_normalize(description), set())
+        hits = self.search(f"{description}\n{required_fields or ''}", k, exclude=same)
+        return [corpus.by_id(key) for key, _ in hits if corpus.by_id(key) is not None]
+
+
+def few_shot_context(description: str, required_fields=None, k: int = None) -> str:
+    """Prompt section with the k nearest existing detections, or '' when retrieval is disabled."""
+    k = int(os.getenv("RETRIEVAL_EXAMPLES") or 3) if k is None else k
+    if k <= 0:
+        return ''
+    try:
+        examples = retrieval_index.examples(description, required_fields, k)
+    except Exception as e:
+        logging.error(f"Retrieval failed: {e}")
+        return ''
+    if not examples:
+        return ''
+    blocks = []
+    for record in examples:
+        search = record.search
+        if len(search) > MAX_EXAMPLE_CHARS:
+            search = search[:MAX_EXAMPLE_CHARS] + ' ...'
+        blocks.append(f"### {record.name}\nDescription: {record.description.strip()}\n```spl\n{search}\n```")
+    return "\n## Below are similar existing detections for reference:\n" + "\n\n".join(blocks)
+
+
+retrieval_index = RetrievalIndex(os.getenv("RETRIEVAL_INDEX_PATH") or DEFAULT_RETRIEVAL_PATH)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Update the retrieval index or query it.")
+    parser.add_argument("query", nargs="?", help="description to search for; omit to only update the index")
+    parser.add_argument("-k", type=int, default=3)
+    args = parser.parse_args()
+    added = retrieval_index.update()
+    print(f"Indexed {added} new or changed detections")
+    if args.query:
+        for key, score in retrieval_index.search(args.query, args.k):
+            print(f"{score:8.3f}  {corpus.by_id(key).name}")
@@ -0,0 +1,351 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+from openai.types.chat import ChatCompletion
+from src.cache import response_cache
+from src.config import env_flag
+from src.instrumentation import instrumentation
+import asyncio
+import contextvars
+import logging
+import openai
+import os
+import threading
+import time
+import weakref
+
+load_dotenv()
+
+# provider name -> prefix of its <PREFIX>_API_KEY / _BASE_URL / _MODEL_NAME settings
+PROVIDER_ENV = {"openai": "OPENAI", "deepseek": "DEEPSEEK", "llama": "LLAMA"}
+# upper bound on concurrent requests issued through the async clients
+MAX_CONCURRENT_REQUESTS = int(os.getenv("LLM_MAX_CONCURRENT_REQUESTS", 16))
+_async_semaphores = weakref.WeakKeyDictionary()
+
+
+def _async_semaphore() -> asyncio.Semaphore:
+    # asyncio primitives are bound to the loop that first uses them, so keep one per loop
+    loop = asyncio.get_running_loop()
+    if loop not in _async_semaphores:
+        _async_semaphores[loop] = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    return _async_semaphores[loop]
+
+
+class AllProvidersFailed(Exception):
+    def __init__(self, stage: str, errors: list):
+        super().__init__(f"All providers failed for {stage or 'unknown'}: " +
+                         "; ".join(f"{name}: {error}" for name, error in errors))
+        self.errors = errors
+
+
+class ProviderStats:
+    """Sliding window of latencies and outcomes, plus a circuit breaker after consecutive failures."""
+
+    def __init__(self, window: int = 200, failure_threshold: int = 3, cooldown: float = 30):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.calls = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool):
+        with self._lock:
+            self.calls += 1
+            self.outcomes.append(ok)
+            if ok:
+                self.latencies.append(latency)
+                self.consecutive_failures = 0
+                return
+            self.errors += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                self.open_until = time.monotonic() + self.cooldown
+
+    def percentile(self, p: float):
+        with self._lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+    @property
+    def error_rate(self) -> float:
+        with self._lock:
+            return (len(self.outcomes) - sum(self.outcomes)) / len(self.outcomes) if self.outcomes else 0.0
+
+    @property
+    def samples(self) -> int:
+        return len(self.latencies)
+
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.open_until
+
+    def score(self) -> float:
+        # expected cost of a call: median latency inflated by the chance of having to fail over
+        p50 = self.percentile(0.5)
+        return (p50 if p50 is not None else 0.0) * (1 + 4 * self.error_rate)
+
+    def as_dict(self) -> dict:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {"calls": self.calls, "errors": self.errors, "error_rate": round(self.error_rate, 4),
+                "p50": round(p50, 3) if p50 is not None else None, "p95": round(p95, 3) if p95 is not None else None,
+                "healthy": self.healthy()}
+
+
+class Provider:
+    def __init__(self, name: str, api_key: str, model: str, base_url: str = None, timeout: float = None,
+                 max_retries: int = openai.DEFAULT_MAX_RETRIES):
+        self.name = name
+        self.model = model
+        options = {"api_key": api_key, "base_url": base_url or None, "max_retries": max_retries}
+        if timeout is not None:
+            options["timeout"] = timeout
+        self.client = openai.OpenAI(**options)
+        self.async_client = openai.AsyncOpenAI(**options)
+        self.stats = ProviderStats()
+
+    @classmethod
+    def from_env(cls, name: str, timeout: float = None, max_retries: int = openai.DEFAULT_MAX_RETRIES):
+        """The provider configured in the environment, or None when its key or model is missing."""
+        prefix = PROVIDER_ENV[name]
+        api_key, model = os.getenv(f"{prefix}_API_KEY"), os.getenv(f"{prefix}_MODEL_NAME")
+        # .env.example placeholders such as <YOUR_LLAMA_API_KEY> count as unset
+        if not api_key or not model or api_key.startswith("<"):
+            return None
+        return cls(name, api_key, model, os.getenv(f"{prefix}_BASE_URL"), timeout, max_retries)
+
+
+def parse_routes(text: str) -> dict:
+    """'extract_info_from_pipe=llama;reflect_and_score_rule=llama,openai;*=openai' -> {stage: [providers]}"""
+    routes = {}
+    for entry in (text or '').split(';'):
+        if '=' not in entry:
+            continue
+        stage, names = entry.split('=', 1)
+        routes[stage.strip()] = [name.strip() for name in names.split(',') if name.strip()]
+    return routes
+
+
+class ProviderRouter:
+    """
+    Holds a client for every configured provider (openai, deepseek, llama) and routes each call by its stage.
+
+    A stage is routed to the providers listed for it in LLM_ROUTES (matched exactly or by the prefix before ':',
+    '*' being the fallback), else to the default provider, so that set_default() moves every unrouted stage. Routes
+    naming providers that are not configured are skipped. The remaining providers follow as failover targets;
+    providers that failed several times in a row are skipped for a cooldown. Within the listed providers the one
+    with the lowest expected latency (p50 weighted by error rate) goes first.
+    With hedging on, a request still running after the primary's p95 latency is also sent to the next
+    candidate and the first response wins; losing async requests are cancelled, losing sync requests (which cannot
+    be interrupted) finish in the background, fill the cache and are recorded as cancelled, so their tokens stay
+    out of the per-rule usage. Hedging is off unless LLM_HEDGE=true, since every hedge pays for a second request.
+    Per-provider p50/p95 latency and error rates are kept in stats().
+    """
+
+    def __init__(self, providers: dict, default: str, routes: dict = None, hedge: bool = False,
+                 hedge_after: float = None, min_samples: int = 20, max_workers: int = 32):
+        if default not in providers:
+            raise ValueError(f"Default provider {default} is not configured")
+        self.providers = providers
+        self.default = default
+        self.routes = dict(routes or {})
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.min_samples = min_samples
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-router")
+
+    @classmethod
+    def from_env(cls):
+        timeout = float(os.getenv("LLM_TIMEOUT")) if os.getenv("LLM_TIMEOUT") else None
+        # the SDK retries each request itself before the router fails over
+        max_retries = int(os.getenv("LLM_CLIENT_MAX_RETRIES") or openai.DEFAULT_MAX_RETRIES)
+        providers = {}
+        for name in PROVIDER_ENV:
+            provider = Provider.from_env(name, timeout, max_retries)
+            if provider is not None:
+                providers[name] = provider
+        hedge_after = os.getenv("LLM_HEDGE_AFTER")
+        return cls(providers, default=os.getenv("LLM_DEFAULT_PROVIDER") or "openai",
+                   routes=parse_routes(os.getenv("LLM_ROUTES")),
+                   hedge=env_flag("LLM_HEDGE", False),
+                   hedge_after=float(hedge_after) if hedge_after else None)
+
+    def set_default(self, name: str):
+        if name not in self.providers:
+            raise ValueError(f"Provider {name} is not configured")
+        self.default = name
+
+    def _route(self, stage: str) -> list:
+        stage = stage or ''
+        keys = [key for key in self.routes if key != '*' and (stage == key or stage.startswith(key + ':'))]
+        if keys:
+            names = self.routes[max(keys, key=len)]
+        else:
+            names = self.routes.get('*') or [self.default]
+        names = [name for name in names if name in self.providers]
+        return names or [self.default]
+
+    def candidates(self, stage: str) -> list:
+        preferred = [self.providers[name] for name in self._route(stage)]
+        others = [provider for provider in self.providers.values() if provider not in preferred]
+        if len(preferred) > 1 and all(p.stats.samples >= self.min_samples for p in preferred):
+            preferred.sort(key=lambda p: p.stats.score())
+        others.sort(key=lambda p: (p.name != self.default, p.stats.score()))
+        ordered = preferred + others
+        # providers behind an open circuit are only tried when nothing else is left
+        return [p for p in ordered if p.stats.healthy()] + [p for p in ordered if not p.stats.healthy()]
+
+    def _hedge_delay(self, provider: Provider):
+        if not self.hedge:
+            return None
+        if self.hedge_after is not None:
+            return self.hedge_after
+        if provider.stats.samples < self.min_samples:
+            return None
+        return provider.stats.percentile(0.95)
+
+    def primary(self, stage: str) -> Provider:
+        """The first provider routed for stage, whatever its health or latency; batch jobs are pinned to it."""
+        return self.providers[self._route(stage)[0]]
+
+    @staticmethod
+    def cache_key(provider: Provider, messages: list, params: dict) -> str:
+        return response_cache.make_key(provider.model, messages, base_url=str(provider.client.base_url), **params)
+
+    def _cached(self, provider: Provider, messages: list, params: dict):
+        key = self.cache_key(provider, messages, params)
+        return key, response_cache.get(key)
+
+    def _call(self, provider: Provider, messages: list, stage: str, retries: int, params: dict,
+              abandoned: threading.Event = None) -> ChatCompletion:
+        # identical (endpoint, model, messages, params) requests are served from the on-disk cache
+        with instrumentation.call(stage, provider.model, retries, provider=provider.name, abandoned=abandoned) as call:
+            key, cached = self._cached(provider, messages, params)
+            if cached is not None:
+                call.response, call.cache_hit = ChatCompletion.model_validate_json(cached), True
+                return call.response
+            start = time.perf_counter()
+            try:
+                call.response = provider.client.chat.completions.create(model=provider.model, messages=messages,
+                                                                        **params)
+            except Exception:
+                provider.stats.record(time.perf_counter() - start, False)
+                raise
+            provider.stats.record(time.perf_counter() - start, True)
+            response_cache.set(key, call.response.model_dump_json())
+            return call.response
+
+    async def _acall(self, provider: Provider, messages: list, stage: str, retries: int,
+                     params: dict) -> ChatCompletion:
+        with instrumentation.call(stage, provider.model, retries, provider=provider.name) as call:
+            key, cached = self._cached(provider, messages, params)
+            if cached is not None:
+                call.response, call.cache_hit = ChatCompletion.model_validate_json(cached), True
+                return call.response
+            async with _async_semaphore():
+                start = time.perf_counter()
+                try:
+                    call.response = await provider.async_client.chat.completions.create(
+                        model=provider.model, messages=messages, **params)
+                except asyncio.CancelledError:
+                    # a hedged request that lost the race is neither a success nor a failure
+                    raise
+                except Exception:
+                    provider.stats.record(time.perf_counter() - start, False)
+                    raise
+                provider.stats.record(time.perf_counter() - start, True)
+            response_cache.set(key, call.response.model_dump_json())
+            return call.response
+
+    def complete(self, messages: list, stage: str = None, retries: int = 0, **params) -> ChatCompletion:
+        candidates = self.candidates(stage)
+        errors = []
+        if len(candidates) == 1 or self._hedge_delay(candidates[0]) is None:
+            for provider in candidates:
+                try:
+                    return self._call(provider, messages, stage, retries, params)
+                except Exception as e:
+                    logging.warning(f"{provider.name} failed for {stage}: {e}")
+                    errors.append((provider.name, e))
+            raise AllProvidersFailed(stage, errors)
+
+        remaining = list(candidates)
+        pending = {}
+        hedged = False
+        abandoned = threading.Event()
+
+        def submit(provider):
+            # each attempt gets its own copy of the context so usage tracking follows it into the pool
+            future = self._executor.submit(contextvars.copy_context().run, self._call, provider, messages, stage,
+                                           retries, params, abandoned)
+            pending[future] = provider
+
+        submit(remaining.pop(0))
+        while pending:
+            timeout = self._hedge_delay(candidates[0]) if remaining and not hedged else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                logging.info(f"Hedging {stage} on {remaining[0].name} after {timeout:.2f}s")
+                submit(remaining.pop(0))
+                continue
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    response = future.result()
+                except Exception as e:
+                    logging.warning(f"{provider.name} failed for {stage}: {e}")
+                    errors.append((provider.name, e))
+                    continue
+                # the slower attempt, if any, finishes in the background and fills the cache
+                abandoned.set()
+                for loser in pending:
+                    loser.cancel()
+                return response
+            if not pending and remaining:
+                submit(remaining.pop(0))
+        raise AllProvidersFailed(stage, errors)
+
+    async def acomplete(self, messages: list, stage: str = None, retries: int = 0, **params) -> ChatCompletion:
+        candidates = self.candidates(stage)
+        remaining = list(candidates)
+        errors = []
+        pending = {}
+        hedged = False
+
+        def submit(provider):
+            pending[asyncio.ensure_future(self._acall(provider, messages, stage, retries, params))] = provider
+
+        submit(remaining.pop(0))
+        try:
+            while pending:
+                delay = self._hedge_delay(candidates[0]) if remaining and not hedged else None
+                done, _ = await asyncio.wait(pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    logging.info(f"Hedging {stage} on {remaining[0].name} after {delay:.2f}s")
+                    submit(remaining.pop(0))
+                    continue
+                for task in done:
+                    provider = pending.pop(task)
+                    try:
+                        return task.result()
+                    except Exception as e:
+                        logging.warning(f"{provider.name} failed for {stage}: {e}")
+                        errors.append((provider.name, e))
+                if not pending and remaining:
+                    submit(remaining.pop(0))
+        finally:
+            for task in pending:
+                task.cancel()
+        raise AllProvidersFailed(stage, errors)
+
+    def stats(self) -> dict:
+        return {name: provider.stats.as_dict() for name, provider in self.providers.items()}
+
+
+router = ProviderRouter.from_env()
@@ -1,12 +1,27 @@
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from pathlib import Path
+from openai.types.chat import ChatCompletion
+from src.context import context_compactor
+from src.instrumentation import track_usage
+from src.known_rules import find_known_rule
+from src.macros import MacroCycleError, macro_index
+from src.pipe_index import pipe_index
+from src.prompt_builder import build_messages
+from src.router import PROVIDER_ENV, router
+from src.spl_parser import parse_pipe, split_pipes, strip_code_fence
+from src.step_planner import ALL_STEPS, nothing_to_add, plan_dsl_steps
 import pandas as pd
 import openai
 import os
 import json
 import re
+import asyncio
+import contextvars
 import logging
+import queue
+import threading
 import time
 
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
@@ -17,43 +32,22 @@ logging.basicConfig(level=logging.INFO,
                     ])
 load_dotenv()
 
-client = openai.OpenAI(api_key=os.environ['OPENAI_API_KEY'])
-model = os.environ['OPENAI_MODEL_NAME']
-
 
 def switch_llm_provider(provider="openai"):
+    """Make provider the default for stages without a route; the other providers stay available for failover."""
+    global client, async_client, model
 
-    global client, model
-
-    providers = {
-        "openai": {
-            "api_key": os.getenv("OPENAI_API_KEY"),
-            "base_url": os.getenv("OPENAI_BASE_URL"),
-            "model": os.getenv("OPENAI_MODEL_NAME")
-        },
-        "deepseek": {
-            "api_key": os.getenv("DEEPSEEK_API_KEY"),
-            "base_url": os.getenv("DEEPSEEK_BASE_URL"),
-            "model": os.getenv("DEEPSEEK_MODEL_NAME")
-        },
-        "llama": {
-            "api_key": os.getenv("LLAMA_API_KEY"),
-            "base_url": os.getenv("LLAMA_BASE_URL"),
-            "model": os.getenv("LLAMA_MODEL_NAME")
-        }
-    }
-
-    if provider not in providers:
+    if provider not in PROVIDER_ENV:
         raise ValueError(f"Unknown provider: {provider}")
-
-    config = providers[provider]
-
-    client = openai.OpenAI(api_key=config["api_key"], base_url=config["base_url"])
-    model = config["model"]
+    router.set_default(provider)
+    # module-level handles for callers that talk to the default provider directly (Batch API, utils)
+    client = router.providers[provider].client
+    async_client = router.providers[provider].async_client
+    model = router.providers[provider].model
     logging.info(f"Switched to {provider} provider.")
 
 
-switch_llm_provider("openai")
+switch_llm_provider(router.default)
 
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s',
@@ -63,6 +57,15 @@ logging.basicConfig(level=logging.INFO,
                     ])
 
 
+def chat_completion(messages: list, stage: str = None, retries: int = 0, **params) -> ChatCompletion:
+    # routed by stage across the configured providers, with failover and the on-disk response cache
+    return router.complete(messages, stage=stage, retries=retries, **params)
+
+
+async def async_chat_completion(messages: list, stage: str = None, retries: int = 0, **params) -> ChatCompletion:
+    return await router.acomplete(messages, stage=stage, retries=retries, **params)
+
+
 class Rule(ABC):
     def __init__(self, rule_type: str, rule_content: str):
         self.rule_type = rule_type
@@ -89,11 +92,12 @@ class SplunkRule(Rule):
 
     def preprocess(self):
         self.pipes = []
-        pipes = self.rule_content.split("|")
+        pipes = split_pipes(self.rule_content)
         for pipe in pipes:
-            pipe_info = extract_info_from_pipe(pipe)
+            pipe_info = get_pipe_info(pipe, self.rule_type.lower())
             pipe_info['pipe'] = pipe
             self.pipes.append(pipe_info)
+        pipe_index.save()
 
     def show_pipes(self):
         preprocessed_data = self.pipes
@@ -118,11 +122,12 @@ class SentinelRule(Rule):
 
     def preprocess(self):
         self.pipes = []
-        pipes = self.rule_content.split("|")
+        pipes = split_pipes(self.rule_content)
         for pipe in pipes:
-            pipe_info = extract_info_from_pipe(pipe)
+            pipe_info = get_pipe_info(pipe, self.rule_type.lower())
             pipe_info['pipe'] = pipe
             self.pipes.append(pipe_info)
+        pipe_index.save()
 
     @classmethod
     def from_convert_result(cls, pipes: list) -> Rule:
@@ -136,12 +141,21 @@ class RuleConverter:
         "sentinel": SentinelRule
     }
 
+    RULE_NAMES = {
+        SplunkRule: "Splunk",
+        SentinelRule: "Microsoft Sentinel"
+    }
+
     @classmethod
-    def convert_rule(cls, input_rule: Rule, target_rule_type: str) -> Rule:
+    def convert_rule(cls, input_rule: Rule, target_rule_type: str, parallel: bool = False,
+                     max_workers: int = 8) -> Rule:
         target_rule_type = target_rule_type.lower()
         if target_rule_type not in cls.RULE_CLASSES:
             raise ValueError(f"Rule type {target_rule_type} is not supported.")
         target_rule_class = cls.RULE_CLASSES[target_rule_type]
+        if parallel:
+            target_rule_pipes = cls._convert_pipes_parallel(input_rule, target_rule_type, max_workers)
+            return target_rule_class.from_convert_result(target_rule_pipes)
         target_rule_pipes = []
         from src.prompt import RULE_CONVERSION_PROMPT
         sys_prompt = RULE_CONVERSION_PROMPT.format(target_rule_type=target_rule_type)
@@ -154,11 +168,7 @@ class RuleConverter:
                 The operation type is {pipe['operation_type']}
                 '''  # todo: add input and output fields
                 messages.append({"role": "user", "content": user_prompt})
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    response_format={"type": "json_object"}
-                )
+                response = chat_completion(messages, stage="convert_rule", response_format={"type": "json_object"})
                 converted_rule = response.choices[0].message.content
                 target_rule_pipes.append(json.loads(converted_rule)['result'])
                 messages.append({"role": "assistant", "content": converted_rule})
@@ -171,16 +181,105 @@ class RuleConverter:
                             The operation type is {pipe['operation_type']}
                             '''  # todo: add input and output fields
                 messages.append({"role": "user", "content": user_prompt})
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    response_format={"type": "json_object"}
-                )
+                response = chat_completion(messages, stage="convert_rule", response_format={"type": "json_object"})
                 converted_rule = response.choices[0].message.content
                 target_rule_pipes.append(json.loads(converted_rule)['result'])
                 messages.append({"role": "assistant", "content": converted_rule})
         return target_rule_class.from_convert_result(target_rule_pipes)
 
+    @classmethod
+    def _convert_pipes_parallel(cls, input_rule: Rule, target_rule_type: str, max_workers: int = 8) -> list:
+        """
+        Convert every pipe independently with a compact context (the fields flowing in from the previous
+        pipes, derived locally) instead of the whole conversation, then stitch the pieces in one final call.
+        """
+        from src.prompt import RULE_CONVERSION_PROMPT, RULE_STITCH_PROMPT
+        sys_prompt = RULE_CONVERSION_PROMPT.format(target_rule_type=target_rule_type)
+        rule_name = cls.RULE_NAMES[type(input_rule)]
+        schemas = cls._incoming_fields(input_rule.pipes)
+
+        def convert(index):
+            pipe = input_rule.pipes[index]
+            user_prompt = f'''
+                The following is a part of a {rule_name} rule:
+                {pipe['pipe']}
+                The operation type is {pipe['operation_type']}
+                The input fields are {pipe.get('input_fields', [])} and the output fields are {pipe.get('output_fields', [])}
+                This is pipe {index + 1} of {len(input_rule.pipes)}. Fields available from the previous pipes: {schemas[index]}
+                '''
+            messages = [{"role": "system", "content": sys_prompt}, {"role": "user", "content": user_prompt}]
+            response = chat_completion(messages, stage="convert_rule:pipe", response_format={"type": "json_object"})
+            return json.loads(response.choices[0].message.content)['result']
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # a fresh context copy per task keeps usage tracking attached to the caller
+            futures = [executor.submit(contextvars.copy_context().run, convert, index)
+                       for index in range(len(input_rule.pipes))]
+            target_rule_pipes = [future.result() for future in futures]
+
+        stitch_prompt = RULE_STITCH_PROMPT.format(target_rule_type=target_rule_type)
+        user_prompt = f'''
+        The following is the original {rule_name} rule:
+        {input_rule.rule_content}
+        The following are its pipes converted one by one:
+        {json.dumps(target_rule_pipes, ensure_ascii=False, indent=2)}
+        '''
+        messages = [{"role": "system", "content": stitch_prompt}, {"role": "user", "content": user_prompt}]
+        try:
+            response = chat_completion(messages, stage="convert_rule:stitch", response_format={"type": "json_object"})
+            stitched = json.loads(response.choices[0].message.content)['result']
+        except Exception as e:
+            logging.error(f"Stitching failed, keeping the per-pipe conversion: {e}")
+            return target_rule_pipes
+        return split_pipes(stitched)
+
+    @staticmethod
+    def _incoming_fields(pipes: list) -> list:
+        # fields known to exist before each pipe, tracked through the pipe info of the previous pipes
+        schemas, available = [], []
+        for pipe in pipes:
+            schemas.append(list(available))
+            inputs, outputs = pipe.get('input_fields') or [], pipe.get('output_fields') or []
+            operation_type = pipe.get('operation_type')
+            command = pipe['pipe'].split(maxsplit=1)[0].lower() if pipe['pipe'].strip() else ''
+            if (operation_type == 'AGGREGATE' and command not in ('eventstats', 'streamstats')) or \
+                    (operation_type == 'OUTPUT' and command in ('table', 'fields') and outputs):
+                # stats-like commands and table replace the event schema
+                available = list(outputs)
+            elif operation_type == 'RENAME':
+                available = [f for f in available if f not in inputs] + list(outputs)
+            else:
+                available += [f for f in inputs + outputs if f not in available]
+        return schemas
+
+
+def parse_pipe_locally(pipe_str: str):
+    parsed = parse_pipe(pipe_str)
+    if parsed is None and '`' in pipe_str:
+        # a macro pipe is classified by what it expands to
+        try:
+            expanded = split_pipes(macro_index.expand(pipe_str))
+        except MacroCycleError as e:
+            logging.error(f"Failed to expand {pipe_str!r}: {e}")
+            expanded = []
+        if len(expanded) == 1:
+            parsed = parse_pipe(expanded[0])
+    return parsed
+
+
+def get_pipe_info(pipe_str: str, rule_type: str = "splunk") -> dict:
+    # common SPL commands are parsed locally, other known pipes come from the fingerprint index,
+    # and only the rest costs an LLM call
+    if rule_type == "splunk":
+        parsed = parse_pipe_locally(pipe_str)
+        if parsed is not None:
+            return parsed.info()
+    pipe_info = pipe_index.get(pipe_str, rule_type)
+    if pipe_info is None:
+        pipe_info = extract_info_from_pipe(pipe_str)
+        pipe_index.put(pipe_str, pipe_info, rule_type)
+    return pipe_info
+
 
 def extract_info_from_pipe(pipe_str: str) -> dict:
     from src.prompt import PREPROCESSING_PROMPT
@@ -189,37 +288,54 @@ def extract_info_from_pipe(pipe_str: str) -> dict:
     The following is a part of a Splunk rule:
     {pipe_str}
     '''
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
+    response = chat_completion(
+        [
             {"role": "system", "content": sys_prompt},
             {"role": "user", "content": user_prompt},
         ],
+        stage="extract_info_from_pipe",
         response_format={"type": "json_object"}
     )
     return json.loads(response.choices[0].message.content)
 
 
-def safe_chat_completion(messages, max_retries=5, delay=2):
+def safe_chat_completion(messages, max_retries=5, delay=2, stage=None):
     retries = 0
     while retries < max_retries:
         try:
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-            )
+            response = chat_completion(messages, stage=stage, retries=retries)
             return response
         except Exception as e:
             retries += 1
-            print(f"Attempt {retries} failed with error: {e}")
+            logging.warning(f"Attempt {retries} of {stage or 'LLM call'} failed with error: {e}")
             time.sleep(delay)
     raise Exception(f"All {max_retries} attempts failed.")
 
 
+async def async_safe_chat_completion(messages, max_retries=5, delay=2, stage=None):
+    # asyncio.CancelledError is not an Exception subclass, so cancellation is never retried
+    retries = 0
+    while retries < max_retries:
+        try:
+            return await async_chat_completion(messages, stage=stage, retries=retries)
+        except Exception as e:
+            retries += 1
+            logging.warning(f"Attempt {retries} of {stage or 'LLM call'} failed with error: {e}")
+            await asyncio.sleep(delay)
+    raise Exception(f"All {max_retries} attempts failed.")
+
+
 class RuleGenerator:
+    DSL_STEPS = ALL_STEPS
+
     @classmethod
     def web_rule_generator(cls, description: str, rule_type: str, required_fields: str = None,
                            log_demo: str = None):
+        known = find_known_rule(description, rule_type, required_fields)
+        if known is not None:
+            yield "KNOWN_RULE", str(known)
+            yield "FINAL_RULE", known.rule
+            return
         dsl_rule_collected = ""
         for step, result in cls.generate_dsl_rule(description, rule_type, required_fields, log_demo, stream=True):
             yield step, result
@@ -232,6 +348,9 @@ class RuleGenerator:
     @classmethod
     def generate_rule(cls, description: str, rule_type: str, required_fields: str = None,
                       log_demo: str = None):
+        known = find_known_rule(description, rule_type, required_fields)
+        if known is not None:
+            return known.rule
         logging.info("Generating DSL rule...")
         dsl_rule = cls.generate_dsl_rule(description, rule_type, required_fields, log_demo, stream=False)
         dsl_rule = next(dsl_rule)
@@ -245,7 +364,15 @@ class RuleGenerator:
     def generate_rule_simple(cls, description: str, rule_type: str, required_fields: str = None,
                              log_demo: str = None) -> str:
         # analyse_result = cls._analyse_rule_description(description, rule_type)
+        messages = cls._simple_rule_messages(description, rule_type, required_fields)
+        # try several times to get the response
+        response = safe_chat_completion(messages, stage="generate_rule_simple")
+        return response.choices[0].message.content
+
+    @classmethod
+    def _simple_rule_messages(cls, description: str, rule_type: str, required_fields: str = None) -> list:
         from src.prompt import RULE_GENERATE_PROMPT_SIMPLE
+        from src.retrieval import few_shot_context
         sys_prompt = RULE_GENERATE_PROMPT_SIMPLE.format(rule_type=rule_type)
         user_prompt = f'''
         The following is the {rule_type} rule description:
@@ -253,13 +380,16 @@ class RuleGenerator:
         The following are the required fields:
         {required_fields}
         '''
-        messages = [{"role": "system", "content": sys_prompt}, {"role": "user", "content": user_prompt}]
-        # try several times to get the response
-        response = safe_chat_completion(messages)
-        return response.choices[0].message.content
+        return build_messages(sys_prompt, [(None, few_shot_context(description, required_fields))], user_prompt)
 
     @classmethod
     def optimize_rule(cls, rule: str, description: str) -> str:
+        messages = cls._optimize_rule_messages(rule, description)
+        response = safe_chat_completion(messages, stage="optimize_rule")
+        return cls._extract_block(response.choices[0].message.content, 'spl')
+
+    @classmethod
+    def _optimize_rule_messages(cls, rule: str, description: str) -> list:
         from src.prompt import RULE_OPTIMIZE_PROMPT
         sys_prompt = RULE_OPTIMIZE_PROMPT
         user_prompt = f'''
@@ -268,10 +398,41 @@ class RuleGenerator:
         The following is the description of the rule:
         {description}
         '''
-        messages = [{"role": "system", "content": sys_prompt}, {"role": "user", "content": user_prompt}]
-        response = safe_chat_completion(messages)
-        rule_message = re.search(r'```spl\n(.*?)\n```', response.choices[0].message.content, re.DOTALL).group(1)
-        return rule_message
+        return [{"role": "system", "content": sys_prompt}, {"role": "user", "content": user_prompt}]
+
+    @staticmethod
+    def _extract_block(message: str, language: str) -> str:
+        # use re to extract the text between ```<language> and ```
+        return re.search(rf'```{language}\n(.*?)\n```', message, re.DOTALL).group(1)
+
+    @classmethod
+    def _extract_rule(cls, message: str) -> str:
+        # the bare search of an answer: its ```spl block, else its only other fenced block, else the answer itself
+        try:
+            return cls._extract_block(message, 'spl').strip()
+        except AttributeError:
+            return strip_code_fence(message)
+
+    @staticmethod
+    def _split_dsl_lines(dsl_message: str) -> list:
+        # split the dsl message by \n and remove the empty lines
+        return [line for line in dsl_message.split('\n') if line.strip()]
+
+    @classmethod
+    def _dsl_lines(cls, dsl_message: str) -> list:
+        try:
+            return cls._split_dsl_lines(cls._extract_block(dsl_message, 'plaintext'))
+        except AttributeError:
+            # no ```plaintext block: the model found nothing to add for this step
+            return []
+
+    @staticmethod
+    def _keep_dsl_turn(dsl_msgs: list, dsl_message: str, dsl_rules: list):
+        # steps without DSL output are dropped from the conversation so later steps do not carry them
+        if dsl_rules:
+            dsl_msgs.append({"role": "assistant", "content": dsl_message})
+        else:
+            dsl_msgs.pop()
 
     @classmethod
     def _analyse_rule_description(cls, description: str, rule_type: str):
@@ -283,109 +444,264 @@ class RuleGenerator:
                 {description}
                 """
         messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}]
-        analyse_response = client.chat.completions.create(model=model, messages=messages, )
+        analyse_response = chat_completion(messages, stage="_analyse_rule_description")
         analyse_result = analyse_response.choices[0].message.content
         return analyse_result
 
     @classmethod
     def generate_dsl_rule(cls, description: str, rule_type: str, required_fields: str = None,
-                          log_demo: str = None, stream: bool = False):
-        from src.prompt import TASK_BREAKDOWN_PROMPTS
-        from src.prompt import DSL_GENERATION_PROMPT
-        from src.data import DSL_KEYWORD
-        keyword = "\n".join(f'{k}: {v}' for k, v in DSL_KEYWORD.items())
-        sys_prompt = DSL_GENERATION_PROMPT.format(rule_type=rule_type, rule_description=description, keyword=keyword)
-        # if it has required fields, add to the prompt
-        if required_fields:
-            sys_prompt += f'\nBelow are the required fields:\n{required_fields}'
-        if log_demo:
-            sys_prompt += f'\nBelow is a demo log:\n{log_demo}'
-        dsl_msgs = [{"role": "system", "content": sys_prompt}]
-        breakdown_msgs = []
-        background_prompt = TASK_BREAKDOWN_PROMPTS['BACKGROUND'].format(rule_type=rule_type, description=description)
-        breakdown_msgs.append({"role": "system", "content": background_prompt})
-
+                          log_demo: str = None, stream: bool = False, pipeline: bool = True):
+        breakdown_msgs, dsl_msgs = cls._dsl_conversations(description, rule_type, required_fields, log_demo)
+        steps = plan_dsl_steps(description)
         dsl_rules = []
-        steps = [
-            'UNDERSTANDING_PROBLEM', 'IDENTIFY_DATA_SOURCE', 'DEFINE_INITIAL_FILTERS',
-            'EXTRACT_RELEVANT_FIELDS', 'PERFORM_DATA_AGGREGATION', 'CALCULATE_DERIVED_METRICS',
-            'FILTER_ANOMALIES', 'OPTIMIZE_OUTPUT'
-        ]
-
-        for step in steps:
-            _, step_output = cls._analyse_subtask(breakdown_msgs, dsl_msgs, step)
-            dsl_rules.extend(step_output)
-
-            if stream:
-                yield step, _
-                yield step, step_output
-
-        print(dsl_rules)
+        if pipeline:
+            # the breakdown conversation never reads the DSL one, so it runs ahead in a worker thread
+            # and step N's DSL translation overlaps step N+1's analysis
+            analyses = queue.Queue()
+            stop = threading.Event()
+            # copy the context so per-rule usage tracking follows the worker thread
+            worker = threading.Thread(target=contextvars.copy_context().run,
+                                      args=(cls._breakdown_chain, breakdown_msgs, steps, analyses, stop),
+                                      daemon=True)
+            worker.start()
+        try:
+            for step in steps:
+                if pipeline:
+                    analyse_message = analyses.get()
+                else:
+                    analyse_message = cls._breakdown_subtask(breakdown_msgs, step)
+                if stream:
+                    yield step, analyse_message or ''
+                if analyse_message is None or nothing_to_add(analyse_message):
+                    step_output = []
+                else:
+                    step_output = cls._translate_subtask(dsl_msgs, step, analyse_message)
+                dsl_rules.extend(step_output)
+
+                if stream:
+                    yield step, step_output
+        finally:
+            if pipeline:
+                stop.set()
+
+        logging.debug(f"DSL rules: {dsl_rules}")
         # optimize the dsl rules
         dsl_rules_str_optimized = cls._optimize_dsl_rule(dsl_rules, description)
-        print(dsl_rules_str_optimized)
+        logging.debug(f"Optimized DSL rules: {dsl_rules_str_optimized}")
         if stream:
             yield "FINAL_RESULT", dsl_rules_str_optimized
         else:
             yield dsl_rules_str_optimized
 
+    @classmethod
+    def _dsl_conversations(cls, description: str, rule_type: str, required_fields: str = None,
+                           log_demo: str = None) -> tuple:
+        from src.prompt import TASK_BREAKDOWN_PROMPTS
+        from src.prompt import DSL_GENERATION_PROMPT
+        from src.data import DSL_KEYWORD
+        from src.retrieval import few_shot_context
+        keyword = "\n".join(f'{k}: {v}' for k, v in DSL_KEYWORD.items())
+        # the instructions stay a fixed prefix; the rule itself goes into the first user message
+        sys_prompt = DSL_GENERATION_PROMPT.format(rule_type=rule_type, keyword=keyword)
+        dsl_msgs = build_messages(sys_prompt, [
+            ("Below is the description of the rule", description),
+            ("Below are the required fields", required_fields),
+            ("Below is a demo log", log_demo),
+            (None, few_shot_context(description, required_fields)),
+        ])
+        background_prompt = TASK_BREAKDOWN_PROMPTS['BACKGROUND'].format(rule_type=rule_type)
+        breakdown_msgs = build_messages(background_prompt, [("Below is the description of the rule", description)])
+        return breakdown_msgs, dsl_msgs
+
     @classmethod
     def _analyse_subtask(cls, breakdown_msgs: list, dsl_msgs: list, subtask_name: str) -> tuple:
+        analyse_message = cls._breakdown_subtask(breakdown_msgs, subtask_name)
+        if analyse_message is None:
+            return '', ''
+        if nothing_to_add(analyse_message):
+            return analyse_message, []
+        return analyse_message, cls._translate_subtask(dsl_msgs, subtask_name, analyse_message)
+
+    @classmethod
+    def _breakdown_chain(cls, breakdown_msgs: list, steps: list, analyses: queue.Queue, stop: threading.Event):
+        for step in steps:
+            if stop.is_set():
+                return
+            try:
+                analyses.put(cls._breakdown_subtask(breakdown_msgs, step))
+            except Exception as e:
+                logging.error(f"Error: {e}")
+                analyses.put(None)
+
+    @classmethod
+    def _breakdown_subtask(cls, breakdown_msgs: list, subtask_name: str):
         from src.prompt import TASK_BREAKDOWN_PROMPTS
         subtask_prompt = TASK_BREAKDOWN_PROMPTS[subtask_name]
         breakdown_msgs.append({"role": "user", "content": subtask_prompt})
+        stage = f"_analyse_subtask:{subtask_name}:breakdown"
         try:
-            response = client.chat.completions.create(model=model, messages=breakdown_msgs)
+            response = chat_completion(context_compactor.compact(breakdown_msgs, 'breakdown', stage), stage=stage)
         except Exception as e:
             logging.error(f"Error: {e}")
-            return '', ''
+            breakdown_msgs.pop()
+            return None
         analyse_message = response.choices[0].message.content
         breakdown_msgs.append({"role": "assistant", "content": analyse_message})
+        return analyse_message
 
+    @classmethod
+    def _translate_subtask(cls, dsl_msgs: list, subtask_name: str, analyse_message: str):
         dsl_msgs.append({"role": "user", "content": subtask_name.replace('_', ' ') + ':\n' + analyse_message})
+        stage = f"_analyse_subtask:{subtask_name}:dsl"
         try:
-            response = client.chat.completions.create(model=model, messages=dsl_msgs)
+            response = chat_completion(context_compactor.compact(dsl_msgs, 'dsl', stage), stage=stage)
         except Exception as e:
             logging.error(f"Error: {e}")
-            return '', ''
+            dsl_msgs.pop()
+            return []
         dsl_message = response.choices[0].message.content
-        dsl_msgs.append({"role": "assistant", "content": dsl_message})
-        # use re to extract the text between ```plaintext and ```
-        dsl_message = re.search(r'```plaintext\n(.*?)\n```', dsl_message, re.DOTALL).group(1)
-        # split the dsl message by \n and remove the empty lines
-        dsl_rules = [line for line in dsl_message.split('\n') if line.strip()]
-        print(subtask_name.replace('_', ' ') + ':\n' + analyse_message)
-        print(dsl_rules)
-        return analyse_message, dsl_rules
+        dsl_rules = cls._dsl_lines(dsl_message)
+        cls._keep_dsl_turn(dsl_msgs, dsl_message, dsl_rules)
+        logging.debug(subtask_name.replace('_', ' ') + ':\n' + analyse_message)
+        logging.debug(f"DSL rules: {dsl_rules}")
+        return dsl_rules
 
     @classmethod
     def _optimize_dsl_rule(cls, dsl_rules, rule_description) -> str:
+        messages = cls._optimize_dsl_messages(dsl_rules, rule_description)
+        try:
+            response = chat_completion(messages, stage="_optimize_dsl_rule")
+        except Exception as e:
+            logging.error(f"Error: {e}")
+            return ''
+        return cls._extract_block(response.choices[0].message.content, 'plaintext')
+
+    @classmethod
+    def _optimize_dsl_messages(cls, dsl_rules, rule_description) -> list:
         from src.data import DSL_KEYWORD
         from src.prompt import DSL_OPTIMIZE_PROMPT
         dsl_rules_str = "\n".join(dsl_rules)
         sys_prompt = DSL_OPTIMIZE_PROMPT.format(keyword="\n".join(f'{k}: {v}' for k, v in DSL_KEYWORD.items()))
         user_prompt = f'## DSL Rules:\n{dsl_rules_str}\n\n## Rule Description:\n{rule_description}'
-        messages = [{"role": "system", "content": sys_prompt}, {"role": "user", "content": user_prompt}]
-        try:
-            response = client.chat.completions.create(model=model, messages=messages)
-        except Exception as e:
-            logging.error(f"Error: {e}")
-            return ''
-        response_message = response.choices[0].message.content
-        dsl_message = re.search(r'```plaintext\n(.*?)\n```', response_message, re.DOTALL).group(1)
-        return dsl_message
+        return [{"role": "system", "content": sys_prompt}, {"role": "user", "content": user_prompt}]
 
     @classmethod
     def generate_rule_from_dsl(cls, description: str, dsl_rule: str, rule_type: str, required_fields: list = None) -> str:
+        messages = cls._rule_from_dsl_messages(description, dsl_rule, rule_type, required_fields)
+        response = safe_chat_completion(messages, stage="generate_rule_from_dsl")
+        return response.choices[0].message.content
+
+    @classmethod
+    def _rule_from_dsl_messages(cls, description: str, dsl_rule: str, rule_type: str,
+                                required_fields: list = None) -> list:
         from src.prompt import RULE_GENERATE_FROM_DSL_PROMPT
         from src.data import DSL_KEYWORD
         sys_prompt = RULE_GENERATE_FROM_DSL_PROMPT.format(rule_type=rule_type, keyword="\n".join(
             f'{k}: {v}' for k, v in DSL_KEYWORD.items()))
-        if required_fields:
-            sys_prompt += f'\n## Below are the required fields:\n{required_fields}'
         user_prompt = f'## DSL Rule:\n{dsl_rule} \n\n ## Rule Description:\n{description}'
-        messages = [{"role": "system", "content": sys_prompt}, {"role": "user", "content": user_prompt}]
-        response = safe_chat_completion(messages)
+        return build_messages(sys_prompt, [("Below are the required fields", required_fields)], user_prompt)
+
+
+class AsyncRuleGenerator:
+    """
+    asyncio counterpart of RuleGenerator built on the router's AsyncOpenAI clients.
+
+    Prompts and response parsing are reused from RuleGenerator. Requests are bounded by
+    LLM_MAX_CONCURRENT_REQUESTS per event loop, and cancelling the awaiting task cancels
+    any in-flight completion along with the background breakdown chain.
+    """
+
+    @classmethod
+    async def generate_rule(cls, description: str, rule_type: str, required_fields: str = None,
+                            log_demo: str = None) -> str:
+        known = find_known_rule(description, rule_type, required_fields)
+        if known is not None:
+            return known.rule
+        logging.info("Generating DSL rule...")
+        dsl_rule = await cls.generate_dsl_rule(description, rule_type, required_fields, log_demo)
+        logging.info("Generating rule from DSL...")
+        rule = await cls.generate_rule_from_dsl(description, dsl_rule, rule_type)
+        logging.info("Optimizing rule...")
+        return await cls.optimize_rule(rule, description)
+
+    @classmethod
+    async def generate_rule_simple(cls, description: str, rule_type: str, required_fields: str = None,
+                                   log_demo: str = None) -> str:
+        messages = RuleGenerator._simple_rule_messages(description, rule_type, required_fields)
+        response = await async_safe_chat_completion(messages, stage="generate_rule_simple")
+        return response.choices[0].message.content
+
+    @classmethod
+    async def optimize_rule(cls, rule: str, description: str) -> str:
+        messages = RuleGenerator._optimize_rule_messages(rule, description)
+        response = await async_safe_chat_completion(messages, stage="optimize_rule")
+        return RuleGenerator._extract_block(response.choices[0].message.content, 'spl')
+
+    @classmethod
+    async def generate_dsl_rule(cls, description: str, rule_type: str, required_fields: str = None,
+                                log_demo: str = None) -> str:
+        breakdown_msgs, dsl_msgs = RuleGenerator._dsl_conversations(description, rule_type, required_fields, log_demo)
+        steps = plan_dsl_steps(description)
+        analyses = asyncio.Queue()
+        breakdown = asyncio.create_task(cls._breakdown_chain(breakdown_msgs, steps, analyses))
+        dsl_rules = []
+        try:
+            for step in steps:
+                analyse_message = await analyses.get()
+                if analyse_message is not None and not nothing_to_add(analyse_message):
+                    dsl_rules.extend(await cls._translate_subtask(dsl_msgs, step, analyse_message))
+        finally:
+            breakdown.cancel()
+        return await cls._optimize_dsl_rule(dsl_rules, description)
+
+    @classmethod
+    async def _breakdown_chain(cls, breakdown_msgs: list, steps: list, analyses: asyncio.Queue):
+        from src.prompt import TASK_BREAKDOWN_PROMPTS
+        for step in steps:
+            breakdown_msgs.append({"role": "user", "content": TASK_BREAKDOWN_PROMPTS[step]})
+            stage = f"_analyse_subtask:{step}:breakdown"
+            try:
+                response = await async_chat_completion(context_compactor.compact(breakdown_msgs, 'breakdown', stage),
+                                                       stage=stage)
+            except Exception as e:
+                logging.error(f"Error: {e}")
+                breakdown_msgs.pop()
+                analyses.put_nowait(None)
+                continue
+            analyse_message = response.choices[0].message.content
+            breakdown_msgs.append({"role": "assistant", "content": analyse_message})
+            analyses.put_nowait(analyse_message)
+
+    @classmethod
+    async def _translate_subtask(cls, dsl_msgs: list, subtask_name: str, analyse_message: str):
+        dsl_msgs.append({"role": "user", "content": subtask_name.replace('_', ' ') + ':\n' + analyse_message})
+        stage = f"_analyse_subtask:{subtask_name}:dsl"
+        try:
+            response = await async_chat_completion(context_compactor.compact(dsl_msgs, 'dsl', stage), stage=stage)
+        except Exception as e:
+            logging.error(f"Error: {e}")
+            dsl_msgs.pop()
+            return []
+        dsl_message = response.choices[0].message.content
+        dsl_rules = RuleGenerator._dsl_lines(dsl_message)
+        RuleGenerator._keep_dsl_turn(dsl_msgs, dsl_message, dsl_rules)
+        return dsl_rules
+
+    @classmethod
+    async def _optimize_dsl_rule(cls, dsl_rules, rule_description) -> str:
+        messages = RuleGenerator._optimize_dsl_messages(dsl_rules, rule_description)
+        try:
+            response = await async_chat_completion(messages, stage="_optimize_dsl_rule")
+        except Exception as e:
+            logging.error(f"Error: {e}")
+            return ''
+        return RuleGenerator._extract_block(response.choices[0].message.content, 'plaintext')
+
+    @classmethod
+    async def generate_rule_from_dsl(cls, description: str, dsl_rule: str, rule_type: str,
+                                     required_fields: list = None) -> str:
+        messages = RuleGenerator._rule_from_dsl_messages(description, dsl_rule, rule_type, required_fields)
+        response = await async_safe_chat_completion(messages, stage="generate_rule_from_dsl")
         return response.choices[0].message.content
 
 
@@ -0,0 +1,288 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from dotenv import load_dotenv
+from functools import lru_cache
+from pathlib import Path
+from src.event_logs import FIELD_ALIASES
+from src.macros import MacroCycleError, macro_index
+from src.spl_parser import (parse_pipe, split_pipes, SPLSyntaxError, WORD, STRING, FIELD, MACRO, OP, LPAREN, RPAREN,
+                            COMMA)
+import argparse
+import fnmatch
+import json
+import logging
+import numpy as np
+import os
+import time
+import yaml
+
+load_dotenv()
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+SIMILARITY_WEIGHTS = {"commands": 0.3, "fields": 0.3, "predicates": 0.4}
+# structural scores in this band are too close to call; those pairs go to the LLM judge
+DEFAULT_JUDGE_BAND = (0.4, 0.75)
+# tstats/datamodel options that look like predicates but say nothing about the detection logic
+_OPTIONS = {'summariesonly', 'allow_old_summaries', 'fillnull_value', 'prestats', 'local', 'append', 'chunk_size',
+            'max_match', 'mode', 'field', 'span', 'limit', 'maxsearches', 'max', 'keepempty', 'consecutive',
+            'timeformat', 'earliest', 'latest', 'index'}
+_FILTER_COMMANDS = {'search', 'where', 'tstats'}
+# tstats filters and aggregates in one command, like a search followed by stats
+_COMMAND_EQUIVALENTS = {'tstats': ('search', 'stats')}
+_MACRO_COMMANDS = {'drop_dm_object_name': 'rename', 'security_content_ctime': 'convert'}
+# Windows event fields -> the CIM names the detections mostly use (CommandLine and process are one field)
+_CANONICAL_FIELDS = {name.lower(): alias.lower() for alias, name in FIELD_ALIASES.items() if alias.islower()}
+_CANONICAL_FIELDS.update({alias.lower(): _CANONICAL_FIELDS[name.lower()] for alias, name in FIELD_ALIASES.items()
+                          if not alias.islower()})
+
+
+@dataclass(frozen=True)
+class RuleStructure:
+    """What two rules are compared on: the pipe commands in order, the fields they touch and their filters."""
+    commands: tuple
+    fields: frozenset
+    predicates: frozenset
+
+
+def canonical_field(name: str) -> str:
+    # Processes.process_name and process_name are the same field once the datamodel prefix is dropped
+    name = name.strip('\'"').split('.')[-1].lower()
+    return _CANONICAL_FIELDS.get(name, name)
+
+
+def _value(token) -> str:
+    return token.value.strip('\'"').replace('\\\\', '\\').lower()
+
+
+def _macro_command(pipe: str):
+    """The command an unexpanded macro pipe stands for; None for the empty *_filter macros."""
+    name = pipe.strip().strip('`').split('(', 1)[0]
+    if name.endswith('_filter'):
+        return None
+    return _MACRO_COMMANDS.get(name, 'macro')
+
+
+def _predicates(tokens: list) -> set:
+    """'field<op>value' for every comparison, one 'field=value' per member of field IN (...)."""
+    predicates = set()
+    for i, token in enumerate(tokens[:-2]):
+        if token.kind not in (WORD, FIELD, STRING) or canonical_field(token.value) in _OPTIONS:
+            continue
+        following = tokens[i + 1]
+        if following.kind == OP and tokens[i + 2].kind in (WORD, STRING, FIELD):
+            operator = following.value.replace('==', '=')
+            predicates.add(f"{canonical_field(token.value)}{operator}{_value(tokens[i + 2])}")
+        elif following.kind == WORD and following.value.lower() == 'in' and tokens[i + 2].kind == LPAREN:
+            for member in tokens[i + 3:]:
+                if member.kind == RPAREN:
+                    break
+                if member.kind != COMMA:
+                    predicates.add(f"{canonical_field(token.value)}={_value(member)}")
+    return predicates
+
+
+@lru_cache(maxsize=65536)
+def rule_structure(search: str) -> RuleStructure:
+    try:
+        expanded = macro_index.expand(search)
+    except MacroCycleError:
+        expanded = search
+    commands, fields, predicates = [], set(), set()
+    for pipe in split_pipes(expanded):
+        parsed = parse_pipe(pipe)
+        if parsed is not None and parsed.command == 'macro':
+            command = _macro_command(pipe)
+            if command:
+                commands.append(command)
+            continue
+        if parsed is None:
+            # unknown commands still count in the sequence
+            word = pipe.split(None, 1)[0].lower() if pipe.strip() else ''
+            command = _macro_command(pipe) if word.startswith('`') else word
+            if command:
+                commands.append(command)
+            continue
+        if parsed.command == 'search' and not parsed.input_fields and pipe.strip() in ('*', 'search *'):
+            # what the empty *_filter macros expand to
+            continue
+        commands.extend(_COMMAND_EQUIVALENTS.get(parsed.command, (parsed.command,)))
+        # '*' and unexpanded $arguments$ are not fields
+        fields.update(canonical_field(name) for name in parsed.input_fields + parsed.output_fields
+                      if '*' not in name and '$' not in name)
+        if parsed.command in _FILTER_COMMANDS:
+            predicates |= _predicates([token for token in parsed.args if token.kind != MACRO])
+    fields -= _OPTIONS
+    return RuleStructure(tuple(commands), frozenset(fields), frozenset(predicates))
+
+
+def _structure(search: str) -> RuleStructure:
+    try:
+        return rule_structure(search or '')
+    except SPLSyntaxError:
+        return RuleStructure((), frozenset(), frozenset())
+
+
+def batched_edit_distance(left: list, right: list) -> np.ndarray:
+    """Levenshtein distance between left[k] and right[k] (sequences of ints) for all pairs at once."""
+    n = len(left)
+    left_lengths = np.array([len(s) for s in left], dtype=np.int64)
+    right_lengths = np.array([len(s) for s in right], dtype=np.int64)
+    width = int(right_lengths.max(initial=0))
+    a = np.full((n, int(left_lengths.max(initial=0))), -1, dtype=np.int64)
+    b = np.full((n, width), -2, dtype=np.int64)
+    for k in range(n):
+        a[k, :left_lengths[k]] = left[k]
+        b[k, :right_lengths[k]] = right[k]
+    rows = np.arange(n)
+    previous = np.tile(np.arange(width + 1, dtype=np.int64), (n, 1))
+    distances = previous[rows, right_lengths].copy()
+    for i in range(1, a.shape[1] + 1):
+        current = np.empty_like(previous)
+        current[:, 0] = i
+        cost = (a[:, i - 1, None] != b).astype(np.int64)
+        for j in range(1, width + 1):
+            current[:, j] = np.minimum(np.minimum(previous[:, j], current[:, j - 1]) + 1,
+                                       previous[:, j - 1] + cost[:, j - 1])
+        done = left_lengths == i
+        distances[done] = current[done, right_lengths[done]]
+        previous = current
+    return distances
+
+
+def _jaccard(left: frozenset, right: frozenset) -> float:
+    if not left and not right:
+        return 1.0
+    return len(left & right) / len(left | right)
+
+
+def _predicate_overlap(generated: frozenset, reference: frozenset) -> tuple:
+    """
+    (Dice overlap of the filters, reference filters without a match), where a wildcard value on either side
+    matches the other one.
+    """
+    if not generated and not reference:
+        return 1.0, set()
+    matched = len(generated & reference)
+    rest = set(reference - generated)
+    for predicate in generated - reference:
+        hit = next((other for other in rest if fnmatch.fnmatchcase(other, predicate) or
+                    fnmatch.fnmatchcase(predicate, other)), None)
+        if hit is not None:
+            rest.discard(hit)
+            matched += 1
+    return 2 * matched / (len(generated) + len(reference)), rest
+
+
+def compare_rules(pairs: list) -> list:
+    """
+    Structural similarity of (generated, reference) rule pairs: command-sequence edit similarity, field-set
+    Jaccard and filter-predicate overlap, combined with SIMILARITY_WEIGHTS into a 0-1 score.
+    """
+    structures = [(_structure(generated), _structure(reference)) for generated, reference in pairs]
+    vocabulary = {}
+    left = [[vocabulary.setdefault(c, len(vocabulary)) for c in g.commands] for g, _ in structures]
+    right = [[vocabulary.setdefault(c, len(vocabulary)) for c in r.commands] for _, r in structures]
+    distances = batched_edit_distance(left, right) if pairs else np.zeros(0)
+    longest = np.maximum([len(s) for s in left] or [0], [len(s) for s in right] or [0])
+    command_similarity = np.where(longest > 0, 1 - distances / np.maximum(longest, 1), 1.0)
+    results = []
+    for k, (generated, reference) in enumerate(structures):
+        overlap, missing = _predicate_overlap(generated.predicates, reference.predicates)
+        scores = {"commands": round(float(command_similarity[k]), 4),
+                  "fields": round(_jaccard(generated.fields, reference.fields), 4),
+                  "predicates": round(overlap, 4)}
+        scores["structural"] = round(sum(SIMILARITY_WEIGHTS[name] * scores[name] for name in SIMILARITY_WEIGHTS), 4)
+        scores["missing_predicates"] = sorted(missing)
+        results.append(scores)
+    return results
+
+
+def judge(generated: str, reference: str) -> dict:
+    """The 'Logical Consistency' LLM judge for one pair: {"score", "explanation"}."""
+    from src.prompt import LLM_EVALUATION_PROMPTS
+    from src.rule import chat_completion
+    messages = [{"role": "system", "content": LLM_EVALUATION_PROMPTS["Logical Consistency"].format()},
+                {"role": "user", "content": f"Input:\n```spl\n{generated}\n```\n```spl\n{reference}\n```"}]
+    response = chat_completion(messages, stage="judge_rule_similarity", response_format={"type": "json_object"})
+    result = json.loads(response.choices[0].message.content)
+    return {"score": float(result["score"]), "explanation": result.get("explanation", '')}
+
+
+def evaluate_pairs(pairs: list, use_judge: bool = True, band: tuple = None, workers: int = 4) -> list:
+    """
+    Scores every pair structurally and sends only the pairs whose structural score falls inside band to the LLM
+    judge. "score" is the judge's score for judged pairs and the structural one otherwise.
+    """
+    band = band or DEFAULT_JUDGE_BAND
+    results = compare_rules(pairs)
+    for result in results:
+        result["score"] = result["structural"]
+    ambiguous = [k for k, result in enumerate(results) if band[0] <= result["structural"] <= band[1]]
+    if not use_judge or not ambiguous:
+        return results
+
+    def run(k):
+        try:
+            return k, judge(*pairs[k])
+        except Exception as e:
+            logging.error(f"Similarity judge failed, keeping the structural score: {e}")
+            return k, None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for k, verdict in executor.map(run, ambiguous):
+            if verdict is not None:
+                results[k].update(score=round(verdict["score"], 4), judge_score=verdict["score"],
+                                  judge_explanation=verdict["explanation"])
+    return results
+
+
+def _judge_band() -> tuple:
+    value = os.getenv("SIMILARITY_JUDGE_BAND")
+    if not value:
+        return DEFAULT_JUDGE_BAND
+    low, high = (float(part) for part in value.split(','))
+    return low, high
+
+
+def load_pairs(runner_output: str) -> list:
+    """(path, generated, reference) from a src.runner JSONL output, the reference being the description's rule."""
+    pairs = []
+    with open(runner_output, 'r', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get('status') != 'ok' or not record.get('rule'):
+                continue
+            with open(os.path.join(PROJECT_ROOT, record['path']), 'r', encoding='utf-8') as description:
+                reference = (yaml.safe_load(description) or {}).get('rule')
+            if reference:
+                pairs.append((record['path'], record['rule'], reference))
+    return pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score generated rules against the reference rules of their "
+                                                 "descriptions, with the LLM judge only for ambiguous pairs.")
+    parser.add_argument('--input', required=True, help="src.runner JSONL output")
+    parser.add_argument('--output', default=None, help="per-pair scores (default <input>.similarity.json)")
+    parser.add_argument('--no-judge', action='store_true', help="structural scores only")
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    pairs = load_pairs(args.input)
+    results = evaluate_pairs([(g, r) for _, g, r in pairs], not args.no_judge, _judge_band(), args.workers)
+    for (path, _, _), result in zip(pairs, results):
+        result["path"] = path
+    scores = [result["score"] for result in results]
+    summary = {"pairs": len(results), "judged": sum("judge_score" in result for result in results),
+               "score_mean": round(float(np.mean(scores)), 4) if scores else None,
+               "structural_mean": round(float(np.mean([r["structural"] for r in results])), 4) if scores else None,
+               "elapsed": round(time.perf_counter() - start, 3)}
+    output = args.output or f"{os.path.splitext(args.input)[0]}.similarity.json"
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({"summary": summary, "pairs": results}, f, ensure_ascii=False, indent=2, sort_keys=True)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
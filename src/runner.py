@@ -0,0 +1,159 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from src.instrumentation import instrumentation, track_usage
+from src.known_rules import known_rules, known_rule_match
+from src.rule import RuleGenerator
+from src.router import router
+from src.agent import SecurityRuleAgent
+from src.utils import description_and_rule_generator
+import argparse
+import json
+import logging
+import os
+import time
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+DESCRIPTIONS_PATH = os.path.join(PROJECT_ROOT, 'dataset/descriptions')
+
+
+def list_categories() -> list:
+    return sorted(d for d in os.listdir(DESCRIPTIONS_PATH)
+                  if not d.startswith('.') and os.path.isdir(os.path.join(DESCRIPTIONS_PATH, d)))
+
+
+def load_checkpoint(output_path: str) -> set:
+    # paths that already finished successfully; failed or truncated entries are retried
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get('status') == 'ok':
+                done.add(record['path'])
+    return done
+
+
+def _ends_mid_line(path: str) -> bool:
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        if not f.tell():
+            return False
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) != b"\n"
+
+
+def generate_one(path: str, data: dict, category: str, mode: str, rule_type: str) -> dict:
+    required_fields = data.get('required_fields') or []
+    required_fields = "\n".join(f"- {field}" for field in required_fields)
+    record = {"path": os.path.relpath(path, PROJECT_ROOT), "category": category, "mode": mode}
+    start = time.perf_counter()
+    with track_usage(rule_id=record["path"]) as usage:
+        try:
+            if mode == 'agent':
+                rule = SecurityRuleAgent().run_agent(data['description'], rule_type=rule_type,
+                                                     required_fields=required_fields)
+            else:
+                rule = RuleGenerator.generate_rule(data['description'], rule_type, required_fields)
+            record.update(status="ok", rule=rule)
+            if known_rule_match.get() is not None:
+                record["provenance"] = known_rule_match.get().as_dict()
+        except Exception as e:
+            logging.error(f"Failed to generate rule for {path}: {e}")
+            record.update(status="error", error=str(e))
+    record["latency"] = round(time.perf_counter() - start, 3)
+    record["usage"] = usage.as_dict()
+    return record
+
+
+def run_batch(categories: list, output_path: str, mode: str = 'generator', rule_type: str = 'splunk',
+              workers: int = 4, limit: int = None) -> list:
+    done = load_checkpoint(output_path)
+    jobs = []
+    for category in categories:
+        for path, data in description_and_rule_generator(category):
+            if os.path.relpath(path, PROJECT_ROOT) not in done:
+                jobs.append((path, data, category))
+    if limit:
+        jobs = jobs[:limit]
+    logging.info(f"{len(done)} rules already checkpointed, {len(jobs)} to generate with {workers} workers")
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    records = []
+    with ThreadPoolExecutor(max_workers=workers) as executor, open(output_path, 'a', encoding='utf-8') as out:
+        if _ends_mid_line(output_path):
+            # the last run died while writing a line; start a new one so the next record is not glued to it
+            out.write("\n")
+        futures = [executor.submit(generate_one, path, data, category, mode, rule_type)
+                   for path, data, category in jobs]
+        for future in as_completed(futures):
+            record = future.result()
+            # one line per finished rule, flushed immediately so a crash loses at most in-flight work
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            records.append(record)
+            logging.info(f"[{len(records)}/{len(jobs)}] {record['status']} {record['path']} "
+                         f"({record['latency']}s, {record['usage']['total_tokens']} tokens)")
+    return records
+
+
+def summarize(records: list) -> dict:
+    latencies = sorted(r['latency'] for r in records)
+    if not latencies:
+        return {"rules": 0}
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+    return {
+        "rules": len(records),
+        "failed": sum(r['status'] != 'ok' for r in records),
+        "latency_mean": round(sum(latencies) / len(latencies), 3),
+        "latency_p50": percentile(0.5),
+        "latency_p95": percentile(0.95),
+        "reused_known": sum('provenance' in r for r in records),
+        "llm_calls": sum(r['usage']['calls'] for r in records),
+        "cached_calls": sum(r['usage']['cached_calls'] for r in records),
+        "llm_errors": sum(r['usage'].get('errors', 0) for r in records),
+        "prompt_tokens": sum(r['usage']['prompt_tokens'] for r in records),
+        "cached_prompt_tokens": sum(r['usage'].get('cached_prompt_tokens', 0) for r in records),
+        "prompt_cache_ratio": round(sum(r['usage'].get('cached_prompt_tokens', 0) for r in records) /
+                                    max(sum(r['usage']['prompt_tokens'] for r in records), 1), 4),
+        "completion_tokens": sum(r['usage']['completion_tokens'] for r in records),
+        "compacted_tokens": sum(r['usage'].get('compacted_tokens', 0) for r in records),
+        "providers": router.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate rules for the detection descriptions in batch.")
+    parser.add_argument('--category', default='all',
+                        help=f"dataset/descriptions category or 'all' ({', '.join(list_categories())})")
+    parser.add_argument('--mode', choices=['generator', 'agent'], default='generator',
+                        help="RuleGenerator.generate_rule or SecurityRuleAgent.run_agent")
+    parser.add_argument('--rule-type', default='splunk')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--limit', type=int, default=None, help="only generate the first N pending rules")
+    parser.add_argument('--output', default=None, help="JSONL checkpoint file, appended to and resumed from")
+    parser.add_argument('--reuse-known', action='store_true',
+                        help="answer descriptions that match an existing detection from the corpus; off by default "
+                             "because the batch descriptions are the corpus itself")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="serve per-stage LLM metrics in Prometheus format on this port while running")
+    args = parser.parse_args()
+
+    known_rules.enabled = args.reuse_known
+    if args.metrics_port:
+        instrumentation.serve_metrics(args.metrics_port)
+
+    categories = list_categories() if args.category == 'all' else [args.category]
+    output = args.output or os.path.join(PROJECT_ROOT, 'output', f'batch_{args.category}_{args.mode}.jsonl')
+    records = run_batch(categories, output, args.mode, args.rule_type, args.workers, args.limit)
+    print(json.dumps(summarize(records), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+from dataclasses import dataclass, field, asdict
+from dotenv import load_dotenv
+from src.prompt_builder import build_messages
+from src.rule_similarity import canonical_field, rule_structure
+from src.spl_engine import local_engine
+from src.spl_parser import SPLSyntaxError
+from src.spl_validator import validate_spl
+import json
+import re
+
+load_dotenv()
+
+DIMENSIONS = ("logical_coherence", "syntax_validation", "execution_feasibility")
+PASS_SCORE = 0.6
+# present in every event, never worth flagging as missing
+_IMPLICIT_FIELDS = {'_time', '_raw', 'host', 'source', 'sourcetype', 'index'}
+
+
+@dataclass
+class ScoreFailure:
+    dimension: str
+    reason: str
+    detail: str = ''
+
+    def __str__(self):
+        return f"{self.dimension}: {self.reason}" + (f" ({self.detail})" if self.detail else "")
+
+
+@dataclass
+class PreScore:
+    """The deterministic part of a rule's reflection scores, with the reasons behind every lowered score."""
+    syntax_validation: float
+    execution_feasibility: float
+    failures: list = field(default_factory=list)
+    dry_run: str = None
+
+    @property
+    def passed(self) -> bool:
+        return self.syntax_validation >= PASS_SCORE and self.execution_feasibility >= PASS_SCORE
+
+    def scores(self) -> dict:
+        return {"syntax_validation": self.syntax_validation, "execution_feasibility": self.execution_feasibility,
+                "failures": [asdict(failure) for failure in self.failures], "dry_run": self.dry_run}
+
+
+def parse_required_fields(required_fields) -> list:
+    """'- a\\n- b' (as the prompts take them), 'a, b' or a list -> ['a', 'b']"""
+    if not required_fields:
+        return []
+    if isinstance(required_fields, str):
+        required_fields = re.split(r'[\n,]', required_fields)
+    names = [str(name).strip().lstrip('-*').strip().strip('`\'"') for name in required_fields]
+    return [name for name in names if name]
+
+
+def _missing_fields(rule: str, required_fields: list) -> list:
+    try:
+        used = set(rule_structure(rule).fields)
+    except SPLSyntaxError:
+        used = set()
+    text = rule.lower()
+    missing = []
+    for name in required_fields:
+        canonical = canonical_field(name)
+        if canonical in _IMPLICIT_FIELDS or '*' in name or canonical in used:
+            continue
+        # fields only used inside eval/where expressions are not always reported by the parser
+        short = name.split('.')[-1].lower()
+        if re.search(rf'(?<![\w.]){re.escape(short)}(?!\w)', text) is None:
+            missing.append(name)
+    return missing
+
+
+def prescore_rule(rule: str, required_fields=None) -> PreScore:
+    """
+    Scores syntax_validation and execution_feasibility without an LLM: the local SPL validator for syntax, a
+    check that the rule touches every required field, and a dry run on the local SPL engine, which catches
+    searches that parse but cannot execute (bad regexes, eval errors). Rules the engine does not support, such as
+    tstats over datamodels, are not penalized for it.
+    """
+    failures = []
+    validation = validate_spl(rule)
+    for error in validation.errors:
+        failures.append(ScoreFailure("syntax_validation", "syntax_error", str(error)))
+    syntax = 1.0 if validation.valid else 0.0
+
+    required = parse_required_fields(required_fields)
+    missing = _missing_fields(rule, required) if rule and rule.strip() else required
+    for name in missing:
+        failures.append(ScoreFailure("execution_feasibility", "missing_required_field", name))
+    feasibility = 1.0 - len(missing) / len(required) if required else 1.0
+
+    dry_run = None
+    if validation.valid:
+        result = local_engine.run(rule)
+        if result.error:
+            failures.append(ScoreFailure("execution_feasibility", "execution_error", result.error))
+            feasibility = 0.0
+            dry_run = f"error: {result.error}"
+        elif result.unsupported:
+            dry_run = f"not run locally: {result.unsupported}"
+        else:
+            dry_run = f"ok: {result.count} results over {result.scanned} local events"
+    return PreScore(syntax, round(feasibility, 4), failures, dry_run)
+
+
+def combine_scores(prescore: PreScore, llm_scores: dict = None, error: str = None) -> dict:
+    """
+    The reflection scores: syntax_validation and execution_feasibility from the pre-score, logical_coherence from
+    the LLM. logical_coherence is left out when the LLM was not asked or its answer was unusable, so the rule is
+    neither accepted nor sent to the logical coherence optimizer for it.
+    """
+    scores = prescore.scores()
+    if error is not None:
+        scores["failures"].append(asdict(ScoreFailure("logical_coherence", "unusable_reflection", error)))
+    elif llm_scores is not None:
+        if "logical_coherence" in llm_scores:
+            scores["logical_coherence"] = llm_scores["logical_coherence"]
+            if scores["logical_coherence"] < PASS_SCORE:
+                scores["failures"].append(asdict(ScoreFailure("logical_coherence", "low_llm_rating",
+                                                              llm_scores.get("comment", ''))))
+        else:
+            scores["failures"].append(asdict(ScoreFailure("logical_coherence", "unusable_reflection",
+                                                          "no logical_coherence rating")))
+    scores["comment"] = (llm_scores or {}).get("comment") or "; ".join(
+        str(ScoreFailure(**failure)) for failure in scores["failures"])
+    return scores
+
+
+def failure_notes(scores: dict, dimension: str) -> str:
+    """The failure reasons of one dimension as bullet lines, for the optimizer's feedback."""
+    return "\n".join(f"- {failure['reason']}: {failure['detail']}" for failure in scores.get("failures") or []
+                     if failure["dimension"] == dimension)
+
+
+def score_messages(rule: str, description: str) -> list:
+    # SCORE_PROMPT is a fixed prefix; the rule and description follow in the user message
+    from src.prompt import SCORE_PROMPT
+    return build_messages(SCORE_PROMPT, [("Here is the rule to evaluate", rule),
+                                         ("Below is the description of the ideal rule", description)])
+
+
+def parse_llm_scores(content: str) -> dict:
+    """The numeric ratings (clamped to 0-1) and comment of a SCORE_PROMPT answer; raises ValueError otherwise."""
+    try:
+        result = json.loads(content)
+    except (TypeError, json.JSONDecodeError) as e:
+        raise ValueError(f"reflection result is not JSON: {e}")
+    if not isinstance(result, dict):
+        raise ValueError("reflection result is not a JSON object")
+    scores = {}
+    for dimension in DIMENSIONS:
+        try:
+            scores[dimension] = min(max(float(result[dimension]), 0.0), 1.0)
+        except (KeyError, TypeError, ValueError):
+            continue
+    if not scores:
+        raise ValueError(f"reflection result has no ratings: {content[:200]}")
+    if result.get("comment"):
+        scores["comment"] = str(result["comment"])
+    return scores
@@ -0,0 +1,1431 @@
+from dataclasses import dataclass, field
+from dotenv import load_dotenv
+from pathlib import Path
+from src.event_logs import event_view
+from src.event_store import EventView
+from src.macros import MacroCycleError, macro_index, parse_macro_call
+from src.spl_parser import (tokenize, split_pipes, SPLSyntaxError, WORD, STRING, FIELD, MACRO, OP, COMMA, LPAREN,
+                            RPAREN, LBRACKET, _index_of_word, _strip_options)
+import argparse
+import hashlib
+import ipaddress
+import json
+import math
+import numpy as np
+import os
+import pandas as pd
+import re
+import threading
+import time
+import urllib.parse
+import warnings
+
+load_dotenv()
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+LOOKUP_PATH = os.getenv("SPL_LOOKUP_PATH") or os.path.join(PROJECT_ROOT, "dataset/lookups")
+DEFAULT_TIME_FORMAT = "%m/%d/%Y %H:%M:%S"
+SORT_LIMIT = 10000
+
+# search terms on these fields do not constrain the local events
+_IGNORED_FIELDS = {'index', 'earliest', 'latest', 'earliest_time', 'latest_time', 'splunk_server'}
+# the ingested logs are rendered WinEventLog, most detections target the XmlWinEventLog rendering of the same channel;
+# events imported from .evtx files carry the file as source, so source and sourcetype terms match either field
+_SOURCE_FIELDS = ('source', 'sourcetype')
+_XML_PREFIX = re.compile(r'^xml', re.IGNORECASE)
+# commands that pass events through (filtered, reordered or with fields added), so results are still whole events
+_EVENT_COMMANDS = {'search', 'where', 'regex', 'eval', 'rex', 'rename', 'sort', 'dedup', 'bin', 'bucket', 'lookup',
+                   'head', 'tail', 'fillnull', 'convert', '`'}
+_GENERATING = {'tstats', 'mstats', 'inputlookup', 'makeresults', 'rest', 'metadata', 'from', 'datamodel',
+               'inputcsv', 'loadjob', 'savedsearch', 'pivot', 'multisearch', 'union', 'dbinspect', 'eventcount'}
+_TIME_UNITS = {'s': 1, 'sec': 1, 'secs': 1, 'second': 1, 'seconds': 1, 'm': 60, 'min': 60, 'mins': 60,
+               'minute': 60, 'minutes': 60, 'h': 3600, 'hr': 3600, 'hrs': 3600, 'hour': 3600, 'hours': 3600,
+               'd': 86400, 'day': 86400, 'days': 86400, 'w': 604800, 'week': 604800, 'weeks': 604800,
+               'mon': 2592000, 'month': 2592000, 'months': 2592000}
+_SPAN = re.compile(r'^(\d+(?:\.\d+)?)([a-z]*)$', re.IGNORECASE)
+_RELATIVE = re.compile(r'^([+-]\d+)?([a-z]+)?(?:@([a-z]+))?$', re.IGNORECASE)
+_NUMBER = re.compile(r'^[+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?$')
+_CIDR = re.compile(r'^\d{1,3}(\.\d{1,3}){3}/\d{1,2}$')
+_EXPR_TOKEN = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<string>"(?:[^"\\]|\\.)*")
+  | (?P<field>'(?:[^'\\]|\\.)*')
+  | (?P<number>(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?)
+  | (?P<name>[A-Za-z_@$][\w@$]*(?:[.:][A-Za-z_][\w]*)*)
+  | (?P<op>==|!=|<=|>=|[-+*/%.,()<>=!])
+''', re.VERBOSE)
+# stats functions computed by the pandas group-by kernels
+_NATIVE_AGGREGATIONS = {'count': 'count', 'c': 'count', 'dc': 'nunique', 'distinct_count': 'nunique',
+                        'estdc': 'nunique', 'sum': 'sum', 'avg': 'mean', 'mean': 'mean', 'median': 'median',
+                        'min': 'min', 'max': 'max', 'stdev': 'std', 'var': 'var'}
+# binding power of the infix operators in eval/where expressions
+_INFIX = {'or': 1, 'xor': 2, 'and': 3, '=': 5, '==': 5, '!=': 5, '<': 5, '>': 5, '<=': 5, '>=': 5, 'like': 5,
+          'in': 5, '+': 6, '-': 6, '.': 6, '*': 7, '/': 7, '%': 7}
+
+
+class UnsupportedSPL(ValueError):
+    """A command or function outside the subset the local engine evaluates."""
+
+
+class SPLExecutionError(ValueError):
+    pass
+
+
+@dataclass
+class ExecutionResult:
+    search: str
+    results: pd.DataFrame = None
+    scanned: int = 0
+    elapsed: float = 0.0
+    warnings: list = field(default_factory=list)
+    error: str = None
+    unsupported: str = None
+
+    @property
+    def feasible(self) -> bool:
+        return self.error is None and self.unsupported is None
+
+    @property
+    def count(self) -> int:
+        return 0 if self.results is None else len(self.results)
+
+    def records(self, max_results: int = 100) -> list:
+        if self.results is None:
+            return []
+        frame = self.results.head(max_results)
+        # raw events are what the search matched, not what it returns; keep the extracted fields only
+        frame = frame.drop(columns=[c for c in ('_raw', 'Message') if c in frame and len(frame.columns) > 2])
+        return [{key: _json_value(value) for key, value in row.items() if not _is_null(value)}
+                for row in frame.to_dict('records')]
+
+    def as_dict(self, max_results: int = 100) -> dict:
+        return {"backend": "local", "feasible": self.feasible, "events_scanned": self.scanned,
+                "result_count": self.count, "elapsed": self.elapsed, "error": self.error,
+                "unsupported": self.unsupported, "warnings": self.warnings, "results": self.records(max_results)}
+
+
+def _is_null(value) -> bool:
+    return not isinstance(value, (list, tuple, np.ndarray)) and pd.isna(value)
+
+
+def _json_value(value):
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_json_value(v) for v in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _text_value(value):
+    if isinstance(value, (list, tuple)):
+        return " ".join(_text_value(v) for v in value)
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return str(int(value))
+    if isinstance(value, (bool, np.bool_)):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+def _text(series: pd.Series) -> pd.Series:
+    # stay object dtype even when every value is null, so the .str accessor keeps working
+    return series.astype(object).map(_text_value, na_action='ignore').astype(object)
+
+
+def _numbers(series: pd.Series) -> pd.Series:
+    if pd.api.types.is_bool_dtype(series):
+        return series.astype(float)
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype(float)
+    try:
+        return pd.to_numeric(series, errors='coerce').astype(float)
+    except (TypeError, ValueError):
+        # multivalue cells: compare on the first value, as Splunk does for most functions
+        first = series.map(lambda v: v[0] if isinstance(v, (list, tuple)) and v else v, na_action='ignore')
+        return pd.to_numeric(first, errors='coerce').astype(float)
+
+
+def _truthy(series: pd.Series) -> pd.Series:
+    if pd.api.types.is_bool_dtype(series):
+        return series.fillna(False).astype(bool)
+    numbers = _numbers(series)
+    return (numbers.fillna(0) != 0) | (numbers.isna() & series.notna() & (_text(series) != ''))
+
+
+def _contains(text: pd.Series, pattern: str, case: bool = True) -> pd.Series:
+    with warnings.catch_warnings():
+        # capture groups in detection regexes are fine, only the match matters here
+        warnings.simplefilter('ignore', UserWarning)
+        return text.str.contains(pattern, case=case, regex=True, na=False).astype(bool)
+
+
+def _unescape(value: str) -> str:
+    return re.sub(r'\\([\\"])', r'\1', value)
+
+
+def _wildcard(pattern: str, anchored: bool = True) -> str:
+    body = '.*'.join(re.escape(part) for part in pattern.split('*'))
+    return f'^{body}$' if anchored else body
+
+
+def python_regex(pattern: str) -> str:
+    # PCRE named groups (?<name>...) -> Python (?P<name>...)
+    return re.sub(r'\(\?<([A-Za-z_]\w*)>', r'(?P<\1>', pattern)
+
+
+def _span_seconds(span: str) -> float:
+    match = _SPAN.match(span.strip())
+    if not match:
+        raise SPLExecutionError(f"invalid span {span!r}")
+    number, unit = float(match.group(1)), match.group(2).lower()
+    if not unit:
+        return number
+    if unit not in _TIME_UNITS:
+        raise SPLExecutionError(f"invalid span {span!r}")
+    return number * _TIME_UNITS[unit]
+
+
+def _relative_time(epoch: float, spec: str) -> float:
+    match = _RELATIVE.match(spec.strip())
+    if not match or not (match.group(1) or match.group(3)):
+        raise UnsupportedSPL(f"relative_time specifier {spec!r}")
+    offset, unit, snap = match.groups()
+    if offset:
+        epoch += int(offset) * _TIME_UNITS.get((unit or 's').lower(), 1)
+    if snap:
+        size = _TIME_UNITS.get(snap.lower())
+        if size is None:
+            raise UnsupportedSPL(f"relative_time snap @{snap}")
+        epoch = math.floor(epoch / size) * size
+    return epoch
+
+
+def _in_cidr(value, network) -> bool:
+    try:
+        return ipaddress.ip_address(str(value).strip()) in network
+    except ValueError:
+        return False
+
+
+def _expressiontokenize(text: str) -> list:
+    tokens, pos = [], 0
+    while pos < len(text):
+        match = _EXPR_TOKEN.match(text, pos)
+        if not match:
+            raise SPLExecutionError(f"unexpected character {text[pos]!r} in expression at position {pos}")
+        pos = match.end()
+        kind = match.lastgroup
+        if kind == 'space':
+            continue
+        value = match.group(kind)
+        if kind in ('string', 'field'):
+            value = re.sub(r'\\(.)', r'\1', value[1:-1]) if kind == 'field' else _unescape(value[1:-1])
+        tokens.append((kind, value))
+    return tokens
+
+
+class _ExpressionParser:
+    """Pratt parser for eval/where expressions; produces nested tuples evaluated by SPLEngine._evaluate."""
+
+    def __init__(self, text: str):
+        self.tokens = _expressiontokenize(text)
+        self.pos = 0
+
+    def parse(self):
+        node = self.expression(0)
+        if self.pos < len(self.tokens):
+            raise SPLExecutionError(f"unexpected {self.tokens[self.pos][1]!r} in expression")
+        return node
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def advance(self):
+        token = self.peek()
+        if token[0] is None:
+            raise SPLExecutionError("expression ends unexpectedly")
+        self.pos += 1
+        return token
+
+    def expect(self, value: str):
+        kind, found = self.advance()
+        if found != value:
+            raise SPLExecutionError(f"expected {value!r} in expression, found {found!r}")
+
+    def _operator(self):
+        kind, value = self.peek()
+        if kind == 'op' and value in _INFIX:
+            return value
+        if kind == 'name' and value.lower() in _INFIX:
+            return value.lower()
+        return None
+
+    def expression(self, power: int):
+        node = self.prefix()
+        while True:
+            op = self._operator()
+            if op is None or _INFIX[op] <= power:
+                return node
+            self.advance()
+            if op == 'in':
+                node = ('in', node, self.arguments())
+            else:
+                node = ('binary', op, node, self.expression(_INFIX[op]))
+
+    def arguments(self) -> list:
+        self.expect('(')
+        args = []
+        if self.peek()[1] == ')':
+            self.advance()
+            return args
+        while True:
+            args.append(self.expression(0))
+            kind, value = self.advance()
+            if value == ')':
+                return args
+            if value != ',':
+                raise SPLExecutionError(f"expected ',' or ')' in arguments, found {value!r}")
+
+    def prefix(self):
+        kind, value = self.advance()
+        if kind == 'number':
+            return ('literal', float(value))
+        if kind == 'string':
+            return ('literal', value)
+        if kind == 'field':
+            return ('field', value)
+        if kind == 'op' and value == '(':
+            node = self.expression(0)
+            self.expect(')')
+            return node
+        if kind == 'op' and value in ('-', '+'):
+            operand = self.expression(7)
+            return ('binary', '*', ('literal', -1.0), operand) if value == '-' else operand
+        if kind == 'op' and value == '!':
+            return ('not', self.expression(4))
+        if kind == 'name':
+            if value.lower() == 'not':
+                return ('not', self.expression(4))
+            if self.peek()[1] == '(':
+                return ('call', value.lower(), self.arguments())
+            if value.lower() in ('true', 'false'):
+                return ('literal', value.lower() == 'true')
+            return ('field', value)
+        raise SPLExecutionError(f"unexpected {value!r} in expression")
+
+
+def parse_expression(text: str):
+    return _ExpressionParser(text).parse()
+
+
+def _names(tokens: list) -> list:
+    return [token.value for token in tokens if token.kind in (WORD, FIELD, STRING) and token.value.lower() != 'as']
+
+
+# factories for the simple eval functions; each returns a function of (engine, frame, argument nodes)
+
+def _numeric_function(name, function):
+    def apply(self, frame, nodes):
+        values = [_numbers(value) for value in self._args(frame, nodes, 1, 2, name)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = function(*values)
+        return pd.Series(result, index=frame.index).replace([np.inf, -np.inf], np.nan)
+    return apply
+
+
+def _text_function(name, function):
+    def apply(self, frame, nodes):
+        values = self._args(frame, nodes, 1, None, name)
+        extra = [self._scalar(node, frame) for node in nodes[1:]]
+        return function(_text(values[0]), *extra)
+    return apply
+
+
+def _min_max_function(name):
+    def apply(self, frame, nodes):
+        values = pd.concat([_numbers(value) for value in self._args(frame, nodes, 1, name=name)], axis=1)
+        return values.min(axis=1) if name == 'min' else values.max(axis=1)
+    return apply
+
+
+def _hash_function(algorithm):
+    def apply(self, frame, nodes):
+        values = _text(self._args(frame, nodes, 1, 1, algorithm)[0])
+        return values.map(lambda v: hashlib.new(algorithm, v.encode('utf-8')).hexdigest(), na_action='ignore')
+    return apply
+
+
+class SPLEngine:
+    """
+    Runs a practical subset of SPL over locally ingested events, so rules can be checked for execution
+    feasibility (does it run, does it return anything) without a Splunk instance.
+
+    Events come from src.event_logs (the redteam ground-truth logs by default) as a view over the columnar event
+    store. The leading search terms are tested on the stored codes and offsets, then only the matching events and the
+    fields the rest of the search reads are decoded into a pandas DataFrame, on which every command is evaluated
+    column-wise. Supported commands: search, where, eval, rex,
+    regex, stats, rename, table, fields, sort, dedup, bin/bucket, lookup (CSV files under SPL_LOOKUP_PATH), head,
+    tail, fillnull and convert. Macros are expanded from dataset/macros first. Anything else (tstats, join,
+    subsearches, ...) is reported as unsupported rather than guessed at.
+    """
+
+    def __init__(self, paths=None):
+        self.paths = paths
+        self._lookups = {}
+        self._lock = threading.Lock()
+
+    def events(self, techniques=None) -> EventView:
+        view = event_view(self.paths)
+        if techniques:
+            wanted = {t.upper() for t in techniques}
+            view = view.select(view.mask('technique', lambda frame: frame['technique'].isin(wanted)
+                                         | frame['technique'].str.split('.').str[0].isin(wanted)))
+        return view
+
+    def run(self, search: str, techniques=None, events=None) -> ExecutionResult:
+        """Runs the search over events (an EventView or a DataFrame, the local events by default)."""
+        started = time.perf_counter()
+        result = ExecutionResult(search=search)
+        try:
+            events = self.events(techniques) if events is None else events
+            result.scanned = len(events)
+            pipeline = self._pipeline(search)
+            if isinstance(events, EventView):
+                events, pipeline = self._scan(events, pipeline, result.warnings)
+                columns = self._columns(events, pipeline)
+                frame = events.frame(columns)
+            else:
+                frame = events
+            for command, args in pipeline:
+                handler = self._COMMANDS.get(command)
+                if handler is None:
+                    raise UnsupportedSPL(f"command '{command}'")
+                frame = handler(self, frame, args, result.warnings)
+            if isinstance(events, EventView):
+                frame = self._complete(events, frame, columns, pipeline)
+            result.results = frame.reset_index(drop=True)
+        except UnsupportedSPL as e:
+            result.unsupported = str(e)
+        except (SPLSyntaxError, SPLExecutionError, MacroCycleError, re.error) as e:
+            result.error = str(e)
+        result.elapsed = round(time.perf_counter() - started, 4)
+        return result
+
+    def _pipeline(self, search: str) -> list:
+        expanded = re.sub(r'```.*?```', ' ', macro_index.expand(search), flags=re.DOTALL)
+        if not expanded.strip():
+            # an empty search would match every event
+            raise SPLExecutionError("empty search" + (" (only comments or a code fence)" if search.strip() else ""))
+        generating = expanded.lstrip().startswith('|')
+        pipeline = []
+        for i, pipe in enumerate(split_pipes(expanded, strict=True)):
+            command, args = re.match(r'(\S+)\s*(.*)$', pipe, re.DOTALL).groups()
+            command = command.lower()
+            if i == 0 and not generating:
+                # a search without a leading '|' starts with implicit search terms
+                pipeline.append(('search', args if command == 'search' else pipe))
+                continue
+            if i == 0 and command in _GENERATING:
+                raise UnsupportedSPL(f"generating command '{command}'")
+            if pipe.startswith('`'):
+                pipeline.append(('`', pipe))
+                continue
+            pipeline.append((command, args))
+        return pipeline
+
+    def _scan(self, view: EventView, pipeline: list, warnings: list) -> tuple:
+        """(the events the leading search terms match, newest first, the rest of the pipeline)."""
+        if pipeline and pipeline[0][0] == 'search':
+            tokens = tokenize(pipeline[0][1])
+            if tokens:
+                view = view.select(_StoredSearchTerms(self, view, tokens, warnings).parse())
+            pipeline = pipeline[1:]
+        return view.newest_first(), pipeline
+
+    @staticmethod
+    def _columns(view: EventView, pipeline: list) -> list:
+        """The columns the rest of the pipeline may read: the fields it names or matches with a wildcard."""
+        commands = {command for command, _ in pipeline}
+        if 'fillnull' in commands:
+            return view.columns
+        text = ' '.join(args for _, args in pipeline)
+        # _raw is read by bare search terms and by rex and regex without a field; fields keeps it
+        names = {'_time'} | ({'_raw'} if commands & {'search', 'regex', 'rex', 'fields'} else set())
+        names |= set(re.findall(r'\w+', text)) | set(re.findall(r'[\w.]*\w', text))
+        wildcards = [re.compile(_wildcard(word)) for word in set(re.findall(r'[^\s,()=|"\']*\*[^\s,()=|"\']*', text))]
+        return [name for name in view.columns if name in names or any(p.match(name) for p in wildcards)]
+
+    @staticmethod
+    def _complete(view: EventView, frame: pd.DataFrame, columns: list, pipeline: list) -> pd.DataFrame:
+        """Results that are still whole events get the fields that were not decoded for the pipeline."""
+        missing = [name for name in view.columns if name not in columns and name not in frame]
+        if not missing or not len(frame) or any(command not in _EVENT_COMMANDS for command, _ in pipeline):
+            return frame
+        # the frame's index is the events' position in the view
+        rest = view.take(frame.index.to_numpy()).frame(missing).set_index(frame.index)
+        frame = pd.concat([frame, rest], axis=1)
+        return frame[[name for name in view.columns if name in frame] + [c for c in frame if c not in view.columns]]
+
+    # search
+
+    def _search(self, frame, args, warnings):
+        tokens = tokenize(args)
+        if not tokens:
+            return frame
+        parser = _SearchTerms(self, frame, tokens, warnings)
+        return frame[parser.parse()]
+
+    def _term(self, frame, name: str, op: str, value: str) -> pd.Series:
+        if name.lower() in _IGNORED_FIELDS:
+            return pd.Series(True, index=frame.index)
+        if name in _SOURCE_FIELDS and op in ('=', '==', '!='):
+            value = _XML_PREFIX.sub('', _unescape(value))
+            mask = pd.Series(False, index=frame.index)
+            for column in (frame[f] for f in _SOURCE_FIELDS if f in frame):
+                mask |= self._equals(column, _text(column).str.replace(_XML_PREFIX, '', regex=True), value)
+            return ~mask if op == '!=' else mask
+        if name not in frame:
+            return pd.Series(False, index=frame.index)
+        column = frame[name]
+        value = _unescape(value)
+        text = _text(column)
+        if op in ('=', '=='):
+            return self._equals(column, text, value)
+        if op == '!=':
+            return column.notna() & ~self._equals(column, text, value)
+        return self._compare(column, text, op, value)
+
+    @staticmethod
+    def _equals(column, text, value: str) -> pd.Series:
+        if value == '*':
+            return column.notna()
+        mask = text.str.fullmatch(_wildcard(value), case=False, na=False).astype(bool)
+        if _NUMBER.match(value):
+            mask |= (_numbers(column) == float(value)).fillna(False)
+        elif _CIDR.match(value):
+            network = ipaddress.ip_network(value, strict=False)
+            mask |= text.map(lambda v: _in_cidr(v, network), na_action='ignore').fillna(False).astype(bool)
+        return mask
+
+    @staticmethod
+    def _compare(column, text, op: str, value) -> pd.Series:
+        compare = {'<': np.less, '>': np.greater, '<=': np.less_equal, '>=': np.greater_equal}[op]
+        if isinstance(value, (int, float)) or _NUMBER.match(str(value)):
+            numbers = _numbers(column)
+            return pd.Series(compare(numbers, float(value)), index=column.index) & numbers.notna()
+        return pd.Series(compare(text.fillna('').astype(str), str(value)), index=column.index) & column.notna()
+
+    def _raw_term(self, frame, value: str) -> pd.Series:
+        if '_raw' not in frame:
+            return pd.Series(False, index=frame.index)
+        pattern = _wildcard(_unescape(value), anchored=False)
+        return _contains(frame['_raw'], pattern, case=False)
+
+    def _stored_term(self, view: EventView, name: str, op: str, value: str) -> np.ndarray:
+        """_term over an EventView, one stored column at a time."""
+        if name.lower() in _IGNORED_FIELDS:
+            return np.ones(len(view), dtype=bool)
+        if name in _SOURCE_FIELDS and op in ('=', '==', '!='):
+            mask = np.zeros(len(view), dtype=bool)
+            for column in (f for f in _SOURCE_FIELDS if f in view.columns):
+                mask |= view.mask(column, lambda frame: self._term(frame, name, '=', value))
+            return ~mask if op == '!=' else mask
+        if name not in view.columns:
+            return np.zeros(len(view), dtype=bool)
+        return view.mask(name, lambda frame: self._term(frame, name, op, value))
+
+    def _stored_raw_term(self, view: EventView, value: str) -> np.ndarray:
+        if '_raw' not in view.columns:
+            return np.zeros(len(view), dtype=bool)
+        return view.mask('_raw', lambda frame: self._raw_term(frame, value))
+
+    def _where(self, frame, args, warnings):
+        return frame[_truthy(self._evaluate(parse_expression(args), frame)).to_numpy()]
+
+    def _regex(self, frame, args, warnings):
+        tokens = tokenize(args)
+        if len(tokens) >= 3 and tokens[1].kind == OP:
+            name, op, pattern = tokens[0].value, tokens[1].value, tokens[2].value
+        elif tokens and tokens[0].kind == STRING:
+            name, op, pattern = '_raw', '=', tokens[0].value
+        else:
+            raise SPLExecutionError("regex expects field=\"<regex>\" or field!=\"<regex>\"")
+        column = frame[name] if name in frame else pd.Series(np.nan, index=frame.index, dtype=object)
+        matched = _contains(_text(column), python_regex(_unescape(pattern)))
+        return frame[~matched if op == '!=' else matched]
+
+    # eval
+
+    def _eval(self, frame, args, warnings):
+        frame = frame.copy()
+        for assignment in self._assignments(args):
+            name, expression = assignment
+            frame[name] = self._evaluate(parse_expression(expression), frame)
+        return frame
+
+    @staticmethod
+    def _assignments(args: str) -> list:
+        """'a = x, b = if(y, 1, 0)' -> [('a', 'x'), ('b', 'if(y, 1, 0)')], splitting on top-level commas."""
+        parts, depth, quote, escaped, start = [], 0, None, False, 0
+        for i, c in enumerate(args):
+            if quote:
+                # "a\\" ends the string: only an odd number of backslashes escapes the quote
+                if escaped:
+                    escaped = False
+                elif c == '\\':
+                    escaped = True
+                elif c == quote:
+                    quote = None
+            elif c in '"\'':
+                quote = c
+            elif c == '(':
+                depth += 1
+            elif c == ')':
+                depth -= 1
+            elif c == ',' and depth == 0:
+                parts.append(args[start:i])
+                start = i + 1
+        parts.append(args[start:])
+        assignments = []
+        for part in filter(str.strip, parts):
+            match = re.match(r"\s*('[^']+'|[^\s=]+)\s*=(?!=)(.*)$", part, re.DOTALL)
+            if not match:
+                raise SPLExecutionError(f"eval expects field=expression, got {part.strip()!r}")
+            assignments.append((match.group(1).strip("'"), match.group(2).strip()))
+        return assignments
+
+    def _evaluate(self, node, frame) -> pd.Series:
+        kind = node[0]
+        index = frame.index
+        if kind == 'literal':
+            return pd.Series([node[1]] * len(index), index=index, dtype=object if isinstance(node[1], str) else None)
+        if kind == 'field':
+            if node[1] in frame:
+                return frame[node[1]]
+            return pd.Series(np.nan, index=index, dtype=object)
+        if kind == 'not':
+            return ~_truthy(self._evaluate(node[1], frame))
+        if kind == 'in':
+            values = _text(self._evaluate(node[1], frame))
+            options = {_text_value(self._scalar(arg, frame)) for arg in node[2]}
+            return values.isin(options) & values.notna()
+        if kind == 'call':
+            function = self._FUNCTIONS.get(node[1])
+            if function is None:
+                raise UnsupportedSPL(f"eval function {node[1]}()")
+            return function(self, frame, node[2])
+        return self._binary(node[1], self._evaluate(node[2], frame), self._evaluate(node[3], frame))
+
+    def _scalar(self, node, frame, default=None):
+        """The value of an argument that has to be the same for every event (a pattern, a format, a base)."""
+        if node[0] == 'literal':
+            return node[1]
+        values = self._evaluate(node, frame).dropna()
+        if not len(values):
+            return default
+        if _text(values).nunique() > 1:
+            raise UnsupportedSPL("a per-event value where a constant argument is expected")
+        return values.iloc[0]
+
+    def _integer(self, node, frame, default=None):
+        value = self._scalar(node, frame)
+        number = _numbers(pd.Series([value])).iloc[0]
+        return default if pd.isna(number) else int(number)
+
+    def _integers(self, node, frame) -> pd.Series:
+        # per-event integer arguments, e.g. mvindex(values, len - 1)
+        return _numbers(self._evaluate(node, frame)).round()
+
+    @staticmethod
+    def _binary(op: str, left: pd.Series, right: pd.Series) -> pd.Series:
+        if op in ('and', 'or', 'xor'):
+            left, right = _truthy(left), _truthy(right)
+            return left & right if op == 'and' else left | right if op == 'or' else left ^ right
+        both = left.notna() & right.notna()
+        if op == '.':
+            return (_text(left) + _text(right)).where(both)
+        if op == 'like':
+            pattern = _text(right).map(lambda p: '^' + re.escape(p).replace('%', '.*').replace('_', '.') + '$',
+                                       na_action='ignore')
+            texts = _text(left)
+            return pd.Series([bool(re.match(p, t, re.DOTALL)) if isinstance(p, str) and isinstance(t, str) else False
+                              for t, p in zip(texts, pattern)], index=left.index)
+        x, y = _numbers(left), _numbers(right)
+        numeric = x.notna() & y.notna()
+        if op in ('=', '==', '!=', '<', '>', '<=', '>='):
+            compare = {'=': np.equal, '==': np.equal, '!=': np.not_equal, '<': np.less, '>': np.greater,
+                       '<=': np.less_equal, '>=': np.greater_equal}[op]
+            as_numbers = compare(x, y)
+            as_text = compare(_text(left).fillna(''), _text(right).fillna(''))
+            return pd.Series(np.where(numeric, as_numbers, as_text), index=left.index).astype(bool) & both
+        if op == '+':
+            added = (x + y).astype(object)
+            # '+' on strings concatenates
+            strings = both & ~numeric
+            added[strings] = _text(left)[strings] + _text(right)[strings]
+            return added.where(both)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            value = {'-': np.subtract, '*': np.multiply, '/': np.divide, '%': np.mod}[op](x, y)
+        return value.replace([np.inf, -np.inf], np.nan).where(numeric)
+
+    # functions take (engine, frame, argument nodes)
+
+    def _args(self, frame, nodes, minimum: int, maximum: int = None, name: str = '') -> list:
+        if len(nodes) < minimum or (maximum is not None and len(nodes) > maximum):
+            raise SPLExecutionError(f"wrong number of arguments to {name}()")
+        return [self._evaluate(node, frame) for node in nodes]
+
+    def _fn_if(self, frame, nodes):
+        condition, yes, no = self._args(frame, nodes, 3, 3, 'if')
+        return yes.astype(object).where(_truthy(condition), no.astype(object))
+
+    def _fn_case(self, frame, nodes):
+        values = pd.Series(np.nan, index=frame.index, dtype=object)
+        pairs = list(zip(nodes[0::2], nodes[1::2]))
+        for condition, value in reversed(pairs):
+            values = self._evaluate(value, frame).astype(object).where(_truthy(self._evaluate(condition, frame)),
+                                                                       values)
+        return values
+
+    def _fn_coalesce(self, frame, nodes):
+        values = self._args(frame, nodes, 1, name='coalesce')
+        result = values[0].astype(object)
+        for value in values[1:]:
+            result = result.where(result.notna(), value.astype(object))
+        return result
+
+    def _fn_validate(self, frame, nodes):
+        # validate(condition, message, ...): the message of the first condition that is false
+        values = pd.Series(np.nan, index=frame.index, dtype=object)
+        pairs = list(zip(nodes[0::2], nodes[1::2]))
+        for condition, message in reversed(pairs):
+            values = self._evaluate(message, frame).astype(object).where(~_truthy(self._evaluate(condition, frame)),
+                                                                         values)
+        return values
+
+    def _fn_substr(self, frame, nodes):
+        values = _text(self._args(frame, nodes, 2, 3, 'substr')[0])
+        starts = self._integers(nodes[1], frame)
+        lengths = self._integers(nodes[2], frame) if len(nodes) > 2 else pd.Series(np.nan, index=frame.index)
+
+        def cut(value, start, length):
+            if not isinstance(value, str) or pd.isna(start):
+                return np.nan
+            begin = int(start) - 1 if start > 0 else int(start)
+            end = None if pd.isna(length) else begin + int(length)
+            return value[begin:None if end is not None and begin < 0 <= end else end]
+        return pd.Series([cut(*row) for row in zip(values, starts, lengths)], index=frame.index, dtype=object)
+
+    def _fn_replace(self, frame, nodes):
+        values = _text(self._args(frame, nodes, 3, 3, 'replace')[0])
+        pattern, replacement = str(self._scalar(nodes[1], frame)), str(self._scalar(nodes[2], frame))
+        return values.str.replace(python_regex(pattern), replacement, regex=True)
+
+    def _fn_match(self, frame, nodes):
+        values = _text(self._args(frame, nodes, 2, 2, 'match')[0])
+        return _contains(values, python_regex(str(self._scalar(nodes[1], frame))))
+
+    def _fn_like(self, frame, nodes):
+        left, right = self._args(frame, nodes, 2, 2, 'like')
+        return self._binary('like', left, right)
+
+    def _fn_tonumber(self, frame, nodes):
+        values = self._args(frame, nodes, 1, 2, 'tonumber')[0]
+        if len(nodes) == 1:
+            return _numbers(values)
+        base = self._integer(nodes[1], frame, 10)
+
+        def convert(value):
+            try:
+                return float(int(str(value).strip(), base))
+            except ValueError:
+                return np.nan
+        return _text(values).map(convert, na_action='ignore').astype(float)
+
+    def _fn_tostring(self, frame, nodes):
+        values = self._args(frame, nodes, 1, 2, 'tostring')[0]
+        form = str(self._scalar(nodes[1], frame)).lower() if len(nodes) > 1 else None
+        if form == 'hex':
+            return _numbers(values).map(lambda v: hex(int(v)), na_action='ignore')
+        if form == 'commas':
+            return _numbers(values).map(lambda v: f"{v:,.2f}".rstrip('0').rstrip('.'), na_action='ignore')
+        if form == 'duration':
+            return _numbers(values).map(lambda v: time.strftime('%H:%M:%S', time.gmtime(v)), na_action='ignore')
+        return _text(values)
+
+    def _fn_round(self, frame, nodes):
+        values = _numbers(self._args(frame, nodes, 1, 2, 'round')[0])
+        return values.round(self._integer(nodes[1], frame, 0) if len(nodes) > 1 else 0)
+
+    def _fn_now(self, frame, nodes):
+        return pd.Series(float(time.time()), index=frame.index)
+
+    def _fn_strftime(self, frame, nodes):
+        values = _numbers(self._args(frame, nodes, 2, 2, 'strftime')[0])
+        form = str(self._scalar(nodes[1], frame))
+        return pd.to_datetime(values, unit='s', errors='coerce').dt.strftime(form).astype(object).where(values.notna())
+
+    def _fn_strptime(self, frame, nodes):
+        values = _text(self._args(frame, nodes, 2, 2, 'strptime')[0])
+        parsed = pd.to_datetime(values, format=str(self._scalar(nodes[1], frame)), errors='coerce')
+        return pd.Series((parsed - pd.Timestamp(0)) / pd.Timedelta(seconds=1), index=frame.index)
+
+    def _fn_relative_time(self, frame, nodes):
+        values = _numbers(self._args(frame, nodes, 2, 2, 'relative_time')[0])
+        spec = str(self._scalar(nodes[1], frame))
+        return values.map(lambda v: _relative_time(v, spec), na_action='ignore')
+
+    def _fn_split(self, frame, nodes):
+        values = _text(self._args(frame, nodes, 2, 2, 'split')[0])
+        return values.str.split(str(self._scalar(nodes[1], frame)), regex=False)
+
+    def _fn_mvcount(self, frame, nodes):
+        values = self._args(frame, nodes, 1, 1, 'mvcount')[0]
+        return values.map(lambda v: float(len(v)) if isinstance(v, (list, tuple)) else 1.0, na_action='ignore')
+
+    def _fn_mvindex(self, frame, nodes):
+        values = self._args(frame, nodes, 2, 3, 'mvindex')[0]
+        starts = self._integers(nodes[1], frame)
+        ends = self._integers(nodes[2], frame) if len(nodes) > 2 else pd.Series(np.nan, index=frame.index)
+
+        def pick(value, start, end):
+            if _is_null(value) or pd.isna(start):
+                return np.nan
+            items, start = list(value) if isinstance(value, (list, tuple)) else [value], int(start)
+            if pd.isna(end):
+                return items[start] if -len(items) <= start < len(items) else np.nan
+            picked = items[start:(int(end) + 1) or None]
+            return picked[0] if len(picked) == 1 else picked or np.nan
+        return pd.Series([pick(*row) for row in zip(values, starts, ends)], index=frame.index, dtype=object)
+
+    def _fn_mvjoin(self, frame, nodes):
+        values = self._args(frame, nodes, 2, 2, 'mvjoin')[0]
+        delimiter = str(self._scalar(nodes[1], frame))
+        return values.map(lambda v: delimiter.join(map(_text_value, v)) if isinstance(v, (list, tuple))
+                          else _text_value(v), na_action='ignore')
+
+    def _fn_mvappend(self, frame, nodes):
+        columns = self._args(frame, nodes, 1, name='mvappend')
+        rows = []
+        for values in zip(*columns):
+            row = []
+            for value in values:
+                if isinstance(value, (list, tuple)):
+                    row.extend(value)
+                elif not _is_null(value):
+                    row.append(value)
+            rows.append(row or np.nan)
+        return pd.Series(rows, index=frame.index, dtype=object)
+
+    def _fn_cidrmatch(self, frame, nodes):
+        network = ipaddress.ip_network(str(self._scalar(nodes[0], frame)), strict=False)
+        values = _text(self._args(frame, nodes, 2, 2, 'cidrmatch')[1])
+        return values.map(lambda v: _in_cidr(v, network), na_action='ignore').fillna(False).astype(bool)
+
+    def _fn_in(self, frame, nodes):
+        values = _text(self._args(frame, nodes, 2, name='in')[0])
+        return values.isin({_text_value(self._scalar(node, frame)) for node in nodes[1:]}) & values.notna()
+
+    def _fn_isnum(self, frame, nodes):
+        return _numbers(self._args(frame, nodes, 1, 1, 'isnum')[0]).notna()
+
+    def _fn_isstr(self, frame, nodes):
+        values = self._args(frame, nodes, 1, 1, 'isstr')[0]
+        return values.notna() & _numbers(values).isna()
+
+    _FUNCTIONS = {
+        'if': _fn_if, 'case': _fn_case, 'coalesce': _fn_coalesce, 'validate': _fn_validate,
+        'isnull': lambda self, frame, nodes: self._args(frame, nodes, 1, 1, 'isnull')[0].isna(),
+        'isnotnull': lambda self, frame, nodes: self._args(frame, nodes, 1, 1, 'isnotnull')[0].notna(),
+        'null': lambda self, frame, nodes: pd.Series(np.nan, index=frame.index, dtype=object),
+        'true': lambda self, frame, nodes: pd.Series(True, index=frame.index),
+        'false': lambda self, frame, nodes: pd.Series(False, index=frame.index),
+        'len': _text_function('len', lambda values: values.str.len()),
+        'lower': _text_function('lower', lambda values: values.str.lower()),
+        'upper': _text_function('upper', lambda values: values.str.upper()),
+        'trim': _text_function('trim', lambda values, chars=None: values.str.strip(chars)),
+        'ltrim': _text_function('ltrim', lambda values, chars=None: values.str.lstrip(chars)),
+        'rtrim': _text_function('rtrim', lambda values, chars=None: values.str.rstrip(chars)),
+        'urldecode': _text_function('urldecode', lambda values: values.map(urllib.parse.unquote,
+                                                                             na_action='ignore')),
+        'substr': _fn_substr, 'replace': _fn_replace, 'match': _fn_match, 'like': _fn_like,
+        'tonumber': _fn_tonumber, 'tostring': _fn_tostring, 'round': _fn_round,
+        'abs': _numeric_function('abs', np.abs), 'ceil': _numeric_function('ceil', np.ceil),
+        'ceiling': _numeric_function('ceiling', np.ceil),
+        'floor': _numeric_function('floor', np.floor), 'sqrt': _numeric_function('sqrt', np.sqrt),
+        'ln': _numeric_function('ln', np.log),
+        'exp': _numeric_function('exp', np.exp), 'pow': _numeric_function('pow', np.power),
+        'log': _numeric_function('log', lambda values, base=None: np.log10(values) if base is None
+                                 else np.log(values) / np.log(base)),
+        'exact': _numeric_function('exact', lambda values: values),
+        'min': _min_max_function('min'), 'max': _min_max_function('max'),
+        'now': _fn_now, 'time': _fn_now, 'strftime': _fn_strftime, 'strptime': _fn_strptime,
+        'relative_time': _fn_relative_time,
+        'split': _fn_split, 'mvcount': _fn_mvcount, 'mvindex': _fn_mvindex, 'mvjoin': _fn_mvjoin,
+        'mvappend': _fn_mvappend, 'cidrmatch': _fn_cidrmatch, 'in': _fn_in, 'isnum': _fn_isnum, 'isstr': _fn_isstr,
+        'md5': _hash_function('md5'), 'sha1': _hash_function('sha1'), 'sha256': _hash_function('sha256'),
+    }
+
+    # extraction
+
+    def _rex(self, frame, args, warnings):
+        tokens, options = _strip_options(tokenize(args), {'field', 'mode', 'max_match', 'offset_field'})
+        patterns = [_unescape(token.value) for token in tokens if token.kind == STRING]
+        if not patterns:
+            raise SPLExecutionError("rex expects a quoted regular expression")
+        source = options.get('field', '_raw')
+        column = _text(frame[source]) if source in frame else pd.Series(np.nan, index=frame.index, dtype=object)
+        frame = frame.copy()
+        if options.get('mode') == 'sed':
+            frame[source] = self._sed(column, patterns[0])
+            return frame
+        if options.get('max_match') not in (None, '1'):
+            warnings.append("rex max_match is evaluated as max_match=1")
+        pattern = re.compile(python_regex(patterns[0]))
+        if not pattern.groupindex:
+            return frame
+        extracted = column.str.extract(pattern, expand=True)
+        for name in pattern.groupindex:
+            values = extracted[name]
+            # a field keeps its value when the expression does not match
+            frame[name] = values.where(values.notna(), frame[name]) if name in frame else values
+        return frame
+
+    @staticmethod
+    def _sed(column: pd.Series, expression: str) -> pd.Series:
+        match = re.match(r'^s(.)(.*?)(?<!\\)\1(.*?)(?<!\\)\1([gi0-9]*)$', expression, re.DOTALL)
+        if not match:
+            raise UnsupportedSPL(f"rex sed expression {expression!r}")
+        _, pattern, replacement, flags = match.groups()
+        count = 0 if 'g' in flags else int(re.sub(r'\D', '', flags) or 1)
+        compiled = re.compile(python_regex(pattern), re.IGNORECASE if 'i' in flags else 0)
+        return column.map(lambda v: compiled.sub(replacement, v, count=count), na_action='ignore')
+
+    # aggregation
+
+    def _stats(self, frame, args, warnings):
+        tokens, _ = _strip_options(tokenize(args))
+        by = _index_of_word(tokens, {'by'})
+        by_fields = _names(tokens[by + 1:]) if by >= 0 else []
+        aggregations = self._aggregations(tokens[:by] if by >= 0 else tokens)
+        if not aggregations:
+            raise SPLExecutionError("stats expects at least one aggregation")
+        if any(name not in frame for name in by_fields):
+            return pd.DataFrame(columns=by_fields + [alias for alias, _, _ in aggregations])
+        if not by_fields:
+            row = {alias: self._aggregate(function, self._column(frame, source), frame) for alias, function, source
+                   in aggregations}
+            return pd.DataFrame([row])
+        keys = [_text(frame[name]).rename(f'__by{n}') for n, name in enumerate(by_fields)]
+        groups = frame.groupby(keys, dropna=True, sort=True)
+        sizes = groups.size()
+        result = pd.DataFrame(index=sizes.index)
+        for alias, function, source in aggregations:
+            column = self._column(frame, source)
+            native = _NATIVE_AGGREGATIONS.get(function)
+            numbers = _numbers(column) if native not in (None, 'count', 'nunique') else None
+            if function in ('count', 'c') and source is None:
+                result[alias] = sizes
+            elif native in ('count', 'nunique'):
+                result[alias] = getattr(_text(column).groupby(keys, dropna=True, sort=True), native)()
+            elif native and (function not in ('min', 'max') or numbers.notna().sum() == column.notna().sum()):
+                grouped = numbers.groupby(keys, dropna=True, sort=True)
+                result[alias] = grouped.sum(min_count=1) if native == 'sum' else getattr(grouped, native)()
+            else:
+                # values(), earliest() and the like produce lists or depend on other fields; one call per group
+                result[alias] = pd.Series([self._aggregate(function, column.iloc[groups.indices[key]],
+                                                           frame.iloc[groups.indices[key]])
+                                           for key in sizes.index], index=sizes.index, dtype=object)
+        result = result.reset_index()
+        # the by fields come first, under their own names (an aggregation may reuse one of them as alias)
+        result.columns = by_fields + list(result.columns[len(by_fields):])
+        return result.loc[:, ~result.columns.duplicated(keep='last')]
+
+    @staticmethod
+    def _column(frame, source):
+        if source is None:
+            return pd.Series(1, index=frame.index)
+        return frame[source] if source in frame else pd.Series(np.nan, index=frame.index, dtype=object)
+
+    @staticmethod
+    def _aggregations(tokens: list) -> list:
+        """[(output name, function, source field or None)] for 'count min(_time) as firstTime dc(user)'."""
+        aggregations, i = [], 0
+        while i < len(tokens):
+            token = tokens[i]
+            if token.kind == COMMA:
+                i += 1
+                continue
+            if token.kind != WORD:
+                raise SPLExecutionError(f"unexpected {token.value!r} in stats")
+            function, source = token.value.lower(), None
+            name = token.value
+            if i + 1 < len(tokens) and tokens[i + 1].kind == LPAREN:
+                close = i + 2
+                while close < len(tokens) and tokens[close].kind != RPAREN:
+                    if tokens[close].kind in (LPAREN, LBRACKET):
+                        raise UnsupportedSPL(f"stats {function}() over an expression")
+                    close += 1
+                inner = tokens[i + 2:close]
+                if len(inner) > 1:
+                    raise UnsupportedSPL(f"stats {function}() over an expression")
+                source = inner[0].value if inner else None
+                name = f"{token.value}({source})" if source else token.value
+                i = close + 1
+            else:
+                i += 1
+            if i + 1 < len(tokens) and tokens[i].kind == WORD and tokens[i].value.lower() == 'as':
+                name = tokens[i + 1].value
+                i += 2
+            aggregations.append((name, function, source))
+        return aggregations
+
+    @staticmethod
+    def _aggregate(function: str, values: pd.Series, frame: pd.DataFrame = None):
+        present = values.dropna()
+        if function in ('count', 'c'):
+            return len(present)
+        if function in ('dc', 'distinct_count', 'estdc', 'estdc_error'):
+            return _text(present).nunique()
+        if function in ('values', 'list'):
+            texts = _text(present)
+            return sorted(set(texts)) if function == 'values' else list(texts)[:100]
+        if function in ('first', 'last'):
+            return present.iloc[0 if function == 'first' else -1] if len(present) else np.nan
+        if function in ('earliest', 'latest'):
+            if not len(present) or frame is None or '_time' not in frame:
+                return present.iloc[0] if len(present) else np.nan
+            times = frame.loc[present.index, '_time']
+            return present.loc[times.idxmin() if function == 'earliest' else times.idxmax()]
+        if function == 'mode':
+            return _text(present).mode().iloc[0] if len(present) else np.nan
+        numbers = _numbers(present).dropna()
+        if function in ('min', 'max'):
+            if not len(numbers) and len(present):
+                texts = _text(present)
+                return texts.min() if function == 'min' else texts.max()
+            return (numbers.min() if function == 'min' else numbers.max()) if len(numbers) else np.nan
+        if not len(numbers):
+            return np.nan
+        if function == 'sum':
+            return numbers.sum()
+        if function in ('avg', 'mean'):
+            return numbers.mean()
+        if function == 'median':
+            return numbers.median()
+        if function in ('stdev', 'stdevp', 'var', 'varp'):
+            ddof = 0 if function.endswith('p') else 1
+            return numbers.std(ddof=ddof) if function.startswith('stdev') else numbers.var(ddof=ddof)
+        if function == 'range':
+            return numbers.max() - numbers.min()
+        percentile = re.match(r'^(?:p|perc|exactperc|upperperc)(\d+(?:\.\d+)?)$', function)
+        if percentile:
+            return numbers.quantile(float(percentile.group(1)) / 100)
+        raise UnsupportedSPL(f"stats function {function}()")
+
+    # field shaping
+
+    def _rename(self, frame, args, warnings):
+        mapping = {}
+        names = [token.value for token in tokenize(args) if token.kind != COMMA]
+        if len(names) % 3 or any(names[i].lower() != 'as' for i in range(1, len(names), 3)):
+            raise SPLExecutionError(f"rename expects '<field> AS <new name>', got {args.strip()!r}")
+        for old, new in zip(names[0::3], names[2::3]):
+            if '*' in old:
+                pattern = re.compile(_wildcard(old))
+                for column in frame.columns:
+                    match = pattern.match(column)
+                    if match and column not in mapping:
+                        # each '*' in the new name takes the text the '*' in the old name matched
+                        captured = iter(re.match(_wildcard(old).replace('.*', '(.*)'), column).groups())
+                        mapping[column] = re.sub(r'\*', lambda _: next(captured, ''), new)
+            elif old in frame:
+                mapping[old] = new
+        frame = frame.drop(columns=[new for old, new in mapping.items() if new in frame and new not in mapping])
+        return frame.rename(columns=mapping)
+
+    def _select(self, frame, names: list, keep_missing: bool) -> list:
+        selected = []
+        for name in names:
+            if '*' in name:
+                pattern = re.compile(_wildcard(name))
+                selected.extend(c for c in frame.columns if pattern.match(c) and c not in selected)
+            elif name not in selected and (name in frame or keep_missing):
+                selected.append(name)
+        return selected
+
+    def _table(self, frame, args, warnings):
+        names = _names(t for t in tokenize(args) if t.kind != COMMA)
+        selected = self._select(frame, names, keep_missing=True)
+        return frame.reindex(columns=selected)
+
+    def _fields(self, frame, args, warnings):
+        tokens = [t for t in tokenize(args) if t.kind != COMMA]
+        remove = bool(tokens) and tokens[0].value == '-'
+        if tokens and tokens[0].value in ('-', '+'):
+            tokens = tokens[1:]
+        selected = self._select(frame, _names(tokens), keep_missing=False)
+        if remove:
+            return frame.drop(columns=selected)
+        # internal fields stay unless they are explicitly removed
+        return frame[selected + [c for c in ('_raw', '_time') if c in frame and c not in selected]]
+
+    def _sort(self, frame, args, warnings):
+        tokens = [t for t in tokenize(args) if t.kind != COMMA]
+        limit = SORT_LIMIT
+        if tokens and re.fullmatch(r'\d+', tokens[0].value):
+            limit = int(tokens[0].value) or None
+            tokens = tokens[1:]
+        elif tokens and tokens[0].value.lower().startswith('limit') and len(tokens) > 2:
+            limit = int(tokens[2].value) or None
+            tokens = tokens[3:]
+        reverse = bool(tokens) and tokens[-1].kind == WORD and tokens[-1].value.lower() in ('d', 'desc')
+        if reverse:
+            tokens = tokens[:-1]
+        keys, sign, mode, i = [], True, 'auto', 0
+        while i < len(tokens):
+            token = tokens[i]
+            if token.value in ('-', '+'):
+                sign = token.value == '+'
+            elif token.kind == WORD and token.value.lower() in ('num', 'str', 'ip', 'auto') \
+                    and i + 1 < len(tokens) and tokens[i + 1].kind == LPAREN:
+                mode = token.value.lower()
+                i += 1
+            elif token.kind in (WORD, FIELD, STRING):
+                name = token.value
+                if name[0] in '+-':
+                    sign, name = name[0] == '+', name[1:]
+                keys.append((name, sign, mode))
+                sign, mode = True, 'auto'
+            i += 1
+        if not keys:
+            return frame.head(limit) if limit else frame
+        work, columns, ascending = frame.copy(), [], []
+        for n, (name, sign, mode) in enumerate(keys):
+            column = self._column(frame, name)
+            numbers = _numbers(column)
+            use_numbers = mode == 'num' or (mode == 'auto' and numbers.notna().sum() == column.notna().sum())
+            work[f'__sort{n}'] = numbers if use_numbers else _text(column).str.lower()
+            columns.append(f'__sort{n}')
+            ascending.append(sign != reverse)
+        ordered = work.sort_values(columns, ascending=ascending, kind='stable', na_position='last')
+        ordered = ordered.drop(columns=columns)
+        return ordered.head(limit) if limit else ordered
+
+    def _dedup(self, frame, args, warnings):
+        tokens = [t for t in tokenize(args) if t.kind != COMMA]
+        tokens, options = _strip_options(tokens, {'keepempty', 'consecutive', 'keepevents'})
+        keep = 1
+        if tokens and re.fullmatch(r'\d+', tokens[0].value):
+            keep, tokens = int(tokens[0].value), tokens[1:]
+        sortby = _index_of_word(tokens, {'sortby'})
+        sort_args = ' '.join(t.value for t in tokens[sortby + 1:]) if sortby >= 0 else None
+        names = _names(tokens[:sortby] if sortby >= 0 else tokens)
+        if not names:
+            raise SPLExecutionError("dedup expects at least one field")
+        if any(name not in frame for name in names):
+            return frame if options.get('keepempty') == 'true' else frame.iloc[0:0]
+        keys = pd.concat([_text(frame[name]) for name in names], axis=1, keys=names)
+        present = keys.notna().all(axis=1)
+        if options.get('consecutive') == 'true':
+            changed = (keys != keys.shift()).any(axis=1)
+            kept = changed
+        else:
+            kept = keys[present].groupby(names, dropna=True).cumcount().reindex(frame.index) < keep
+        kept = kept.fillna(False).astype(bool) & present
+        if options.get('keepempty') == 'true':
+            kept |= ~present
+        frame = frame[kept.to_numpy()]
+        return self._sort(frame, sort_args, warnings) if sort_args else frame
+
+    def _bin(self, frame, args, warnings):
+        tokens, options = _strip_options(tokenize(args), {'span', 'bins', 'minspan', 'start', 'end', 'aligntime'})
+        names = [t.value for t in tokens if t.kind in (WORD, FIELD)]
+        if not names:
+            raise SPLExecutionError("bin expects a field")
+        source = names[0]
+        alias = _index_of_word(tokens, {'as'})
+        target = tokens[alias + 1].value if 0 <= alias < len(tokens) - 1 else source
+        frame = frame.copy()
+        if source not in frame:
+            return frame
+        numbers = _numbers(frame[source])
+        if 'span' in options:
+            span = _span_seconds(options['span'])
+        elif 'bins' in options and numbers.notna().any():
+            span = (numbers.max() - numbers.min()) / max(int(options['bins']), 1) or 1
+            warnings.append(f"bin bins={options['bins']} approximated with a fixed span of {span:g}")
+        else:
+            warnings.append(f"bin without span= leaves {source} unchanged")
+            return frame
+        frame[target] = np.floor(numbers / span) * span
+        return frame
+
+    def _lookup(self, frame, args, warnings):
+        tokens, _ = _strip_options(tokenize(args), {'local', 'update', 'event_time_field'})
+        tokens = [t for t in tokens if t.kind != COMMA]
+        if not tokens:
+            raise SPLExecutionError("lookup expects a lookup table")
+        table_name, tokens = tokens[0].value, tokens[1:]
+        output = _index_of_word(tokens, {'output', 'outputnew'})
+        overwrite = output < 0 or tokens[output].value.lower() == 'output'
+        matches = self._lookup_pairs(tokens[:output] if output >= 0 else tokens)
+        outputs = self._lookup_pairs(tokens[output + 1:]) if output >= 0 else []
+        table = self._lookup_table(table_name)
+        frame = frame.copy()
+        if table is None:
+            warnings.append(f"lookup table '{table_name}' not found under {LOOKUP_PATH}; its fields are left empty")
+            for _, name in outputs:
+                if name not in frame:
+                    frame[name] = np.nan
+            return frame
+        if not outputs:
+            matched = {column for column, _ in matches}
+            outputs = [(column, column) for column in table.columns if column not in matched]
+        missing = [column for column, _ in matches + outputs if column not in table]
+        if missing:
+            raise SPLExecutionError(f"lookup table '{table_name}' has no field(s) {', '.join(missing)}")
+        right = table[[column for column, _ in matches] + [column for column, _ in outputs]]
+        right = right.drop_duplicates(subset=[column for column, _ in matches])
+        right.columns = [f'__key{n}' for n in range(len(matches))] + [f'__out{n}' for n in range(len(outputs))]
+        left = pd.DataFrame({f'__key{n}': (_text(frame[name]) if name in frame
+                                           else pd.Series(np.nan, index=frame.index, dtype=object))
+                             for n, (_, name) in enumerate(matches)}, index=frame.index)
+        joined = left.merge(right, how='left', on=list(left.columns)).set_index(frame.index)
+        for n, (_, name) in enumerate(outputs):
+            values = joined[f'__out{n}']
+            if name in frame and not overwrite:
+                frame[name] = frame[name].where(frame[name].notna(), values)
+            else:
+                frame[name] = values
+        return frame
+
+    @staticmethod
+    def _lookup_pairs(tokens: list) -> list:
+        """[(lookup field, event field)] for 'a AS b c'."""
+        pairs, i = [], 0
+        while i < len(tokens):
+            if i + 2 < len(tokens) and tokens[i + 1].value.lower() == 'as':
+                pairs.append((tokens[i].value, tokens[i + 2].value))
+                i += 3
+            else:
+                pairs.append((tokens[i].value, tokens[i].value))
+                i += 1
+        return pairs
+
+    def _lookup_table(self, name: str):
+        with self._lock:
+            if name not in self._lookups:
+                table = None
+                for candidate in (name, f"{name}.csv"):
+                    path = os.path.join(LOOKUP_PATH, candidate)
+                    if os.path.isfile(path):
+                        table = pd.read_csv(path, dtype=str, keep_default_na=False).replace('', np.nan)
+                        break
+                self._lookups[name] = table
+            return self._lookups[name]
+
+    # the rest of the subset
+
+    def _head(self, frame, args, warnings):
+        tokens, options = _strip_options(tokenize(args), {'limit', 'null', 'keeplast'})
+        count = options.get('limit') or (tokens[0].value if tokens else '10')
+        if not re.fullmatch(r'\d+', count):
+            raise UnsupportedSPL("head with an eval expression")
+        return frame.head(int(count))
+
+    def _tail(self, frame, args, warnings):
+        tokens = tokenize(args)
+        return frame.tail(int(tokens[0].value) if tokens and tokens[0].value.isdigit() else 10)
+
+    def _fillnull(self, frame, args, warnings):
+        tokens, options = _strip_options(tokenize(args), {'value'})
+        names = _names(t for t in tokens if t.kind != COMMA) or list(frame.columns)
+        frame = frame.copy()
+        value = options.get('value', '0')
+        for name in names:
+            frame[name] = frame[name].astype(object).where(frame[name].notna(), value) if name in frame else value
+        return frame
+
+    def _convert(self, frame, args, warnings):
+        tokens, options = _strip_options(tokenize(args), {'timeformat'})
+        time_format = options.get('timeformat', DEFAULT_TIME_FORMAT)
+        frame = frame.copy()
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            if token.kind != WORD or i + 3 >= len(tokens) or tokens[i + 1].kind != LPAREN:
+                i += 1
+                continue
+            function, source = token.value.lower(), tokens[i + 2].value
+            i += 4
+            target = source
+            if i + 1 < len(tokens) and tokens[i].value.lower() == 'as':
+                target = tokens[i + 1].value
+                i += 2
+            if source not in frame:
+                continue
+            values = frame[source]
+            if function == 'ctime':
+                numbers = _numbers(values)
+                frame[target] = pd.to_datetime(numbers, unit='s', errors='coerce').dt.strftime(time_format) \
+                    .astype(object).where(numbers.notna())
+            elif function == 'mktime':
+                parsed = pd.to_datetime(_text(values), format=time_format, errors='coerce')
+                frame[target] = (parsed - pd.Timestamp(0)) / pd.Timedelta(seconds=1)
+            elif function in ('num', 'auto', 'rmunit', 'rmcomma', 'memk', 'dur2sec'):
+                cleaned = _text(values).str.replace(r'[,\s]|[A-Za-z]+$', '', regex=True)
+                frame[target] = _numbers(cleaned).where(_numbers(cleaned).notna(), values) \
+                    if function == 'auto' else _numbers(cleaned)
+            elif function != 'none':
+                raise UnsupportedSPL(f"convert {function}()")
+        return frame
+
+    def _unresolved_macro(self, frame, args, warnings):
+        call = parse_macro_call(args.strip().strip('`'))
+        warnings.append(f"macro `{call[0] if call else args.strip()}` is not defined locally and was skipped")
+        return frame
+
+    _COMMANDS = {
+        'search': _search, 'where': _where, 'regex': _regex, 'eval': _eval, 'rex': _rex, 'stats': _stats,
+        'rename': _rename, 'table': _table, 'fields': _fields, 'sort': _sort, 'dedup': _dedup, 'bin': _bin,
+        'bucket': _bin, 'lookup': _lookup, 'head': _head, 'tail': _tail, 'fillnull': _fillnull,
+        'convert': _convert, '`': _unresolved_macro,
+    }
+
+
+class _SearchTerms:
+    """
+    Evaluates the boolean search terms of a search command into a row mask, in a single recursive descent.
+    As in Splunk, OR binds tighter than the implicit AND: 'a OR b c' is '(a OR b) c'.
+    """
+
+    def __init__(self, engine: SPLEngine, frame: pd.DataFrame, tokens: list, warnings: list):
+        self.engine = engine
+        self.frame = frame
+        self.tokens = tokens
+        self.warnings = warnings
+        self.pos = 0
+
+    def parse(self) -> pd.Series:
+        mask = self.conjunction()
+        if self.pos < len(self.tokens):
+            raise SPLExecutionError(f"unexpected {self.tokens[self.pos].value!r} in search")
+        return mask
+
+    def _keyword(self, word: str) -> bool:
+        token = self.tokens[self.pos] if self.pos < len(self.tokens) else None
+        return token is not None and token.kind == WORD and token.value == word
+
+    def conjunction(self) -> pd.Series:
+        mask = self.disjunction()
+        while self.pos < len(self.tokens) and self.tokens[self.pos].kind != RPAREN:
+            if self._keyword('AND'):
+                self.pos += 1
+            mask = mask & self.disjunction()
+        return mask
+
+    def disjunction(self) -> pd.Series:
+        mask = self.negation()
+        while self._keyword('OR'):
+            self.pos += 1
+            mask = mask | self.negation()
+        return mask
+
+    def negation(self) -> pd.Series:
+        if self._keyword('NOT'):
+            self.pos += 1
+            return ~self.negation()
+        return self.term()
+
+    def _all(self, value: bool) -> pd.Series:
+        return pd.Series(value, index=self.frame.index)
+
+    def _field_term(self, name: str, op: str, value: str) -> pd.Series:
+        return self.engine._term(self.frame, name, op, value)
+
+    def _raw_term(self, value: str) -> pd.Series:
+        return self.engine._raw_term(self.frame, value)
+
+    def term(self) -> pd.Series:
+        if self.pos >= len(self.tokens):
+            raise SPLExecutionError("search ends with an operator")
+        token = self.tokens[self.pos]
+        following = self.tokens[self.pos + 1] if self.pos + 1 < len(self.tokens) else None
+        self.pos += 1
+        if token.kind == LPAREN:
+            mask = self.conjunction()
+            if self.pos >= len(self.tokens) or self.tokens[self.pos].kind != RPAREN:
+                raise SPLExecutionError("unclosed parenthesis in search")
+            self.pos += 1
+            return mask
+        if token.kind == LBRACKET:
+            raise UnsupportedSPL("subsearch")
+        if token.kind == MACRO:
+            self.warnings.append(f"macro `{token.value}` is not defined locally and matches every event")
+            return self._all(True)
+        # field names may be quoted: "result.status"="SUCCESS"
+        if token.kind in (WORD, FIELD, STRING) and following is not None and following.kind == OP:
+            if self.pos + 1 >= len(self.tokens):
+                raise SPLExecutionError(f"missing value after {token.value}{following.value}")
+            value = self.tokens[self.pos + 1]
+            self.pos += 2
+            return self._field_term(token.value, following.value, value.value)
+        if token.kind in (WORD, FIELD, STRING) and following is not None and following.kind == WORD \
+                and following.value.lower() == 'in' and self.pos + 1 < len(self.tokens) \
+                and self.tokens[self.pos + 1].kind == LPAREN:
+            return self._in_list(token.value)
+        if token.kind == WORD and token.value.upper() in ('TERM', 'CASE') and following is not None \
+                and following.kind == LPAREN:
+            self.pos += 1
+            mask = self.term()
+            self.pos += 1
+            return mask
+        if token.kind in (WORD, STRING):
+            return self._raw_term(token.value)
+        raise SPLExecutionError(f"unexpected {token.value!r} in search")
+
+    def _in_list(self, name: str) -> pd.Series:
+        self.pos += 1
+        if self.pos >= len(self.tokens) or self.tokens[self.pos].kind != LPAREN:
+            raise SPLExecutionError(f"expected a value list after {name} IN")
+        self.pos += 1
+        mask = self._all(False)
+        while self.pos < len(self.tokens) and self.tokens[self.pos].kind != RPAREN:
+            token = self.tokens[self.pos]
+            if token.kind != COMMA:
+                mask = mask | self._field_term(name, '=', token.value)
+            self.pos += 1
+        self.pos += 1
+        return mask
+
+
+class _StoredSearchTerms(_SearchTerms):
+    """The same search terms over an EventView: masks are numpy arrays built from the stored columns."""
+
+    def _all(self, value: bool) -> np.ndarray:
+        return np.full(len(self.frame), value, dtype=bool)
+
+    def _field_term(self, name: str, op: str, value: str) -> np.ndarray:
+        return self.engine._stored_term(self.frame, name, op, value)
+
+    def _raw_term(self, value: str) -> np.ndarray:
+        return self.engine._stored_raw_term(self.frame, value)
+
+
+local_engine = SPLEngine()
+
+
+def run_local(search: str, techniques=None) -> ExecutionResult:
+    return local_engine.run(search, techniques)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run an SPL search over the local redteam events.")
+    parser.add_argument("search")
+    parser.add_argument("--technique", action="append", default=None, help="only events of this technique")
+    parser.add_argument("--max-results", type=int, default=20)
+    args = parser.parse_args()
+    result = local_engine.run(args.search, args.technique)
+    print(json.dumps(result.as_dict(args.max_results), ensure_ascii=False, indent=2, default=str))
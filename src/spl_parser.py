@@ -0,0 +1,540 @@
+from dataclasses import dataclass, field
+import re
+
+# token kinds
+WORD = 'word'
+STRING = 'string'
+FIELD = 'field'  # single-quoted field reference, e.g. 'Processes.process_name'
+MACRO = 'macro'
+OP = 'op'
+COMMA = 'comma'
+LPAREN, RPAREN = 'lparen', 'rparen'
+LBRACKET, RBRACKET = 'lbracket', 'rbracket'
+PIPE = 'pipe'
+
+_PUNCTUATION = {'(': LPAREN, ')': RPAREN, '[': LBRACKET, ']': RBRACKET, ',': COMMA, '|': PIPE}
+_OPERATORS = ('!=', '==', '<=', '>=', '=', '<', '>')
+_WORD_BREAK = set(' \t\r\n"\'`()[],|=<>!')
+_IDENTIFIER = re.compile(r'^[A-Za-z_][\w.{}:@*-]*$')
+_NUMBER = re.compile(r'^[+-]?\d+(\.\d+)?$')
+_NAMED_GROUP = re.compile(r'\(\?P?<([A-Za-z_]\w*)>')
+# a Markdown code fence around LLM output, e.g. ```spl ... ```; a ```comment``` inside a search stays on one line
+_CODE_FENCE = re.compile(r'^[ \t]*```[ \t]*(spl|splunk|plaintext|text|sql)?[ \t]*\n(.*?)\n[ \t]*```[ \t]*$',
+                         re.DOTALL | re.MULTILINE | re.IGNORECASE)
+_KEYWORDS = {'and', 'or', 'not', 'xor', 'like', 'in', 'by', 'as', 'true', 'false', 'null', 'output', 'outputnew',
+             'over', 'where', 'from'}
+
+
+class SPLSyntaxError(ValueError):
+    def __init__(self, message: str, position: int):
+        super().__init__(f"{message} at position {position}")
+        self.message = message
+        self.position = position
+
+
+@dataclass
+class Token:
+    kind: str
+    value: str
+    pos: int
+
+
+@dataclass
+class ParsedPipe:
+    command: str
+    operation_type: str
+    input_fields: list = field(default_factory=list)
+    output_fields: list = field(default_factory=list)
+    args: list = field(default_factory=list)
+    text: str = ''
+
+    def info(self) -> dict:
+        return {"operation_type": self.operation_type, "input_fields": self.input_fields,
+                "output_fields": self.output_fields}
+
+
+# command -> DSL_KEYWORD category
+COMMAND_KEYWORDS = {
+    'search': 'FILTER', 'where': 'FILTER', 'regex': 'FILTER',
+    'rex': 'EXTRACT', 'spath': 'EXTRACT', 'extract': 'EXTRACT', 'kv': 'EXTRACT', 'xmlkv': 'EXTRACT',
+    'eval': 'TRANSFORM', 'convert': 'TRANSFORM', 'strcat': 'TRANSFORM', 'makemv': 'TRANSFORM',
+    'mvexpand': 'TRANSFORM', 'mvcombine': 'TRANSFORM', 'addinfo': 'TRANSFORM', 'fieldformat': 'TRANSFORM',
+    'replace': 'TRANSFORM', 'foreach': 'TRANSFORM', 'addtotals': 'TRANSFORM', 'fromjson': 'EXTRACT',
+    'rename': 'RENAME',
+    'lookup': 'LOOKUP', 'inputlookup': 'LOOKUP', 'iplocation': 'LOOKUP',
+    'stats': 'AGGREGATE', 'tstats': 'AGGREGATE', 'mstats': 'AGGREGATE', 'eventstats': 'AGGREGATE', 'streamstats': 'AGGREGATE',
+    'chart': 'AGGREGATE', 'timechart': 'AGGREGATE', 'top': 'AGGREGATE', 'rare': 'AGGREGATE',
+    'transaction': 'AGGREGATE', 'datamodel': 'AGGREGATE',
+    'join': 'JOIN',
+    'sort': 'SORT',
+    'append': 'APPEND', 'appendcols': 'APPEND', 'appendpipe': 'APPEND', 'union': 'APPEND', 'multisearch': 'APPEND',
+    'fillnull': 'FILL', 'filldown': 'FILL',
+    'dedup': 'DEDUP',
+    'table': 'OUTPUT', 'fields': 'OUTPUT', 'head': 'OUTPUT', 'tail': 'OUTPUT', 'outputlookup': 'OUTPUT',
+    'collect': 'OUTPUT', 'sendalert': 'OUTPUT',
+    'bin': 'BUCKET', 'bucket': 'BUCKET',
+    'fit': 'APPLY', 'apply': 'APPLY', 'predict': 'APPLY', 'anomalydetection': 'APPLY', 'map': 'APPLY',
+}
+_STATS_COMMANDS = {'stats', 'tstats', 'mstats', 'eventstats', 'streamstats', 'chart', 'timechart'}
+# fields Splunk always has on an event; they are inputs but never "created" by a pipe
+_SEARCH_METADATA = {'index', 'earliest', 'latest', 'earliest_time', 'latest_time'}
+
+
+def code_fence(text: str):
+    """The first Markdown code fence in text as a re.Match (group 2 is its content), or None."""
+    return _CODE_FENCE.search(text or '')
+
+
+def strip_code_fence(text: str) -> str:
+    """
+    The search inside the Markdown code fence LLM output wraps it in (a ```spl block before any other), without
+    the prose around it; text without a fence is returned as is, stripped.
+    """
+    blocks = list(_CODE_FENCE.finditer(text or ''))
+    if not blocks:
+        return (text or '').strip()
+    spl = [block for block in blocks if (block.group(1) or '').lower() in ('spl', 'splunk')]
+    return (spl or blocks)[0].group(2).strip()
+
+
+def tokenize(text: str) -> list:
+    tokens = []
+    i, n = 0, len(text)
+    while i < n:
+        c = text[i]
+        if c.isspace():
+            i += 1
+        elif text.startswith('```', i):
+            # ```comment```
+            end = text.find('```', i + 3)
+            if end < 0:
+                raise SPLSyntaxError("unterminated comment", i)
+            i = end + 3
+        elif c in '"\'`':
+            end = i + 1
+            while end < n and text[end] != c:
+                end += 2 if text[end] == '\\' and c != '`' else 1
+            kind = {'"': STRING, "'": FIELD, '`': MACRO}[c]
+            if end >= n:
+                raise SPLSyntaxError(f"unterminated {kind} literal", i)
+            tokens.append(Token(kind, text[i + 1:end], i))
+            i = end + 1
+        elif c in _PUNCTUATION:
+            tokens.append(Token(_PUNCTUATION[c], c, i))
+            i += 1
+        elif c in '=<>!':
+            op = next((op for op in _OPERATORS if text.startswith(op, i)), None)
+            if op is None:
+                raise SPLSyntaxError(f"unexpected character {c!r}", i)
+            tokens.append(Token(OP, op, i))
+            i += len(op)
+        else:
+            end = i
+            while end < n and text[end] not in _WORD_BREAK:
+                # a backslash escapes the next character, e.g. \"privileged\" outside of a string
+                end += 2 if text[end] == '\\' and end + 1 < n else 1
+            tokens.append(Token(WORD, text[i:end], i))
+            i = end
+    return tokens
+
+
+def split_pipes(search: str, strict: bool = False) -> list:
+    """
+    Split a search on top-level '|', ignoring pipes inside quotes, macros, subsearch brackets and
+    parentheses. Unbalanced input falls back to a plain split unless strict is set.
+    """
+    try:
+        tokens = tokenize(search)
+    except SPLSyntaxError:
+        if strict:
+            raise
+        return [pipe.strip() for pipe in search.split('|') if pipe.strip()]
+    pipes, start, depth = [], 0, 0
+    for token in tokens:
+        if token.kind in (LPAREN, LBRACKET):
+            depth += 1
+        elif token.kind in (RPAREN, RBRACKET):
+            depth -= 1
+            if depth < 0 and strict:
+                raise SPLSyntaxError(f"unbalanced {token.value!r}", token.pos)
+            depth = max(depth, 0)
+        elif token.kind == PIPE and depth == 0:
+            pipes.append(search[start:token.pos])
+            start = token.pos + 1
+    if depth and strict:
+        raise SPLSyntaxError("unclosed bracket or parenthesis", len(search))
+    pipes.append(search[start:])
+    return [pipe.strip() for pipe in pipes if pipe.strip()]
+
+
+def _unique(fields) -> list:
+    seen = []
+    for f in fields:
+        if f and f not in seen:
+            seen.append(f)
+    return seen
+
+
+def _is_identifier(token: Token) -> bool:
+    if token.kind == FIELD:
+        return True
+    return (token.kind == WORD and bool(_IDENTIFIER.match(token.value)) and not _NUMBER.match(token.value)
+            and token.value.lower() not in _KEYWORDS and token.value != '*')
+
+
+def _expression_fields(tokens: list) -> list:
+    # identifiers that are not function names
+    fields = []
+    for i, token in enumerate(tokens):
+        if _is_identifier(token) and not (i + 1 < len(tokens) and tokens[i + 1].kind == LPAREN):
+            fields.append(token.value)
+    return fields
+
+
+def _split_top_level(tokens: list, kind: str = COMMA) -> list:
+    parts, current, depth = [], [], 0
+    for token in tokens:
+        if token.kind in (LPAREN, LBRACKET):
+            depth += 1
+        elif token.kind in (RPAREN, RBRACKET):
+            depth -= 1
+        if token.kind == kind and depth == 0:
+            parts.append(current)
+            current = []
+        else:
+            current.append(token)
+    parts.append(current)
+    return [part for part in parts if part]
+
+
+def _strip_options(tokens: list, options: set = None) -> tuple:
+    """Remove top-level key=value options; returns (remaining tokens, options dict)."""
+    remaining, found, i = [], {}, 0
+    while i < len(tokens):
+        token = tokens[i]
+        if (token.kind == WORD and i + 2 < len(tokens) and tokens[i + 1].kind == OP and tokens[i + 1].value == '='
+                and (options is None or token.value.lower() in options)):
+            found[token.value.lower()] = tokens[i + 2].value
+            i += 3
+        else:
+            remaining.append(token)
+            i += 1
+    return remaining, found
+
+
+def _index_of_word(tokens: list, words: set) -> int:
+    depth = 0
+    for i, token in enumerate(tokens):
+        if token.kind in (LPAREN, LBRACKET):
+            depth += 1
+        elif token.kind in (RPAREN, RBRACKET):
+            depth -= 1
+        elif depth == 0 and token.kind == WORD and token.value.lower() in words:
+            return i
+    return -1
+
+
+def _field_list(tokens: list) -> list:
+    return [token.value for token in tokens if _is_identifier(token) or (token.kind == WORD and '*' in token.value)]
+
+
+def _parse_aggregations(tokens: list) -> tuple:
+    inputs, outputs, i = [], [], 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token.kind == WORD and i + 1 < len(tokens) and tokens[i + 1].kind == LPAREN:
+            depth, j = 0, i + 1
+            while j < len(tokens):
+                depth += tokens[j].kind == LPAREN
+                depth -= tokens[j].kind == RPAREN
+                if depth == 0:
+                    break
+                j += 1
+            inner = tokens[i + 2:j]
+            inputs.extend(_expression_fields(inner))
+            name = f"{token.value}({' '.join(t.value for t in inner)})"
+            i = j + 1
+        elif token.kind == WORD and token.value.lower() not in _KEYWORDS:
+            # bare function such as `count`
+            name = token.value
+            i += 1
+        else:
+            i += 1
+            continue
+        if i + 1 < len(tokens) and tokens[i].kind == WORD and tokens[i].value.lower() == 'as':
+            name = tokens[i + 1].value
+            i += 2
+        outputs.append(name)
+    return inputs, outputs
+
+
+def _parse_stats(command: str, tokens: list) -> tuple:
+    tokens = [token for token in tokens if token.kind != MACRO]
+    tokens, _ = _strip_options(tokens, {'summariesonly', 'allow_old_summaries', 'fillnull_value', 'prestats',
+                                        'local', 'append', 'chunk_size', 'include_reduced_buckets', 'dedup_splitvals',
+                                        'allnum', 'delim', 'partitions', 'window', 'global', 'current', 'reset_on_change',
+                                        'time_window', 'span', 'limit', 'useother', 'usenull', 'bins', 'cont',
+                                        'fixedrange', 'format', 'minspan', 'agg'})
+    by = _index_of_word(tokens, {'by', 'over'})
+    by_tokens = tokens[by + 1:] if by >= 0 else []
+    head = tokens[:by] if by >= 0 else tokens
+    inputs = []
+    if command in ('tstats', 'mstats'):
+        where = _index_of_word(head, {'where'})
+        if where >= 0:
+            # the where clause of tstats uses search syntax, so right-hand sides are literals
+            inputs.extend(_parse_search(head[where + 1:])[0])
+            head = head[:where]
+        source = _index_of_word(head, {'from'})
+        if source >= 0:
+            head = head[:source]
+    agg_inputs, outputs = _parse_aggregations(head)
+    by_tokens, _ = _strip_options(by_tokens)
+    by_fields = _field_list(by_tokens)
+    return _unique(inputs + agg_inputs + by_fields), _unique(by_fields + outputs)
+
+
+def _parse_eval(tokens: list) -> tuple:
+    inputs, outputs = [], []
+    for assignment in _split_top_level(tokens):
+        if len(assignment) >= 2 and assignment[1].kind == OP and assignment[1].value == '=':
+            outputs.append(assignment[0].value)
+            inputs.extend(_expression_fields(assignment[2:]))
+        else:
+            inputs.extend(_expression_fields(assignment))
+    return _unique(inputs), _unique(outputs)
+
+
+def _parse_rename(tokens: list) -> tuple:
+    inputs, outputs = [], []
+    for i, token in enumerate(tokens):
+        if token.kind == WORD and token.value.lower() == 'as' and 0 < i < len(tokens) - 1:
+            inputs.append(tokens[i - 1].value)
+            outputs.append(tokens[i + 1].value)
+    return inputs, outputs
+
+
+def _parse_lookup(tokens: list) -> tuple:
+    tokens, _ = _strip_options(tokens, {'local', 'update', 'event_time_field'})
+    if not tokens:
+        return [], []
+    tokens = tokens[1:]  # lookup table name
+    output = _index_of_word(tokens, {'output', 'outputnew'})
+    match_tokens = tokens[:output] if output >= 0 else tokens
+    output_tokens = tokens[output + 1:] if output >= 0 else []
+
+    def resolve(part, take_alias):
+        names = []
+        for item in _split_top_level(part):
+            words = [t for t in item if t.kind != COMMA]
+            i = 0
+            while i < len(words):
+                if i + 2 < len(words) and words[i + 1].value.lower() == 'as':
+                    names.append(words[i + 2].value if take_alias else words[i].value)
+                    i += 3
+                else:
+                    names.append(words[i].value)
+                    i += 1
+        return names
+
+    # `lookup table lookup_field AS event_field OUTPUT lookup_out AS event_out`
+    return _unique(resolve(match_tokens, True)), _unique(resolve(output_tokens, True))
+
+
+def _parse_search(tokens: list) -> tuple:
+    inputs = []
+    for i, token in enumerate(tokens):
+        if not _is_identifier(token) or i + 1 >= len(tokens):
+            continue
+        following = tokens[i + 1]
+        if following.kind == OP or (following.kind == WORD and following.value.lower() == 'in'):
+            inputs.append(token.value)
+    return _unique(f for f in inputs if f.lower() not in _SEARCH_METADATA), []
+
+
+def _parse_rex(tokens: list) -> tuple:
+    tokens, options = _strip_options(tokens, {'field', 'mode', 'max_match', 'offset_field'})
+    source = options.get('field', '_raw')
+    if options.get('mode') == 'sed':
+        return [source], [source]
+    outputs = []
+    for token in tokens:
+        if token.kind == STRING:
+            outputs.extend(_NAMED_GROUP.findall(token.value))
+    return [source], _unique(outputs)
+
+
+def _parse_convert(tokens: list) -> tuple:
+    tokens, _ = _strip_options(tokens, {'timeformat'})
+    inputs, outputs = _parse_aggregations(tokens)
+    # without an alias convert writes back into the converted field
+    outputs = [inputs[n] if '(' in name and n < len(inputs) else name for n, name in enumerate(outputs)]
+    return _unique(inputs), _unique(outputs)
+
+
+def _parse_top(tokens: list) -> tuple:
+    tokens, _ = _strip_options(tokens)
+    by = _index_of_word(tokens, {'by'})
+    fields = _field_list(tokens[:by] if by >= 0 else tokens)
+    by_fields = _field_list(tokens[by + 1:]) if by >= 0 else []
+    return _unique(fields + by_fields), _unique(by_fields + fields + ['count', 'percent'])
+
+
+def _parse_bin(tokens: list) -> tuple:
+    tokens, _ = _strip_options(tokens)
+    fields = _field_list(tokens)
+    if not fields:
+        return [], []
+    alias = _index_of_word(tokens, {'as'})
+    output = tokens[alias + 1].value if 0 <= alias < len(tokens) - 1 else fields[0]
+    return [fields[0]], [output]
+
+
+def _parse_field_list(command: str, tokens: list) -> tuple:
+    tokens, options = _strip_options(tokens)
+    if tokens and tokens[0].kind == WORD and tokens[0].value in ('-', '+'):
+        removed = tokens[0].value == '-'
+        tokens = tokens[1:]
+    else:
+        removed = False
+    if command in ('sort', 'dedup'):
+        sortby = _index_of_word(tokens, {'sortby'})
+        if sortby >= 0:
+            tokens = tokens[:sortby] + tokens[sortby + 1:]
+        values = []
+        for token in tokens:
+            if token.kind == WORD and not _NUMBER.match(token.value) and token.value.lower() not in ('num', 'str', 'ip', 'auto'):
+                values.append(token.value.lstrip('+-'))
+        fields = [f for f in values if f]
+        return _unique(fields), []
+    fields = _field_list(tokens)
+    if command == 'fillnull':
+        return _unique(fields), _unique(fields)
+    if command in ('mvexpand', 'makemv', 'filldown', 'mvcombine'):
+        return _unique(fields), _unique(fields)
+    if command == 'fields' and removed:
+        return _unique(fields), []
+    return _unique(fields), _unique(fields)
+
+
+def _parse_join(tokens: list) -> tuple:
+    depth, outside = 0, []
+    for token in tokens:
+        if token.kind == LBRACKET:
+            depth += 1
+        elif token.kind == RBRACKET:
+            depth -= 1
+        elif depth == 0:
+            outside.append(token)
+    outside, _ = _strip_options(outside)
+    return _unique(_field_list(outside)), []
+
+
+def _parse_spath(tokens: list) -> tuple:
+    tokens, options = _strip_options(tokens, {'input', 'output', 'path'})
+    output = options.get('output') or options.get('path') or (tokens[0].value if tokens else None)
+    return [options.get('input', '_raw')], [output] if output else []
+
+
+def _parse_strcat(tokens: list) -> tuple:
+    tokens, _ = _strip_options(tokens, {'allrequired'})
+    fields = [token.value for token in tokens if _is_identifier(token)]
+    if not fields:
+        return [], []
+    return _unique(fields[:-1]), [fields[-1]]
+
+
+def _parse_iplocation(tokens: list) -> tuple:
+    tokens, options = _strip_options(tokens, {'prefix', 'allfields', 'lang'})
+    fields = _field_list(tokens)
+    prefix = options.get('prefix', '')
+    return fields[:1], [prefix + name for name in ('City', 'Country', 'Region', 'lat', 'lon')]
+
+
+def _parse_replace(tokens: list) -> tuple:
+    target = _index_of_word(tokens, {'in'})
+    fields = _field_list(tokens[target + 1:]) if target >= 0 else []
+    return fields, fields
+
+
+def _parse_transaction(tokens: list) -> tuple:
+    tokens, _ = _strip_options(tokens)
+    return _unique(_field_list(tokens)), ['duration', 'eventcount']
+
+
+def _parse_macro(text: str):
+    match = re.match(r'^`([\w-]+)(?:\((.*)\))?`$', text.strip(), re.DOTALL)
+    if not match:
+        return None
+    name, args = match.group(1), [a.strip().strip('"') for a in (match.group(2) or '').split(',') if a.strip()]
+    if name.endswith('_filter'):
+        return ParsedPipe('macro', 'FILTER', [], [], text=text)
+    if name == 'drop_dm_object_name' and args:
+        return ParsedPipe('macro', 'RENAME', [f"{args[0]}.*"], ['*'], text=text)
+    if name == 'security_content_ctime' and args:
+        return ParsedPipe('macro', 'TRANSFORM', args[:1], args[:1], text=text)
+    return None
+
+
+_HANDLERS = {
+    'eval': _parse_eval, 'rename': _parse_rename, 'lookup': _parse_lookup, 'rex': _parse_rex,
+    'search': _parse_search, 'where': lambda tokens: (_unique(_expression_fields(tokens)), []),
+    'regex': _parse_search, 'convert': _parse_convert, 'top': _parse_top, 'rare': _parse_top,
+    'bin': _parse_bin, 'bucket': _parse_bin, 'join': _parse_join, 'spath': _parse_spath, 'strcat': _parse_strcat,
+    'iplocation': _parse_iplocation, 'transaction': _parse_transaction, 'replace': _parse_replace,
+    'fromjson': lambda tokens: (_field_list(tokens)[:1], []),
+}
+_FIELD_LIST_COMMANDS = {'table', 'fields', 'sort', 'dedup', 'fillnull', 'mvexpand', 'makemv', 'filldown',
+                        'mvcombine'}
+_NO_FIELD_COMMANDS = {'head', 'tail', 'append', 'appendcols', 'appendpipe', 'union', 'multisearch', 'inputlookup',
+                      'outputlookup', 'collect', 'addinfo', 'extract', 'kv', 'xmlkv', 'datamodel', 'sendalert',
+                      'fit', 'apply', 'predict', 'anomalydetection', 'map', 'fieldformat', 'foreach', 'addtotals'}
+
+
+def parse_pipe(pipe: str):
+    """
+    Classify one pipe into a DSL_KEYWORD category and extract its input/output fields.
+
+    Returns a ParsedPipe, or None when the command (or macro) is unknown or the pipe cannot be tokenized,
+    in which case callers fall back to the LLM.
+    """
+    text = pipe.strip()
+    if not text:
+        return None
+    try:
+        tokens = tokenize(text)
+    except SPLSyntaxError:
+        return None
+    if not tokens:
+        return None
+    first = tokens[0]
+    if first.kind == MACRO and len(tokens) == 1:
+        return _parse_macro(text)
+    if first.kind == MACRO:
+        # a data source macro followed by search terms, e.g. `sysmon` EventCode=1
+        command, args = 'search', tokens[1:]
+    elif first.kind == WORD and first.value.lower() in COMMAND_KEYWORDS:
+        command, args = first.value.lower(), tokens[1:]
+    elif first.kind in (STRING, LPAREN) or (first.kind == WORD and (first.value.upper() == 'NOT' or (
+            len(tokens) > 1 and (tokens[1].kind == OP or tokens[1].value.upper() == 'IN')))):
+        # leading search terms such as `index=main EventCode=4688` are an implicit search command
+        command, args = 'search', tokens
+    else:
+        return None
+
+    if command in _STATS_COMMANDS:
+        inputs, outputs = _parse_stats(command, args)
+    elif command in _HANDLERS:
+        inputs, outputs = _HANDLERS[command](args)
+    elif command in _FIELD_LIST_COMMANDS:
+        inputs, outputs = _parse_field_list(command, args)
+    elif command in _NO_FIELD_COMMANDS:
+        inputs, outputs = [], []
+    else:
+        return None
+    return ParsedPipe(command, COMMAND_KEYWORDS[command], inputs, outputs, args=args, text=text)
+
+
+def parse_search(search: str) -> list:
+    """Parse every pipe of a search; unknown pipes are returned as None."""
+    return [parse_pipe(pipe) for pipe in split_pipes(search)]
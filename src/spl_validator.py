@@ -0,0 +1,254 @@
+from dataclasses import dataclass, field, asdict
+from src.macros import macro_index, parse_macro_call
+from src.spl_parser import (tokenize, code_fence, SPLSyntaxError, COMMAND_KEYWORDS, WORD, STRING, FIELD, MACRO, OP,
+                            COMMA, LPAREN, RPAREN, LBRACKET, RBRACKET, PIPE, _NAMED_GROUP, _index_of_word,
+                            _split_top_level, _strip_options)
+
+# commands that produce events themselves and therefore have to start the search (after a leading '|')
+GENERATING_COMMANDS = {'tstats', 'mstats', 'inputlookup', 'makeresults', 'rest', 'metadata', 'from', 'datamodel',
+                       'dbinspect', 'eventcount', 'inputcsv', 'loadjob', 'savedsearch', 'gentimes', 'pivot',
+                       'multisearch', 'union', 'search', 'mpreview', 'ldapsearch'}
+KNOWN_COMMANDS = set(COMMAND_KEYWORDS) | GENERATING_COMMANDS | {
+    'abstract', 'accum', 'addcoltotals', 'addinfo', 'analyzefields', 'anomalies', 'anomalousvalue', 'arules',
+    'associate', 'autoregress', 'bucketdir', 'cluster', 'cofilter', 'collapse', 'concurrency', 'contingency',
+    'correlate', 'delta', 'diff', 'entitymerge', 'erex', 'eventstats', 'findtypes', 'folderize', 'format',
+    'geom', 'geomfilter', 'geostats', 'highlight', 'history', 'iconify', 'inputcsv', 'iplocation', 'kmeans',
+    'kvform', 'localize', 'localop', 'makecontinuous', 'makejson', 'mcollect', 'meventcollect', 'mvcombine',
+    'nomv', 'outlier', 'outputcsv', 'outputtext', 'overlap', 'rangemap', 'redistribute', 'regex', 'reltime',
+    'return', 'reverse', 'rtorder', 'sample', 'score', 'script', 'scrub', 'searchtxn', 'selfjoin', 'sendemail',
+    'set', 'setfields', 'sichart', 'sirare', 'sistats', 'sitimechart', 'sitop', 'summary', 'summaryindex',
+    'tags', 'timewrap', 'tojson', 'transpose', 'trendline', 'tscollect', 'typeahead', 'typelearner', 'typer',
+    'uniq', 'untable', 'walklex', 'x11', 'xmlunescape', 'xpath', 'xyseries', 'fieldsummary', 'ldapfilter',
+    'ldapgroup', 'ldapfetch', 'require', 'streamstats', 'distinct', 'inputintelligence', 'ctable', 'counttable',
+    'multikv', 'cyberchef',
+}
+# macros shipped with Splunk ES / CIM rather than with the detections
+EXTERNAL_MACROS = {'drop_dm_object_name': 1, 'get_asset': 1, 'get_identity4events': 1,
+                   'cim_corporate_web_domain_search': 1}
+_STATS_LIKE = {'stats', 'eventstats', 'streamstats', 'chart', 'timechart', 'tstats', 'mstats', 'sistats',
+               'sichart', 'sitimechart', 'geostats'}
+_FIELD_REQUIRED = {'table', 'dedup', 'mvexpand', 'makemv', 'bin', 'bucket', 'top', 'rare', 'nomv', 'mvcombine'}
+_SUBSEARCH_REQUIRED = {'join', 'append', 'appendcols', 'appendpipe'}
+_BOOLEAN_WORDS = {'and', 'or', 'xor', 'not'}
+# words that cannot end a pipe
+_DANGLING_WORDS = _BOOLEAN_WORDS | {'where', 'as'}
+
+
+@dataclass
+class SPLError:
+    message: str
+    position: int = None
+    command: str = None
+
+    def __str__(self):
+        where = f" at position {self.position}" if self.position is not None else ""
+        return f"{self.command or 'search'}{where}: {self.message}"
+
+
+@dataclass
+class ValidationResult:
+    valid: bool
+    errors: list = field(default_factory=list)
+    source: str = 'local'
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+    def __str__(self):
+        if self.valid:
+            return f"SPL grammar is correct ({self.source} check)"
+        return "SPL grammar errors:\n" + "\n".join(f"- {error}" for error in self.errors)
+
+
+def _check_macro(token, offset: int, command: str) -> list:
+    call = parse_macro_call(token.value)
+    if call is None:
+        return [SPLError(f"malformed macro reference `{token.value}`", offset + token.pos, command)]
+    name, args = call
+    if name.endswith('_filter'):
+        # per-detection tuning macros, empty by default
+        return []
+    if macro_index.get(name, len(args)) is not None or EXTERNAL_MACROS.get(name) == len(args):
+        return []
+    arity = macro_index.arities().get(name, EXTERNAL_MACROS.get(name))
+    if arity is None:
+        return [SPLError(f"unknown macro `{name}`", offset + token.pos, command)]
+    return [SPLError(f"macro `{name}` expects {arity} argument(s), got {len(args)}", offset + token.pos, command)]
+
+
+def _balance(tokens: list, offset: int) -> list:
+    pairs = {RPAREN: LPAREN, RBRACKET: LBRACKET}
+    stack = []
+    for token in tokens:
+        if token.kind in (LPAREN, LBRACKET):
+            stack.append(token)
+        elif token.kind in pairs:
+            if not stack or stack[-1].kind != pairs[token.kind]:
+                return [SPLError(f"unexpected {token.value!r}", offset + token.pos)]
+            stack.pop()
+    return [SPLError(f"unclosed {token.value!r}", offset + token.pos) for token in stack]
+
+
+def _segments(tokens: list) -> list:
+    """Top-level pipe segments as (pipe token or None, tokens, nested subsearches)."""
+    segments, current, subsearches, pipe, depth, open_bracket = [], [], [], None, 0, None
+    for token in tokens:
+        if depth == 0 and token.kind == PIPE:
+            segments.append((pipe, current, subsearches))
+            current, subsearches, pipe = [], [], token
+            continue
+        if token.kind in (LPAREN, LBRACKET):
+            if depth == 0 and token.kind == LBRACKET:
+                open_bracket = token
+            depth += 1
+        elif token.kind in (RPAREN, RBRACKET):
+            depth -= 1
+            if depth == 0 and token.kind == RBRACKET:
+                subsearches.append((open_bracket, token))
+        current.append(token)
+    segments.append((pipe, current, subsearches))
+    return segments
+
+
+def _top_level(tokens: list) -> list:
+    # drop everything nested inside parentheses or subsearch brackets
+    result, depth = [], 0
+    for token in tokens:
+        if token.kind in (RPAREN, RBRACKET):
+            depth -= 1
+        if depth == 0:
+            result.append(token)
+        if token.kind in (LPAREN, LBRACKET):
+            depth += 1
+    return result
+
+
+def _check_arguments(command: str, args: list, has_subsearch: bool) -> list:
+    """Return (message, token) pairs for argument shapes that Splunk would reject."""
+    problems = []
+    anchor = args[0] if args else None
+    if command in _STATS_LIKE:
+        plain, _ = _strip_options([t for t in args if t.kind != MACRO])
+        by = _index_of_word(plain, {'by', 'over'})
+        head = plain[:by] if by >= 0 else plain
+        if command in ('tstats', 'mstats'):
+            for words in ({'where'}, {'from'}):
+                cut = _index_of_word(head, words)
+                head = head[:cut] if cut >= 0 else head
+        if not any(t.kind == WORD and t.value.lower() not in _BOOLEAN_WORDS for t in head):
+            problems.append(("expects at least one aggregation function", anchor))
+        if by >= 0 and by == len(plain) - 1:
+            problems.append((f"expects fields after {plain[by].value!r}", plain[by]))
+    elif command == 'eval':
+        if not args:
+            problems.append(("expects <field>=<expression>", anchor))
+        for assignment in _split_top_level(args):
+            if len(assignment) < 3 or assignment[0].kind not in (WORD, FIELD, STRING) or \
+                    assignment[1].kind != OP or assignment[1].value != '=':
+                problems.append(("expects <field>=<expression>", assignment[0]))
+    elif command == 'where':
+        if not args:
+            problems.append(("expects a boolean expression", anchor))
+    elif command == 'rename':
+        words = [t for t in args if t.kind != COMMA]
+        if not words or len(words) % 3 or any(words[i].value.lower() != 'as' for i in range(1, len(words), 3)):
+            problems.append(("expects <field> AS <new_name>[, ...]", anchor))
+    elif command == 'rex':
+        plain, options = _strip_options(args, {'field', 'mode', 'max_match', 'offset_field'})
+        regexes = [t for t in plain if t.kind == STRING]
+        if not regexes:
+            problems.append(("expects a regular expression in double quotes", anchor))
+        elif options.get('mode') != 'sed' and not _NAMED_GROUP.search(regexes[0].value):
+            problems.append(("regular expression does not extract anything, it needs a named group (?<name>...)",
+                             regexes[0]))
+    elif command == 'lookup':
+        plain, _ = _strip_options(args, {'local', 'update', 'event_time_field'})
+        if len(plain) < 2:
+            problems.append(("expects a lookup name followed by at least one field", anchor))
+    elif command in _FIELD_REQUIRED:
+        plain, _ = _strip_options(args)
+        if not plain:
+            problems.append(("expects at least one field", anchor))
+    elif command in _SUBSEARCH_REQUIRED and not has_subsearch:
+        problems.append(("expects a subsearch in [ ]", anchor))
+    return problems
+
+
+def _validate(search: str, offset: int, errors: list, subsearch: bool = False):
+    try:
+        tokens = tokenize(search)
+    except SPLSyntaxError as e:
+        errors.append(SPLError(e.message, offset + e.position))
+        return
+    balance = _balance(tokens, offset)
+    if balance:
+        errors.extend(balance)
+        return
+    segments = _segments(tokens)
+    leading_pipe = len(segments) > 1 and not segments[0][1] and segments[0][0] is None
+    if leading_pipe:
+        segments = segments[1:]
+    for index, (pipe, segment, subsearches) in enumerate(segments):
+        if not segment:
+            position = offset + (pipe.pos if pipe is not None else 0)
+            errors.append(SPLError("empty pipe", position))
+            continue
+        first = segment[0]
+        command = first.value.lower() if first.kind == WORD else None
+        if first.kind == MACRO:
+            command, args = 'macro', segment
+        elif index == 0 and not leading_pipe:
+            if command in GENERATING_COMMANDS and command != 'search' and not subsearch:
+                errors.append(SPLError("generating command must be preceded by '|'", offset + first.pos, command))
+                continue
+            if command in GENERATING_COMMANDS:
+                # subsearches may start with a generating command without the leading '|'
+                args = segment[1:]
+            else:
+                # leading search terms form an implicit search command
+                command, args = 'search', segment
+        elif command in KNOWN_COMMANDS:
+            args = segment[1:]
+            if index > 0 and command in GENERATING_COMMANDS - {'search', 'union', 'multisearch', 'makeresults'}:
+                _, options = _strip_options(args, {'append', 'prestats'})
+                if options.get('append', 'f').lower() not in ('t', 'true', '1'):
+                    errors.append(SPLError("generating command can only be used as the first command",
+                                           offset + first.pos, command))
+        else:
+            name = first.value if first.kind in (WORD, STRING) else first.kind
+            errors.append(SPLError(f"unknown search command {name!r}", offset + first.pos, name))
+            continue
+
+        for token in segment:
+            if token.kind == MACRO:
+                errors.extend(_check_macro(token, offset, command))
+        top = _top_level(args)
+        if top and (top[-1].kind == OP or (top[-1].kind == WORD and top[-1].value.lower() in _DANGLING_WORDS)):
+            errors.append(SPLError(f"expression ends with {top[-1].value!r}", offset + top[-1].pos, command))
+        for message, token in _check_arguments(command, top, bool(subsearches)):
+            position = token.pos if token is not None else first.pos
+            errors.append(SPLError(message, offset + position, command))
+        for open_bracket, close_bracket in subsearches:
+            inner = search[open_bracket.pos + 1:close_bracket.pos]
+            if not inner.strip():
+                errors.append(SPLError("empty subsearch", offset + open_bracket.pos, command))
+            else:
+                _validate(inner, offset + open_bracket.pos + 1, errors, subsearch=True)
+
+
+def validate_spl(search: str) -> ValidationResult:
+    """
+    Check an SPL search locally: quotes, brackets and parentheses, known commands and where generating commands
+    may appear, the argument shapes of common commands, and macro references against dataset/macros.
+    """
+    errors = []
+    fence = code_fence(search)
+    if not search or not search.strip():
+        errors.append(SPLError("empty search", 0))
+    elif fence is not None:
+        # LLM output passed on as is; the fence would otherwise read as a ```comment``` hiding the whole search
+        errors.append(SPLError("rule is wrapped in a Markdown code fence, pass only the search inside it",
+                               fence.start()))
+    else:
+        _validate(search, 0, errors)
+    return ValidationResult(valid=not errors, errors=errors)
@@ -0,0 +1,162 @@
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from src.splunk_session import SplunkSession, splunk_session
+import asyncio
+import logging
+import os
+import time
+
+load_dotenv()
+
+DEFAULT_EARLIEST_TIME = os.getenv("SPLUNK_EARLIEST_TIME") or "-24h"
+DEFAULT_LATEST_TIME = os.getenv("SPLUNK_LATEST_TIME") or "now"
+
+
+class SplunkJobError(Exception):
+    def __init__(self, message: str, sid: str = None, messages: list = None):
+        super().__init__(message)
+        self.sid = sid
+        self.messages = messages or []
+
+
+class SplunkJobManager:
+    """
+    Non-blocking Splunk search jobs: submit with exec_mode=normal, poll the job status with exponential backoff,
+    then page through the results as JSON (count/offset) instead of one blocking call and a full XML payload.
+
+    run_many() and run_async() run several feasibility checks at once; searches are bounded by
+    earliest_time/latest_time (SPLUNK_EARLIEST_TIME/SPLUNK_LATEST_TIME, last 24h by default) so that a check
+    never scans all time unless asked to.
+    """
+
+    def __init__(self, session: SplunkSession = splunk_session, earliest_time: str = DEFAULT_EARLIEST_TIME,
+                 latest_time: str = DEFAULT_LATEST_TIME, page_size: int = 1000, poll_interval: float = 0.2,
+                 max_poll_interval: float = 5, timeout: float = 300, max_concurrent: int = 8):
+        self.session = session
+        self.earliest_time = earliest_time
+        self.latest_time = latest_time
+        self.page_size = page_size
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.timeout = timeout
+        self.max_concurrent = max_concurrent
+
+    @staticmethod
+    def _search_string(spl: str) -> str:
+        spl = spl.strip()
+        # generating commands (| tstats, | inputlookup, ...) must not get the implicit search prefix
+        return spl if spl.startswith("|") or spl.startswith("search ") else f"search {spl}"
+
+    def submit(self, spl: str, earliest_time: str = None, latest_time: str = None) -> str:
+        data = {"search": self._search_string(spl), "exec_mode": "normal", "output_mode": "json"}
+        earliest_time = earliest_time or self.earliest_time
+        latest_time = latest_time or self.latest_time
+        if earliest_time:
+            data["earliest_time"] = earliest_time
+        if latest_time:
+            data["latest_time"] = latest_time
+        response = self.session.post("search/jobs", data=data)
+        if response.status_code != 201:
+            raise SplunkJobError(f"Error creating search job ({response.status_code}): {response.text}",
+                                 messages=self._messages(response))
+        return response.json()["sid"]
+
+    @staticmethod
+    def _messages(response) -> list:
+        try:
+            return response.json().get("messages") or []
+        except ValueError:
+            return []
+
+    def status(self, sid: str) -> dict:
+        response = self.session.get(f"search/jobs/{sid}", params={"output_mode": "json"})
+        if response.status_code != 200:
+            raise SplunkJobError(f"Error reading job status ({response.status_code}): {response.text}", sid)
+        content = response.json()["entry"][0]["content"]
+        if content.get("isFailed") or content.get("dispatchState") == "FAILED":
+            messages = content.get("messages") or []
+            raise SplunkJobError(f"Search job {sid} failed: {messages}", sid, messages)
+        return content
+
+    def cancel(self, sid: str):
+        try:
+            self.session.post(f"search/jobs/{sid}/control", data={"action": "cancel"})
+        except Exception as e:
+            logging.warning(f"Failed to cancel search job {sid}: {e}")
+
+    def _next_interval(self, interval: float) -> float:
+        return min(interval * 2, self.max_poll_interval)
+
+    def wait(self, sid: str) -> dict:
+        deadline = time.monotonic() + self.timeout
+        interval = self.poll_interval
+        while True:
+            content = self.status(sid)
+            if content.get("isDone"):
+                return content
+            if time.monotonic() >= deadline:
+                self.cancel(sid)
+                raise SplunkJobError(f"Search job {sid} did not finish within {self.timeout}s", sid)
+            time.sleep(interval)
+            interval = self._next_interval(interval)
+
+    def _page(self, sid: str, offset: int, count: int) -> list:
+        response = self.session.get(f"search/jobs/{sid}/results",
+                                    params={"output_mode": "json", "count": count, "offset": offset})
+        if response.status_code == 204:
+            return []
+        if response.status_code != 200:
+            raise SplunkJobError(f"Error retrieving search results ({response.status_code}): {response.text}", sid)
+        return response.json().get("results") or []
+
+    def iter_results(self, sid: str, max_results: int = None):
+        offset = 0
+        while max_results is None or offset < max_results:
+            count = self.page_size if max_results is None else min(self.page_size, max_results - offset)
+            page = self._page(sid, offset, count)
+            yield from page
+            if len(page) < count:
+                return
+            offset += len(page)
+
+    def run(self, spl: str, earliest_time: str = None, latest_time: str = None, max_results: int = None) -> dict:
+        sid = self.submit(spl, earliest_time, latest_time)
+        content = self.wait(sid)
+        return {"sid": sid, "result_count": content.get("resultCount", 0), "messages": content.get("messages") or [],
+                "results": list(self.iter_results(sid, max_results))}
+
+    def run_many(self, queries: list, **kwargs) -> list:
+        """Run several searches concurrently; failed searches come back as their SplunkJobError."""
+        def run_one(spl):
+            try:
+                return self.run(spl, **kwargs)
+            except SplunkJobError as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrent) as executor:
+            return list(executor.map(run_one, queries))
+
+    async def run_async(self, spl: str, earliest_time: str = None, latest_time: str = None,
+                        max_results: int = None) -> dict:
+        # the HTTP calls run in worker threads, the waits between polls do not hold a thread
+        sid = await asyncio.to_thread(self.submit, spl, earliest_time, latest_time)
+        try:
+            deadline = time.monotonic() + self.timeout
+            interval = self.poll_interval
+            while True:
+                content = await asyncio.to_thread(self.status, sid)
+                if content.get("isDone"):
+                    break
+                if time.monotonic() >= deadline:
+                    raise SplunkJobError(f"Search job {sid} did not finish within {self.timeout}s", sid)
+                await asyncio.sleep(interval)
+                interval = self._next_interval(interval)
+        except (SplunkJobError, asyncio.CancelledError):
+            await asyncio.to_thread(self.cancel, sid)
+            raise
+        results = await asyncio.to_thread(lambda: list(self.iter_results(sid, max_results)))
+        return {"sid": sid, "result_count": content.get("resultCount", 0), "messages": content.get("messages") or [],
+                "results": results}
+
+
+job_manager = SplunkJobManager()
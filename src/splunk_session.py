@@ -0,0 +1,143 @@
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from src.config import env_flag
+import io
+import logging
+import os
+import requests
+import splunklib.binding as binding
+import splunklib.client as client
+import threading
+import time
+import urllib3
+
+load_dotenv()
+
+
+class SplunkAuthError(Exception):
+    pass
+
+
+class SplunkSession:
+    """
+    Long-lived connection to the Splunk management API shared by every tool call.
+
+    All requests go through one pooled requests.Session (keep-alive, one TLS handshake per pooled connection).
+    Authentication uses SPLUNK_TOKEN as a bearer token when set; otherwise it logs in once with
+    SPLUNK_USERNAME/SPLUNK_PASSWORD and reuses the session key until it expires (or a request comes back 401),
+    then logs in again. The splunklib service returned by service() is created once and sends its requests
+    through the same pool and session key.
+    """
+
+    def __init__(self, host: str, port, username: str = None, password: str = None, token: str = None,
+                 scheme: str = "https", verify: bool = False, session_ttl: float = 3000, pool_size: int = 16,
+                 timeout: float = 60):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.token = token
+        self.scheme = scheme
+        self.verify = verify
+        # Splunk session keys expire after the server's sessionTimeout (1h by default) of inactivity
+        self.session_ttl = session_ttl
+        self.timeout = timeout
+        self.logins = 0
+        self._session_key = None
+        self._expires_at = 0.0
+        self._service = None
+        self._lock = threading.Lock()
+        self.http = requests.Session()
+        self.http.verify = verify
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+        if not verify:
+            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    @property
+    def configured(self) -> bool:
+        # .env.example placeholders such as <SPLUNK_URL> count as unset
+        return bool(self.host) and not self.host.startswith('<')
+
+    @classmethod
+    def from_env(cls) -> "SplunkSession":
+        return cls(
+            host=os.getenv("SPLUNK_HOST"),
+            port=os.getenv("SPLUNK_PORT"),
+            username=os.getenv("SPLUNK_USERNAME"),
+            password=os.getenv("SPLUNK_PASSWORD"),
+            token=os.getenv("SPLUNK_TOKEN") or None,
+            scheme=os.getenv("SPLUNK_SCHEME") or "https",
+            verify=env_flag("SPLUNK_VERIFY_SSL", False),
+            session_ttl=float(os.getenv("SPLUNK_SESSION_TTL") or 3000),
+            pool_size=int(os.getenv("SPLUNK_POOL_SIZE") or 16),
+        )
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.scheme}://{self.host}:{self.port}"
+
+    def _login(self) -> str:
+        response = self.http.post(f"{self.base_url}/services/auth/login", timeout=self.timeout,
+                                  data={"username": self.username, "password": self.password, "output_mode": "json"})
+        if response.status_code != 200:
+            raise SplunkAuthError(f"Splunk login failed with status {response.status_code}: {response.text}")
+        self.logins += 1
+        logging.info(f"Logged in to Splunk at {self.base_url}")
+        return response.json()["sessionKey"]
+
+    def session_key(self, refresh: bool = False) -> str:
+        with self._lock:
+            if refresh or self._session_key is None or time.monotonic() >= self._expires_at:
+                self._session_key = self._login()
+            # every authenticated request resets the server-side inactivity timeout
+            self._expires_at = time.monotonic() + self.session_ttl
+            return self._session_key
+
+    def auth_header(self, refresh: bool = False) -> str:
+        if self.token:
+            return f"Bearer {self.token}"
+        return f"Splunk {self.session_key(refresh)}"
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """Authenticated request against /services/<path>; a 401 refreshes the session key and retries once."""
+        url = path if path.startswith("http") else f"{self.base_url}/services/{path.lstrip('/')}"
+        headers = kwargs.pop("headers", None) or {}
+        kwargs.setdefault("timeout", self.timeout)
+        response = self.http.request(method, url, headers={**headers, "Authorization": self.auth_header()}, **kwargs)
+        if response.status_code == 401 and not self.token:
+            response = self.http.request(method, url, headers={**headers, "Authorization": self.auth_header(True)},
+                                         **kwargs)
+        return response
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def _splunklib_handler(self, url, message, **kwargs):
+        # splunklib opens a fresh connection per request by default; route it through the pooled session instead
+        headers = {key: value for key, value in message["headers"] if key.lower() != "authorization"}
+        response = self.request(message.get("method", "GET"), url, headers=headers, data=message.get("body") or None)
+        return {
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": list(response.headers.items()),
+            "body": binding.ResponseReader(io.BytesIO(response.content)),
+        }
+
+    def service(self) -> client.Service:
+        with self._lock:
+            if self._service is None:
+                # the handler injects the current credentials, the token here only marks the service as logged in
+                self._service = client.Service(host=self.host, port=self.port, scheme=self.scheme,
+                                               token="Splunk pooled", handler=self._splunklib_handler)
+            return self._service
+
+    def close(self):
+        self.http.close()
+
+
+splunk_session = SplunkSession.from_env()
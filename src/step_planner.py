@@ -0,0 +1,86 @@
+from dotenv import load_dotenv
+import logging
+import os
+import re
+
+load_dotenv()
+
+ALL_STEPS = [
+    'UNDERSTANDING_PROBLEM', 'IDENTIFY_DATA_SOURCE', 'DEFINE_INITIAL_FILTERS',
+    'EXTRACT_RELEVANT_FIELDS', 'PERFORM_DATA_AGGREGATION', 'CALCULATE_DERIVED_METRICS',
+    'FILTER_ANOMALIES', 'OPTIMIZE_OUTPUT'
+]
+# every rule needs a source, a filter and an output
+CORE_STEPS = {'IDENTIFY_DATA_SOURCE', 'DEFINE_INITIAL_FILTERS', 'OPTIMIZE_OUTPUT'}
+
+# words in the description that make an optional step worth an LLM round trip
+STEP_CUES = {
+    'EXTRACT_RELEVANT_FIELDS': r'extract|pars(e|es|ing)|regex|regular expression|rex\b|substring|decod|split|'
+                               r'helper field|new field|url|domain|path|command[- ]?line|argument',
+    'PERFORM_DATA_AGGREGATION': r'count|stats|aggregat|group|sum\b|total|distinct|number of|per (host|user|dest)|'
+                                r'by (host|user|dest|src)|tstats|data ?model|values|summar|occurrence|'
+                                r'first (seen|time)|last seen',
+    'CALCULATE_DERIVED_METRICS': r'ratio|rate\b|percent|average|\bavg\b|mean|median|deviation|stdev|variance|'
+                                 r'score|entropy|length|difference|duration|time between|calculat|comput|'
+                                 r'derive|z-?score|percentile',
+    'FILTER_ANOMALIES': r'threshold|exceed|more than|greater than|less than|at least|above|below|anomal|outlier|'
+                        r'unusual|spike|rare|baseline|deviat|first (seen|time)|[<>]=?\s*\d|\d+\s*(or more|times)',
+}
+_COMPILED_CUES = {step: re.compile(pattern, re.IGNORECASE) for step, pattern in STEP_CUES.items()}
+# cues that something beyond filter-and-count is going on; any of them keeps UNDERSTANDING_PROBLEM
+_COMPLEX_CUES = re.compile(r'correlat|sequence|followed by|within \d+|multiple stages|subsearch|join|lookup|'
+                           r'compar|baseline|machine learning|behavio', re.IGNORECASE)
+
+# breakdown answers that say the step does not apply; their DSL translation is skipped. The phrase has to be the
+# whole opening sentence, so "Filter where ParentImage is not none" is not mistaken for one
+_NOTHING_TO_ADD = re.compile(r'(none|n/a|not applicable|nothing (else |more |further )?to add|'
+                             r'no (additional|further|specific|derived|extra|new)\b[\w\s/-]{0,60}|'
+                             r'(this step|this|it|that|\w+( \w+)?) (is|are) not (needed|required|necessary|'
+                             r'applicable|mentioned)( (here|for this (rule|detection|step)))?)',
+                             re.IGNORECASE)
+MAX_EMPTY_ANALYSIS_CHARS = 240
+
+
+def nothing_to_add(analysis: str) -> bool:
+    """True for a short breakdown answer whose whole opening sentence says the step does not apply."""
+    analysis = (analysis or '').strip()
+    if not analysis:
+        return True
+    first_sentence = re.split(r'(?<=[.!?])\s', analysis, maxsplit=1)[0]
+    # markdown emphasis and the closing punctuation are not part of the phrase
+    first_sentence = first_sentence.strip('*_`#> ').rstrip('.!:;').strip('*_` ')
+    return len(analysis) <= MAX_EMPTY_ANALYSIS_CHARS and _NOTHING_TO_ADD.fullmatch(first_sentence) is not None
+
+
+def classify_complexity(description: str) -> tuple:
+    """(complexity, cued optional steps) for a description; complexity is 'simple', 'moderate' or 'complex'."""
+    cued = {step for step, pattern in _COMPILED_CUES.items() if pattern.search(description or '')}
+    complex_cue = _COMPLEX_CUES.search(description or '') is not None
+    if complex_cue or len(cued) == len(_COMPILED_CUES):
+        return 'complex', cued
+    if cued & {'CALCULATE_DERIVED_METRICS', 'FILTER_ANOMALIES', 'EXTRACT_RELEVANT_FIELDS'}:
+        return 'moderate', cued
+    return 'simple', cued
+
+
+def plan_dsl_steps(description: str, mode: str = None) -> list:
+    """
+    The TASK_BREAKDOWN_PROMPTS steps worth running for a description, in their usual order.
+
+    DSL_STEP_PLANNER=full (or mode='full') keeps all eight steps. Otherwise the description is classified
+    locally: complex descriptions keep every step, simpler ones keep the core steps plus the optional steps whose
+    cue words appear in the description (a trivial "count EventCode 4625 by host" runs four steps instead of eight).
+    """
+    mode = (mode or os.getenv("DSL_STEP_PLANNER") or 'adaptive').lower()
+    if mode == 'full':
+        return list(ALL_STEPS)
+    complexity, cued = classify_complexity(description)
+    if complexity == 'complex':
+        steps = list(ALL_STEPS)
+    else:
+        keep = CORE_STEPS | cued
+        if complexity == 'moderate':
+            keep.add('UNDERSTANDING_PROBLEM')
+        steps = [step for step in ALL_STEPS if step in keep]
+    logging.info(f"Planned {len(steps)}/{len(ALL_STEPS)} DSL steps for a {complexity} description: {steps}")
+    return steps
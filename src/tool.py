@@ -1,83 +1,109 @@
 import pandas as pd
-import requests
-import xml.etree.ElementTree as ET
-from requests.auth import HTTPBasicAuth
 from colorama import Fore, Style, init
+import json
+import logging
 import os
-import urllib3
 from pathlib import Path
 import re
 from dotenv import load_dotenv
-import splunklib.client as client
 import splunklib.results as results
+from src.spl_engine import local_engine
+from src.splunk_jobs import SplunkJobError, job_manager
+from src.splunk_session import splunk_session
+from src.spl_validator import SPLError, ValidationResult, validate_spl
+from splunklib.binding import HTTPError
 
 load_dotenv()
 
+FEASIBILITY_SOURCES = {"splunk": "Splunk API", "local": "local SPL engine over the redteam logs"}
 
-def query_splunk(spl_query: str):
-    init(autoreset=True)
 
-    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+def feasibility_backend() -> str:
+    """
+    Where execution feasibility is checked: FEASIBILITY_BACKEND=splunk, local (src.spl_engine over the redteam
+    logs), or auto (the default), which uses Splunk only when SPLUNK_HOST is configured.
+    """
+    backend = (os.getenv("FEASIBILITY_BACKEND") or "auto").lower()
+    if backend == "auto":
+        return "splunk" if splunk_session.configured else "local"
+    return backend
+
+
+def query_local(spl_query: str, max_results: int = 100) -> str:
+    result = local_engine.run(spl_query)
+    if not result.feasible:
+        logging.warning(f"Local search failed: {result.error or 'unsupported ' + result.unsupported}")
+    return json.dumps(result.as_dict(max_results), ensure_ascii=False, default=str)
+
+
+def splunk_feedback(job: dict = None, error: SplunkJobError = None) -> str:
+    """
+    A Splunk search job as feasibility feedback, in the shape query_local uses: the job messages are kept so
+    that a search that matched nothing can be told apart from one Splunk rejected or failed to run.
+    """
+    if error is not None:
+        job = {"sid": error.sid, "messages": error.messages}
+    messages = job.get("messages") or []
+    feasible = error is None and not any(isinstance(m, dict) and m.get("type") in ("ERROR", "FATAL") for m in messages)
+    return json.dumps({"backend": "splunk", "feasible": feasible, "sid": job.get("sid"),
+                       "result_count": job.get("result_count", 0), "error": str(error) if error else None,
+                       "messages": messages, "results": job.get("results") or []}, ensure_ascii=False, default=str)
+
 
-    splunk_host = os.getenv("SPLUNK_HOST")
-    splunk_port = os.getenv("SPLUNK_PORT")
-    username = os.getenv("SPLUNK_USERNAME")
-    password = os.getenv("SPLUNK_PASSWORD")
+def query_splunk(spl_query: str, earliest_time: str = None, latest_time: str = None, max_results: int = 100):
+    init(autoreset=True)
+    if feasibility_backend() == "local":
+        return query_local(spl_query, max_results)
 
-    search_job_url = f"https://{splunk_host}:{splunk_port}/services/search/jobs"
+    try:
+        job = job_manager.run(spl_query, earliest_time, latest_time, max_results=max_results)
+    except SplunkJobError as e:
+        logging.error(f"Error running search job: {e}")
+        return splunk_feedback(error=e)
 
-    post_data = {
-        "search": f"search {spl_query}",
-        # 'earliest_time' : '-60d', # '-24h',
-        # 'latest_time' : 'now',
-        "exec_mode": "blocking"
-    }
-    response = requests.post(search_job_url, data=post_data, auth=HTTPBasicAuth(username, password), verify=False)
+    return splunk_feedback(job)
 
-    if response.status_code != 201:
-        print(Fore.RED + "Error creating search job")
-        print(response.text)
-        return
 
+async def query_splunk_async(spl_query: str, earliest_time: str = None, latest_time: str = None,
+                             max_results: int = 100):
+    if feasibility_backend() == "local":
+        # the local engine answers in milliseconds, no need to leave the event loop
+        return query_local(spl_query, max_results)
     try:
-        root = ET.fromstring(response.text)
-        job_id = root.find('sid').text
-    except ET.ParseError:
-        print(Fore.RED + "Error parsing XML response")
-        return
-
-    job_results_url = f"https://{splunk_host}:{splunk_port}/services/search/jobs/{job_id}/results"
-    response = requests.get(job_results_url, auth=HTTPBasicAuth(username, password), verify=False)
-
-    if response.status_code != 200:
-        print(Fore.RED + "Error retrieving search results")
-        print(response.text)
-        return
-
-    return response.text
-
-
-def grammar_check(rule: str):
-    service = client.connect(
-        host=os.getenv("SPLUNK_HOST"),
-        port=os.getenv("SPLUNK_PORT"),
-        username=os.getenv("SPLUNK_USERNAME"),
-        password=os.getenv("SPLUNK_PASSWORD"),
-        scheme="https"
-    )
+        job = await job_manager.run_async(spl_query, earliest_time, latest_time, max_results=max_results)
+    except SplunkJobError as e:
+        logging.error(f"Error running search job: {e}")
+        return splunk_feedback(error=e)
+
+    return splunk_feedback(job)
+
+
+def grammar_check(rule: str) -> ValidationResult:
+    # the local validator catches most mistakes without a round trip; Splunk only sees rules that pass it
+    result = validate_spl(rule)
+    if not result.valid:
+        for error in result.errors:
+            logging.info(f"SPL grammar error: {error}")
+        return result
+    if not splunk_session.configured:
+        logging.info("SPL grammar is correct (local check)")
+        return result
+
     try:
-        response = service.get('search/parser', q=rule, parse_only=True)
-        if 'messages' in response:
-            for message in response['messages']:
-                if message['type'] == 'ERROR':
-                    print(f"❌ SPL Grammar Error: {message['text']}")
-                    break
-            else:
-                print("✅ SPL grammar is correct")
-        else:
-            print("✅ SPL grammar is correct")
+        response = splunk_session.service().get('search/parser', q=rule, parse_only=True, output_mode='json')
+        messages = json.loads(response.body.read()).get('messages') or []
+        errors = [SPLError(message['text']) for message in messages if message.get('type') in ('ERROR', 'FATAL')]
+    except HTTPError as e:
+        errors = [SPLError(str(e).split(' -- ', 1)[-1])]
     except Exception as e:
-        print(f"❌ Response error: {str(e)}")
+        # Splunk was unreachable: the rule only passed the local check, report it as such
+        logging.error(f"Splunk grammar check failed, using the local check only: {e}")
+        return ValidationResult(valid=result.valid, errors=result.errors, source='local')
+    for error in errors:
+        logging.info(f"SPL grammar error: {error.message}")
+    if not errors:
+        logging.info("SPL grammar is correct (Splunk check)")
+    return ValidationResult(valid=not errors, errors=errors, source='splunk')
 
 
 if __name__ == '__main__':
@@ -5,6 +5,7 @@ import os
 import json
 import yaml
 from pathlib import Path
+from src.corpus import corpus
 from src.rule import model
 
 load_dotenv()
@@ -31,15 +32,13 @@ def extract_info_from_markdown_table(markdown_table: str) -> dict:
 
 
 def description_and_rule_generator(rule_type: str) -> dict:
-    dataset_path = os.path.join(PROJECT_ROOT, f'dataset/descriptions/{rule_type}')
-    for file in os.listdir(dataset_path):
-        # read yaml file
-        path = os.path.join(dataset_path, file)
-        with open(path, 'r') as f:
-            data = f.read()
-        # parse yaml file
-        data = yaml.load(data, Loader=yaml.FullLoader)
-        yield path, data
+    # served from the corpus snapshot instead of re-parsing every YAML file
+    for record in corpus.by_category(rule_type):
+        if record.description_path is None:
+            continue
+        path = os.path.join(corpus.dataset_path, record.description_path)
+        yield path, {"description": record.description, "required_fields": list(record.required_fields),
+                     "rule": record.rule}
 
 
 def optimize_rule(rule: str, gt: str) -> str:
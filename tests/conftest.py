@@ -0,0 +1,13 @@
+from pathlib import Path
+import os
+import sys
+import tempfile
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+# src.router builds its providers on import; the tests never reach a real endpoint or the shared caches
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+os.environ.setdefault("OPENAI_MODEL_NAME", "test-model")
+os.environ.setdefault("LLM_CACHE_PATH", os.path.join(tempfile.mkdtemp(prefix="llm_cache_"), "cache.sqlite"))
+os.environ.setdefault("LLM_METRICS_PATH", "")
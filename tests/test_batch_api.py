@@ -0,0 +1,187 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from src.batch_api import BatchRoundRunner, item_key, score_rules
+from src.cache import ResponseCache
+from src.router import Provider, ProviderRouter
+import json
+import os
+import pytest
+import re
+import threading
+
+
+class MockBatchAPI:
+    """
+    The parts of the OpenAI Files and Batch API the runner uses. Batches complete on creation and every
+    request is answered with "echo: <last message>" (as a JSON object when JSON was requested); a last message
+    of "fail" yields a failed request.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.batches = {}
+        self.submitted = []
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                if self.path.endswith("/files"):
+                    self._json(api.create_file(body))
+                elif self.path.endswith("/batches"):
+                    self._json(api.create_batch(json.loads(body)))
+                else:
+                    self.send_error(404)
+
+            def do_GET(self):
+                match = re.search(r"/files/([^/]+)/content$", self.path)
+                if match:
+                    data = api.files[match.group(1)].encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/octet-stream")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                    return
+                match = re.search(r"/batches/([^/]+)$", self.path)
+                if match:
+                    self._json(api.batches[match.group(1)])
+                    return
+                self.send_error(404)
+
+            def _json(self, payload: dict):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/v1"
+
+    def create_file(self, body: bytes) -> dict:
+        # the multipart upload carries the JSONL lines verbatim
+        lines = [line for line in body.decode("utf-8").splitlines() if line.startswith('{"custom_id"')]
+        file_id = f"file-{len(self.files)}"
+        self.files[file_id] = "\n".join(lines)
+        return {"id": file_id, "object": "file", "bytes": len(body), "created_at": 0, "filename": "input.jsonl",
+                "purpose": "batch", "status": "processed"}
+
+    def create_batch(self, request: dict) -> dict:
+        requests = [json.loads(line) for line in self.files[request["input_file_id"]].splitlines()]
+        self.submitted.append(requests)
+        output = []
+        for n, item in enumerate(requests):
+            content = item["body"]["messages"][-1]["content"]
+            answer = f"echo: {content}"
+            if item["body"].get("response_format", {}).get("type") == "json_object":
+                answer = json.dumps({"echo": content})
+            if content == "fail":
+                response = {"status_code": 500, "body": {"error": {"message": "mock failure"}}}
+            else:
+                response = {"status_code": 200, "body": {
+                    "id": f"chatcmpl-{n}", "object": "chat.completion", "created": 0, "model": item["body"]["model"],
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": answer}}]}}
+            output.append(json.dumps({"id": f"req-{n}", "custom_id": item["custom_id"], "response": response,
+                                      "error": None}))
+        output_id = f"file-{len(self.files)}"
+        self.files[output_id] = "\n".join(output)
+        batch_id = f"batch-{len(self.batches)}"
+        self.batches[batch_id] = {
+            "id": batch_id, "object": "batch", "endpoint": request["endpoint"],
+            "input_file_id": request["input_file_id"],
+            "completion_window": request["completion_window"], "status": "completed", "created_at": 0,
+            "output_file_id": output_id, "error_file_id": None,
+            "request_counts": {"completed": len(requests), "failed": 0, "total": len(requests)}}
+        return self.batches[batch_id]
+
+
+@pytest.fixture
+def api():
+    api = MockBatchAPI()
+    yield api
+    api.server.shutdown()
+
+
+@pytest.fixture
+def router(api):
+    providers = {name: Provider(name, "test-key", f"{name}-model", base_url=api.base_url, max_retries=0)
+                 for name in ("openai", "llama")}
+    return ProviderRouter(providers, default="openai", routes={"reflect_and_score_rule": ["llama"]}, hedge=False)
+
+
+def _runner(tmp_path, router, cache_name="cache.sqlite") -> BatchRoundRunner:
+    cache = ResponseCache(path=os.path.join(tmp_path, cache_name))
+    return BatchRoundRunner(os.path.join(tmp_path, "work"), poll_interval=0, router=router, cache=cache)
+
+
+def _request(content: str, stage: str = "optimize_rule") -> tuple:
+    return stage, [{"role": "user", "content": content}], {}
+
+
+def test_round_results_are_attached_by_custom_id(tmp_path, api, router):
+    runner = _runner(tmp_path, router)
+    results = runner.run_round("optimize", {"a": _request("first"), "b": _request("second"), "c": _request("fail")})
+    assert results == {"a": "echo: first", "b": "echo: second", "c": None}
+    assert len(api.submitted) == 1
+
+
+def test_requests_go_to_the_routed_provider_and_cache(tmp_path, api, router):
+    runner = _runner(tmp_path, router)
+    runner.run_round("mixed", {"a": _request("rule"), "s": _request("score", "reflect_and_score_rule")})
+    models = sorted(request["body"]["model"] for batch in api.submitted for request in batch)
+    assert models == ["llama-model", "openai-model"]
+    key = router.cache_key(router.providers["llama"], [{"role": "user", "content": "score"}], {})
+    assert runner.cache.get(key) is not None
+
+    # a second run is served from the cache without new batches
+    assert runner.run_round("mixed", {"s": _request("score", "reflect_and_score_rule")}) == {"s": "echo: score"}
+    assert len(api.submitted) == 2
+
+
+def test_resume_reattaches_to_a_submitted_batch(tmp_path, api, router):
+    requests = {"a": _request("first"), "b": _request("second")}
+    crashed = _runner(tmp_path, router)
+    provider = router.providers["openai"]
+    name = f"optimize.openai.{crashed._digest(provider, requests)}.0"
+    crashed._submit(provider, name, requests)
+
+    results = _runner(tmp_path, router, "fresh.sqlite").run_round("optimize", requests)
+    assert results == {"a": "echo: first", "b": "echo: second"}
+    assert len(api.submitted) == 1
+
+
+def test_changed_request_set_does_not_reuse_old_outputs(tmp_path, api, router):
+    _runner(tmp_path, router).run_round("optimize", {"a": _request("first"), "b": _request("second")})
+    # same round name and custom_ids, different requests, and no cache to answer them
+    results = _runner(tmp_path, router, "fresh.sqlite").run_round(
+        "optimize", {"a": _request("changed"), "b": _request("second")})
+    assert results == {"a": "echo: changed", "b": "echo: second"}
+    assert len(api.submitted) == 2
+
+
+def test_score_results_follow_items_not_positions(tmp_path, api, router):
+    items = [{"id": "rules/a.yml", "rule": "index=a", "description": "a"},
+             {"id": "rules/b.yml", "rule": "index=b", "description": "b"}]
+    first = score_rules(items, _runner(tmp_path, router))
+    custom_ids = {request["custom_id"] for request in api.submitted[0]}
+    assert custom_ids == {f"{item_key(item)}-score" for item in items}
+
+    # reordered and extended on resume: cached results still land on their own items, only the new one is sent
+    items = [{"id": "rules/c.yml", "rule": "index=c", "description": "c"}] + items[::-1]
+    second = score_rules(items, _runner(tmp_path, router))
+    assert [record["id"] for record in second] == ["rules/c.yml", "rules/b.yml", "rules/a.yml"]
+    for record in first + second:
+        assert f"index={record['id'][6]}" in record["scores"]["echo"]
+    assert [len(batch) for batch in api.submitted] == [2, 1]
+
+
+def test_duplicate_item_ids_are_rejected(tmp_path, router):
+    items = [{"id": "rules/a.yml", "rule": "index=a", "description": "a"}] * 2
+    with pytest.raises(ValueError):
+        score_rules(items, _runner(tmp_path, router))
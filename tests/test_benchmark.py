@@ -0,0 +1,66 @@
+from src import benchmark
+from src.benchmark import BenchmarkCase, compare, run_benchmark
+import json
+import pandas as pd
+
+
+def _events(*images) -> pd.DataFrame:
+    return pd.DataFrame.from_records([{"_time": float(n), "EventCode": "4688", "Image": f"C:\\Windows\\{image}"}
+                                      for n, image in enumerate(images)])
+
+
+GROUPS = {
+    "T1490#1": _events("vssadmin.exe"),
+    "T1490#2": _events("wmic.exe", "svchost.exe"),
+    "T1059#1": _events("cmd.exe"),
+    "T1003#1": _events("procdump.exe"),
+}
+RULES = {
+    # fires on its own test and on T1059#1
+    "t1490_1.txt": "```spl\nEventCode=4688 (Image=*vssadmin.exe OR Image=*cmd.exe)\n```",
+    # cannot run locally, so it detects nothing
+    "t1490_2.txt": "| tstats count where Processes.process_name=wmic.exe",
+}
+USAGE = {"calls": 4, "prompt_tokens": 900, "completion_tokens": 100, "total_tokens": 1000}
+
+
+def _generate_one(path, data, category, mode, rule_type):
+    return {"status": "ok", "rule": RULES[path], "latency": 2.0, "usage": dict(USAGE)}
+
+
+def test_run_benchmark_scores_one_technique(monkeypatch):
+    monkeypatch.setattr(benchmark, "test_alerts", lambda: GROUPS)
+    monkeypatch.setattr(benchmark, "generate_one", _generate_one)
+    cases = [BenchmarkCase(f"T1490#{n}", "T1490", f"Atomic Test #{n} - x", f"t1490_{n}.txt", "delete shadow copies")
+             for n in (2, 1)]
+    report = run_benchmark(cases, workers=2)
+
+    assert list(report) == ["schema_version", "config", "summary", "techniques", "cases"]
+    assert report["schema_version"] == benchmark.SCHEMA_VERSION
+    assert report["config"] == {"mode": "generator", "rule_type": "splunk", "model": benchmark.model, "workers": 2,
+                                "reuse_known": False}
+    first, second = report["cases"]
+    assert [first["id"], second["id"]] == ["T1490#1", "T1490#2"]
+    assert (first["tp"], first["fp"], first["fn"]) == (1, 1, 1)
+    assert (first["precision"], first["recall"], first["f1"]) == (0.5, 0.5, 0.5)
+    assert first["fired"] == ["T1059#1", "T1490#1"] and first["detected_own_test"] and first["executable"]
+    assert (second["tp"], second["fp"], second["fn"], second["f1"]) == (0, 0, 2, 0.0)
+    assert second["problem"] == "unsupported generating command 'tstats'" and not second["executable"]
+
+    technique = report["techniques"]["T1490"]
+    assert (technique["tp"], technique["fp"], technique["fn"]) == (1, 1, 3)
+    assert (technique["precision"], technique["recall"], technique["f1"]) == (0.5, 0.25, 0.3333)
+    summary = report["summary"]
+    assert set(summary) == {"cases", "generated", "executable", "detected_own_test", "reused_known", "latency_mean",
+                            "llm_calls", "prompt_tokens", "completion_tokens", "total_tokens", "calls_per_rule",
+                            "tokens_per_rule", "tp", "fp", "fn", "precision", "recall", "f1", "macro_f1",
+                            "wall_time"}
+    assert (summary["cases"], summary["generated"], summary["executable"], summary["detected_own_test"]) == (2, 2, 1, 1)
+    assert (summary["f1"], summary["macro_f1"]) == (0.3333, 0.3333)
+    assert (summary["llm_calls"], summary["calls_per_rule"], summary["tokens_per_rule"]) == (8, 4.0, 1000.0)
+
+    # the report survives JSON and compares equal to itself; a lower F1 than the baseline is a regression
+    baseline = json.loads(json.dumps(report))
+    assert compare(baseline, report) == []
+    baseline["techniques"]["T1490"]["f1"] = 0.5
+    assert compare(baseline, report) == ["REGRESSION T1490 f1: 0.5 -> 0.3333"]
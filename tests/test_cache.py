@@ -0,0 +1,72 @@
+from src.cache import ResponseCache
+import os
+import time
+
+
+def _cache(tmp_path, **kwargs) -> ResponseCache:
+    return ResponseCache(path=os.path.join(tmp_path, "cache.sqlite"), **kwargs)
+
+
+def _entries(cache: ResponseCache) -> int:
+    return cache.stats()["entries"]
+
+
+def test_round_trip(tmp_path):
+    cache = _cache(tmp_path)
+    key = cache.make_key("model", [{"role": "user", "content": "hi"}], temperature=0)
+    assert cache.get(key) is None
+    cache.set(key, "answer")
+    assert cache.get(key) == "answer"
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_key_depends_on_params():
+    messages = [{"role": "user", "content": "hi"}]
+    assert ResponseCache.make_key("m", messages, temperature=0) != ResponseCache.make_key("m", messages, temperature=1)
+    assert ResponseCache.make_key("m", messages, a=1, b=2) == ResponseCache.make_key("m", messages, b=2, a=1)
+
+
+def test_eviction_only_runs_every_n_inserts(tmp_path):
+    cache = _cache(tmp_path, max_entries=10, evict_every=5)
+    for n in range(14):
+        cache.set(f"k{n}", "v")
+    # checked after the 5th and 10th insert; 14 rows stay until the next check
+    assert _entries(cache) == 14
+    cache.set("k14", "v")
+    assert _entries(cache) == 9
+
+
+def test_eviction_trims_to_low_water_mark_keeping_recent_entries(tmp_path):
+    cache = _cache(tmp_path, max_entries=10, evict_every=1)
+    for n in range(10):
+        cache.set(f"k{n}", "v")
+        time.sleep(0.002)
+    cache.get("k0")
+    cache.set("k10", "v")
+    assert _entries(cache) == 9
+    assert cache.get("k0") == "v"
+    assert cache.get("k10") == "v"
+    assert cache.get("k1") is None
+
+
+def test_expired_entries_are_dropped(tmp_path):
+    cache = _cache(tmp_path, ttl=0.05, evict_every=1)
+    cache.set("old", "v")
+    time.sleep(0.1)
+    assert cache.get("old") is None
+    cache.set("new", "v")
+    assert _entries(cache) == 1
+
+
+def test_disabled_cache_stores_nothing(tmp_path):
+    cache = _cache(tmp_path, enabled=False)
+    cache.set("k", "v")
+    assert cache.get("k") is None
+
+
+def test_bypass_skips_the_cache_for_the_current_thread(tmp_path):
+    cache = _cache(tmp_path)
+    cache.set("k", "v")
+    with cache.bypass():
+        assert cache.get("k") is None
+    assert cache.get("k") == "v"
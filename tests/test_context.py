@@ -0,0 +1,74 @@
+from src.context import ContextCompactor, estimate_tokens
+from src.instrumentation import instrumentation
+from src.prompt_builder import build_messages
+
+# prose the summaries drop, as in real answers
+FILLER = "\n".join(["Attackers delete shadow copies before encrypting files so that they cannot be restored."] * 5)
+BREAKDOWN_ANSWERS = [
+    f"The rule looks at process creation.\n- Image ends with vssadmin.exe\n- CommandLine contains delete shadows\n"
+    f"{FILLER}",
+    f"Only Windows hosts matter here.\nNothing else is relevant for the data source selection.\n{FILLER}",
+    f"- count by host\n- threshold of 1\n{FILLER}",
+]
+DSL_ANSWERS = [
+    f"{FILLER}\n```plaintext\nFILTER Image=*vssadmin.exe\nFILTER CommandLine=*delete*\n```",
+    f"Nothing to add for this step.\n{FILLER}",
+    "```plaintext\nAGGREGATE count BY host\n```",
+]
+
+
+def _conversation(answers: list) -> list:
+    messages = build_messages("You break detection rules down.", [("Below is the description of the rule",
+                                                                   "Detect shadow copy deletion")])
+    for n, answer in enumerate(answers):
+        messages += [{"role": "user", "content": f"STEP_{n}:\nquestion {n}"},
+                     {"role": "assistant", "content": answer}]
+    return messages + [{"role": "user", "content": "STEP_NEXT:\nnext question"}]
+
+
+def test_breakdown_keeps_the_prefix_and_the_latest_turn():
+    messages = _conversation(BREAKDOWN_ANSWERS)
+    compacted = ContextCompactor(keep_turns=1).compact(messages, 'breakdown')
+    assert compacted[:2] == messages[:2]
+    assert compacted[-3:] == messages[-3:]
+    summary = compacted[2]["content"]
+    assert len(compacted) == 6 and compacted[2]["role"] == "user"
+    # bullet lines are kept, an answer without bullets keeps its first lines
+    assert "- Image ends with vssadmin.exe" in summary and "The rule looks at process creation." not in summary
+    assert "Only Windows hosts matter here.\nNothing else" in summary and "- count by host" not in summary
+    assert "Attackers delete" not in summary
+    assert estimate_tokens(compacted) < estimate_tokens(messages)
+
+
+def test_dsl_summary_keeps_every_dsl_line_so_far():
+    messages = _conversation(DSL_ANSWERS)
+    compacted = ContextCompactor(keep_turns=1).compact(messages, 'dsl')
+    summary = compacted[2]["content"]
+    assert summary.startswith("## Steps already translated: STEP_0, STEP_1\n")
+    assert "```plaintext\nFILTER Image=*vssadmin.exe\nFILTER CommandLine=*delete*\n```" in summary
+    assert compacted[-3:] == messages[-3:]
+
+
+def test_short_or_disabled_conversations_are_sent_as_is():
+    messages = _conversation(BREAKDOWN_ANSWERS[:1])
+    assert ContextCompactor(keep_turns=1).compact(messages, 'breakdown') is messages
+    longer = _conversation(BREAKDOWN_ANSWERS)
+    assert ContextCompactor(keep_turns=3).compact(longer, 'breakdown') is longer
+    assert ContextCompactor(enabled=False).compact(longer, 'breakdown') is longer
+
+
+def test_stored_conversation_is_untouched_and_savings_are_reported():
+    messages = _conversation(BREAKDOWN_ANSWERS * 4)
+    stored = [dict(message) for message in messages]
+    before = instrumentation.compaction.get("test_context", 0)
+    compacted = ContextCompactor(keep_turns=2).compact(messages, 'breakdown', "test_context")
+    assert messages == stored
+    assert compacted[-5:] == messages[-5:]
+    assert instrumentation.compaction["test_context"] - before == estimate_tokens(messages) - estimate_tokens(compacted)
+
+
+def test_long_answers_are_cut():
+    answer = "\n".join(f"- point {n} " + "x" * 40 for n in range(40))
+    messages = _conversation([answer, "last"])
+    summary = ContextCompactor(keep_turns=1, max_answer_chars=200).compact(messages, 'breakdown')[2]["content"]
+    assert summary.endswith(" ...") and len(summary) < 300
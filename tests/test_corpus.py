@@ -0,0 +1,120 @@
+from src import corpus as corpus_module
+from src.corpus import Corpus
+import os
+import pytest
+import yaml
+
+
+def _write(dataset, path: str, data: dict):
+    path = os.path.join(dataset, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        yaml.safe_dump(data, f)
+
+
+def _detection(name: str, technique: str = "T1059.001", search: str = "index=main") -> dict:
+    return {"id": f"id-{name}", "name": name, "type": "TTP", "search": search, "data_source": ["Sysmon EventID 1"],
+            "tags": {"mitre_attack_id": [technique], "required_fields": ["_time", "dest"]}}
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    dataset = os.path.join(tmp_path, "dataset")
+    _write(dataset, "detections/endpoint/a.yml", _detection("a"))
+    _write(dataset, "detections/endpoint/b.yml", _detection("b", "T1003"))
+    _write(dataset, "descriptions/endpoint/a.yml", {"description": "detect a", "rule": "index=main a",
+                                                   "required_fields": ["_time", "Image"]})
+    return dataset
+
+
+@pytest.fixture
+def parsed(dataset, monkeypatch):
+    parsed = []
+    parse_file = corpus_module._parse_file
+
+    def counting_parse_file(path):
+        parsed.append(os.path.relpath(path, dataset))
+        return parse_file(path)
+
+    monkeypatch.setattr(corpus_module, "_parse_file", counting_parse_file)
+    return parsed
+
+
+def _corpus(dataset) -> Corpus:
+    return Corpus(dataset, os.path.join(os.path.dirname(dataset), "corpus.snapshot"))
+
+
+def test_records_are_joined_and_indexed(dataset):
+    corpus = _corpus(dataset)
+    a = corpus.by_id("id-a")
+    assert (a.description, a.rule, a.required_fields) == ("detect a", "index=main a", ("_time", "Image"))
+    assert corpus.by_id("id-b").required_fields == ("_time", "dest")
+    assert [r.name for r in corpus.by_mitre("t1059")] == ["a"]
+    assert [r.name for r in corpus.by_data_source("sysmon eventid 1")] == ["a", "b"]
+    assert corpus.categories() == ["endpoint"]
+
+
+def test_snapshot_is_reused_until_a_file_changes(dataset, parsed):
+    assert len(_corpus(dataset)) == 2
+    assert len(parsed) == 3
+
+    parsed.clear()
+    assert [r.name for r in _corpus(dataset)] == ["a", "b"]
+    assert parsed == []
+
+    # same size, newer mtime: the snapshot entry is stale
+    path = os.path.join(dataset, "detections", "endpoint", "b.yml")
+    _write(dataset, "detections/endpoint/b.yml", _detection("c", "T1003"))
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10 ** 9))
+    corpus = _corpus(dataset)
+    assert [r.name for r in corpus] == ["a", "c"]
+    assert parsed == [os.path.join("detections", "endpoint", "b.yml")]
+
+
+def test_added_and_removed_files(dataset, parsed):
+    corpus = _corpus(dataset)
+    corpus.load()
+    parsed.clear()
+
+    _write(dataset, "detections/network/d.yml", _detection("d", "T1071"))
+    os.remove(os.path.join(dataset, "detections", "endpoint", "a.yml"))
+    corpus.load(refresh=True)
+    assert parsed == [os.path.join("detections", "network", "d.yml")]
+    assert corpus.categories() == ["endpoint", "network"]
+    assert corpus.by_mitre("T1059") == []
+    # the description of a removed detection stays in the corpus on its own
+    assert [(r.id, r.detection_path, r.description) for r in corpus.by_name("a")] == [("a", None, "detect a")]
+
+    # the snapshot written by the refresh reflects both changes
+    parsed.clear()
+    assert sorted(r.id for r in _corpus(dataset)) == ["a", "id-b", "id-d"]
+    assert parsed == []
+
+
+@pytest.mark.parametrize("damage", [
+    lambda blob: blob[:-10],
+    lambda blob: blob[:-1] + bytes([blob[-1] ^ 0xFF]),
+    lambda blob: b"NOTMAGIC!" + blob[9:],
+    lambda blob: b"",
+])
+def test_corrupt_snapshot_is_rebuilt(dataset, parsed, caplog, damage):
+    corpus = _corpus(dataset)
+    corpus.load()
+    with open(corpus.snapshot_path, "rb") as f:
+        blob = f.read()
+    with open(corpus.snapshot_path, "wb") as f:
+        f.write(damage(blob))
+
+    parsed.clear()
+    assert [r.name for r in _corpus(dataset)] == ["a", "b"]
+    assert len(parsed) == 3
+    if blob:
+        assert "Ignoring corrupt corpus snapshot" in caplog.text
+
+
+def test_invalid_yaml_keeps_the_file_as_an_empty_record(dataset, caplog):
+    with open(os.path.join(dataset, "detections", "endpoint", "e.yml"), "w", encoding="utf-8") as f:
+        f.write("name: [unclosed\n")
+    corpus = _corpus(dataset)
+    assert corpus.by_id("e").search == ''
+    assert "Failed to parse" in caplog.text
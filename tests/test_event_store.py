@@ -0,0 +1,100 @@
+from src.event_store import CHUNK_ROWS, EventTable, EventView
+from src.spl_engine import SPLEngine
+import numpy as np
+import os
+import pandas as pd
+import pytest
+
+FIRST = [
+    {"_time": 100.0, "host": "ws1", "EventCode": "4688", "Image": "C:\\Windows\\cmd.exe", "_raw": "cmd.exe /c whoami"},
+    {"_time": 300.0, "host": "ws2", "EventCode": "4688", "Image": "C:\\Windows\\powershell.exe",
+     "_raw": "powershell -enc AAAA"},
+    {"_time": 200.0, "host": "ws1", "EventCode": "4624", "_raw": "An account was successfully logged on"},
+]
+# the second file has a field the first lacks and none of its Image values
+SECOND = [
+    {"_time": 250.0, "host": "dc1", "EventCode": "4688", "Image": "C:\\Windows\\cmd.exe", "User": "admin",
+     "_raw": "cmd.exe /c net user"},
+    {"_time": 50.0, "host": "dc1", "EventCode": "4104", "_raw": "ScriptBlock whoami"},
+]
+
+
+@pytest.fixture
+def view(tmp_path) -> EventView:
+    tables = []
+    for n, events in enumerate((FIRST, SECOND)):
+        path = os.path.join(tmp_path, f"t{n}")
+        EventTable.write(path, f"source{n}.txt", events)
+        tables.append(EventTable(path))
+    return EventView(tables)
+
+
+def _newest_first(events: list) -> pd.DataFrame:
+    frame = pd.DataFrame.from_records(events)
+    return frame.sort_values('_time', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def test_frame_decodes_only_the_rows_and_columns_asked_for(view):
+    table = view.tables[0]
+    assert list(table.column("_raw", np.array([2]))) == ["An account was successfully logged on"]
+    assert list(table.column("Image", np.array([1, 2]))) == ["C:\\Windows\\powershell.exe", None]
+
+    picked = view.take(np.array([3, 0]))
+    frame = picked.frame(["host", "User"])
+    assert list(frame.columns) == ["host", "User"]
+    assert frame["host"].tolist() == ["dc1", "ws1"]
+    assert frame["User"].tolist()[0] == "admin" and pd.isna(frame["User"].tolist()[1])
+
+
+def test_mask_tests_distinct_values_not_rows(view):
+    tested = []
+
+    def predicate(frame):
+        tested.extend(frame["EventCode"].tolist())
+        return frame["EventCode"] == "4688"
+
+    assert view.mask("EventCode", predicate).tolist() == [True, True, False, True, False]
+    assert sorted(value for value in tested if isinstance(value, str)) == ["4104", "4624", "4688", "4688"]
+
+
+def test_mask_on_text_is_chunked(tmp_path, monkeypatch):
+    monkeypatch.setattr("src.event_store.CHUNK_ROWS", 2)
+    path = os.path.join(tmp_path, "t")
+    EventTable.write(path, "source.txt", [{"_raw": f"event {n}"} for n in range(5)])
+    sizes = []
+
+    def predicate(frame):
+        sizes.append(len(frame))
+        return frame["_raw"].str.endswith(("1", "4"))
+
+    assert EventView([EventTable(path)]).mask("_raw", predicate).tolist() == [False, True, False, False, True]
+    assert max(sizes) <= 2 < CHUNK_ROWS
+
+
+def test_newest_first_and_groups(view):
+    assert view.newest_first().frame(["_time"])["_time"].tolist() == [300.0, 250.0, 200.0, 100.0, 50.0]
+    groups = view.groups(["host"])
+    assert list(groups) == [("dc1",), ("ws1",), ("ws2",)]
+    assert groups[("ws1",)].frame(["_time"])["_time"].tolist() == [100.0, 200.0]
+
+
+@pytest.mark.parametrize("search", [
+    'EventCode=4688 Image="*\\\\cmd.exe"',
+    'whoami',
+    'host=ws* NOT EventCode=4624',
+    'sourcetype=foo OR EventCode IN (4104, 4624)',
+    'EventCode!=4688',
+    'EventCode=4688 | stats count by host',
+    'EventCode=4688 | eval image=lower(Image) | where like(image, "%cmd%")',
+    'EventCode=4688 | rename Image as process | table host, process, User',
+    'EventCode=* | dedup host | fillnull value=none',
+    'User=admin | rex "net (?<command>\\w+)"',
+])
+def test_stored_events_give_the_same_results_as_a_frame(view, search):
+    engine = SPLEngine()
+    stored = engine.run(search, events=view)
+    frame = engine.run(search, events=_newest_first(FIRST + SECOND))
+    assert stored.error is None and frame.error is None
+    assert stored.scanned == frame.scanned == 5
+    assert set(stored.results.columns) == set(frame.results.columns)
+    assert stored.records() == frame.records()
@@ -0,0 +1,34 @@
+from contextlib import nullcontext
+from src.instrumentation import Instrumentation
+import asyncio
+import pytest
+
+
+def _attempt(instrumentation: Instrumentation, retries: int, error: BaseException = None):
+    with pytest.raises(type(error)) if error is not None else nullcontext():
+        with instrumentation.call("stage", "model", retries=retries):
+            if error is not None:
+                raise error
+
+
+def test_retries_count_retried_calls_not_attempt_indices():
+    instrumentation = Instrumentation()
+    _attempt(instrumentation, 0, RuntimeError("boom"))
+    _attempt(instrumentation, 1, RuntimeError("boom"))
+    _attempt(instrumentation, 2)
+    totals = instrumentation.totals[("stage", "model")]
+    assert totals["calls"] == 3
+    assert totals["retries"] == 2
+    assert totals["errors"] == 2
+    assert "rulepilot_llm_retries_total{stage=\"stage\",model=\"model\"} 2" in instrumentation.prometheus_text()
+
+
+def test_cancelled_calls_are_not_errors_and_stay_out_of_the_rule_usage():
+    instrumentation = Instrumentation()
+    with instrumentation.track_usage("rule") as tracker:
+        _attempt(instrumentation, 0, asyncio.CancelledError())
+        _attempt(instrumentation, 0)
+    totals = instrumentation.totals[("stage", "model")]
+    assert totals["cancelled"] == 1 and totals["errors"] == 0
+    assert tracker.calls == 1 and tracker.errors == 0
+    assert [record.cancelled for record in instrumentation.records] == [True, False]
@@ -0,0 +1,82 @@
+from src import benchmark
+from src.agent import SecurityRuleAgent
+from src.config import env_flag
+from src.known_rules import KnownRuleIndex, KnownRuleMatch, find_known_rule, known_rule_match, known_rules
+from src.rule import RuleGenerator
+import pytest
+
+
+@pytest.fixture
+def lookup(monkeypatch):
+    def use(rule: str):
+        match = KnownRuleMatch("id", "Known Detection", rule, 1.0, "exact")
+        monkeypatch.setattr(known_rules, "lookup", lambda description, required_fields=None: match)
+    monkeypatch.setattr(known_rules, "enabled", True)
+    return use
+
+
+def test_valid_known_rule_is_reused_with_its_prescore(lookup):
+    lookup('index=main EventCode=4688 | stats count by host')
+    match = find_known_rule("description", "splunk", "- host")
+    assert match is not None and match.prescore["syntax_validation"] == 1.0
+    assert known_rule_match.get() is match
+
+
+def test_invalid_known_rule_is_not_reused(lookup):
+    lookup('index=main | stats count by')
+    assert find_known_rule("description", "splunk") is None
+    assert known_rule_match.get() is None
+
+
+def test_known_rules_only_answer_splunk(lookup):
+    lookup('index=main | stats count by host')
+    assert find_known_rule("description", "sentinel") is None
+
+
+def test_benchmark_turns_reuse_off_unless_asked(monkeypatch):
+    seen = []
+
+    def generate_one(path, data, category, mode, rule_type):
+        seen.append(known_rules.enabled)
+        return {"status": "ok", "rule": None, "latency": 0.0,
+                "usage": {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}}
+
+    monkeypatch.setattr(benchmark, "generate_one", generate_one)
+    monkeypatch.setattr(benchmark, "test_alerts", dict)
+    monkeypatch.setattr(known_rules, "enabled", True)
+    case = benchmark.BenchmarkCase("T1#1", "T1", "Atomic Test #1 - x", "path", "description")
+    report = benchmark.run_benchmark([case], workers=1)
+    assert seen == [False] and known_rules.enabled
+    assert report["config"]["reuse_known"] is False and report["summary"]["reused_known"] == 0
+    benchmark.run_benchmark([case], workers=1, reuse_known=True)
+    assert seen == [False, True]
+
+
+@pytest.mark.parametrize("value, expected", [(None, False), ("", False), ("true", True), (" YES ", True), ("1", True),
+                                             ("false", False), ("0", False), ("on", False)])
+def test_env_flag(monkeypatch, value, expected):
+    if value is None:
+        monkeypatch.delenv("SOME_FLAG", raising=False)
+    else:
+        monkeypatch.setenv("SOME_FLAG", value)
+    assert env_flag("SOME_FLAG", False) is expected
+    assert env_flag("SOME_FLAG", True) is (True if value in (None, "") else expected)
+
+
+def test_library_calls_do_not_reuse_corpus_rules_by_default(monkeypatch):
+    assert not KnownRuleIndex().enabled
+    monkeypatch.setattr(known_rules, "enabled", KnownRuleIndex().enabled)
+    monkeypatch.setattr(known_rules, "lookup", lambda *args, **kwargs: pytest.fail("looked up a known rule"))
+
+    class Generated(Exception):
+        pass
+
+    def generate_dsl_rule(*args, **kwargs):
+        raise Generated()
+
+    monkeypatch.setattr(RuleGenerator, "generate_dsl_rule", generate_dsl_rule)
+    for call in (lambda: RuleGenerator.generate_rule("description", "splunk"),
+                 lambda: list(RuleGenerator.web_rule_generator("description", "splunk")),
+                 lambda: SecurityRuleAgent().run_agent("description")):
+        with pytest.raises(Generated):
+            call()
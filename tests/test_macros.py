@@ -0,0 +1,83 @@
+from src.macros import MacroCycleError, MacroIndex, macro_index, parse_macro_call
+import json
+import os
+import pytest
+import yaml
+
+MACROS = {
+    "sysmon": {"definition": "(source=XmlWinEventLog:Microsoft-Windows-Sysmon/Operational)"},
+    "process_filter": {"arguments": ["field", "value"], "definition": '$field$="$value$" $fieldx$=1'},
+    "sysmon_process": {"arguments": ["image"], "definition": "`sysmon` EventCode=1 `process_filter(Image, $image$)`"},
+    "ping": {"definition": "`pong`"},
+    "pong": {"definition": "index=main `ping`"},
+}
+
+
+def _write(macros_path, name: str, macro: dict):
+    with open(os.path.join(macros_path, f"{name}.yml"), "w", encoding="utf-8") as f:
+        yaml.safe_dump({"name": name, **macro}, f)
+
+
+@pytest.fixture
+def index(tmp_path) -> MacroIndex:
+    macros_path = os.path.join(tmp_path, "macros")
+    os.makedirs(macros_path)
+    for name, macro in MACROS.items():
+        _write(macros_path, name, macro)
+    return MacroIndex(macros_path, os.path.join(tmp_path, "macro_index.json"))
+
+
+def test_parse_macro_call_splits_top_level_arguments():
+    assert parse_macro_call('process_filter(Image, "a,b")') == ("process_filter", ["Image", '"a,b"'])
+    assert parse_macro_call("f(lower(x, y), z)") == ("f", ["lower(x, y)", "z"])
+    assert parse_macro_call("sysmon") == ("sysmon", [])
+    assert parse_macro_call("not a macro") is None
+
+
+def test_arguments_are_substituted_by_name(index):
+    # only declared arguments are placeholders; $fieldx$ is left alone
+    assert index.expand("`process_filter(CommandLine, *whoami*)`") == 'CommandLine="*whoami*" $fieldx$=1'
+
+
+def test_nested_macros_expand_recursively(index):
+    assert index.expand("`sysmon_process(*\\\\cmd.exe)` | stats count by host") == (
+        '(source=XmlWinEventLog:Microsoft-Windows-Sysmon/Operational) EventCode=1 Image="*\\\\cmd.exe" $fieldx$=1'
+        " | stats count by host")
+
+
+def test_cycles_raise(index):
+    with pytest.raises(MacroCycleError) as e:
+        index.expand("`ping`")
+    assert e.value.chain == ["ping", "pong", "ping"]
+
+
+def test_unknown_macros_comments_and_strings_are_left_as_is(index):
+    search = ('`sysmon` | `drop_dm_object_name(Processes)` | `sysmon_filter` | `process_filter(Image)` '
+              '| eval note="`sysmon`" ``` `sysmon` ```')
+    assert index.expand(search) == (
+        '(source=XmlWinEventLog:Microsoft-Windows-Sysmon/Operational) | `drop_dm_object_name(Processes)` '
+        '| `sysmon_filter` | `process_filter(Image)` | eval note="`sysmon`" ``` `sysmon` ```')
+
+
+def test_serialized_index_round_trips(index, monkeypatch):
+    assert index.get("process_filter", 2)["arguments"] == ["field", "value"]
+    assert index.arities()["sysmon_process"] == 1
+    with open(index.path, "r", encoding="utf-8") as f:
+        assert set(json.load(f)["entries"]) == {"sysmon", "process_filter(2)", "sysmon_process(1)", "ping", "pong"}
+
+    # a second index loads the JSON instead of parsing the YAML files again
+    reloaded = MacroIndex(index.macros_path, index.path)
+    monkeypatch.setattr(reloaded, "_build", lambda: pytest.fail("rebuilt an up-to-date index"))
+    assert reloaded.expand("`sysmon_process(x)`") == index.expand("`sysmon_process(x)`")
+    assert reloaded.entries == index.entries
+
+
+def test_changed_macro_file_rebuilds_the_index(index):
+    assert index.expand("`sysmon`").startswith("(source=")
+    _write(index.macros_path, "sysmon", {"definition": "index=sysmon"})
+    assert MacroIndex(index.macros_path, index.path).expand("`sysmon`") == "index=sysmon"
+
+
+def test_shipped_macros_expand():
+    assert macro_index.expand("`security_content_ctime(firstTime)`") == \
+        'convert timeformat="%Y-%m-%dT%H:%M:%S" ctime(firstTime)'
@@ -0,0 +1,57 @@
+from src import corpus as corpus_module, rule
+from src.pipe_index import PipeIndex
+from types import SimpleNamespace
+import json
+import os
+
+
+def test_fingerprint_ignores_whitespace_and_detection_filters():
+    a = PipeIndex.fingerprint("| `wmi_spawning_powershell_filter`")
+    assert a == PipeIndex.fingerprint("|  `registry_keys_used_for_persistence_filter` ")
+    assert PipeIndex.normalize("stats  count\n  by host") == "stats count by host"
+    assert PipeIndex.fingerprint("stats count by host") != PipeIndex.fingerprint("stats count by host", "sentinel")
+    assert PipeIndex.fingerprint("stats count by host") != PipeIndex.fingerprint("stats count by user")
+
+
+def test_put_get_and_save_round_trip(tmp_path):
+    path = os.path.join(tmp_path, "pipe_index.json")
+    index = PipeIndex(path)
+    assert index.get("eval x=1") is None
+    index.put("eval  x=1", {"pipe": "eval  x=1", "operation_type": "eval", "output_fields": ["x"]})
+    assert index.get("eval x=1") == {"operation_type": "eval", "output_fields": ["x"]}
+    assert (index.hits, index.misses) == (1, 1)
+    index.save()
+    assert PipeIndex(path).get("eval x=1") == {"operation_type": "eval", "output_fields": ["x"]}
+
+
+def test_truncated_index_starts_empty(tmp_path, caplog):
+    path = os.path.join(tmp_path, "pipe_index.json")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"key": {"pipe": "x", "rule_type": "splunk", "info": {}}})[:20])
+    index = PipeIndex(path)
+    assert index.entries == {}
+    assert "Ignoring unreadable pipe index" in caplog.text
+
+
+def test_prewarm_extracts_repeated_pipes_once(tmp_path, monkeypatch):
+    searches = ["index=main | `a_filter` | custom_cmd foo", "index=main | `b_filter` | custom_cmd  foo",
+                "index=main | custom_cmd bar"]
+    monkeypatch.setattr(corpus_module, "corpus", [SimpleNamespace(search=s) for s in searches] + [
+        SimpleNamespace(search="")])
+    # only the custom command needs the LLM; everything else is parsed locally
+    monkeypatch.setattr(rule, "parse_pipe_locally",
+                        lambda pipe: None if pipe.strip().startswith(("custom_cmd", "`")) else object())
+    extracted = []
+
+    def extract_info_from_pipe(pipe):
+        extracted.append(pipe)
+        return {"operation_type": "custom"}
+
+    monkeypatch.setattr(rule, "extract_info_from_pipe", extract_info_from_pipe)
+    index = PipeIndex(os.path.join(tmp_path, "pipe_index.json"))
+    # the two filter macros and the two spellings of 'custom_cmd foo' each count as one pipe seen twice
+    assert index.prewarm(min_count=2, workers=2) == 2
+    assert sorted(PipeIndex.normalize(pipe) for pipe in extracted) == ["`detection_filter`", "custom_cmd foo"]
+    assert index.get("custom_cmd foo") == {"operation_type": "custom"}
+    assert index.get("custom_cmd bar") is None
+    assert index.prewarm(min_count=2) == 0
@@ -0,0 +1,51 @@
+from openai.types import CompletionUsage
+from src.prompt_builder import build_messages, cached_prompt_tokens, render_sections
+from src.rule import RuleGenerator
+from src.scoring import score_messages
+from types import SimpleNamespace
+import pytest
+
+FIRST = ("Detect deletion of volume shadow copies with vssadmin", "- _time\n- Image\n- CommandLine")
+SECOND = ("Detect LSASS memory reads by non-system processes", "- _time\n- TargetImage\n- GrantedAccess")
+
+
+def test_render_sections_skips_empty_content():
+    assert render_sections([("Fields", ["host", "user"]), ("Empty", "  "), ("None", None), (None, "## Own heading\nx"),
+                            ("Log", "line\n")]) == "## Fields:\n- host\n- user\n\n## Own heading\nx\n\n## Log:\nline"
+
+
+def test_build_messages_puts_everything_variable_after_the_static_prompt():
+    assert build_messages("static") == [{"role": "system", "content": "static"}]
+    assert build_messages("static", [("Rule", "index=main")], "  rate it  ") == [
+        {"role": "system", "content": "static"}, {"role": "user", "content": "## Rule:\nindex=main\n\nrate it"}]
+
+
+@pytest.mark.parametrize("build", [
+    lambda description, fields: RuleGenerator._dsl_conversations(description, "splunk", fields)[0],
+    lambda description, fields: RuleGenerator._dsl_conversations(description, "splunk", fields, "log line")[1],
+    lambda description, fields: RuleGenerator._simple_rule_messages(description, "splunk", fields),
+    lambda description, fields: RuleGenerator._rule_from_dsl_messages(description, "FILTER x=1", "splunk", fields),
+    lambda description, fields: score_messages("index=main | stats count", description),
+])
+def test_prompt_prefix_is_byte_identical_across_descriptions(monkeypatch, build):
+    monkeypatch.setenv("RETRIEVAL_EXAMPLES", "0")
+    first, second = build(*FIRST), build(*SECOND)
+    assert first[0]["role"] == "system"
+    assert first[0]["content"].encode("utf-8") == second[0]["content"].encode("utf-8")
+    for description, _ in (FIRST, SECOND):
+        assert description not in first[0]["content"]
+    assert FIRST[0] in first[-1]["content"]
+    assert first[1:] != second[1:]
+
+
+def test_cached_prompt_tokens():
+    assert cached_prompt_tokens(None) == 0
+    usage = CompletionUsage(prompt_tokens=2000, completion_tokens=10, total_tokens=2010,
+                            prompt_tokens_details={"cached_tokens": 1536})
+    assert cached_prompt_tokens(usage) == 1536
+    # DeepSeek reports cache hits at the top level, as an extra field
+    deepseek = CompletionUsage.model_validate({"prompt_tokens": 2000, "completion_tokens": 10, "total_tokens": 2010,
+                                               "prompt_cache_hit_tokens": 1024, "prompt_cache_miss_tokens": 976})
+    assert cached_prompt_tokens(deepseek) == 1024
+    assert cached_prompt_tokens(SimpleNamespace(prompt_tokens_details={"cached_tokens": 64})) == 64
+    assert cached_prompt_tokens(CompletionUsage(prompt_tokens=5, completion_tokens=1, total_tokens=6)) == 0
@@ -0,0 +1,109 @@
+from src import retrieval
+from src.retrieval import RetrievalIndex
+from types import SimpleNamespace
+import os
+import pytest
+
+
+def _record(rule_id: str, description: str, name: str = None) -> SimpleNamespace:
+    return SimpleNamespace(id=rule_id, name=name or rule_id, description=description, search=f"index=main {rule_id}",
+                           required_fields=("_time", "dest"), data_source=("Sysmon EventID 1",))
+
+
+RECORDS = [
+    _record("vss", "Deletion of volume shadow copies with vssadmin"),
+    _record("lsass", "Credential dumping by reading lsass process memory"),
+    _record("reg", "Registry run key persistence"),
+]
+
+
+class FakeCorpus:
+    def __init__(self, records: list):
+        self.records = records
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def by_id(self, rule_id: str):
+        return next((record for record in self.records if record.id == rule_id), None)
+
+
+@pytest.fixture
+def index(tmp_path) -> RetrievalIndex:
+    return RetrievalIndex(os.path.join(tmp_path, "retrieval"))
+
+
+def _keys(index: RetrievalIndex, text: str) -> list:
+    return [key for key, _ in index.search(text, k=5)]
+
+
+def _segments(index: RetrievalIndex) -> list:
+    return sorted(entry for entry in os.listdir(index.path) if entry.startswith("segment_"))
+
+
+def test_update_only_indexes_new_or_changed_records(index):
+    assert index.update(RECORDS) == 3
+    assert _keys(index, "shadow copies") == ["vss"]
+    assert index.update(RECORDS) == 0 and len(index.segments) == 1
+
+    # a new index over the same directory reads the segments instead of rebuilding
+    reopened = RetrievalIndex(index.path)
+    assert reopened.update(RECORDS) == 0
+    assert reopened.search("lsass memory") == index.search("lsass memory")
+
+
+def test_changed_record_masks_its_old_version(index):
+    index.update(RECORDS)
+    changed = [RECORDS[0], _record("lsass", "Mimikatz sekurlsa logonpasswords"), RECORDS[2]]
+    assert index.update(changed) == 1
+    assert len(index.segments) == 2 and len(_segments(index)) == 2
+    assert _keys(index, "mimikatz") == ["lsass"]
+    assert _keys(index, "credential dumping memory") == []
+    assert [int(live.sum()) for live in index._live] == [2, 1]
+
+
+def test_deleted_record_merges_the_segments(index):
+    index.update(RECORDS)
+    index.update([RECORDS[0], _record("lsass", "Mimikatz sekurlsa logonpasswords"), RECORDS[2]])
+    assert index.update([RECORDS[0], RECORDS[2]]) == 0
+    assert len(index.segments) == 1 and index.segments[0].path.endswith("_merged")
+    assert sorted(index.segments[0].keys) == ["reg", "vss"]
+    assert _keys(index, "mimikatz") == [] and _keys(index, "registry persistence") == ["reg"]
+    # the replaced segments are gone from disk
+    assert _segments(index) == [os.path.basename(index.segments[0].path)]
+
+
+def test_segments_are_compacted_past_the_limit(index, monkeypatch):
+    monkeypatch.setattr(retrieval, "MAX_SEGMENTS", 2)
+    index.update(RECORDS)
+    index.update([_record("vss", "vssadmin resize shadowstorage"), *RECORDS[1:]])
+    assert len(index.segments) == 2
+    index.update([_record("vss", "wmic shadowcopy delete"), *RECORDS[1:]])
+    assert len(index.segments) == 1 and len(_segments(index)) == 1
+    assert _keys(index, "wmic shadowcopy") == ["vss"] and _keys(index, "shadowstorage") == []
+
+
+def test_examples_leave_out_the_same_description(index, monkeypatch):
+    records = RECORDS + [_record("vss2", "Shadow copy deletion with wmic", name="wmic shadow copies")]
+    monkeypatch.setattr(retrieval, "corpus", FakeCorpus(records))
+    monkeypatch.setattr(retrieval, "retrieval_index", index)
+    index.update(records)
+    # punctuation and case do not make it a different description
+    examples = index.examples("deletion of Volume Shadow Copies, with vssadmin!", ["_time", "dest"], k=1)
+    assert [record.id for record in examples] == ["vss2"]
+    assert [record.id for record in index.examples("vssadmin deleting shadow copies", k=1)] == ["vss"]
+
+    context = retrieval.few_shot_context("Deletion of volume shadow copies with vssadmin", k=1)
+    assert "### wmic shadow copies" in context and "index=main vss2" in context
+    assert retrieval.few_shot_context("anything", k=0) == ''
+
+
+def test_updates_within_one_millisecond_keep_their_segments(index, monkeypatch):
+    monkeypatch.setattr(retrieval, "time", SimpleNamespace(time=lambda: 1000.0))
+    index.update(RECORDS)
+    index.update([RECORDS[0], _record("lsass", "Mimikatz sekurlsa logonpasswords"), RECORDS[2]])
+    assert len(_segments(index)) == 2
+    assert _keys(index, "shadow copies") == ["vss"] and _keys(index, "mimikatz") == ["lsass"]
+    index.update(RECORDS[1:])
+    index.update(RECORDS[2:])
+    assert _keys(index, "registry persistence") == ["reg"] and _keys(index, "shadow copies") == []
@@ -0,0 +1,177 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from openai.types.chat import ChatCompletion
+from src.instrumentation import instrumentation, track_usage
+from src.router import AllProvidersFailed, Provider, ProviderRouter, parse_routes
+import asyncio
+import json
+import pytest
+import threading
+import time
+import uuid
+
+
+class MockChatAPI:
+    """An OpenAI-compatible /chat/completions endpoint that answers with its name, fails with `status` or stalls
+    for `delay` seconds before answering."""
+
+    def __init__(self, name: str, status: int = 200, delay: float = 0.0):
+        self.name = name
+        self.status = status
+        self.delay = delay
+        self.requests = 0
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                api.requests += 1
+                time.sleep(api.delay)
+                if api.status != 200:
+                    return self._json(api.status, {"error": {"message": f"{api.name} unavailable", "type": "server"}})
+                self._json(200, _completion(api.name).model_dump() | {"model": body["model"]})
+
+            def _json(self, status: int, payload: dict):
+                data = json.dumps(payload).encode("utf-8")
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except OSError:
+                    # the client gave up waiting
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/v1"
+
+    def provider(self, timeout: float = 5) -> Provider:
+        return Provider(self.name, "test-key", f"{self.name}-model", base_url=self.base_url, timeout=timeout,
+                        max_retries=0)
+
+
+@pytest.fixture
+def apis():
+    apis = []
+
+    def start(name: str, status: int = 200, delay: float = 0.0) -> MockChatAPI:
+        apis.append(MockChatAPI(name, status, delay))
+        return apis[-1]
+
+    yield start
+    for api in apis:
+        api.server.shutdown()
+
+
+def _completion(content: str) -> ChatCompletion:
+    return ChatCompletion.model_validate({
+        "id": "chatcmpl", "object": "chat.completion", "created": 0, "model": "model",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}})
+
+
+def _provider(name: str, delay: float) -> Provider:
+    provider = Provider(name, "test-key", f"{name}-model", base_url="http://127.0.0.1:9/v1", max_retries=0)
+
+    def create(**kwargs):
+        time.sleep(delay)
+        return _completion(name)
+
+    async def acreate(**kwargs):
+        await asyncio.sleep(delay)
+        return _completion(name)
+
+    provider.client.chat.completions.create = create
+    provider.async_client.chat.completions.create = acreate
+    return provider
+
+
+def _router(hedge: bool = True) -> ProviderRouter:
+    providers = {"openai": _provider("openai", 0.3), "deepseek": _provider("deepseek", 0.0)}
+    return ProviderRouter(providers, default="openai", hedge=hedge, hedge_after=0.05)
+
+
+def _messages() -> list:
+    # unique per test, so the shared response cache never answers
+    return [{"role": "user", "content": str(uuid.uuid4())}]
+
+
+def test_hedging_is_off_by_default(monkeypatch):
+    monkeypatch.delenv("LLM_HEDGE", raising=False)
+    assert ProviderRouter.from_env().hedge is False
+    router = _router(hedge=False)
+    assert router.complete(_messages(), stage="stage").choices[0].message.content == "openai"
+
+
+def test_sync_hedge_loser_is_left_out_of_the_rule_usage():
+    router = _router()
+    with track_usage("rule") as usage:
+        response = router.complete(_messages(), stage="hedged_sync")
+        assert response.choices[0].message.content == "deepseek"
+        time.sleep(0.4)
+    assert usage.calls == 1 and usage.completion_tokens == 5
+    records = [record for record in instrumentation.records if record.stage == "hedged_sync"]
+    assert sorted((record.provider, record.cancelled) for record in records) == [("deepseek", False),
+                                                                                  ("openai", True)]
+
+
+def test_async_hedge_loser_is_cancelled():
+    router = _router()
+
+    async def run():
+        with track_usage("rule") as usage:
+            response = await router.acomplete(_messages(), stage="hedged_async")
+            await asyncio.sleep(0)
+        return response, usage
+
+    response, usage = asyncio.run(run())
+    assert response.choices[0].message.content == "deepseek"
+    assert usage.calls == 1 and usage.errors == 0
+    records = [record for record in instrumentation.records if record.stage == "hedged_async"]
+    assert sorted((record.provider, record.cancelled) for record in records) == [("deepseek", False),
+                                                                                  ("openai", True)]
+
+
+def test_routes():
+    routes = parse_routes("extract_info_from_pipe=llama; reflect_and_score_rule=llama,openai;*=openai")
+    assert routes == {"extract_info_from_pipe": ["llama"], "reflect_and_score_rule": ["llama", "openai"],
+                      "*": ["openai"]}
+    router = ProviderRouter({"openai": _provider("openai", 0), "deepseek": _provider("deepseek", 0)},
+                            default="openai", routes={"convert_rule": ["deepseek"]})
+    assert router.primary("convert_rule:pipe").name == "deepseek"
+    assert router.primary("reflect_and_score_rule").name == "openai"
+
+
+def test_default_provider_takes_every_unrouted_stage(monkeypatch):
+    monkeypatch.delenv("LLM_ROUTES", raising=False)
+    router = ProviderRouter({"openai": _provider("openai", 0), "llama": _provider("llama", 0)}, default="openai")
+    assert router.primary("extract_info_from_pipe").name == "openai"
+    router.set_default("llama")
+    assert {router.primary(stage).name for stage in ("extract_info_from_pipe", "reflect_and_score_rule",
+                                                     "generate_rule_from_dsl", "optimize_rule")} == {"llama"}
+
+
+@pytest.mark.parametrize("failure", [{"status": 503}, {"delay": 1.0}])
+def test_failover_on_server_error_or_timeout(apis, failure):
+    primary, backup = apis("openai", **failure), apis("deepseek")
+    router = ProviderRouter({"openai": primary.provider(timeout=0.3), "deepseek": backup.provider()}, default="openai")
+    response = router.complete(_messages(), stage="failover_sync")
+    assert response.choices[0].message.content == "deepseek"
+    assert (primary.requests, backup.requests) == (1, 1)
+    assert router.providers["openai"].stats.errors == 1
+
+    response = asyncio.run(router.acomplete(_messages(), stage="failover_async"))
+    assert response.choices[0].message.content == "deepseek"
+    assert router.stats()["openai"]["errors"] == 2 and router.stats()["deepseek"]["errors"] == 0
+
+
+def test_all_providers_failing_raises_with_every_error(apis):
+    router = ProviderRouter({"openai": apis("openai", status=500).provider(),
+                             "deepseek": apis("deepseek", status=502).provider()}, default="openai")
+    with pytest.raises(AllProvidersFailed) as e:
+        router.complete(_messages(), stage="all_down")
+    assert [name for name, _ in e.value.errors] == ["openai", "deepseek"]
@@ -0,0 +1,109 @@
+from src import rule_similarity
+from src.rule_similarity import batched_edit_distance, compare_rules, evaluate_pairs
+import pytest
+
+SEARCH = 'index=main sourcetype=sysmon EventCode=1 process_name=vssadmin.exe'
+RULE = f'{SEARCH} | stats count by host, user | where count > 1'
+REORDERED = f'{SEARCH} | where count > 1 | stats count by host, user'
+DISJOINT = 'index=auth action=failure | table src, dest'
+# 0.4619 structurally, inside the default judge band
+CLOSE = 'index=main sourcetype=sysmon process_name=wmic.exe | stats count by dest'
+
+
+def _levenshtein(left: list, right: list) -> int:
+    previous = list(range(len(right) + 1))
+    for i, a in enumerate(left, 1):
+        current = [i]
+        for j, b in enumerate(right, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a != b)))
+        previous = current
+    return previous[-1]
+
+
+def test_batched_edit_distance_matches_the_pairwise_distance():
+    left = [[1, 2, 3], [], [1, 2], [1, 2, 3, 4], [5], [1, 1, 2, 3, 5, 8]]
+    right = [[1, 2, 3], [1], [2, 1], [4, 3, 2, 1], [], [1, 2, 3, 8]]
+    assert batched_edit_distance(left, right).tolist() == [0, 1, 2, 4, 1, 2]
+    assert batched_edit_distance(left, right).tolist() == [_levenshtein(a, b) for a, b in zip(left, right)]
+    assert batched_edit_distance([], []).tolist() == []
+
+
+def test_identical_rules_score_one():
+    assert compare_rules([(RULE, RULE)]) == [{"commands": 1.0, "fields": 1.0, "predicates": 1.0, "structural": 1.0,
+                                              "missing_predicates": []}]
+
+
+def test_reordered_pipes_only_cost_command_similarity():
+    [scores] = compare_rules([(REORDERED, RULE)])
+    assert scores["fields"] == 1.0 and scores["predicates"] == 1.0
+    assert scores["commands"] == 0.3333 and scores["structural"] == 0.8
+
+
+def test_disjoint_rules_share_only_the_leading_search():
+    [scores] = compare_rules([(DISJOINT, RULE)])
+    assert scores["fields"] == 0.0 and scores["predicates"] == 0.0
+    assert scores["missing_predicates"] == ["count>1", "process_name=vssadmin.exe", "signature_id=1",
+                                            "sourcetype=sysmon"]
+    assert scores["structural"] == round(rule_similarity.SIMILARITY_WEIGHTS["commands"] * scores["commands"], 4)
+
+
+def test_field_names_and_wildcards_are_normalised():
+    # EventCode is signature_id in the CIM and a wildcard value matches the exact one
+    [scores] = compare_rules([('sourcetype=sysmon signature_id=1 process_name=*vssadmin*',
+                               'sourcetype=sysmon EventCode=1 process_name=vssadmin.exe')])
+    assert scores["fields"] == 1.0 and scores["predicates"] == 1.0 and scores["missing_predicates"] == []
+    # tstats counts as a search followed by stats
+    [scores] = compare_rules([('| tstats count from datamodel=Endpoint.Processes by Processes.user',
+                               'index=main | stats count by user')])
+    assert scores["commands"] == 1.0
+
+
+def test_empty_or_broken_rules_do_not_raise():
+    assert compare_rules([]) == []
+    [scores] = compare_rules([('', RULE)])
+    assert scores["structural"] == 0.0
+    [scores] = compare_rules([('index=main | where (count > 1', RULE)])
+    assert 0.0 <= scores["structural"] <= 1.0
+
+
+@pytest.fixture
+def judged(monkeypatch) -> list:
+    calls = []
+
+    def judge(generated: str, reference: str) -> dict:
+        calls.append((generated, reference))
+        return {"score": 0.9, "explanation": "same intent"}
+    monkeypatch.setattr(rule_similarity, "judge", judge)
+    return calls
+
+
+def test_only_pairs_inside_the_band_are_judged(judged):
+    pairs = [(RULE, RULE), (CLOSE, RULE), (DISJOINT, RULE)]
+    results = evaluate_pairs(pairs)
+    assert judged == [(CLOSE, RULE)]
+    assert [result["structural"] for result in results] == [1.0, 0.4619, 0.1]
+    assert [result["score"] for result in results] == [1.0, 0.9, 0.1]
+    assert results[1]["judge_explanation"] == "same intent"
+    assert "judge_score" not in results[0] and "judge_score" not in results[2]
+
+
+def test_band_edges_are_inclusive_and_the_judge_can_be_off(judged):
+    evaluate_pairs([(RULE, RULE), (REORDERED, RULE)], band=(0.8, 1.0))
+    assert judged == [(RULE, RULE), (REORDERED, RULE)]
+    results = evaluate_pairs([(CLOSE, RULE)], use_judge=False)
+    assert len(judged) == 2 and results[0]["score"] == 0.4619 and "judge_score" not in results[0]
+
+
+def test_a_failing_judge_keeps_the_structural_score(monkeypatch):
+    def judge(generated: str, reference: str) -> dict:
+        raise ValueError("no JSON")
+    monkeypatch.setattr(rule_similarity, "judge", judge)
+    [result] = evaluate_pairs([(CLOSE, RULE)])
+    assert result["score"] == result["structural"] == 0.4619 and "judge_score" not in result
+
+
+def test_judge_band_from_the_environment(monkeypatch):
+    monkeypatch.delenv("SIMILARITY_JUDGE_BAND", raising=False)
+    assert rule_similarity._judge_band() == rule_similarity.DEFAULT_JUDGE_BAND
+    monkeypatch.setenv("SIMILARITY_JUDGE_BAND", "0.2, 0.9")
+    assert rule_similarity._judge_band() == (0.2, 0.9)
@@ -0,0 +1,54 @@
+from src import runner
+from src.rule import RuleGenerator
+import json
+import os
+
+
+def _descriptions(names: list):
+    return [(os.path.join(runner.DESCRIPTIONS_PATH, "endpoint", f"{name}.yml"), {"description": f"detect {name}"})
+            for name in names]
+
+
+def _record(name: str, status: str) -> dict:
+    return {"path": os.path.join("dataset", "descriptions", "endpoint", f"{name}.yml"), "status": status}
+
+
+def test_resume_skips_finished_descriptions(tmp_path, monkeypatch):
+    generated = []
+
+    def generate_rule(description, rule_type, required_fields):
+        generated.append(description)
+        return f"index=main {description.split()[-1]}"
+
+    monkeypatch.setattr(runner, "description_and_rule_generator", lambda category: _descriptions(["a", "b", "c"]))
+    monkeypatch.setattr(RuleGenerator, "generate_rule", staticmethod(generate_rule))
+    output = os.path.join(tmp_path, "batch.jsonl")
+    with open(output, "w", encoding="utf-8") as f:
+        f.write(json.dumps(_record("a", "ok")) + "\n")
+        f.write(json.dumps(_record("b", "error")) + "\n")
+        # a line cut short by a crash is retried, not fatal
+        f.write('{"path": "dataset/descriptions/endpoint/c.yml", "sta')
+
+    assert runner.load_checkpoint(output) == {_record("a", "ok")["path"]}
+    records = runner.run_batch(["endpoint"], output, workers=2)
+    assert sorted(generated) == ["detect b", "detect c"]
+    assert sorted(r["rule"] for r in records) == ["index=main b", "index=main c"]
+    assert all(r["status"] == "ok" and "usage" in r for r in records)
+
+    # every description has finished now: a second run generates nothing
+    generated.clear()
+    assert runner.run_batch(["endpoint"], output) == [] and generated == []
+    assert len(runner.load_checkpoint(output)) == 3
+
+
+def test_failed_generation_is_checkpointed_as_error(tmp_path, monkeypatch):
+    def generate_rule(description, rule_type, required_fields):
+        raise RuntimeError("provider down")
+
+    monkeypatch.setattr(runner, "description_and_rule_generator", lambda category: _descriptions(["a"]))
+    monkeypatch.setattr(RuleGenerator, "generate_rule", staticmethod(generate_rule))
+    output = os.path.join(tmp_path, "batch.jsonl")
+    records = runner.run_batch(["endpoint"], output)
+    assert [(r["status"], r["error"]) for r in records] == [("error", "provider down")]
+    assert runner.load_checkpoint(output) == set()
+    assert runner.summarize(records)["failed"] == 1
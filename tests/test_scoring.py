@@ -0,0 +1,80 @@
+from src import agent
+from src.agent import SecurityRuleAgent
+from src.rule import RuleGenerator
+from src.scoring import PASS_SCORE, PreScore, combine_scores, parse_llm_scores, prescore_rule
+import json
+import pytest
+
+RULE = 'index=main EventCode=4688 Image="*\\\\vssadmin.exe" | stats count by host, Image'
+FENCED = f"Here is the optimized rule:\n```spl\n{RULE}\n```\nIt counts shadow copy tooling per host."
+
+
+def test_valid_rule_passes():
+    prescore = prescore_rule(RULE, "- host\n- Image")
+    assert prescore.passed and prescore.failures == []
+    assert prescore.dry_run.startswith("ok: ")
+
+
+def test_fenced_rule_fails_until_extracted():
+    assert prescore_rule(FENCED).syntax_validation == 0.0
+    assert RuleGenerator._extract_rule(FENCED) == RULE
+    assert prescore_rule(RuleGenerator._extract_rule(FENCED)).passed
+
+
+def test_missing_required_fields_lower_feasibility():
+    prescore = prescore_rule(RULE, "- host\n- CommandLine\n- ParentImage\n- _time")
+    assert prescore.execution_feasibility == 0.5
+    assert sorted(f.detail for f in prescore.failures if f.reason == "missing_required_field") == \
+        ["CommandLine", "ParentImage"]
+
+
+def test_invalid_rule_scores_zero_syntax_and_is_not_run():
+    prescore = prescore_rule("index=main | stats count by")
+    assert prescore.syntax_validation == 0.0 and not prescore.passed
+    assert prescore.dry_run is None
+
+
+def test_execution_error_zeroes_feasibility_but_unsupported_commands_do_not():
+    prescore = prescore_rule('index=main | rex field=Image "(?<name>[^\\\\]+$"')
+    assert (prescore.syntax_validation, prescore.execution_feasibility) == (1.0, 0.0)
+    assert [f.reason for f in prescore.failures] == ["execution_error"] and prescore.dry_run.startswith("error: ")
+    unsupported = prescore_rule("index=main | eval x=foo(Image)")
+    assert unsupported.passed and unsupported.dry_run == "not run locally: eval function foo()"
+
+
+def test_llm_scores_are_clamped_and_must_be_json():
+    scores = parse_llm_scores(json.dumps({"logical_coherence": 1.5, "syntax_validation": "0.2", "comment": "ok"}))
+    assert scores == {"logical_coherence": 1.0, "syntax_validation": 0.2, "comment": "ok"}
+    with pytest.raises(ValueError):
+        parse_llm_scores("not json")
+    with pytest.raises(ValueError):
+        parse_llm_scores(json.dumps({"comment": "no ratings"}))
+
+
+def test_combine_scores_takes_only_logical_coherence_from_the_llm():
+    prescore = PreScore(1.0, 1.0)
+    scores = combine_scores(prescore, {"logical_coherence": 0.4, "syntax_validation": 0.0, "comment": "too broad"})
+    assert scores["syntax_validation"] == 1.0 and scores["logical_coherence"] == 0.4
+    assert [f["reason"] for f in scores["failures"]] == ["low_llm_rating"]
+    unusable = combine_scores(prescore, error="reflection result is not JSON")
+    assert "logical_coherence" not in unusable and unusable["failures"][0]["reason"] == "unusable_reflection"
+
+
+def test_agent_scores_and_optimizes_the_search_inside_a_fence(monkeypatch):
+    answers = []
+
+    def call(messages, response_format="text", stage=None, **kwargs):
+        answers.append(stage)
+        if stage == "reflect_and_score_rule":
+            return json.dumps({"logical_coherence": 0.9})
+        return FENCED
+
+    monkeypatch.setattr(agent, "_call_openai_api", call)
+    monkeypatch.setattr(agent, "grammar_check", lambda rule: f"checked {rule}")
+    rule_agent = SecurityRuleAgent()
+    scores = rule_agent.reflect_and_score_rule(FENCED, "shadow copy tooling")
+    assert scores["syntax_validation"] == 1.0 and scores["logical_coherence"] >= PASS_SCORE
+
+    improved = rule_agent.optimize_rule("index=main | stats count by", {"syntax_validation": 0.0}, "shadow copies")
+    assert improved == RULE
+    assert answers == ["reflect_and_score_rule", "optimize_rule:syntax_validation"]
@@ -0,0 +1,108 @@
+from src import spl_engine
+from src.benchmark import fired_tests
+from src.spl_engine import SPLEngine
+import os
+import pandas as pd
+import pytest
+
+EVENTS = pd.DataFrame.from_records([
+    {"_time": 2.0, "EventCode": "4688", "Image": "C:\\Windows\\System32\\vssadmin.exe", "_raw": "vssadmin delete"},
+    {"_time": 1.0, "EventCode": "4624", "_raw": "An account was successfully logged on"},
+])
+
+
+@pytest.mark.parametrize("search", ["", "   ", "``` nothing but a comment ```",
+                                    "```spl\nEventCode=4688\n```"])
+def test_empty_search_is_an_error_not_every_event(search):
+    result = SPLEngine().run(search, events=EVENTS)
+    assert result.error is not None and result.error.startswith("empty search")
+    assert result.count == 0
+
+
+def test_search_command_still_filters():
+    assert SPLEngine().run("search EventCode=4688", events=EVENTS).count == 1
+    assert SPLEngine().run("EventCode=4688 ``` new processes ```", events=EVENTS).count == 1
+
+
+def test_benchmark_unwraps_fenced_rules():
+    groups = {"T1490#1": EVENTS.iloc[:1].reset_index(drop=True), "T1078#1": EVENTS.iloc[1:].reset_index(drop=True)}
+    answer = "Here is the rule:\n```spl\nEventCode=4688 Image=*vssadmin.exe\n```\nIt flags shadow copy deletion."
+    assert fired_tests(answer, groups) == ({"T1490#1"}, None)
+    assert fired_tests("EventCode=4688 Image=*vssadmin.exe", groups) == ({"T1490#1"}, None)
+
+
+PROCESSES = pd.DataFrame.from_records([
+    {"_time": 400.0, "host": "ws1", "EventCode": "4688", "Image": "C:\\Windows\\System32\\cmd.exe",
+     "CommandLine": "cmd.exe /c whoami /all", "User": "alice", "_raw": "cmd.exe /c whoami /all"},
+    {"_time": 300.0, "host": "ws2", "EventCode": "4688", "Image": "C:\\Windows\\System32\\vssadmin.exe",
+     "CommandLine": "vssadmin delete shadows /all /quiet", "User": "bob", "_raw": "vssadmin delete shadows"},
+    {"_time": 200.0, "host": "ws1", "EventCode": "4688", "Image": "C:\\Windows\\System32\\powershell.exe",
+     "CommandLine": "powershell -enc SQBFAFgA", "User": "alice", "_raw": "powershell -enc"},
+    {"_time": 100.0, "host": "dc1", "EventCode": "4624", "User": "alice",
+     "_raw": "An account was successfully logged on"},
+])
+
+
+@pytest.fixture
+def lookups(tmp_path, monkeypatch):
+    with open(os.path.join(tmp_path, "users.csv"), "w", encoding="utf-8") as f:
+        f.write("user,department\nalice,finance\nbob,it\n")
+    monkeypatch.setattr(spl_engine, "LOOKUP_PATH", str(tmp_path))
+
+
+@pytest.mark.parametrize("search, records", [
+    ('EventCode=4688 | stats count dc(Image) as images values(User) as users by host',
+     [{"host": "ws1", "count": 2, "images": 2, "users": ["alice"]}, {"host": "ws2", "count": 1, "images": 1,
+                                                                     "users": ["bob"]}]),
+    ('EventCode=4688 | eval exe=lower(replace(Image, ".*\\\\\\\\", "")), long=if(len(CommandLine)>22, "yes", "no") '
+     '| table exe long',
+     [{"exe": "cmd.exe", "long": "no"}, {"exe": "vssadmin.exe", "long": "yes"}, {"exe": "powershell.exe",
+                                                                               "long": "yes"}]),
+    ('EventCode=4688 | where match(CommandLine, "(?i)delete\\s+shadows") OR like(Image, "%cmd%") | table host',
+     [{"host": "ws1"}, {"host": "ws2"}]),
+    ('EventCode=4688 | rex field=CommandLine "^(?<program>\\S+)\\s+(?<first_arg>\\S+)" | table program first_arg',
+     [{"program": "cmd.exe", "first_arg": "/c"}, {"program": "vssadmin", "first_arg": "delete"},
+      {"program": "powershell", "first_arg": "-enc"}]),
+    ('User=bob | rename CommandLine as cmd, User as user | table host user cmd',
+     [{"host": "ws2", "user": "bob", "cmd": "vssadmin delete shadows /all /quiet"}]),
+    ('EventCode=4688 | dedup host | table host', [{"host": "ws1"}, {"host": "ws2"}]),
+    ('* | lookup users user as User OUTPUT department | stats count by department',
+     [{"department": "finance", "count": 3}, {"department": "it", "count": 1}]),
+    ('* | sort - _time | head 2 | table _time', [{"_time": 400}, {"_time": 300}]),
+    ('* | sort User, -_time | table User _time',
+     [{"User": "alice", "_time": 400}, {"User": "alice", "_time": 200}, {"User": "alice", "_time": 100},
+      {"User": "bob", "_time": 300}]),
+    ('EventCode=4688 | bin _time span=200s | stats count by _time', [{"_time": "200", "count": 2},
+                                                                     {"_time": "400", "count": 1}]),
+    ('EventCode=4688 | `security_content_ctime(_time)` | head 1 | table _time', [{"_time": "1970-01-01T00:06:40"}]),
+    ('EventCode=4688 | fillnull value=none Missing | head 1 | table Missing', [{"Missing": "none"}]),
+])
+def test_commands(lookups, search, records):
+    result = SPLEngine().run(search, events=PROCESSES)
+    assert result.feasible and result.warnings == []
+    assert result.records() == records
+
+
+@pytest.mark.parametrize("search, unsupported", [
+    ('| tstats count where index=main by host', "generating command 'tstats'"),
+    ('EventCode=4688 | join host [search EventCode=4624]', "command 'join'"),
+    ('EventCode=4688 | eval x=unknownfunc(Image)', "eval function unknownfunc()"),
+])
+def test_unsupported_commands_are_reported_not_guessed(search, unsupported):
+    result = SPLEngine().run(search, events=PROCESSES)
+    assert result.unsupported == unsupported and result.error is None and not result.feasible
+    assert result.records() == []
+
+
+def test_execution_errors():
+    assert SPLEngine().run('EventCode=4688 | rex field=CommandLine "(?<broken"', events=PROCESSES).error is not None
+    assert SPLEngine().run('EventCode=4688 | stats count(', events=PROCESSES).error is not None
+
+
+def test_unknown_macros_and_lookups_are_skipped_with_a_warning(lookups):
+    result = SPLEngine().run('EventCode=4688 | `drop_dm_object_name(Processes)` | stats count', events=PROCESSES)
+    assert result.records() == [{"count": 3}]
+    assert result.warnings == ["macro `drop_dm_object_name` is not defined locally and was skipped"]
+    result = SPLEngine().run('* | lookup missing user as User OUTPUT department | table department',
+                             events=PROCESSES)
+    assert result.feasible and result.count == 4 and "lookup table 'missing' not found" in result.warnings[0]
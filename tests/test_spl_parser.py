@@ -0,0 +1,90 @@
+from src import rule
+from src.spl_parser import (SPLSyntaxError, parse_pipe, parse_search, split_pipes, strip_code_fence, tokenize, MACRO,
+                            PIPE, STRING, WORD)
+import pytest
+
+
+def test_tokenize_kinds_and_comments():
+    tokens = tokenize('index=main ```a comment``` "quoted | text" `sysmon` | stats count')
+    kinds = [token.kind for token in tokens]
+    assert kinds == [WORD, 'op', WORD, STRING, MACRO, PIPE, WORD, WORD]
+    assert tokens[3].value == 'quoted | text'
+
+
+@pytest.mark.parametrize("search", ['index=main "unterminated', 'index=main ```open comment'])
+def test_tokenize_rejects_unterminated_literals(search):
+    with pytest.raises(SPLSyntaxError):
+        tokenize(search)
+
+
+def test_split_pipes_ignores_nested_pipes():
+    search = 'index=main [search index=other | fields host] | eval x=if(a=="|", 1, 0) | stats count'
+    assert split_pipes(search) == ['index=main [search index=other | fields host]', 'eval x=if(a=="|", 1, 0)',
+                                   'stats count']
+
+
+def test_parse_pipe_fields():
+    parsed = parse_pipe('stats count min(_time) as firstTime by dest, user')
+    assert parsed.operation_type == 'AGGREGATE'
+    assert set(parsed.input_fields) >= {'_time', 'dest', 'user'}
+    assert set(parsed.output_fields) >= {'count', 'firstTime'}
+    assert parse_pipe('rename process_name as process').info() == {
+        "operation_type": "RENAME", "input_fields": ["process_name"], "output_fields": ["process"]}
+    assert parse_pipe('notacommand foo') is None
+
+
+def test_split_pipes_strict_reports_unclosed_brackets():
+    assert split_pipes('index=main [search x') == ['index=main [search x']
+    with pytest.raises(SPLSyntaxError):
+        split_pipes('index=main [search x', strict=True)
+
+
+@pytest.mark.parametrize("pipe, info", [
+    ('eval cmd=lower(CommandLine), len=len(cmd)', ("TRANSFORM", ["CommandLine", "cmd"], ["cmd", "len"])),
+    ('rex field=CommandLine "(?<user>\\w+)@(?<domain>\\S+)"', ("EXTRACT", ["CommandLine"], ["user", "domain"])),
+    ('lookup ut_shannon_lookup word as domain OUTPUT ut_shannon as entropy', ("LOOKUP", ["domain"], ["entropy"])),
+    ('search EventCode=4688 Image=*cmd.exe', ("FILTER", ["EventCode", "Image"], [])),
+    ('where count > 5 AND isnotnull(user)', ("FILTER", ["count", "user"], [])),
+    ('tstats count from datamodel=Endpoint.Processes where Processes.process_name=cmd.exe by Processes.dest',
+     ("AGGREGATE", ["Processes.process_name", "Processes.dest"], ["Processes.dest", "count"])),
+    ('`drop_dm_object_name(Processes)`', ("RENAME", ["Processes.*"], ["*"])),
+    ('`security_content_ctime(firstTime)`', ("TRANSFORM", ["firstTime"], ["firstTime"])),
+    ('join type=left host [search index=a | fields host, ip]', ("JOIN", ["host"], [])),
+    ('table _time host user', ("OUTPUT", ["_time", "host", "user"], ["_time", "host", "user"])),
+    ('bin _time span=1h', ("BUCKET", ["_time"], ["_time"])),
+    ('dedup host', ("DEDUP", ["host"], [])),
+    ('head 10', ("OUTPUT", [], [])),
+    ('spath input=payload output=method path=request.method', ("EXTRACT", ["payload"], ["method"])),
+    ('fillnull value=0 count', ("FILL", ["count"], ["count"])),
+])
+def test_parse_pipe_commands(pipe, info):
+    operation_type, input_fields, output_fields = info
+    assert parse_pipe(pipe).info() == {"operation_type": operation_type, "input_fields": input_fields,
+                                       "output_fields": output_fields}
+
+
+def test_parse_search_skips_search_metadata():
+    pipes = parse_search('index=main EventCode=4688 | stats count by host | where count>1')
+    assert [(p.command, p.operation_type) for p in pipes] == [
+        ("search", "FILTER"), ("stats", "AGGREGATE"), ("where", "FILTER")]
+    assert pipes[0].input_fields == ["EventCode"]
+
+
+def test_known_pipes_never_reach_the_llm(monkeypatch):
+    def extract_info_from_pipe(pipe):
+        raise AssertionError(f"LLM called for {pipe!r}")
+
+    monkeypatch.setattr(rule, "extract_info_from_pipe", extract_info_from_pipe)
+    assert rule.get_pipe_info('stats count by host')["operation_type"] == "AGGREGATE"
+    assert rule.get_pipe_info('`security_content_ctime(lastTime)`')["output_fields"] == ["lastTime"]
+
+
+@pytest.mark.parametrize("text, search", [
+    ("```spl\nindex=main | stats count\n```", "index=main | stats count"),
+    ("Here is the rule:\n\n```spl\nindex=main\n| stats count\n```\nIt counts events.", "index=main\n| stats count"),
+    ("```plaintext\nindex=main\n```\n```spl\nindex=other\n```", "index=other"),
+    ("```\nindex=main\n```", "index=main"),
+    ("  index=main ```comment``` | stats count \n", "index=main ```comment``` | stats count"),
+])
+def test_strip_code_fence(text, search):
+    assert strip_code_fence(text) == search
@@ -0,0 +1,47 @@
+from src.spl_validator import validate_spl
+import pytest
+
+
+@pytest.mark.parametrize("search", [
+    'index=main EventCode=4688 | stats count by host',
+    '| tstats count from datamodel=Endpoint.Processes where Processes.process_name=cmd.exe by Processes.dest',
+    'index=main ```only a comment``` | table host',
+    'index=main [search index=other | fields host] | eval x=if(a>1, "y", "n")',
+    'index=main | rex field=_raw "user=(?<user>\\w+)" | rename user as account',
+])
+def test_valid_searches(search):
+    result = validate_spl(search)
+    assert result.valid, result.errors
+
+
+@pytest.mark.parametrize("search, message", [
+    ('', 'empty search'),
+    ('index=main |', 'empty pipe'),
+    ('index=main | stats count by', "expects fields after 'by'"),
+    ('index=main | frobnicate x', "unknown search command 'frobnicate'"),
+    ('tstats count from datamodel=Endpoint.Processes', "generating command must be preceded by '|'"),
+    ('index=main | eval x=(1', "unclosed '('"),
+    ('index=main | rex "no group"', 'it needs a named group'),
+    ('index=main | join host', 'expects a subsearch'),
+    ('index=main | where', 'expects a boolean expression'),
+])
+def test_invalid_searches(search, message):
+    result = validate_spl(search)
+    assert not result.valid
+    assert any(message in str(error) for error in result.errors), result.errors
+
+
+@pytest.mark.parametrize("rule", [
+    "```spl\nindex=main | stats count\n```",
+    "Here is the rule:\n```spl\nindex=main | stats count\n```",
+])
+def test_fenced_rules_are_reported_as_fenced(rule):
+    result = validate_spl(rule)
+    assert not result.valid
+    assert [error.message for error in result.errors] == [
+        "rule is wrapped in a Markdown code fence, pass only the search inside it"]
+
+
+def test_unknown_macro():
+    result = validate_spl('`no_such_macro_anywhere` | stats count')
+    assert not result.valid and "unknown macro" in str(result.errors[0])
@@ -0,0 +1,195 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from src import splunk_jobs, tool
+from src.splunk_jobs import SplunkJobError, SplunkJobManager
+from src.splunk_session import SplunkSession
+from urllib.parse import parse_qs, urlparse
+import asyncio
+import json
+import pytest
+import re
+import threading
+
+
+class MockSearchJobs:
+    """
+    The /services/search/jobs endpoints the job manager uses. A job answers its status polls with isDone=false
+    until it has been polled `polls` times; a search containing "unknown_command" is rejected on submission the
+    way Splunk rejects a search it cannot parse.
+    """
+
+    def __init__(self):
+        self.plans = {}
+        self.jobs = {}
+        self.submitted = []
+        self.pages = []
+        self.cancelled = []
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                form = {key: values[0] for key, values in
+                        parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8")).items()}
+                path = urlparse(self.path).path
+                if path == "/services/search/jobs":
+                    self._json(*api.submit(form))
+                elif re.fullmatch(r"/services/search/jobs/[^/]+/control", path):
+                    api.cancelled.append(path.split("/")[-2])
+                    self._json(200, {})
+                else:
+                    self.send_error(404)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                match = re.fullmatch(r"/services/search/jobs/([^/]+)(/results)?", url.path)
+                if not match or match.group(1) not in api.jobs:
+                    return self.send_error(404)
+                if match.group(2):
+                    return self._json(200, api.results(match.group(1), int(query["offset"]), int(query["count"])))
+                self._json(200, api.status(match.group(1)))
+
+            def _json(self, status: int, payload: dict):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.port = self.server.server_port
+
+    def plan(self, search: str, results: int = 0, polls: int = 1, messages: list = None, failed: bool = False):
+        self.plans[search] = {"results": [{"n": str(n)} for n in range(results)], "polls": polls,
+                              "messages": messages or [], "failed": failed}
+
+    def submit(self, form: dict) -> tuple:
+        self.submitted.append(form)
+        if "unknown_command" in form["search"]:
+            return 400, {"messages": [{"type": "FATAL", "text": "Unknown search command 'unknown_command'."}]}
+        sid = f"job-{len(self.jobs)}"
+        self.jobs[sid] = {**self.plans.get(form["search"], {"results": [], "polls": 1, "messages": [],
+                                                           "failed": False}), "polled": 0}
+        return 201, {"sid": sid}
+
+    def status(self, sid: str) -> dict:
+        job = self.jobs[sid]
+        job["polled"] += 1
+        done = job["polled"] >= job["polls"]
+        content = {"isDone": done, "isFailed": done and job["failed"], "dispatchState": "DONE" if done else "RUNNING",
+                   "resultCount": len(job["results"]) if done else 0, "messages": job["messages"]}
+        return {"entry": [{"name": sid, "content": content}]}
+
+    def results(self, sid: str, offset: int, count: int) -> dict:
+        self.pages.append((sid, offset, count))
+        return {"results": self.jobs[sid]["results"][offset:offset + count]}
+
+
+@pytest.fixture
+def api():
+    api = MockSearchJobs()
+    yield api
+    api.server.shutdown()
+
+
+@pytest.fixture
+def manager(api):
+    session = SplunkSession("127.0.0.1", api.port, token="api-token", scheme="http")
+    return SplunkJobManager(session, page_size=2, poll_interval=0.01, max_poll_interval=0.04, timeout=30)
+
+
+def test_submit_is_non_blocking_and_time_bounded(api, manager):
+    assert manager.submit("index=main EventCode=4688") == "job-0"
+    assert manager.submit("| tstats count where index=main", earliest_time="-7d", latest_time="-1d") == "job-1"
+    assert api.submitted == [
+        {"search": "search index=main EventCode=4688", "exec_mode": "normal", "output_mode": "json",
+         "earliest_time": "-24h", "latest_time": "now"},
+        {"search": "| tstats count where index=main", "exec_mode": "normal", "output_mode": "json",
+         "earliest_time": "-7d", "latest_time": "-1d"}]
+
+    with pytest.raises(SplunkJobError) as e:
+        manager.submit("index=main | unknown_command")
+    assert e.value.messages[0]["type"] == "FATAL"
+
+
+def test_wait_backs_off_up_to_the_maximum_interval(api, manager, monkeypatch):
+    slept = []
+    monkeypatch.setattr(splunk_jobs.time, "sleep", slept.append)
+    api.plan("search index=main", results=1, polls=5)
+    content = manager.wait(manager.submit("index=main"))
+    assert content["isDone"] and content["resultCount"] == 1
+    assert slept == [0.01, 0.02, 0.04, 0.04]
+
+
+def test_wait_cancels_a_job_past_its_timeout(api, manager, monkeypatch):
+    monkeypatch.setattr(splunk_jobs.time, "sleep", lambda interval: None)
+    api.plan("search index=main", polls=100)
+    manager.timeout = 0
+    with pytest.raises(SplunkJobError, match="did not finish"):
+        manager.wait(manager.submit("index=main"))
+    assert api.cancelled == ["job-0"]
+
+
+def test_failed_job_raises_with_its_messages(api, manager):
+    messages = [{"type": "ERROR", "text": "Error in 'lookup' command: Could not find all of the specified lookup"}]
+    api.plan("search index=main", failed=True, messages=messages)
+    with pytest.raises(SplunkJobError) as e:
+        manager.run("index=main")
+    assert e.value.sid == "job-0" and e.value.messages == messages
+
+
+@pytest.mark.parametrize("results, max_results, pages", [
+    (5, None, [(0, 2), (2, 2), (4, 2)]),
+    (4, None, [(0, 2), (2, 2), (4, 2)]),
+    (5, 3, [(0, 2), (2, 1)]),
+    (0, None, [(0, 2)]),
+])
+def test_results_are_paged(api, manager, results, max_results, pages):
+    api.plan("search index=main", results=results)
+    sid = manager.submit("index=main")
+    manager.wait(sid)
+    rows = list(manager.iter_results(sid, max_results))
+    assert [row["n"] for row in rows] == [str(n) for n in range(min(results, max_results or results))]
+    assert [(offset, count) for _, offset, count in api.pages] == pages
+
+
+def test_run_many_returns_failures_in_place(api, manager):
+    api.plan("search index=a", results=3, polls=2)
+    api.plan("search index=b", results=1)
+    jobs = manager.run_many(["index=a", "index=a | unknown_command", "index=b"])
+    assert [job["result_count"] for job in (jobs[0], jobs[2])] == [3, 1]
+    assert len(jobs[0]["results"]) == 3
+    assert isinstance(jobs[1], SplunkJobError)
+
+
+def test_run_async_polls_without_blocking(api, manager):
+    api.plan("search index=a", results=3, polls=3)
+    api.plan("search index=b", results=1, polls=2)
+
+    async def both():
+        return await asyncio.gather(manager.run_async("index=a"), manager.run_async("index=b"))
+
+    jobs = asyncio.run(both())
+    assert [(job["result_count"], len(job["results"])) for job in jobs] == [(3, 3), (1, 1)]
+    assert sorted(job["polled"] for job in api.jobs.values()) == [2, 3]
+
+
+def test_query_splunk_tells_no_results_from_a_failed_search(api, manager, monkeypatch):
+    monkeypatch.setenv("FEASIBILITY_BACKEND", "splunk")
+    monkeypatch.setattr(tool, "job_manager", manager)
+    info = [{"type": "INFO", "text": "No matching fields exist."}]
+    api.plan("search index=main EventCode=1", messages=info)
+    empty = json.loads(tool.query_splunk("index=main EventCode=1"))
+    assert (empty["feasible"], empty["result_count"], empty["error"], empty["messages"]) == (True, 0, None, info)
+
+    failed = json.loads(tool.query_splunk("index=main | unknown_command"))
+    assert not failed["feasible"] and failed["result_count"] == 0
+    assert "unknown_command" in failed["error"] and failed["messages"][0]["type"] == "FATAL"
+
+    api.plan("search index=main EventCode=4688", results=3)
+    found = json.loads(asyncio.run(tool.query_splunk_async("index=main EventCode=4688", max_results=2)))
+    assert found["feasible"] and found["result_count"] == 3 and len(found["results"]) == 2
@@ -0,0 +1,144 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from src.splunk_session import SplunkAuthError, SplunkSession
+from urllib.parse import parse_qs, urlparse
+import json
+import pytest
+import threading
+
+
+class MockSplunk:
+    """
+    Splunk management API stand-in: /services/auth/login hands out session keys for admin/changeme, every other
+    path answers 401 unless it carries the current session key or the bearer token, and echoes the request back.
+    """
+
+    def __init__(self, token: str = "api-token"):
+        self.token = token
+        self.session_key = None
+        self.logins = 0
+        self.requests = []
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                self._handle()
+
+            def do_POST(self):
+                self._handle()
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                form = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode("utf-8")).items()}
+                url = urlparse(self.path)
+                if url.path == "/services/auth/login":
+                    if (form.get("username"), form.get("password")) != ("admin", "changeme"):
+                        return self._json(401, {"messages": [{"type": "WARN", "text": "Login failed"}]})
+                    return self._json(200, {"sessionKey": api.login()})
+                authorization = self.headers.get("Authorization")
+                api.requests.append((self.command, url.path, authorization, self.client_address[1]))
+                if authorization not in (f"Splunk {api.session_key}", f"Bearer {api.token}"):
+                    return self._json(401, {"messages": [{"type": "WARN", "text": "call not properly authenticated"}]})
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                self._json(200, {"path": url.path, "query": query, "form": form, "messages": []})
+
+            def _json(self, status: int, payload: dict):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.port = self.server.server_port
+
+    def login(self) -> str:
+        self.logins += 1
+        self.session_key = f"key-{self.logins}"
+        return self.session_key
+
+    def expire(self):
+        # a server restart or sessionTimeout: the key the client holds is no longer accepted
+        self.session_key = None
+
+
+@pytest.fixture
+def splunk():
+    splunk = MockSplunk()
+    yield splunk
+    splunk.server.shutdown()
+
+
+def _session(splunk, **kwargs) -> SplunkSession:
+    kwargs = {"username": "admin", "password": "changeme", **kwargs}
+    return SplunkSession("127.0.0.1", splunk.port, scheme="http", **kwargs)
+
+
+def test_one_login_and_connection_serve_every_call(splunk):
+    session = _session(splunk)
+    for _ in range(3):
+        assert session.get("search/jobs").status_code == 200
+    assert session.post("/search/jobs", data={"search": "search index=main"}).json()["form"] == {
+        "search": "search index=main"}
+    assert session.logins == splunk.logins == 1
+    assert {authorization for _, _, authorization, _ in splunk.requests} == {"Splunk key-1"}
+    # keep-alive: all four requests arrived over the same pooled connection
+    assert len({port for _, _, _, port in splunk.requests}) == 1
+
+
+def test_rejected_session_key_logs_in_again(splunk):
+    session = _session(splunk)
+    session.get("search/jobs")
+    splunk.expire()
+    assert session.get("search/jobs").status_code == 200
+    assert session.logins == 2
+    assert [authorization for _, _, authorization, _ in splunk.requests] == [
+        "Splunk key-1", "Splunk key-1", "Splunk key-2"]
+
+
+def test_expired_session_key_is_refreshed_before_the_request(splunk):
+    session = _session(splunk, session_ttl=0)
+    session.get("search/jobs")
+    session.get("search/jobs")
+    assert session.logins == 2
+    # no request was sent with a key the client already knew to be stale
+    assert [authorization for _, _, authorization, _ in splunk.requests] == ["Splunk key-1", "Splunk key-2"]
+
+
+def test_bad_credentials_raise(splunk):
+    with pytest.raises(SplunkAuthError):
+        _session(splunk, password="wrong").get("search/jobs")
+
+
+def test_token_is_sent_as_bearer_without_logging_in(splunk):
+    session = _session(splunk, username=None, password=None, token="api-token")
+    assert session.get("search/jobs").status_code == 200
+    assert splunk.logins == 0 and splunk.requests[0][2] == "Bearer api-token"
+
+    # a revoked token is not retried with a login
+    splunk.token = "rotated"
+    assert session.get("search/jobs").status_code == 401
+    assert splunk.logins == 0 and len(splunk.requests) == 2
+
+
+def test_splunklib_service_goes_through_the_pooled_session(splunk):
+    session = _session(splunk)
+    service = session.service()
+    assert session.service() is service
+    response = service.get("search/parser", q="index=main | stats count", parse_only=True, output_mode="json")
+    body = json.loads(response.body.read())
+    assert body["path"] == "/services/search/parser"
+    assert body["query"]["q"] == "index=main | stats count"
+
+    # the placeholder token is never sent; the session key is, and a rejected key is refreshed for splunklib too
+    splunk.expire()
+    service.get("search/parser", q="index=main", output_mode="json")
+    assert [authorization for _, _, authorization, _ in splunk.requests] == [
+        "Splunk key-1", "Splunk key-1", "Splunk key-2"]
+    assert len({port for _, _, _, port in splunk.requests}) == 1
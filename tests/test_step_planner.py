@@ -0,0 +1,37 @@
+from src.step_planner import ALL_STEPS, CORE_STEPS, nothing_to_add, plan_dsl_steps
+import pytest
+
+
+@pytest.mark.parametrize("analysis", [
+    "",
+    "None.",
+    "**None**",
+    "N/A",
+    "Not applicable.",
+    "Nothing to add.",
+    "No additional filters are needed.",
+    "No derived metrics. The counts from the previous step are enough.",
+    "This step is not needed for this rule.",
+    "Aggregation is not required.",
+])
+def test_empty_answers(analysis):
+    assert nothing_to_add(analysis)
+
+
+@pytest.mark.parametrize("analysis", [
+    "Filter where ParentImage is not none.",
+    "Keep events where CommandLine is not empty; none of the other fields matter.",
+    "None of the fields need parsing, but count the events by host.",
+    "No additional filters. " + "Then keep only the events of cmd.exe launched by winword.exe. " * 5,
+    "Count by host and user, the step is not needed otherwise.",
+])
+def test_answers_with_content(analysis):
+    assert not nothing_to_add(analysis)
+
+
+def test_plan_keeps_core_steps_in_order():
+    steps = plan_dsl_steps("Detect EventCode 4625 events", mode='adaptive')
+    assert set(steps) == CORE_STEPS
+    assert steps == [step for step in ALL_STEPS if step in steps]
+    assert plan_dsl_steps("anything", mode='full') == ALL_STEPS
+    assert len(plan_dsl_steps("Correlate a logon followed by a process within 5 minutes")) == len(ALL_STEPS)
@@ -0,0 +1,45 @@
+from src import tool
+from src.splunk_session import SplunkAuthError, splunk_session
+from types import SimpleNamespace
+import io
+import json
+import pytest
+
+
+@pytest.mark.parametrize("host", [None, "", "<SPLUNK_URL>"])
+def test_grammar_check_stays_local_without_a_configured_host(monkeypatch, host):
+    monkeypatch.setattr(splunk_session, "host", host)
+    monkeypatch.setattr(splunk_session, "service", lambda: pytest.fail("tried to reach Splunk"))
+    monkeypatch.setenv("FEASIBILITY_BACKEND", "auto")
+    result = tool.grammar_check('index=main | stats count by host')
+    assert result.valid and result.source == 'local'
+    assert tool.feasibility_backend() == "local"
+
+
+def test_configured_host_uses_splunk(monkeypatch):
+    monkeypatch.setattr(splunk_session, "host", "splunk.example.com")
+    monkeypatch.setenv("FEASIBILITY_BACKEND", "auto")
+    assert tool.feasibility_backend() == "splunk"
+
+
+def test_unreachable_splunk_falls_back_to_the_local_check(monkeypatch, caplog):
+    def service():
+        raise SplunkAuthError("Splunk login failed with status 503")
+
+    monkeypatch.setattr(splunk_session, "host", "splunk.example.com")
+    monkeypatch.setattr(splunk_session, "service", service)
+    result = tool.grammar_check('index=main | stats count by host')
+    assert result.valid and result.source == 'local'
+    assert str(result) == "SPL grammar is correct (local check)"
+    assert "Splunk grammar check failed" in caplog.text and "status 503" in caplog.text
+
+
+def test_splunk_parser_errors_are_reported(monkeypatch):
+    body = {"messages": [{"type": "FATAL", "text": "Unknown search command 'statz'."}]}
+    service = SimpleNamespace(get=lambda path, **kwargs: SimpleNamespace(
+        body=io.BytesIO(json.dumps(body).encode("utf-8"))))
+    monkeypatch.setattr(splunk_session, "host", "splunk.example.com")
+    monkeypatch.setattr(splunk_session, "service", lambda: service)
+    result = tool.grammar_check('index=main | stats count by host')
+    assert not result.valid and result.source == 'splunk'
+    assert [error.message for error in result.errors] == ["Unknown search command 'statz'."]